@@ -1,20 +1,226 @@
+from contextlib import ExitStack
+import copy
 from pathlib import PurePath
 import subprocess
+import time
+
+from .process import kill_process_group
 
 
 class ProgramController:
     """Base interface with an external program.
 
     :param str executable_path: absolute path of the program's executable file
+    :param io_limiter: limits the number of programs reading from the same
+                       device, instance of
+                       :class:`~blu_mkv.iolimit.DeviceLimiter`
+    :param resource_policy: resources allowed to the program, instance of
+                            :class:`~blu_mkv.resources.ResourcePolicy`
+    :param timeout_policy: timeouts of the program's operations, instance of
+                           :class:`~blu_mkv.process.TimeoutPolicy`
     """
-    def __init__(self, executable_file):
+    def __init__(
+            self, executable_file, io_limiter=None, resource_policy=None,
+            timeout_policy=None):
         """
         :param str executable_file:
             name or absolute path of the program's executable file.
             If a name is given, the related file will be searched in
             the directories listed in the environment variable ``PATH``
+        :param io_limiter:
+            if set, the program waits for the devices storing its input files
+            to be available before reading them, instance of
+            :class:`~blu_mkv.iolimit.DeviceLimiter`
+        :param resource_policy:
+            if set, applied to the program when it is started (nice level,
+            CPU affinity, etc.), instance of
+            :class:`~blu_mkv.resources.ResourcePolicy`
+        :param timeout_policy:
+            if set, the program is killed when an operation takes longer than
+            allowed, instance of :class:`~blu_mkv.process.TimeoutPolicy`
         """
         self.executable_path = self._get_executable_path(executable_file)
+        self.io_limiter = io_limiter
+        self.resource_policy = resource_policy
+        self.timeout_policy = timeout_policy
+        self.cancellation_token = None
+        self.metrics = None
+
+    def using(self, resource_policy):
+        """Return a copy of the controller, whose programs are started with
+        another resource policy (e.g., a job's policy).
+
+        The limits of the given policy override the controller's ones.
+
+        :param resource_policy: instance of
+                                :class:`~blu_mkv.resources.ResourcePolicy`
+        :return: instance of the controller's class
+        """
+        controller = copy.copy(self)
+        if self.resource_policy is None:
+            controller.resource_policy = resource_policy
+        else:
+            controller.resource_policy =\
+                self.resource_policy.combine(resource_policy)
+
+        return controller
+
+    def cancellable_by(self, cancellation_token):
+        """Return a copy of the controller, whose programs are killed when a
+        token is cancelled (e.g., a job's token).
+
+        :param cancellation_token: instance of
+                                   :class:`~blu_mkv.process.CancellationToken`
+        :return: instance of the controller's class
+        """
+        controller = copy.copy(self)
+        controller.cancellation_token = cancellation_token
+        return controller
+
+    def reporting_to(self, metrics):
+        """Return a copy of the controller, recording its programs' runs and
+        durations in metrics.
+
+        :param metrics: instance of :class:`~blu_mkv.metrics.Metrics`
+        :return: instance of the controller's class
+        """
+        controller = copy.copy(self)
+        controller.metrics = metrics
+        return controller
+
+    def _run(
+            self, command, media_duration=0, capture_output=True,
+            stderr=None, on_poll=None, poll_interval=1):
+        """Run the program, and return its output, like
+        :func:`subprocess.check_output`.
+
+        The program is started in its own process group, applying the
+        resource policy. If it takes longer than allowed by the timeout
+        policy, or if the cancellation token is cancelled, the program and
+        its children are killed.
+
+        :param list command: command-line of the program
+        :param float media_duration: duration in seconds of the media
+                                     processed by the program, as expected by
+                                     :meth:`.TimeoutPolicy.get_timeout`
+        :param bool capture_output: whether the program's output is returned,
+                                    rather than printed
+        :param stderr: where the program's errors are written, as expected by
+                       :class:`subprocess.Popen`
+        :param on_poll: if set, called every ``poll_interval`` seconds while
+                        the program runs
+        :param float poll_interval: number of seconds between two calls of
+                                    ``on_poll``
+        :return: the program's output, or `None` if not captured
+        :rtype: str or None
+        :raises subprocess.CalledProcessError: if the program fails
+        :raises subprocess.TimeoutExpired: if the program takes too long
+        :raises ~blu_mkv.process.OperationCancelled: if the cancellation
+                                                     token is cancelled
+        """
+        if self.timeout_policy is not None:
+            timeout = self.timeout_policy.get_timeout(media_duration)
+        else:
+            timeout = None
+
+        if self.cancellation_token is not None:
+            self.cancellation_token.raise_if_cancelled()
+
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE if capture_output else None,
+            stderr=stderr,
+            universal_newlines=True,
+            start_new_session=True,
+            **self._get_popen_options())
+
+        def kill():
+            if process.returncode is None:
+                kill_process_group(process)
+
+        if self.cancellation_token is not None:
+            cancellation = self.cancellation_token.on_cancel(kill)
+        else:
+            cancellation = ExitStack()
+
+        start_time = time.monotonic()
+        status = 'failure'
+        try:
+            with cancellation:
+                output = self._communicate(
+                    process, timeout, on_poll, poll_interval)
+            if not process.returncode:
+                status = 'success'
+        except subprocess.TimeoutExpired:
+            status = 'timeout'
+            raise
+        finally:
+            kill()
+            process.wait()
+            if process.stdout is not None:
+                process.stdout.close()
+
+            if (self.cancellation_token is not None and
+                    self.cancellation_token.cancelled):
+                status = 'cancelled'
+            self._record_run(status, time.monotonic() - start_time)
+
+        if self.cancellation_token is not None:
+            self.cancellation_token.raise_if_cancelled()
+        if process.returncode:
+            raise subprocess.CalledProcessError(
+                process.returncode, command, output)
+
+        return output
+
+    def _record_run(self, status, duration):
+        """Record a run of the program in the metrics, if any."""
+        if self.metrics is None:
+            return
+
+        program = PurePath(self.executable_path).name
+        self.metrics.increment(
+            'blu_mkv_program_runs_total', program=program, status=status)
+        self.metrics.observe(
+            'blu_mkv_program_duration_seconds', duration, program=program)
+
+    @staticmethod
+    def _communicate(process, timeout, on_poll, poll_interval):
+        """Wait for a program to end, and return its output."""
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
+        while True:
+            wait_timeout = poll_interval if on_poll is not None else None
+            if timeout is not None:
+                remaining_time = max(0, deadline - time.monotonic())
+                if wait_timeout is None or remaining_time < wait_timeout:
+                    wait_timeout = remaining_time
+
+            try:
+                (output, _) = process.communicate(timeout=wait_timeout)
+                return output
+            except subprocess.TimeoutExpired:
+                if timeout is not None and time.monotonic() >= deadline:
+                    raise subprocess.TimeoutExpired(process.args, timeout)
+                if on_poll is not None:
+                    on_poll()
+
+    def _get_popen_options(self):
+        """Return the options of :class:`subprocess.Popen` applying the
+        resource policy, if any, to the program."""
+        if self.resource_policy is None:
+            return dict()
+        return self.resource_policy.get_popen_options()
+
+    def _limit_io(self, *paths):
+        """Return a context manager holding the devices storing some input
+        files, if an I/O limiter is set. Waiting for the devices stops once
+        the cancellation token is cancelled."""
+        if self.io_limiter is None:
+            return ExitStack()
+        return self.io_limiter.limit(
+            *paths, cancellation_token=self.cancellation_token)
 
     @staticmethod
     def _get_executable_path(executable_file):
@@ -0,0 +1,351 @@
+"""Choose how many programs read a disc at once, from measured throughputs.
+
+The best number of concurrent readers depends on the host: an optical drive
+is slower with two readers than with one, while a RAID array or an NVMe drive
+needs several to be saturated. Before converting a disc, a preflight
+measures with short timed samples the read throughput of the disc with an
+increasing number of concurrent readers, and the write throughput of the
+destination, to choose the number of concurrent probes and remuxes (see
+:func:`preflight`).
+
+Widths are then adjusted while converting, by a :class:`ThroughputTuner`
+following the throughput of the disc's device: the width is increased by one
+as long as the throughput does not drop, and halved when it does (additive
+increase, multiplicative decrease).
+"""
+
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+
+from .bluray import STREAMS_RELATIVE_PATH
+from .iolimit import get_device_statistics
+
+
+#: Size of the reads and writes of the samples, in bytes.
+SAMPLE_BLOCK_SIZE = 1024 * 1024
+
+#: Minimum throughput gain for more concurrent readers to be worth it.
+MIN_CONCURRENCY_GAIN = 0.1
+
+
+def get_sample_files(disc_path, max_files=16):
+    """Return the files of a disc whose reads are measured: the disc itself
+    for a disk image, or its biggest streams otherwise.
+
+    :param str disc_path: path of the disc (disk image, or directory)
+    :param int max_files: maximum number of returned files
+    :return: paths of the files, biggest first
+    :rtype: list
+    """
+    disc_path = Path(str(disc_path))
+    if disc_path.is_file():
+        return [str(disc_path)]
+
+    file_paths = [
+        file_path for file_path in
+        disc_path.joinpath(STREAMS_RELATIVE_PATH).glob('*')
+        if file_path.is_file()]
+    file_paths.sort(key=lambda file_path: file_path.stat().st_size,
+                    reverse=True)
+    return [str(file_path) for file_path in file_paths[:max_files]]
+
+
+def _get_sample_regions(file_paths, regions_count):
+    """Split files into regions of equal size, to be read by concurrent
+    readers.
+
+    :return: list of ``(file_path, start, end)`` tuples
+    :rtype: list
+    """
+    file_sizes = [
+        (file_path, os.stat(file_path).st_size) for file_path in file_paths]
+    region_size = sum(size for (_, size) in file_sizes) // regions_count
+    if not region_size:
+        return [
+            (file_path, 0, file_size) for (file_path, file_size) in file_sizes
+            if file_size][:regions_count]
+
+    regions = list()
+    for (file_path, file_size) in file_sizes:
+        start = 0
+        while (file_size - start >= region_size and
+                len(regions) < regions_count):
+            regions.append((file_path, start, start + region_size))
+            start += region_size
+
+    # Smaller files than a region are read whole.
+    for (file_path, file_size) in file_sizes:
+        if len(regions) >= regions_count:
+            break
+        if file_size < region_size:
+            regions.append((file_path, 0, file_size))
+
+    return regions
+
+
+def _read_region(file_path, start, end, deadline, read_sizes, index):
+    """Read a region of a file sequentially, until its end or a deadline."""
+    with open(file_path, 'rb', buffering=0) as sample_file:
+        # Measure the device, not the page cache.
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(
+                sample_file.fileno(), start, end - start,
+                os.POSIX_FADV_DONTNEED)
+
+        buffer = bytearray(SAMPLE_BLOCK_SIZE)
+        sample_file.seek(start)
+        position = start
+        while position < end and time.monotonic() < deadline:
+            read_size = sample_file.readinto(buffer)
+            if not read_size:
+                break
+            position += read_size
+            read_sizes[index] += read_size
+
+
+def measure_read_throughput(file_paths, concurrency=1, duration=2):
+    """Measure the throughput of concurrent sequential reads of files.
+
+    The files are split into regions, each one read by its own thread from
+    its beginning, until its end or the end of the sample.
+
+    :param list file_paths: paths of the read files
+    :param int concurrency: number of concurrent readers
+    :param float duration: duration of the sample, in seconds
+    :return: number of bytes read per second
+    :rtype: float
+    """
+    regions = _get_sample_regions(file_paths, concurrency)
+    if not regions:
+        return 0
+
+    read_sizes = [0] * len(regions)
+    start_time = time.monotonic()
+    readers = [
+        threading.Thread(
+            target=_read_region,
+            args=(file_path, start, end, start_time + duration, read_sizes,
+                  index))
+        for (index, (file_path, start, end)) in enumerate(regions)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+
+    return sum(read_sizes) / max(time.monotonic() - start_time, 1e-6)
+
+
+def measure_write_throughput(directory, duration=2):
+    """Measure the throughput of a sequential write to a directory.
+
+    A temporary file is written until the end of the sample, and synced to
+    its device, which is counted in the sample.
+
+    :param str directory: path of the directory
+    :param float duration: duration of the sample, in seconds
+    :return: number of bytes written per second
+    :rtype: float
+    """
+    # Random data, for file systems compressing files.
+    block = os.urandom(SAMPLE_BLOCK_SIZE)
+    written_size = 0
+
+    with tempfile.NamedTemporaryFile(
+            dir=str(directory), prefix='.blu-mkv-preflight-') as sample_file:
+        start_time = time.monotonic()
+        deadline = start_time + duration
+        while time.monotonic() < deadline:
+            written_size += sample_file.write(block)
+        sample_file.flush()
+        os.fsync(sample_file.fileno())
+        elapsed_time = time.monotonic() - start_time
+
+    return written_size / max(elapsed_time, 1e-6)
+
+
+def preflight(disc_path, dst_dir, max_concurrency=8, duration=2):
+    """Measure the throughputs of a disc and of a destination directory,
+    and choose the number of concurrent probes and remuxes.
+
+    Readers are doubled as long as the read throughput increases by at
+    least :data:`MIN_CONCURRENCY_GAIN`. Remuxes are limited further if the
+    destination cannot write as fast as they read.
+
+    The returned dictionary has the following keys:
+    - read_throughputs: `dict`, read throughputs in bytes per second, by
+      number of concurrent readers
+    - write_throughput: `float`, write throughput in bytes per second
+    - read_concurrency: `int`, number of concurrent probes
+    - remux_concurrency: `int`, number of concurrent remuxes
+
+    :param str disc_path: path of the disc (disk image, or directory)
+    :param str dst_dir: directory where the Matroska files are written
+    :param int max_concurrency: maximum number of concurrent readers
+    :param float duration: duration of each sample, in seconds
+    :rtype: dict
+    """
+    sample_files = get_sample_files(disc_path)
+    read_throughputs = dict()
+    read_concurrency = 1
+    concurrency = 1
+    while concurrency <= max_concurrency:
+        read_throughputs[concurrency] =\
+            measure_read_throughput(sample_files, concurrency, duration)
+        if concurrency > 1:
+            if read_throughputs[concurrency] <\
+                    read_throughputs[read_concurrency] * (
+                        1 + MIN_CONCURRENCY_GAIN):
+                break
+            read_concurrency = concurrency
+        concurrency *= 2
+
+    write_throughput = measure_write_throughput(dst_dir, duration)
+
+    # Each remux reads at most its share of the best read throughput.
+    reader_throughput =\
+        read_throughputs[read_concurrency] / read_concurrency
+    if reader_throughput > 0:
+        remux_concurrency = max(1, min(
+            read_concurrency, int(write_throughput / reader_throughput)))
+    else:
+        remux_concurrency = 1
+
+    return {
+        'read_throughputs': read_throughputs,
+        'write_throughput': write_throughput,
+        'read_concurrency': read_concurrency,
+        'remux_concurrency': remux_concurrency}
+
+
+class ThroughputTuner:
+    """Adjust the number of concurrent readers of a device, according to its
+    read throughput (additive increase, multiplicative decrease).
+
+    The throughput is measured from the device's statistics, i.e., including
+    reads of other processes, over intervals during which the device is
+    read by the limiter's programs (see
+    :meth:`~blu_mkv.iolimit.DeviceLimiter.tune`). Devices without
+    statistics (e.g., network shares) keep their width.
+
+    The width is adjusted when a program stops reading the device, and
+    periodically while the device is read once :meth:`.start` is called, as
+    programs (e.g., remuxes) can read it for hours. It is shared with the
+    other processes using the limiter's lock directory, if any.
+
+    :param io_limiter: instance of :class:`~blu_mkv.iolimit.DeviceLimiter`
+    :param str device: device whose width is adjusted, as returned by
+                       :meth:`~blu_mkv.iolimit.DeviceLimiter.get_device`
+    :param int min_width: minimum number of concurrent readers
+    :param int max_width: maximum number of concurrent readers
+    :param float interval: minimum number of seconds between two
+                           adjustments
+    :param float tolerance: part of the throughput which can be lost without
+                            reducing the width (e.g., measurement noise)
+    """
+    def __init__(
+            self, io_limiter, device, min_width=1, max_width=8, interval=10,
+            tolerance=0.1):
+        self.io_limiter = io_limiter
+        self.device = device
+        self.min_width = min_width
+        self.max_width = max_width
+        self.interval = interval
+        self.tolerance = tolerance
+
+        #: Throughput measured over the last interval, in bytes per second.
+        self.throughput = None
+        self._lock = threading.Lock()
+        self._last_sample = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def for_path(cls, io_limiter, path, **options):
+        """Return a tuner of the device storing a file, registered to the
+        limiter.
+
+        :param io_limiter: instance of :class:`~blu_mkv.iolimit.DeviceLimiter`
+        :param str path: path of the file (e.g., a disc)
+        :param options: given to the tuner
+        :rtype: instance of :class:`.ThroughputTuner`
+        :raises OSError: if the file does not exist
+        """
+        tuner = cls(io_limiter, io_limiter.get_device(path), **options)
+        io_limiter.tune(tuner)
+        return tuner
+
+    def start(self):
+        """Adjust the width periodically from a background thread, while the
+        device is read, until :meth:`.stop` is called."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop adjusting the width periodically."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Adjust the width periodically, while the device is read."""
+        # Checked several times per interval, so that the width is adjusted
+        # soon after the end of each interval.
+        while not self._stop_event.wait(self.interval / 4):
+            if self.io_limiter.count_readers(self.device):
+                self.update()
+
+    def get_read_bytes(self):
+        """Return the number of bytes read from the device.
+
+        :return: number of bytes, or `None` if unknown
+        :rtype: int or None
+        """
+        statistics = get_device_statistics(
+            self.device, self.io_limiter.sysfs_path)
+        return statistics[0] if statistics is not None else None
+
+    def restart(self):
+        """Start measuring the throughput from now (e.g., once the device is
+        read again, after an idle period)."""
+        read_bytes = self.get_read_bytes()
+        with self._lock:
+            self._last_sample = None
+            if read_bytes is not None:
+                self._last_sample = (time.monotonic(), read_bytes)
+
+    def update(self):
+        """Adjust the device's width, if the interval elapsed since the last
+        adjustment.
+
+        :return: the new width, or `None` if not adjusted
+        :rtype: int or None
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (self._last_sample is None or
+                    now - self._last_sample[0] < self.interval):
+                return None
+
+            read_bytes = self.get_read_bytes()
+            if read_bytes is None:
+                return None
+
+            (last_time, last_read_bytes) = self._last_sample
+            throughput = (read_bytes - last_read_bytes) / (now - last_time)
+            self._last_sample = (now, read_bytes)
+
+            width = self.io_limiter.get_width(self.device)
+            if (self.throughput is not None and
+                    throughput < self.throughput * (1 - self.tolerance)):
+                width = max(self.min_width, width // 2)
+            else:
+                width = min(self.max_width, width + 1)
+            self.throughput = throughput
+
+        self.io_limiter.set_width(self.device, width)
+        return width
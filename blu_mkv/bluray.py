@@ -1,12 +1,20 @@
+from bisect import bisect_left
 from collections import OrderedDict
+from contextlib import contextmanager
+import copy
 from datetime import timedelta
 from pathlib import Path, PurePath
 
 from cached_property import cached_property
 
+from . import ProgramController, clpi, mpls, tsscan
+from .cache import Flight, MemoryCache, get_files_fingerprint
 
+
+CLIPS_RELATIVE_PATH = "BDMV/CLIPINF"
 COVERS_RELATIVE_PATH = "BDMV/META/DL"
 PLAYLISTS_RELATIVE_PATH = "BDMV/PLAYLIST"
+STREAMS_RELATIVE_PATH = "BDMV/STREAM"
 
 
 class BlurayAnalyzer:
@@ -21,13 +29,286 @@ class BlurayAnalyzer:
     :param makemkv_controller:
         interface with Makemkv, instance of subclass of
         :class:`~blu_mkv.makemkv.AbstractMakemkvController`
+    :param analysis_cache:
+        used to reuse previous analysis results, as long as the disc's files
+        they depend on did not change. Instance of
+        :class:`~blu_mkv.cache.AnalysisCache`
+    :param on_playlist_probed:
+        called with the disc's path, the playlist's number and the playlist's
+        details, each time a playlist is found by :meth:`.iter_playlists`
+    :param on_tracks_resolved:
+        called with the disc's path, the playlist's number and the playlist's
+        tracks, each time tracks are returned by :meth:`.get_playlist_tracks`
+    :param on_frames_counted:
+        called with the disc's path, the playlist's number and the frames
+        counts, each time frames are counted by
+        :meth:`.get_subtitles_frames_count`
+    :param cancellation_token:
+        stops the analyses when cancelled, by killing the running programs,
+        instance of :class:`~blu_mkv.process.CancellationToken`
+    :param metrics:
+        records the probed playlists, the analysis cache's hits and misses,
+        and the programs' runs, instance of
+        :class:`~blu_mkv.metrics.Metrics`
+    :param memory_cache:
+        keeps analysis results in memory, as long as the disc's files they
+        depend on did not change, and makes concurrent analyses of the same
+        disc wait for each other rather than running the same programs.
+        Share one instance between the analyzers of a process. Instance of
+        :class:`~blu_mkv.cache.MemoryCache`
     """
     def __init__(
             self, ffprobe_controller, mkvmerge_controller,
-            makemkv_controller=None):
+            makemkv_controller=None, analysis_cache=None,
+            on_playlist_probed=None, on_tracks_resolved=None,
+            on_frames_counted=None, cancellation_token=None, metrics=None,
+            memory_cache=None):
         self.ffprobe_controller = ffprobe_controller
         self.mkvmerge_controller = mkvmerge_controller
         self.makemkv_controller = makemkv_controller
+        self.analysis_cache = analysis_cache
+        self.on_playlist_probed = on_playlist_probed
+        self.on_tracks_resolved = on_tracks_resolved
+        self.on_frames_counted = on_frames_counted
+        self.memory_cache = memory_cache
+        # Results of the clips' analyses, kept in memory even without memory
+        # cache, as clips are often shared by the playlists of a disc.
+        self._clips_cache = MemoryCache()
+
+        self.cancellation_token = None
+        if cancellation_token is not None:
+            self._set_cancellation_token(cancellation_token)
+
+        self.metrics = metrics
+        if metrics is not None:
+            self._bind_controllers(
+                lambda controller: controller.reporting_to(metrics))
+
+    def cancellable_by(self, cancellation_token):
+        """Return a copy of the analyzer, whose analyses are stopped when a
+        token is cancelled (e.g., a job's token).
+
+        Analysis results are shared with the original analyzer.
+
+        :param cancellation_token: instance of
+                                   :class:`~blu_mkv.process.CancellationToken`
+        :rtype: instance of :class:`.BlurayAnalyzer`
+        """
+        bluray_analyzer = copy.copy(self)
+        bluray_analyzer._set_cancellation_token(cancellation_token)
+        return bluray_analyzer
+
+    def with_analysis_cache(self, analysis_cache):
+        """Return a copy of the analyzer using another analysis cache, and no
+        memory cache, so that all its results go through the analysis cache
+        (e.g., to record them).
+
+        :param analysis_cache: instance of
+                               :class:`~blu_mkv.cache.AnalysisCache`, or of
+                               a class with the same ``load`` and ``store``
+                               methods
+        :rtype: instance of :class:`.BlurayAnalyzer`
+        """
+        bluray_analyzer = copy.copy(self)
+        bluray_analyzer.analysis_cache = analysis_cache
+        bluray_analyzer.memory_cache = None
+        bluray_analyzer._clips_cache = MemoryCache()
+        return bluray_analyzer
+
+    def _set_cancellation_token(self, cancellation_token):
+        """Bind the analyzer and its programs' controllers to a cancellation
+        token."""
+        self.cancellation_token = cancellation_token
+        self._bind_controllers(
+            lambda controller: controller.cancellable_by(cancellation_token))
+
+    def _bind_controllers(self, bind):
+        """Replace the programs' controllers by bound copies of them.
+
+        :param bind: called with each controller, returns its bound copy.
+                     Only called with controllers of external programs
+        """
+        for controller_name in [
+                'ffprobe_controller',
+                'mkvmerge_controller',
+                'makemkv_controller']:
+            controller = getattr(self, controller_name)
+            if isinstance(controller, ProgramController):
+                setattr(self, controller_name, bind(controller))
+
+    def _raise_if_cancelled(self):
+        """Stop the current analysis if the cancellation token, if any, has
+        been cancelled."""
+        if self.cancellation_token is not None:
+            self.cancellation_token.raise_if_cancelled()
+
+    def _record_cache_request(self, hit):
+        """Record a hit or a miss of the analysis cache in the metrics, if
+        any."""
+        if self.metrics is not None:
+            self.metrics.increment(
+                'blu_mkv_analysis_cache_requests_total',
+                result='hit' if hit else 'miss')
+
+    @contextmanager
+    def _get_memory_flight(self, disc_path, key, fingerprint):
+        """Return a context manager giving the result of an analysis from the
+        memory cache, or a flight to do the analysis (see
+        :meth:`~blu_mkv.cache.MemoryCache.single_flight`).
+
+        Without memory cache, the flight is never done, and never waited
+        for."""
+        if self.memory_cache is None:
+            yield Flight()
+            return
+
+        memory_key = (str(Path(str(disc_path)).resolve()), key, fingerprint)
+        with self.memory_cache.single_flight(
+                memory_key, self.cancellation_token) as flight:
+            yield flight
+
+    def _load_cached_result(self, disc_path, key, fingerprint):
+        """Return the result of an analysis from the analysis cache.
+
+        :raises KeyError: if there is no analysis cache, or if the result is
+                          not cached
+        """
+        if self.analysis_cache is None:
+            raise KeyError(key)
+
+        try:
+            result = self.analysis_cache.load(disc_path, key, fingerprint)
+        except KeyError:
+            self._record_cache_request(hit=False)
+            raise
+
+        self._record_cache_request(hit=True)
+        return result
+
+    def _get_cached_result(self, disc_path, key, get_dependencies, analyze):
+        """Return the result of an analysis, from the memory or analysis
+        cache if the files it depends on did not change since it was cached.
+
+        :param str disc_path: path of the Bluray disc
+        :param str key: identifier of the analysis on the disc
+        :param get_dependencies: callable returning paths of the files the
+                                 analysis depends on
+        :param analyze: callable doing the analysis
+        """
+        self._raise_if_cancelled()
+        if self.analysis_cache is None and self.memory_cache is None:
+            return analyze()
+
+        fingerprint = get_files_fingerprint(get_dependencies())
+
+        with self._get_memory_flight(disc_path, key, fingerprint) as flight:
+            if flight.done:
+                return flight.result
+
+            try:
+                result = self._load_cached_result(disc_path, key, fingerprint)
+            except KeyError:
+                result = analyze()
+                if self.analysis_cache is not None:
+                    self.analysis_cache.store(
+                        disc_path, key, fingerprint, result)
+
+            flight.set_result(result)
+            return result
+
+    def get_disc_dependencies(self, disc_path):
+        """Return paths of all the playlists, clips and streams of a Bluray
+        disc.
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :rtype: list
+        """
+        return self._get_directories_files(disc_path, [
+            PLAYLISTS_RELATIVE_PATH,
+            CLIPS_RELATIVE_PATH,
+            STREAMS_RELATIVE_PATH])
+
+    def get_playlists_listing_dependencies(self, disc_path):
+        """Return paths of the files the list of a Bluray disc's playlists
+        depends on: all the playlist and clip information files, but not the
+        streams.
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :rtype: list
+        """
+        return self._get_directories_files(disc_path, [
+            PLAYLISTS_RELATIVE_PATH,
+            CLIPS_RELATIVE_PATH])
+
+    @staticmethod
+    def _get_directories_files(disc_path, relative_paths):
+        """Return paths of the files in some of the disc's directories,
+        sorted."""
+        dependencies = list()
+        for relative_path in relative_paths:
+            directory = Path(disc_path, relative_path)
+            dependencies.extend(
+                str(file_path) for file_path in directory.glob('*')
+                if file_path.is_file())
+
+        return sorted(dependencies)
+
+    def get_playlist_dependencies(self, disc_path, playlist_number):
+        """Return paths of the files a playlist depends on: the playlist
+        file itself, and the clip information and stream files of all the
+        clips it plays (including other angles and sub-paths).
+
+        When the playlist file cannot be parsed, all the disc's playlists,
+        clips and streams are returned, to be on the safe side.
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :param int playlist_number: playlist's number
+        :rtype: list
+        """
+        playlist_path = Path(
+            disc_path,
+            PLAYLISTS_RELATIVE_PATH,
+            '{:05d}.mpls'.format(playlist_number))
+
+        try:
+            playlist = mpls.parse_playlist_file(playlist_path)
+        except FileNotFoundError:
+            return [str(playlist_path)]
+        except (OSError, mpls.PlaylistFileError):
+            return self.get_disc_dependencies(disc_path)
+
+        dependencies = [str(playlist_path)]
+        for clip_name in sorted(mpls.get_clip_names(playlist)):
+            dependencies.extend(self._get_clip_paths(disc_path, clip_name))
+
+        return dependencies
+
+    @staticmethod
+    def _get_clip_paths(disc_path, clip_name):
+        """Return paths of the clip information and stream files of a
+        clip."""
+        return [
+            str(Path(
+                disc_path, CLIPS_RELATIVE_PATH, '{}.clpi'.format(clip_name))),
+            str(Path(
+                disc_path, STREAMS_RELATIVE_PATH,
+                '{}.m2ts'.format(clip_name)))]
+
+    def get_clip_size(self, disc_path, clip_name):
+        """Return the size of a clip's stream file.
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :param str clip_name: name of the clip (e.g., "00001")
+        :return: size in bytes
+        :rtype: int
+        :raises OSError: if the stream file is missing
+        """
+        stream_path = self._get_clip_paths(disc_path, clip_name)[1]
+        return Path(stream_path).stat().st_size
 
     def get_playlists(self, disc_path):
         """Return details of playlists present on a Bluray disc by using
@@ -44,21 +325,73 @@ class BlurayAnalyzer:
         :return: a dictionary of found playlists, with their number as key
         :return type: dict
         """
-        ffprobe_analysis =\
-            self.ffprobe_controller.get_bluray_playlists(disc_path)
+        return dict(self.iter_playlists(disc_path))
 
-        playlists = dict()
-        for playlist_number, playlist_info in ffprobe_analysis.items():
-            playlist_duration = playlist_info.get('duration')
-            if playlist_duration is None:
+    def iter_playlists(self, disc_path):
+        """Yield playlists present on a Bluray disc, one after another as
+        they are probed, sorted by number.
+
+        See :meth:`.get_playlists` for more information. The list of
+        playlists, and each playlist's details, are cached separately: a
+        playlist is only probed again if its own playlist file, or the files
+        of the clips it plays, have changed.
+
+        Each playlist's analysis is finished before it is yielded: analyzers
+        sharing the memory cache are never blocked by a slow consumer of the
+        iterator, and probe the playlists it did not reach yet themselves.
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :return: an iterator of ``(playlist_number, playlist_details)``
+                 tuples
+        """
+        playlists_numbers = self._get_cached_result(
+            disc_path, 'playlists_numbers',
+            lambda: self.get_playlists_listing_dependencies(disc_path),
+            lambda: self.ffprobe_controller.get_bluray_playlist_numbers(
+                disc_path))
+
+        for playlist_number in playlists_numbers:
+            playlist_info = self._get_cached_result(
+                disc_path, 'playlist-{:05d}'.format(playlist_number),
+                lambda: self.get_playlist_dependencies(
+                    disc_path, playlist_number),
+                lambda: self._probe_playlist(disc_path, playlist_number))
+            if playlist_info is None:
                 continue
-            playlist_duration = float(playlist_info['duration'])
 
-            playlists[playlist_number] = {
-                'duration': timedelta(seconds=playlist_duration),
-                'size': int(playlist_info['size'])}
+            self._playlist_probed(disc_path, playlist_number, playlist_info)
+            yield (playlist_number, playlist_info)
+
+    def _probe_playlist(self, disc_path, playlist_number):
+        """Probe a playlist by using Ffprobe.
+
+        :return: the playlist's details, or `None` if it has no duration
+        """
+        playlist_info = self.ffprobe_controller.get_bluray_playlist(
+            disc_path, playlist_number)
+
+        playlist_duration = playlist_info.get('duration')
+        if playlist_duration is None:
+            return None
+
+        return {
+            'duration': timedelta(seconds=float(playlist_duration)),
+            'size': int(playlist_info['size'])}
 
-        return playlists
+    def _playlist_probed(self, disc_path, playlist_number, playlist_info):
+        """Record a found playlist in the metrics, if any, and notify it."""
+        if self.metrics is not None:
+            self.metrics.increment('blu_mkv_playlists_probed_total')
+        self._notify(
+            self.on_playlist_probed,
+            disc_path, playlist_number, playlist_info)
+
+    @staticmethod
+    def _notify(callback, *args):
+        """Call a progress callback, if set."""
+        if callback is not None:
+            callback(*args)
 
     def get_covers(self, disc_path):
         """Return covers present on a Bluray disc.
@@ -84,6 +417,7 @@ class BlurayAnalyzer:
         by using Ffprobe and Mkvmerge.
 
         All tracks have the following details:
+        - codec: `str`, codec of the track, as named by Mkvmerge
         - language_code: `str`, language of the track if defined
                          (in ISO639-2 format); `None` otherwise
         - uid: `int`, unique identifier of the track
@@ -96,11 +430,39 @@ class BlurayAnalyzer:
                  is different from the track's uid)
         :return type: dict
         """
-        playlist_tracks = self._get_all_tracks(disc_path, playlist_number)
-        self._set_tracks_languages(disc_path, playlist_number, playlist_tracks)
+        playlist_tracks = self._get_cached_result(
+            disc_path, 'playlist_tracks-{:05d}'.format(playlist_number),
+            lambda: self.get_playlist_dependencies(disc_path, playlist_number),
+            lambda: self._get_playlist_tracks(disc_path, playlist_number))
+
+        self._notify(
+            self.on_tracks_resolved,
+            disc_path, playlist_number, playlist_tracks)
         return playlist_tracks
 
-    def _get_all_tracks(self, disc_path, playlist_number):
+    def _get_playlist_tracks(self, disc_path, playlist_number):
+        """Get tracks of a playlist by using Ffprobe and Mkvmerge."""
+        playlist_path = PurePath(
+            disc_path,
+            PLAYLISTS_RELATIVE_PATH,
+            '{:05d}.mpls'.format(playlist_number))
+
+        mkvmerge_analysis =\
+            self.mkvmerge_controller.get_file_info(str(playlist_path))
+
+        # Streams found by Mkvmerge are expected from Ffprobe too, so that it
+        # can probe deeper if it misses some of them (in fast-probe mode).
+        expected_ids = {
+            track['properties']['ts_pid']
+            for track in mkvmerge_analysis['tracks']
+            if 'ts_pid' in track['properties']}
+
+        playlist_tracks = self._get_all_tracks(
+            disc_path, playlist_number, expected_ids)
+        self._set_tracks_properties(playlist_tracks, mkvmerge_analysis)
+        return playlist_tracks
+
+    def _get_all_tracks(self, disc_path, playlist_number, expected_ids=None):
         """Get all tracks of a playlist by using Ffprobe.
 
         Among all tracks information provided by Ffprobe, only tracks'
@@ -108,7 +470,8 @@ class BlurayAnalyzer:
         """
         ffprobe_analysis = (
             self.ffprobe_controller
-            .get_all_bluray_playlist_streams(disc_path, playlist_number))
+            .get_all_bluray_playlist_streams(
+                disc_path, playlist_number, expected_ids=expected_ids))
 
         tracks = {
             'audio': dict(),
@@ -122,26 +485,21 @@ class BlurayAnalyzer:
 
         return tracks
 
-    def _set_tracks_languages(
-            self, disc_path, playlist_number, playlist_tracks):
-        """Set all tracks language by using Mkvmerge."""
-        playlist_path = PurePath(
-            disc_path,
-            PLAYLISTS_RELATIVE_PATH,
-            '{:05d}.mpls'.format(playlist_number))
-
-        mkvmerge_analysis =\
-            self.mkvmerge_controller.get_file_info(str(playlist_path))
-
-        tracks_language = {
-            track['id']: track['properties'].get('language')
-            for track in mkvmerge_analysis['tracks']}
+    @staticmethod
+    def _set_tracks_properties(playlist_tracks, mkvmerge_analysis):
+        """Set all tracks language and codec from Mkvmerge's analysis."""
+        mkvmerge_tracks = {
+            track['id']: track for track in mkvmerge_analysis['tracks']}
 
         for tracks in playlist_tracks.values():
             for track_id, track_info in tracks.items():
-                track_info['language_code'] = tracks_language[track_id]
+                mkvmerge_track = mkvmerge_tracks[track_id]
+                track_info['codec'] = mkvmerge_track.get('codec')
+                track_info['language_code'] =\
+                    mkvmerge_track['properties'].get('language')
 
-    def get_subtitles_frames_count(self, disc_path, playlist_number):
+    def get_subtitles_frames_count(
+            self, disc_path, playlist_number, track_ids=None):
         """Get subtitles' frames count by using Ffprobe.
 
         Useful to identify forced subtitles.
@@ -149,14 +507,48 @@ class BlurayAnalyzer:
         :param str disc_path: path of the Bluray disc. Must points to a
                               directory
         :param int playlist_number: playlist's number
+        :param list track_ids: identifiers of the subtitle tracks to count
+                               frames for. All subtitle tracks if not set
         :return: a dictionary with subtitle tracks' identifiers as keys,
                  and frames counts as values
         :return type: dict
         """
+        if track_ids is not None and not track_ids:
+            return dict()
+
+        frames_count = self._count_subtitles_frames_in_clips(
+            disc_path, playlist_number, track_ids)
+        if frames_count is None:
+            frames_count = self._count_subtitles_frames_in_playlist(
+                disc_path, playlist_number, track_ids)
+
+        self._notify(
+            self.on_frames_counted, disc_path, playlist_number, frames_count)
+        return frames_count
+
+    def _count_subtitles_frames_in_playlist(
+            self, disc_path, playlist_number, track_ids):
+        """Count subtitles' frames of a whole playlist by using Ffprobe, or
+        reuse the count from the analysis cache."""
+        cache_key = 'subtitles_frames_count-{:05d}'.format(playlist_number)
+        if track_ids is not None:
+            track_ids = sorted(track_ids)
+            cache_key += '-{}'.format(
+                '_'.join(str(track_id) for track_id in track_ids))
+
+        return self._get_cached_result(
+            disc_path, cache_key,
+            lambda: self.get_playlist_dependencies(disc_path, playlist_number),
+            lambda: self._get_subtitles_frames_count(
+                disc_path, playlist_number, track_ids))
+
+    def _get_subtitles_frames_count(
+            self, disc_path, playlist_number, track_ids):
+        """Get subtitles' frames count by using Ffprobe."""
         ffprobe_analysis = (
             self.ffprobe_controller
             .get_bluray_playlist_subtitles_with_frames_count(
-                disc_path, playlist_number))
+                disc_path, playlist_number, track_ids=track_ids))
 
         subtitles = dict()
         for subtitle in ffprobe_analysis:
@@ -166,6 +558,308 @@ class BlurayAnalyzer:
 
         return subtitles
 
+    def _count_subtitles_frames_in_clips(
+            self, disc_path, playlist_number, track_ids):
+        """Count subtitles' frames of a playlist from the subtitle packets
+        of the clips it plays, between the in and out points of each play
+        item.
+
+        Subtitles are carried by one packet per segment, so packets counts
+        are proportional to frames counts, and can be compared the same way.
+
+        :return: a dictionary with subtitle tracks' identifiers as keys, and
+                 packets counts as values; or `None` if the playlist's clips
+                 cannot be probed (e.g., missing or invalid playlist file, or
+                 subtitles stored outside of the playlist's main clips)
+        """
+        playlist_path = Path(
+            disc_path,
+            PLAYLISTS_RELATIVE_PATH,
+            '{:05d}.mpls'.format(playlist_number))
+
+        try:
+            playlist = mpls.parse_playlist_file(playlist_path)
+        except (OSError, mpls.PlaylistFileError):
+            return None
+
+        subtitle_tracks =\
+            self.get_playlist_tracks(disc_path, playlist_number)['subtitle']
+        if track_ids is None:
+            track_ids = list(subtitle_tracks)
+
+        frames_count = {track_id: 0 for track_id in track_ids}
+        found_pids = set()
+
+        for play_item in playlist['play_items']:
+            (_, stream_path) =\
+                self._get_clip_paths(disc_path, play_item['clip_name'])
+            if not Path(stream_path).is_file():
+                return None
+
+            clip_packets = self.get_clip_subtitle_packets(
+                disc_path, play_item['clip_name'])
+            found_pids.update(clip_packets)
+
+            # Packets' timestamps use a 90 kHz clock, while in and out points
+            # use a 45 kHz clock.
+            start = 2 * play_item['in_time']
+            end = 2 * play_item['out_time']
+
+            for track_id in track_ids:
+                timestamps =\
+                    clip_packets.get(subtitle_tracks[track_id]['uid'], [])
+                frames_count[track_id] += (
+                    bisect_left(timestamps, end) -
+                    bisect_left(timestamps, start))
+
+        if any(subtitle_tracks[track_id]['uid'] not in found_pids
+               for track_id in track_ids):
+            return None
+
+        return frames_count
+
+    def get_clip_subtitle_packets(self, disc_path, clip_name):
+        """Return timestamps of the subtitle packets of a clip, by using
+        Ffprobe.
+
+        Clips are often shared by several playlists (e.g., theatrical and
+        extended cuts). Results are thus kept in memory (and in the analysis
+        cache, if any), in order to probe each clip only once.
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :param str clip_name: name of the clip (e.g., "00001")
+        :return: a dictionary with subtitle streams' PIDs as keys, and sorted
+                 lists of packets' timestamps (90 kHz clock) as values
+        :rtype: dict
+        """
+        return self._get_clip_result(
+            disc_path, clip_name, 'clip_subtitle_packets',
+            self._get_clip_subtitle_packets)
+
+    def _get_clip_result(self, disc_path, clip_name, key, analyze):
+        """Return the result of a clip's analysis, from memory or from the
+        analysis cache if the clip did not change since it was cached.
+
+        Without memory cache, results are kept in a small memory cache of the
+        analyzer (and of its copies), bounded like any
+        :class:`~blu_mkv.cache.MemoryCache`.
+
+        :param str disc_path: path of the Bluray disc
+        :param str clip_name: name of the clip
+        :param str key: identifier of the analysis
+        :param analyze: callable doing the analysis, given the path of the
+                        clip's stream file
+        """
+        clip_paths = self._get_clip_paths(disc_path, clip_name)
+        result_key = '{}-{}'.format(key, clip_name)
+
+        def get_result():
+            return self._get_cached_result(
+                disc_path, result_key,
+                lambda: clip_paths,
+                lambda: analyze(clip_paths[1]))
+
+        if self.memory_cache is not None:
+            return get_result()
+
+        # Like in the memory cache, results are only reused as long as the
+        # clip's files do not change.
+        memory_key = (
+            str(Path(str(disc_path)).resolve()), result_key,
+            get_files_fingerprint(clip_paths))
+        return self._clips_cache.get(
+            memory_key, get_result, self.cancellation_token)
+
+    def _get_clip_subtitle_packets(self, stream_path):
+        """Get timestamps of the subtitle packets of a clip by using
+        Ffprobe."""
+        ffprobe_analysis =\
+            self.ffprobe_controller.get_subtitle_packets(stream_path)
+
+        streams_pids = {
+            stream['index']: int(stream['id'], base=16)
+            for stream in ffprobe_analysis['streams']}
+        clip_packets = {pid: list() for pid in streams_pids.values()}
+
+        for packet in ffprobe_analysis.get('packets', []):
+            if packet.get('pts') is None:
+                continue
+            pid = streams_pids[packet['stream_index']]
+            clip_packets[pid].append(int(packet['pts']))
+
+        for timestamps in clip_packets.values():
+            timestamps.sort()
+
+        return clip_packets
+
+    def get_clip_streams_statistics(self, disc_path, clip_name):
+        """Return statistics of each stream of a clip, by scanning its
+        transport stream.
+
+        See :func:`~blu_mkv.tsscan.scan_transport_stream` for more information
+        about the returned statistics. Like
+        :meth:`.get_clip_subtitle_packets`, results are kept in memory (and in
+        the analysis cache, if any).
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :param str clip_name: name of the clip (e.g., "00001")
+        :rtype: dict
+        :raises ImportError: if NumPy is not installed
+        """
+        return self._get_clip_result(
+            disc_path, clip_name, 'clip_streams_statistics',
+            tsscan.scan_transport_stream)
+
+    def get_playlist_streams_statistics(self, disc_path, playlist_number):
+        """Return statistics of each stream of a playlist, by scanning the
+        transport streams of the clips it plays.
+
+        When only a part of a clip is played, its statistics are prorated
+        according to the play item's in and out points.
+
+        The returned dictionary has the following keys:
+        - duration: `float`, duration of the played clips in seconds
+        - streams: dictionary of streams' statistics, with their PID as key.
+          Each stream's statistics is a dictionary with the following keys:
+          - bytes: `int`, size of the stream's payloads
+          - pes_count: `int`, number of PES packets of the stream
+          - bitrate: `float`, average bitrate in bits per second, or `None` if
+                     the duration is unknown
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :param int playlist_number: playlist's number
+        :rtype: dict
+        :raises ImportError: if NumPy is not installed
+        :raises OSError: if the playlist file or a clip is missing
+        :raises ~blu_mkv.mpls.PlaylistFileError: if the playlist file is not
+                                                 valid
+        """
+        playlist = mpls.parse_playlist_file(Path(
+            disc_path,
+            PLAYLISTS_RELATIVE_PATH,
+            '{:05d}.mpls'.format(playlist_number)))
+
+        duration = 0
+        streams = dict()
+        for play_item in playlist['play_items']:
+            clip_statistics = self.get_clip_streams_statistics(
+                disc_path, play_item['clip_name'])
+
+            played_duration = (
+                (play_item['out_time'] - play_item['in_time']) /
+                mpls.TICKS_PER_SECOND)
+            if clip_statistics['duration']:
+                played_ratio =\
+                    min(1, played_duration / clip_statistics['duration'])
+            else:
+                played_ratio = 1
+            duration += played_ratio * clip_statistics['duration']
+
+            for (pid, stream) in clip_statistics['streams'].items():
+                playlist_stream =\
+                    streams.setdefault(pid, {'bytes': 0, 'pes_count': 0})
+                playlist_stream['bytes'] += played_ratio * stream['bytes']
+                playlist_stream['pes_count'] +=\
+                    played_ratio * stream['pes_count']
+
+        for stream in streams.values():
+            stream['bytes'] = int(round(stream['bytes']))
+            stream['pes_count'] = int(round(stream['pes_count']))
+            stream['bitrate'] =\
+                stream['bytes'] * 8 / duration if duration else None
+
+        return {'duration': duration, 'streams': streams}
+
+    def get_clip_tracks(self, disc_path, clip_name):
+        """Return identifiers of the tracks of a clip, as seen by Mkvmerge
+        when remuxing the clip's transport stream on its own.
+
+        Tracks' identifiers in a clip differ from their identifiers in
+        playlists, but tracks can be matched by their PID. When several
+        tracks share the same PID (e.g., a lossless audio track and its lossy
+        core), only the first one is returned. Like
+        :meth:`.get_clip_subtitle_packets`, results are kept in memory (and in
+        the analysis cache, if any).
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :param str clip_name: name of the clip (e.g., "00001")
+        :return: a dictionary with tracks' PIDs as keys, and Mkvmerge's
+                 tracks' identifiers as values
+        :rtype: dict
+        """
+        return self._get_clip_result(
+            disc_path, clip_name, 'clip_tracks', self._get_clip_tracks)
+
+    def _get_clip_tracks(self, stream_path):
+        """Get identifiers of the tracks of a clip by using Mkvmerge."""
+        mkvmerge_analysis = self.mkvmerge_controller.get_file_info(stream_path)
+
+        clip_tracks = dict()
+        for track in mkvmerge_analysis['tracks']:
+            clip_tracks.setdefault(track['properties']['ts_pid'], track['id'])
+
+        return clip_tracks
+
+    def get_playlist_segments(self, disc_path, playlist_number):
+        """Return the parts of clips played by a playlist, in playing order.
+
+        Each play item of the playlist is split at the playlist's entry marks
+        (i.e., chapters), so that chapters can be kept when linking clips
+        together. Each part is a dictionary with the following keys:
+        - clip_name: `str`, name of the played clip
+        - start: `int`, start of the part in nanoseconds, relatively to the
+                 beginning of the clip's presentation
+        - end: `int`, end of the part in nanoseconds, relatively to the
+               beginning of the clip's presentation
+
+        :param str disc_path: path of the Bluray disc. Must points to a
+                              directory
+        :param int playlist_number: playlist's number
+        :rtype: list
+        :raises OSError: if the playlist file or a clip information file is
+                         missing
+        :raises ~blu_mkv.mpls.PlaylistFileError: if the playlist file is not
+                                                 valid
+        :raises ~blu_mkv.clpi.ClipInformationFileError: if a clip information
+                                                        file is not valid
+        """
+        playlist = mpls.parse_playlist_file(Path(
+            disc_path,
+            PLAYLISTS_RELATIVE_PATH,
+            '{:05d}.mpls'.format(playlist_number)))
+
+        segments = list()
+        for (play_item_index, play_item) in enumerate(playlist['play_items']):
+            clip_information = clpi.parse_clip_information_file(
+                self._get_clip_paths(disc_path, play_item['clip_name'])[0])
+            clip_start = clip_information['presentation_start_time']
+
+            split_times = sorted(
+                mark['time'] for mark in playlist['marks']
+                if mark['type'] == mpls.ENTRY_MARK_TYPE and
+                mark['play_item'] == play_item_index and
+                play_item['in_time'] < mark['time'] < play_item['out_time'])
+            split_times = (
+                [play_item['in_time']] + split_times +
+                [play_item['out_time']])
+
+            for (start, end) in zip(split_times, split_times[1:]):
+                segments.append({
+                    'clip_name': play_item['clip_name'],
+                    'start': self._ticks_to_nanoseconds(start - clip_start),
+                    'end': self._ticks_to_nanoseconds(end - clip_start)})
+
+        return segments
+
+    @staticmethod
+    def _ticks_to_nanoseconds(ticks):
+        """Convert a duration from playlists' ticks to nanoseconds."""
+        return max(0, ticks) * 10 ** 9 // mpls.TICKS_PER_SECOND
+
     def identify_multiview_playlists(self, disc_path):
         """Return numbers of playlists containing multiview tracks (like
         three-dimensional video tracks) by using Makemkv.
@@ -181,6 +875,13 @@ class BlurayAnalyzer:
             "Cannot identify multiview playlists because the attribute "
             "'makemkv_controller' is not set")
 
+        return self._get_cached_result(
+            disc_path, 'multiview_playlists',
+            lambda: self.get_disc_dependencies(disc_path),
+            lambda: self._identify_multiview_playlists(disc_path))
+
+    def _identify_multiview_playlists(self, disc_path):
+        """Identify multiview playlists by using Makemkv."""
         makemkv_analysis =\
             self.makemkv_controller.get_disc_info('file', disc_path)
 
@@ -207,11 +908,38 @@ class BlurayDisc:
     :param path str: path of the disc
     :param bluray_analyzer: used to lazily probe the disc,
                             instance of :class:`.BlurayAnalyzer`
+    :param cancellation_token: if set, stops the disc's analyses when
+                               cancelled (see
+                               :meth:`.BlurayAnalyzer.cancellable_by`),
+                               instance of
+                               :class:`~blu_mkv.process.CancellationToken`
     """
-    def __init__(self, path, bluray_analyzer):
+    def __init__(self, path, bluray_analyzer, cancellation_token=None):
+        if cancellation_token is not None:
+            bluray_analyzer = bluray_analyzer.cancellable_by(
+                cancellation_token)
+
         self.path = path
         self.bluray_analyzer = bluray_analyzer
 
+    @classmethod
+    def from_snapshot(cls, snapshot, cancellation_token=None, **options):
+        """Return a disc analyzed from a snapshot of its metadata files and
+        analysis results, without the disc itself.
+
+        :param snapshot: extracted snapshot, instance of
+                         :class:`~blu_mkv.snapshot.DiscSnapshot`
+        :param cancellation_token: if set, stops the disc's analyses when
+                                   cancelled, instance of
+                                   :class:`~blu_mkv.process.CancellationToken`
+        :param options: given to the snapshot's analyzer (e.g., progress
+                        callbacks, see :class:`.BlurayAnalyzer`)
+        :rtype: instance of :class:`.BlurayDisc`
+        """
+        return cls(
+            snapshot.disc_path, snapshot.get_analyzer(**options),
+            cancellation_token=cancellation_token)
+
     @cached_property
     def playlists(self):
         """Return the disc's playlists, sorted by number.
@@ -222,20 +950,55 @@ class BlurayDisc:
         :rtype: list
         """
         raw_playlists = self.bluray_analyzer.get_playlists(self.path)
+        return list(self._make_playlists(sorted(raw_playlists.items())))
+
+    def iter_playlists(self):
+        """Yield the disc's playlists, one after another as they are
+        probed, sorted by number.
+
+        Like :attr:`.playlists`, duplicate playlists are filtered, and the
+        caller can start working on the first playlists while the next ones
+        are being probed. Once all the playlists have been yielded, they are
+        kept as :attr:`.playlists`, and are not probed again.
+
+        :return: an iterator of :class:`.BlurayPlaylist` instances
+        """
+        if 'playlists' in self.__dict__:
+            return iter(self.playlists)
+
+        return self._iter_and_keep_playlists()
 
+    def _iter_and_keep_playlists(self):
+        """Yield the disc's playlists as they are probed, and keep them once
+        they have all been yielded."""
         playlists = list()
-        for (playlist_number, playlist_info) in sorted(raw_playlists.items()):
-            playlist = BlurayPlaylist(
+        for playlist in self._make_playlists(
+                self.bluray_analyzer.iter_playlists(self.path)):
+            playlists.append(playlist)
+            yield playlist
+
+        # Same storage as the cached property.
+        self.__dict__['playlists'] = playlists
+
+    def _make_playlists(self, raw_playlists):
+        """Yield playlists from their details, while filtering duplicates.
+
+        Details must be sorted by number, so that the duplicate with the
+        lowest number is kept."""
+        # Playlists are equal when they have the same duration and size.
+        found_playlists = set()
+        for (playlist_number, playlist_info) in raw_playlists:
+            playlist_key = (playlist_info['duration'], playlist_info['size'])
+            if playlist_key in found_playlists:
+                continue
+            found_playlists.add(playlist_key)
+
+            yield BlurayPlaylist(
                 disc=self,
                 number=playlist_number,
                 duration=playlist_info['duration'],
                 size=playlist_info['size'])
 
-            if playlist not in playlists:
-                playlists.append(playlist)
-
-        return sorted(playlists, key=lambda playlist: playlist.number)
-
     @cached_property
     def multiview_playlists(self):
         """Return playlists containing multiview tracks (like
@@ -387,7 +1150,14 @@ class BlurayPlaylist:
         """
         return self._all_tracks['subtitle']
 
-    def get_forced_subtitles(self, frames_count_factor=0.3):
+    @cached_property
+    def _subtitles_frames_count(self):
+        """Return the frames count of all the playlist's subtitle tracks."""
+        return (
+            self.disc.bluray_analyzer
+            .get_subtitles_frames_count(self.disc.path, self.number))
+
+    def get_forced_subtitles(self, frames_count_factor=0.3, track_ids=None):
         """Return forced subtitles of the playlist, by computing frames count
         for each subtitle track.
 
@@ -397,14 +1167,27 @@ class BlurayPlaylist:
         frames than the result of this multiplication are considered as forced
         subtitles.
 
+        When only some subtitle tracks are candidates (e.g., after filtering
+        tracks by language), forced subtitles are identified per language: a
+        candidate is compared to the "biggest" candidate of the same language.
+        A candidate which is the only one of its language is compared to the
+        "biggest" playlist's subtitle track instead, so frames are then
+        counted for all subtitle tracks. Be aware that when frames are counted
+        with Ffprobe, all subtitle tracks are decoded anyway, unless there is
+        a single candidate.
+
         Be aware: this is a time-consuming operation!
 
         :param float frames_count_factor: used to identify forced subtitles
+        :param track_ids: identifiers of the candidate subtitle tracks.
+                          All subtitle tracks if not set
         rtype: instance of :class:`~collections.OrderedDict`
         """
-        subtitles_frames_count = (
-            self.disc.bluray_analyzer
-            .get_subtitles_frames_count(self.disc.path, self.number))
+        if track_ids is not None:
+            return self._get_forced_subtitles_among_candidates(
+                frames_count_factor, track_ids)
+
+        subtitles_frames_count = self._subtitles_frames_count
 
         if not subtitles_frames_count:
             return OrderedDict()
@@ -419,6 +1202,113 @@ class BlurayPlaylist:
 
         return self._sort_tracks(forced_subtitles)
 
+    def _get_forced_subtitles_among_candidates(
+            self, frames_count_factor, track_ids):
+        """Return forced subtitles among candidate subtitle tracks, by
+        comparing frames count of candidates of the same language."""
+        languages = OrderedDict()
+        for (subtitle_id, subtitle_info) in self.subtitle_tracks.items():
+            if subtitle_id in track_ids:
+                languages.setdefault(
+                    subtitle_info['language_code'], []).append(subtitle_id)
+
+        # Candidates are compared to the other candidates of their language,
+        # or to all the playlist's subtitle tracks when there are none.
+        comparisons = [
+            (subtitle_ids, subtitle_ids if len(subtitle_ids) > 1
+             else list(self.subtitle_tracks))
+            for subtitle_ids in languages.values()]
+        if not comparisons:
+            return OrderedDict()
+
+        if any(len(subtitle_ids) == 1 for subtitle_ids in languages.values()):
+            subtitles_frames_count = self._subtitles_frames_count
+        else:
+            subtitles_frames_count = (
+                self.disc.bluray_analyzer
+                .get_subtitles_frames_count(
+                    self.disc.path, self.number,
+                    track_ids=[
+                        subtitle_id for subtitle_ids in languages.values()
+                        for subtitle_id in subtitle_ids]))
+
+        forced_subtitles = dict()
+        for (subtitle_ids, compared_ids) in comparisons:
+            biggest_subtitle = max(
+                subtitles_frames_count[subtitle_id]
+                for subtitle_id in compared_ids)
+            frames_limit = frames_count_factor * biggest_subtitle
+
+            forced_subtitles.update({
+                subtitle_id: self.subtitle_tracks[subtitle_id]
+                for subtitle_id in subtitle_ids
+                if subtitles_frames_count[subtitle_id] < frames_limit})
+
+        return self._sort_tracks(forced_subtitles)
+
+    @cached_property
+    def streams_statistics(self):
+        """Return statistics of each stream of the playlist, by scanning its
+        clips.
+
+        See :meth:`.BlurayAnalyzer.get_playlist_streams_statistics` for more
+        information. Be aware: this operation reads all the playlist's clips!
+
+        :rtype: dict
+        """
+        return (
+            self.disc.bluray_analyzer
+            .get_playlist_streams_statistics(self.disc.path, self.number))
+
+    def get_tracks_bitrates(self):
+        """Return the average bitrate of each track of the playlist, in bits
+        per second.
+
+        Tracks whose stream is never found in the playlist's clips have a
+        null bitrate.
+
+        :return: a dictionary with tracks' identifiers as keys, and bitrates
+                 as values (`None` if the playlist's duration is unknown)
+        :rtype: dict
+        """
+        streams = self.streams_statistics['streams']
+        null_bitrate = 0.0 if self.streams_statistics['duration'] else None
+
+        bitrates = dict()
+        for tracks in self._all_tracks.values():
+            for (track_id, track_info) in tracks.items():
+                stream = streams.get(track_info['uid'])
+                bitrates[track_id] =\
+                    stream['bitrate'] if stream else null_bitrate
+
+        return bitrates
+
+    def get_tracks_pids(self):
+        """Return the PID of each track of the playlist, i.e., the identifier
+        of its stream in the playlist's clips.
+
+        :return: a dictionary with tracks' identifiers as keys, and PIDs as
+                 values
+        :rtype: dict
+        """
+        return {
+            track_id: track_info['uid']
+            for tracks in self._all_tracks.values()
+            for (track_id, track_info) in tracks.items()}
+
+    @cached_property
+    def segments(self):
+        """Return the parts of clips played by the playlist.
+
+        See :meth:`.BlurayAnalyzer.get_playlist_segments` for more
+        information.
+
+        :rtype: list
+        """
+        return (
+            self.disc.bluray_analyzer
+            .get_playlist_segments(self.disc.path, self.number))
+
     def has_multiview(self):
         """Detect if the playlist has multiview tracks (like three-dimensional
         video tracks).
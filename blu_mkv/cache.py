@@ -0,0 +1,259 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import os
+from pathlib import Path
+import pickle
+import tempfile
+import threading
+
+
+#: Files small enough to be fingerprinted by their content. Other files
+#: (i.e., streams) are only fingerprinted by their size and modification time.
+HASHED_FILE_EXTENSIONS = ('.bdmv', '.clpi', '.mpls')
+
+#: Default maximum number of results kept by a :class:`MemoryCache`.
+DEFAULT_MEMORY_CACHE_ENTRIES = 256
+
+
+def get_files_fingerprint(file_paths):
+    """Return a fingerprint of files, which changes as soon as one of them is
+    modified, added or removed.
+
+    Small metadata files (see :data:`HASHED_FILE_EXTENSIONS`) are hashed, while
+    big stream files are only identified by their size and modification time,
+    as reading them would be far too slow.
+
+    :param list file_paths: paths of the files to fingerprint
+    :return: the fingerprint, as an hexadecimal string
+    :rtype: str
+    """
+    fingerprint = hashlib.sha1()
+
+    for file_path in sorted(str(file_path) for file_path in file_paths):
+        fingerprint.update(file_path.encode('utf-8', 'surrogateescape'))
+
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
+            fingerprint.update(b'missing')
+            continue
+
+        if Path(file_path).suffix.lower() in HASHED_FILE_EXTENSIONS:
+            with open(file_path, 'rb') as hashed_file:
+                fingerprint.update(hashlib.sha1(hashed_file.read()).digest())
+        else:
+            fingerprint.update('{}:{}'.format(
+                file_stat.st_size, file_stat.st_mtime_ns).encode('ascii'))
+
+    return fingerprint.hexdigest()
+
+
+class AnalysisCache:
+    """On-disk cache of Blu-ray discs' analysis results.
+
+    Each result is stored with the fingerprint of the files it depends on
+    (see :func:`get_files_fingerprint`). A result is thus only reused as long
+    as these files do not change.
+
+    Results are stored in one file per disc and analysis, so that several
+    processes can share the same cache directory.
+
+    :param str directory: path of the cache directory, created if missing
+    """
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def _get_result_path(self, disc_path, key):
+        """Return the path of the file where a result is stored."""
+        disc_key = hashlib.sha1(
+            str(Path(str(disc_path)).resolve()).encode(
+                'utf-8', 'surrogateescape')).hexdigest()
+        return self.directory / disc_key / '{}.pickle'.format(key)
+
+    def load(self, disc_path, key, fingerprint):
+        """Return a cached result.
+
+        :param str disc_path: path of the analyzed disc
+        :param str key: identifier of the result on the disc
+                        (e.g., "playlist_tracks-00419")
+        :param str fingerprint: current fingerprint of the files the result
+                                depends on
+        :raises KeyError: if no result is cached, or if the cached result
+                          depends on files which have changed since then
+        """
+        result_path = self._get_result_path(disc_path, key)
+
+        try:
+            with result_path.open('rb') as result_file:
+                (cached_fingerprint, result) = pickle.load(result_file)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            raise KeyError(key)
+
+        if cached_fingerprint != fingerprint:
+            raise KeyError(key)
+
+        return result
+
+    def store(self, disc_path, key, fingerprint, result):
+        """Cache a result.
+
+        The result is written atomically, so concurrent readers never see a
+        partially written result.
+
+        :param str disc_path: path of the analyzed disc
+        :param str key: identifier of the result on the disc
+        :param str fingerprint: fingerprint of the files the result
+                                depends on
+        :param result: the result to cache, must be picklable
+        """
+        result_path = self._get_result_path(disc_path, key)
+        result_path.parent.mkdir(parents=True, exist_ok=True)
+
+        (file_descriptor, temporary_path) = tempfile.mkstemp(
+            dir=str(result_path.parent), suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as result_file:
+                pickle.dump((fingerprint, result), result_file)
+            os.replace(temporary_path, str(result_path))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+
+class Flight:
+    """Computation of a result of a :class:`MemoryCache`, by a single thread.
+
+    If :attr:`done` is set, :attr:`result` has been found in the cache.
+    Otherwise, the result must be computed, and given to :meth:`.set_result`
+    to be cached.
+    """
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.owner = threading.get_ident()
+        # Events of the threads waiting for the result.
+        self._waiters = list()
+
+    def set_result(self, result):
+        """Set the computed result.
+
+        :param result: the result, shared by the cache's users, which must
+                       not modify it
+        """
+        self.result = result
+        self.done = True
+
+
+class MemoryCache:
+    """In-memory cache of Blu-ray discs' analysis results, shared by threads
+    (e.g., by all the analyzers of a process).
+
+    Once the cache is full, the least recently used results are dropped.
+
+    A missing result is only computed by one thread at a time: the other
+    threads needing it wait for it to be computed, rather than computing it
+    too (e.g., probing the same playlist concurrently). If its computation
+    fails, the next waiting thread computes it in turn.
+
+    :param int max_entries: maximum number of cached results
+    """
+    def __init__(self, max_entries=DEFAULT_MEMORY_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._flights = dict()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
+
+    def _join_flight(self, key, cancellation_token):
+        """Return the cached result of a key, or a flight computing it.
+
+        :return: the flight, and whether the caller owns it
+        :rtype: tuple
+        """
+        while True:
+            with self._lock:
+                try:
+                    result = self._results[key]
+                except KeyError:
+                    pass
+                else:
+                    self._results.move_to_end(key)
+                    flight = Flight()
+                    flight.set_result(result)
+                    return (flight, False)
+
+                running_flight = self._flights.get(key)
+                if running_flight is None:
+                    flight = self._flights[key] = Flight()
+                    return (flight, True)
+
+                # The thread computing the result needs it again (e.g.,
+                # from a callback): it cannot wait for itself.
+                if running_flight.owner == threading.get_ident():
+                    return (Flight(), False)
+
+                finished = threading.Event()
+                running_flight._waiters.append(finished)
+
+            if cancellation_token is None:
+                finished.wait()
+            else:
+                with cancellation_token.on_cancel(finished.set):
+                    finished.wait()
+                cancellation_token.raise_if_cancelled()
+
+    def _land_flight(self, key, flight):
+        """Cache the result of a flight, if computed, and wake up the threads
+        waiting for it."""
+        with self._lock:
+            del self._flights[key]
+            if flight.done:
+                self._results[key] = flight.result
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+
+            for finished in flight._waiters:
+                finished.set()
+
+    @contextmanager
+    def single_flight(self, key, cancellation_token=None):
+        """Return a context manager giving the cached result of a key, or a
+        flight to compute it, instance of :class:`.Flight`.
+
+        The result is cached when the context manager exits, if it has been
+        set. Until then, other threads asking for the same key wait.
+
+        :param key: hashable identifier of the result (e.g., the disc's
+                    path, the analysis and the fingerprint of the files it
+                    depends on)
+        :param cancellation_token: stops waiting for another thread when
+                                   cancelled, instance of
+                                   :class:`~blu_mkv.process.CancellationToken`
+        :raises ~blu_mkv.process.OperationCancelled: if the token is
+                                                    cancelled while waiting
+        """
+        (flight, owned) = self._join_flight(key, cancellation_token)
+        try:
+            yield flight
+        finally:
+            if owned:
+                self._land_flight(key, flight)
+
+    def get(self, key, compute, cancellation_token=None):
+        """Return the cached result of a key, computing it if missing.
+
+        :param key: hashable identifier of the result
+        :param compute: callable returning the result
+        :param cancellation_token: stops waiting for another thread when
+                                   cancelled, instance of
+                                   :class:`~blu_mkv.process.CancellationToken`
+        """
+        with self.single_flight(key, cancellation_token) as flight:
+            if not flight.done:
+                flight.set_result(compute())
+            return flight.result
@@ -0,0 +1,306 @@
+from datetime import datetime
+from pathlib import Path
+import sqlite3
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS discs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    analyzed_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY,
+    disc_id INTEGER NOT NULL REFERENCES discs (id) ON DELETE CASCADE,
+    number INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    size INTEGER NOT NULL,
+    is_movie INTEGER NOT NULL,
+    has_multiview INTEGER,
+    UNIQUE (disc_id, number)
+);
+
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    playlist_id INTEGER NOT NULL
+        REFERENCES playlists (id) ON DELETE CASCADE,
+    track_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    language_code TEXT,
+    codec TEXT,
+    forced INTEGER,
+    UNIQUE (playlist_id, track_id)
+);
+
+CREATE INDEX IF NOT EXISTS playlists_disc_id ON playlists (disc_id);
+CREATE INDEX IF NOT EXISTS tracks_type_language_codec
+    ON tracks (type, language_code, codec);
+CREATE INDEX IF NOT EXISTS tracks_type_language_forced
+    ON tracks (type, language_code, forced);
+"""
+
+
+class BlurayCatalog:
+    """Local SQLite catalog of analyzed Blu-ray discs.
+
+    The catalog stores playlists and tracks found by a
+    :class:`~blu_mkv.bluray.BlurayAnalyzer`, so that questions about a whole
+    library can be answered without probing discs again.
+
+    The database is opened in WAL mode: several processes (e.g., conversion
+    workers) can thus write into the same catalog at once.
+
+    :param str database_path: path of the SQLite database, created if missing
+    :param float timeout: how many seconds to wait for a database lock held
+                          by another writer
+    """
+    def __init__(self, database_path, timeout=30):
+        self.database_path = database_path
+        self.connection = sqlite3.connect(database_path, timeout=timeout)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """Close the connection to the database."""
+        self.connection.close()
+
+    def add_disc(
+            self, bluray_disc, playlists=None, detect_forced_subtitles=True,
+            frames_count_factor=0.3, disc_path=None, forced_subtitles=None,
+            identify_multiview=True):
+        """Record the analysis of a Blu-ray disc in the catalog.
+
+        All playlists of the disc are recorded, but tracks are only probed
+        and recorded for the given ``playlists``. Previous records of the
+        same disc are replaced.
+
+        Multiview playlists are only identified when the disc's analyzer has
+        a Makemkv controller. Otherwise, the multiview flag is left unknown
+        (``None``).
+
+        Forced subtitles already identified (e.g., by a conversion plan, see
+        :meth:`~blu_mkv.plan.ConversionPlan.get_forced_subtitles`) can be
+        given, so that they are not identified again.
+
+        :param bluray_disc: instance of :class:`~blu_mkv.bluray.BlurayDisc`
+        :param list playlists: playlists whose tracks have to be recorded.
+                               Defaults to the disc's movie playlists
+        :param bool detect_forced_subtitles: identify forced subtitles. Be
+                                             aware: this is a time-consuming
+                                             operation! When disabled, the
+                                             forced flag is left unknown
+        :param float frames_count_factor: used to identify forced subtitles,
+            see :meth:`~blu_mkv.bluray.BlurayPlaylist.get_forced_subtitles`
+        :param str disc_path: path under which the disc is recorded. Defaults
+                              to the disc's path, but should be set to the
+                              disk image's path for mounted disk images
+        :param dict forced_subtitles: forced flags of subtitle tracks already
+                                      identified, as dictionaries of flags by
+                                      track identifier, by playlist number.
+                                      Forced subtitles are then not
+                                      identified, and the forced flag of
+                                      other tracks is left unknown
+        :param bool identify_multiview: identify multiview playlists. When
+                                        disabled, the multiview flag is left
+                                        unknown
+        """
+        if playlists is None:
+            playlists = bluray_disc.get_movie_playlists()
+        movie_playlists = [
+            playlist.number for playlist in bluray_disc.get_movie_playlists()]
+
+        if identify_multiview and\
+                bluray_disc.bluray_analyzer.makemkv_controller is not None:
+            multiview_playlists = [
+                playlist.number
+                for playlist in bluray_disc.multiview_playlists]
+        else:
+            multiview_playlists = None
+
+        # Probe the disc before opening the transaction, in order to not
+        # lock the database for other writers in the meantime.
+        playlists_tracks = dict()
+        for playlist in playlists:
+            if forced_subtitles is not None:
+                forced_flags = forced_subtitles.get(playlist.number, dict())
+            elif detect_forced_subtitles:
+                forced_ids = playlist.get_forced_subtitles(
+                    frames_count_factor=frames_count_factor)
+                forced_flags = {
+                    track_id: track_id in forced_ids
+                    for track_id in playlist.subtitle_tracks}
+            else:
+                forced_flags = dict()
+
+            playlists_tracks[playlist.number] = list(
+                self._list_playlist_tracks(playlist, forced_flags))
+
+        disc_path = str(Path(str(disc_path or bluray_disc.path)).resolve())
+
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM discs WHERE path = ?', (disc_path,))
+            disc_id = self.connection.execute(
+                'INSERT INTO discs (path, analyzed_at) VALUES (?, ?)',
+                (disc_path, datetime.utcnow().isoformat())).lastrowid
+
+            for playlist in bluray_disc.playlists:
+                if multiview_playlists is None:
+                    has_multiview = None
+                else:
+                    has_multiview = playlist.number in multiview_playlists
+
+                playlist_id = self.connection.execute(
+                    'INSERT INTO playlists '
+                    '(disc_id, number, duration, size, is_movie, '
+                    'has_multiview) VALUES (?, ?, ?, ?, ?, ?)',
+                    (disc_id, playlist.number,
+                     playlist.duration.total_seconds(), playlist.size,
+                     playlist.number in movie_playlists,
+                     has_multiview)).lastrowid
+
+                self.connection.executemany(
+                    'INSERT INTO tracks '
+                    '(playlist_id, track_id, type, uid, language_code, '
+                    'codec, forced) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(playlist_id,) + track for track
+                     in playlists_tracks.get(playlist.number, [])])
+
+    @staticmethod
+    def _list_playlist_tracks(playlist, forced_flags):
+        """Yield the tracks of a playlist as rows of the ``tracks`` table,
+        without the playlist's identifier.
+
+        :param dict forced_flags: forced flags of the subtitle tracks, by
+                                  track identifier. Unknown for missing tracks
+        """
+        for (track_type, tracks) in [
+                ('video', playlist.video_tracks),
+                ('audio', playlist.audio_tracks),
+                ('subtitle', playlist.subtitle_tracks)]:
+            for (track_id, track_info) in tracks.items():
+                if track_type == 'subtitle':
+                    forced = forced_flags.get(track_id)
+                else:
+                    forced = None
+
+                yield (
+                    track_id, track_type, track_info['uid'],
+                    track_info['language_code'], track_info.get('codec'),
+                    forced)
+
+    def get_discs(self):
+        """Return the cataloged discs, sorted by path.
+
+        Each disc is a dictionary with the following keys:
+        - path: `str`, absolute path of the disc
+        - analyzed_at: `str`, date of the analysis, in ISO 8601 format
+
+        :rtype: list
+        """
+        rows = self.connection.execute(
+            'SELECT path, analyzed_at FROM discs ORDER BY path')
+        return [dict(row) for row in rows]
+
+    def search_tracks(
+            self, track_type=None, language_code=None, codec=None,
+            forced=None, movies_only=False):
+        """Return cataloged tracks matching all the given criteria.
+
+        Each track is a dictionary with the following keys:
+        - disc_path: `str`, path of the disc containing the track
+        - playlist_number: `int`, number of the playlist containing the track
+        - track_id: `int`, index of the track in the playlist
+        - type: `str`, either 'video', 'audio' or 'subtitle'
+        - uid: `int`, unique identifier of the track
+        - language_code: `str` or `None`, language in ISO639-2 format
+        - codec: `str` or `None`, codec as named by Mkvmerge
+        - forced: `bool` or `None` if unknown, forced flag of subtitles
+
+        :param str track_type: either 'video', 'audio' or 'subtitle'
+        :param str language_code: language in ISO639-2 format
+        :param str codec: codec as named by Mkvmerge
+                          (e.g., "DTS-HD Master Audio")
+        :param bool forced: only keep forced (or not forced) subtitles
+        :param bool movies_only: only search in movie playlists
+        :return: matching tracks, sorted by disc, playlist and track
+        :rtype: list
+        """
+        criteria = [
+            ('tracks.type = ?', track_type),
+            ('tracks.language_code = ?', language_code),
+            ('tracks.codec = ?', codec),
+            ('tracks.forced = ?', forced),
+            ('playlists.is_movie = ?', True if movies_only else None)]
+        conditions = [
+            condition for (condition, value) in criteria
+            if value is not None]
+        parameters = [value for (_, value) in criteria if value is not None]
+
+        query = (
+            'SELECT discs.path AS disc_path, '
+            'playlists.number AS playlist_number, tracks.track_id, '
+            'tracks.type, tracks.uid, tracks.language_code, tracks.codec, '
+            'tracks.forced '
+            'FROM tracks '
+            'JOIN playlists ON playlists.id = tracks.playlist_id '
+            'JOIN discs ON discs.id = playlists.disc_id')
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY discs.path, playlists.number, tracks.track_id'
+
+        tracks = list()
+        for row in self.connection.execute(query, parameters):
+            track = dict(row)
+            if track['forced'] is not None:
+                track['forced'] = bool(track['forced'])
+            tracks.append(track)
+
+        return tracks
+
+    def search_playlists(self, disc_path=None, movies_only=False):
+        """Return cataloged playlists, sorted by disc and number.
+
+        Each playlist is a dictionary with the following keys:
+        - disc_path: `str`, path of the disc containing the playlist
+        - number: `int`, playlist's number
+        - duration: `float`, playlist's duration in seconds
+        - size: `int`, playlist's size in bytes
+        - is_movie: `bool`, if the playlist is a movie playlist
+        - has_multiview: `bool` or `None` if unknown, if the playlist contains
+                         multiview tracks
+
+        :param str disc_path: only return playlists of this disc
+        :param bool movies_only: only return movie playlists
+        :rtype: list
+        """
+        criteria = [
+            ('discs.path = ?', disc_path and str(Path(disc_path).resolve())),
+            ('playlists.is_movie = ?', True if movies_only else None)]
+        conditions = [
+            condition for (condition, value) in criteria
+            if value is not None]
+        parameters = [value for (_, value) in criteria if value is not None]
+
+        query = (
+            'SELECT discs.path AS disc_path, playlists.number, '
+            'playlists.duration, playlists.size, playlists.is_movie, '
+            'playlists.has_multiview '
+            'FROM playlists JOIN discs ON discs.id = playlists.disc_id')
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY discs.path, playlists.number'
+
+        playlists = list()
+        for row in self.connection.execute(query, parameters):
+            playlist = dict(row)
+            playlist['is_movie'] = bool(playlist['is_movie'])
+            if playlist['has_multiview'] is not None:
+                playlist['has_multiview'] = bool(playlist['has_multiview'])
+            playlists.append(playlist)
+
+        return playlists
@@ -0,0 +1,71 @@
+"""Parser of Blu-ray clip information files (``BDMV/CLIPINF/*.clpi``).
+
+Only the sequence information, needed to know when clips' presentation
+starts and ends, is decoded.
+"""
+
+import struct
+
+
+class ClipInformationFileError(ValueError):
+    """Raised when a clip information file cannot be parsed."""
+
+
+def parse_clip_information_file(file_path):
+    """Parse a Blu-ray clip information file.
+
+    The returned dictionary has the following keys:
+    - presentation_start_time: `int`, timestamp of the first presented
+      frame of the clip, in :data:`~blu_mkv.mpls.TICKS_PER_SECOND` ticks
+    - presentation_end_time: `int`, timestamp of the end of the clip's
+      presentation, in :data:`~blu_mkv.mpls.TICKS_PER_SECOND` ticks
+
+    Only the first sequence of the clip is taken into account, as clips
+    almost always have a single one.
+
+    :param str file_path: path of the clip information file
+    :rtype: dict
+    :raises ClipInformationFileError: if the file is not a valid clip
+                                      information file
+    """
+    with open(str(file_path), 'rb') as clip_information_file:
+        data = clip_information_file.read()
+
+    try:
+        return parse_clip_information(data)
+    except struct.error as exc:
+        raise ClipInformationFileError(
+            "{} is truncated: {}".format(file_path, exc)) from exc
+
+
+def parse_clip_information(data):
+    """Parse the content of a Blu-ray clip information file.
+
+    See :func:`parse_clip_information_file` for the returned details.
+
+    :param bytes data: content of the clip information file
+    :rtype: dict
+    :raises ClipInformationFileError: if the content is not valid
+    :raises struct.error: if the content is truncated
+    """
+    if data[:4] != b'HDMV':
+        raise ClipInformationFileError("Missing HDMV signature")
+
+    (sequence_info_address,) = struct.unpack_from('>I', data, 8)
+
+    (atc_sequences_count,) =\
+        struct.unpack_from('>B', data, sequence_info_address + 5)
+    if not atc_sequences_count:
+        raise ClipInformationFileError("Missing ATC sequence")
+
+    (stc_sequences_count,) =\
+        struct.unpack_from('>B', data, sequence_info_address + 10)
+    if not stc_sequences_count:
+        raise ClipInformationFileError("Missing STC sequence")
+
+    (presentation_start_time, presentation_end_time) =\
+        struct.unpack_from('>II', data, sequence_info_address + 18)
+
+    return {
+        'presentation_start_time': presentation_start_time,
+        'presentation_end_time': presentation_end_time}
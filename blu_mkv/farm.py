@@ -0,0 +1,375 @@
+"""Conversion farm: a coordinator queuing discs, and workers converting them
+on several hosts.
+
+The coordinator holds a :class:`~blu_mkv.jobqueue.JobQueue`, and exposes it
+through a small JSON API over HTTP:
+
+- ``GET /jobs``: return all the jobs
+- ``POST /jobs``, with the ``path`` of a disc: queue the disc, unless already
+  queued, and return the new job's ``id``, or `null`
+- ``POST /leases``, with the name of the ``worker``: lease the oldest pending
+  job to the worker, and return it with its ``lease_duration``. Nothing is
+  returned (status 204) if there are no pending jobs
+- ``POST /jobs/<id>/heartbeat``, with the ``worker`` and its ``progress``:
+  renew the job's lease
+- ``POST /jobs/<id>/complete``, with the ``worker``: mark the job as done
+- ``POST /jobs/<id>/fail``, with the ``worker`` and the ``error``: mark the
+  job as failed
+- ``POST /jobs/<id>/release``, with the ``worker``: put the job back in the
+  queue, e.g., when its conversion was interrupted by stopping the worker
+
+The last four requests fail with status 409 if the job is not leased to the
+worker anymore: a lease which is not renewed in time expires, and its job is
+given to another worker.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from .jobqueue import JobQueue, get_worker_name
+from .process import CancellationToken, is_killed_by_signal
+
+
+#: Number of seconds a lease lasts, unless renewed.
+DEFAULT_LEASE_DURATION = 60
+
+
+class LeaseLost(Exception):
+    """Raised when a worker's job has been given to another worker, e.g.,
+    because its lease expired."""
+
+
+class CoordinatorServer(HTTPServer):
+    """HTTP server of a :class:`.Coordinator`.
+
+    Requests are handled one at a time, by the thread serving them, which is
+    the only one using the job queue.
+    """
+    def __init__(self, server_address, coordinator):
+        super().__init__(server_address, CoordinatorRequestHandler)
+        self.coordinator = coordinator
+
+    def service_actions(self):
+        self.coordinator.requeue_expired_leases()
+
+
+class CoordinatorRequestHandler(BaseHTTPRequestHandler):
+    """Handle requests of the coordinator's API."""
+    # Do not let a stalled worker block the others.
+    timeout = 10
+
+    def do_GET(self):
+        self._handle_request('GET')
+
+    def do_POST(self):
+        self._handle_request('POST')
+
+    def _handle_request(self, method):
+        try:
+            content_length = int(self.headers.get('Content-Length') or 0)
+            if content_length:
+                request = json.loads(
+                    self.rfile.read(content_length).decode('utf-8'))
+            else:
+                request = dict()
+
+            (status, response) = self.server.coordinator.handle_request(
+                method, self.path, request)
+        except (KeyError, TypeError, ValueError) as exc:
+            (status, response) = (400, {'error': str(exc)})
+
+        self.send_response(status)
+        if response is None:
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps(response).encode('utf-8')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Coordinator:
+    """Lease jobs of a persistent queue to workers, over HTTP.
+
+    :param str queue_path: path of the job queue's database, created if
+                           missing
+    :param str address: address to listen to. Defaults to the loopback
+                        address
+    :param int port: port to listen to. If 0, any free port is used
+    :param float lease_duration: number of seconds after which a job is given
+                                 to another worker, unless its lease is
+                                 renewed
+    """
+    def __init__(
+            self, queue_path, address='127.0.0.1', port=0,
+            lease_duration=DEFAULT_LEASE_DURATION):
+        self.queue_path = queue_path
+        self.lease_duration = lease_duration
+        self.job_queue = None
+        self.server = CoordinatorServer((address, port), self)
+
+    @property
+    def url(self):
+        """Return the URL of the coordinator's API.
+
+        :rtype: str
+        """
+        (address, port) = self.server.server_address[:2]
+        return 'http://{}:{}'.format(address, port)
+
+    def serve_forever(self, poll_interval=0.5):
+        """Serve the workers' requests, until shut down.
+
+        The job queue is opened by the calling thread, and only used by it.
+
+        :param float poll_interval: how many seconds between two checks of
+                                    the expired leases, and of the shutdown
+        """
+        self.job_queue = JobQueue(self.queue_path)
+        try:
+            self.server.serve_forever(poll_interval)
+        finally:
+            self.job_queue.close()
+            self.job_queue = None
+            self.server.server_close()
+
+    def shutdown(self):
+        """Stop serving requests, from another thread."""
+        self.server.shutdown()
+
+    def requeue_expired_leases(self):
+        """Put back in the queue the jobs whose lease expired.
+
+        :return: identifiers of the jobs put back in the queue
+        :rtype: list
+        """
+        return self.job_queue.requeue_expired_leases()
+
+    def handle_request(self, method, path, request):
+        """Handle a request of the API.
+
+        :param str method: HTTP method of the request
+        :param str path: path of the request
+        :param dict request: JSON body of the request
+        :return: HTTP status, and JSON response or `None`
+        :rtype: tuple
+        :raises KeyError: if a parameter is missing
+        """
+        parts = [part for part in urlsplit(path).path.split('/') if part]
+
+        if parts == ['jobs'] and method == 'GET':
+            return (200, self.job_queue.get_jobs())
+
+        if parts == ['jobs'] and method == 'POST':
+            try:
+                job_id = self.job_queue.add(request['path'])
+            except OSError as exc:
+                return (422, {'error': str(exc)})
+            return (201 if job_id is not None else 200, {'id': job_id})
+
+        if parts == ['leases'] and method == 'POST':
+            job = self.job_queue.claim(request['worker'], self.lease_duration)
+            if job is None:
+                return (204, None)
+            job['lease_duration'] = self.lease_duration
+            return (200, job)
+
+        if (len(parts) == 3 and parts[0] == 'jobs' and parts[1].isdigit() and
+                method == 'POST'):
+            job_id = int(parts[1])
+            worker = request['worker']
+            if parts[2] == 'heartbeat':
+                leased = self.job_queue.renew_lease(
+                    job_id, worker, self.lease_duration,
+                    request.get('progress'))
+            elif parts[2] == 'complete':
+                leased = self.job_queue.complete(job_id, worker)
+            elif parts[2] == 'fail':
+                leased = self.job_queue.fail(
+                    job_id, request.get('error'), worker)
+            elif parts[2] == 'release':
+                leased = self.job_queue.retry(job_id, worker)
+            else:
+                return (404, {'error': "Unknown action {}".format(parts[2])})
+
+            if not leased:
+                return (409, {'error': "Job {} is not leased to {}".format(
+                    job_id, worker)})
+            return (200, dict())
+
+        return (404, {'error': "Unknown resource {}".format(path)})
+
+
+class FarmWorker:
+    """Lease jobs from a coordinator, and convert them.
+
+    While a job is converted, its lease is renewed along with its progress.
+    If the lease is lost anyway (e.g., the worker was cut off from the
+    coordinator for too long), the conversion is cancelled, as the job has
+    been given to another worker.
+
+    Conversions failing once the worker is being stopped, or because a
+    program was killed by a termination signal (e.g., the worker's service
+    was stopped), are interrupted rather than failed: their job is put back
+    in the queue.
+
+    :param str coordinator_url: URL of the coordinator's API
+    :param convert: called with the path of a disc, an instance of
+                    :class:`~blu_mkv.process.CancellationToken` cancelled
+                    when the lease is lost, and a function to call with the
+                    conversion's progress (between 0 and 1). Must raise an
+                    exception if the conversion fails
+    :param str worker: name of the worker. Defaults to the current process,
+                       as returned by :func:`~blu_mkv.jobqueue.get_worker_name`
+    :param float heartbeat_interval: how many seconds between two renewals of
+                                     a lease. Defaults to a third of the
+                                     lease's duration
+    :param float request_timeout: how many seconds to wait for the
+                                  coordinator's responses
+    """
+    def __init__(
+            self, coordinator_url, convert, worker=None,
+            heartbeat_interval=None, request_timeout=10):
+        self.coordinator_url = coordinator_url.rstrip('/')
+        self.convert = convert
+        self.worker = worker or get_worker_name()
+        self.heartbeat_interval = heartbeat_interval
+        self.request_timeout = request_timeout
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Stop leasing jobs. The running job is waited for by :meth:`.run`.
+        """
+        self._stop_event.set()
+
+    def _request(self, path, request):
+        """Send a request to the coordinator, and return its response.
+
+        :raises LeaseLost: if the job is not leased to the worker anymore
+        :raises OSError: if the coordinator cannot be reached
+        """
+        http_request = Request(
+            self.coordinator_url + path,
+            data=json.dumps(request).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST')
+        try:
+            with urlopen(http_request, timeout=self.request_timeout) as\
+                    response:
+                body = response.read()
+        except HTTPError as exc:
+            if exc.code == 409:
+                raise LeaseLost(exc.read().decode('utf-8'))
+            raise
+
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def lease(self):
+        """Lease the oldest pending job.
+
+        :return: the job, or `None` if there are no pending jobs
+        :rtype: dict or None
+        :raises OSError: if the coordinator cannot be reached
+        """
+        return self._request('/leases', {'worker': self.worker})
+
+    def run_job(self, job):
+        """Convert a leased job's disc, and report the result.
+
+        :param dict job: as returned by :meth:`.lease`
+        :return: whether the result has been reported. If not, the lease has
+                 been lost
+        :rtype: bool
+        :raises OSError: if the coordinator cannot be reached to report the
+                         result. The job is then given to another worker once
+                         its lease expires
+        """
+        cancellation_token = CancellationToken()
+        job_done = threading.Event()
+        progress = {'value': None}
+
+        def report_progress(value):
+            progress['value'] = value
+
+        def renew_lease():
+            heartbeat_interval =\
+                self.heartbeat_interval or job['lease_duration'] / 3
+            while not job_done.wait(heartbeat_interval):
+                try:
+                    self._request(
+                        '/jobs/{}/heartbeat'.format(job['id']),
+                        {'worker': self.worker, 'progress': progress['value']})
+                except LeaseLost:
+                    cancellation_token.cancel()
+                    return
+                except OSError:
+                    # Try again, until the lease expires.
+                    continue
+
+        heartbeat = threading.Thread(target=renew_lease, daemon=True)
+        heartbeat.start()
+        interrupted = False
+        try:
+            self.convert(job['path'], cancellation_token, report_progress)
+        except Exception as exc:
+            error = str(exc) or repr(exc)
+            interrupted = (
+                self._stop_event.is_set() or is_killed_by_signal(exc))
+        else:
+            error = None
+        finally:
+            job_done.set()
+            heartbeat.join()
+
+        if cancellation_token.cancelled:
+            return False
+
+        try:
+            if error is None:
+                self._request(
+                    '/jobs/{}/complete'.format(job['id']),
+                    {'worker': self.worker})
+            elif interrupted:
+                self._request(
+                    '/jobs/{}/release'.format(job['id']),
+                    {'worker': self.worker})
+            else:
+                self._request(
+                    '/jobs/{}/fail'.format(job['id']),
+                    {'worker': self.worker, 'error': error})
+        except LeaseLost:
+            return False
+
+        return True
+
+    def run(self, poll_interval=5):
+        """Lease and convert jobs one after another, until stopped.
+
+        :param float poll_interval: how many seconds to wait before leasing a
+                                    job again, when there are no pending jobs
+                                    or the coordinator cannot be reached
+        """
+        while not self._stop_event.is_set():
+            try:
+                job = self.lease()
+            except OSError:
+                job = None
+
+            if job is None:
+                self._stop_event.wait(poll_interval)
+                continue
+
+            try:
+                self.run_job(job)
+            except OSError:
+                continue
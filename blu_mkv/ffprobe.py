@@ -1,9 +1,20 @@
 from abc import ABCMeta, abstractmethod
 import json
+from pathlib import Path
 import re
 import subprocess
 
 from . import ProgramController
+from .process import get_media_duration
+
+
+#: Probing depths tried one after another in fast-probe mode, as
+#: ``(probesize, analyzeduration)`` tuples, in bytes and microseconds.
+#: `None` stands for Ffprobe's default depth.
+FAST_PROBE_DEPTHS = [(1000000, 500000), (10000000, 5000000), None]
+
+#: Streams' types handled when analyzing playlists.
+STREAM_TYPES = ('audio', 'subtitle', 'video')
 
 
 class AbstractFfprobeController(metaclass=ABCMeta):
@@ -12,12 +23,29 @@ class AbstractFfprobeController(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def get_all_bluray_playlist_streams(self, disc_path, playlid_id):
+    def iter_bluray_playlists(self, disc_path):
+        pass
+
+    @abstractmethod
+    def get_bluray_playlist_numbers(self, disc_path):
+        pass
+
+    @abstractmethod
+    def get_bluray_playlist(self, disc_path, playlist_number):
+        pass
+
+    @abstractmethod
+    def get_all_bluray_playlist_streams(
+            self, disc_path, playlid_id, expected_ids=None):
         pass
 
     @abstractmethod
     def get_bluray_playlist_subtitles_with_frames_count(
-            self, disc_path, playlist_id):
+            self, disc_path, playlist_id, track_ids=None):
+        pass
+
+    @abstractmethod
+    def get_subtitle_packets(self, file_path):
         pass
 
 
@@ -25,13 +53,34 @@ class FfprobeController(ProgramController, AbstractFfprobeController):
     """Interface with the Ffprobe program.
 
     :param str executable_path: absolute path of the Ffprobe's executable file
+    :param bool fast_probe: whether playlists are probed in fast-probe mode
     """
-    def __init__(self, executable_file='ffprobe'):
+    def __init__(
+            self, executable_file='ffprobe', io_limiter=None,
+            resource_policy=None, timeout_policy=None, fast_probe=False):
         """
         :param str executable_file: name or absolute path of the Ffprobe's
                                     executable file
+        :param io_limiter: limits concurrent readers of the devices storing
+                           input files, instance of
+                           :class:`~blu_mkv.iolimit.DeviceLimiter`
+        :param resource_policy: resources allowed to the program, instance of
+                                :class:`~blu_mkv.resources.ResourcePolicy`
+        :param timeout_policy: timeouts of the program's operations, instance
+                               of :class:`~blu_mkv.process.TimeoutPolicy`.
+                               Counting frames and reading packets are
+                               allowed more time for longer playlists and
+                               clips
+        :param bool fast_probe: if true, playlists are probed with a small
+                                depth (see :data:`FAST_PROBE_DEPTHS`), and
+                                only the details used by
+                                :class:`~blu_mkv.bluray.BlurayAnalyzer` are
+                                asked for. Playlists are probed again deeper
+                                only if details are missing
         """
-        super().__init__(executable_file)
+        super().__init__(
+            executable_file, io_limiter, resource_policy, timeout_policy)
+        self.fast_probe = fast_probe
 
     def get_default_bluray_playlist_number(self, disc_path):
         """Return the playlist's number used by default by Ffprobe to analyze
@@ -62,41 +111,89 @@ class FfprobeController(ProgramController, AbstractFfprobeController):
                  as keys
         :rtype: dict
         """
+        return dict(self.iter_bluray_playlists(disc_path))
+
+    def iter_bluray_playlists(self, disc_path):
+        """Yield details of playlists present on a Bluray disc, one after
+        another as they are probed, sorted by number.
+
+        See :meth:`.get_bluray_playlists` for more information.
+
+        :param str disc_path: Bluray disc's path
+        :return: an iterator of ``(playlist_number, playlist_details)``
+                 tuples
+        """
+        for playlist_number in self.get_bluray_playlist_numbers(disc_path):
+            yield (
+                playlist_number,
+                self.get_bluray_playlist(disc_path, playlist_number))
+
+    def get_bluray_playlist_numbers(self, disc_path):
+        """Return numbers of the playlists present on a Bluray disc, without
+        probing them.
+
+        :param str disc_path: Bluray disc's path
+        :return: playlists' numbers, sorted
+        :rtype: list
+        """
         # In Ffprobe's output, find lines like:
         # "[bluray @ 0x555da3c70e60] playlist 00419.mpls (2:23:11)"
         playlists_numbers = re.findall(
             r'playlist (\d+)\.mpls \(\d+:\d{2}:\d{2}\)',
             self._analyze_bluray_disc(disc_path))
 
-        playlists = dict()
-        for playlist_number in playlists_numbers:
-            ffprobe_options = ['-show_format', '-playlist', playlist_number]
-            playlist_info = self._analyze_bluray_disc(
-                disc_path, ffprobe_options, json_output=True)['format']
+        return sorted(set(int(number) for number in playlists_numbers))
 
-            playlists[int(playlist_number)] = playlist_info
+    def get_bluray_playlist(self, disc_path, playlist_number):
+        """Return details of a specific Bluray disc's playlist.
 
-        return playlists
+        See :meth:`.get_bluray_playlists` for more information.
 
-    def get_all_bluray_playlist_streams(self, disc_path, playlist_id):
+        :param str disc_path: Bluray disc's path
+        :param int playlist_number: playlist's number
+        :rtype: dict
+        """
+        return self._probe_bluray_playlist(
+            disc_path, playlist_number, '-show_format',
+            'format=duration,size',
+            lambda analysis: (
+                'duration' in analysis.get('format', dict()) and
+                'size' in analysis.get('format', dict())))['format']
+
+    def get_all_bluray_playlist_streams(
+            self, disc_path, playlist_id, expected_ids=None):
         """Return streams' details of a specific Bluray disc's playlist.
 
         Several details are similar between streams. Otherwise, other ones are
         specific to codec types. See Ffprobe's documentation for more
-        information.
+        information. In fast-probe mode, only streams' ``index``,
+        ``codec_type`` and ``id`` are returned.
 
         :param str disc_path: Bluray disc's path
         :param int playlist_id: playlist's identifier
+        :param set expected_ids: PIDs of the streams expected in the playlist
+                                 (e.g., as found by Mkvmerge). In fast-probe
+                                 mode, the playlist is probed deeper until
+                                 they are all found
         :return: a list of dictionaries with all streams' details
         :rtype: list
         """
-        ffprobe_options = ['-show_streams', '-playlist', str(playlist_id)]
+        def has_expected_streams(analysis):
+            streams = analysis.get('streams', [])
+            if not streams or any(
+                    stream.get('codec_type') not in STREAM_TYPES or
+                    'id' not in stream for stream in streams):
+                return False
 
-        return self._analyze_bluray_disc(
-            disc_path, ffprobe_options, json_output=True)['streams']
+            found_ids = {int(stream['id'], base=16) for stream in streams}
+            return not set(expected_ids or []) - found_ids
+
+        return self._probe_bluray_playlist(
+            disc_path, playlist_id, '-show_streams',
+            'stream=index,codec_type,id', has_expected_streams)['streams']
 
     def get_bluray_playlist_subtitles_with_frames_count(
-            self, disc_path, playlist_id):
+            self, disc_path, playlist_id, track_ids=None):
         """Return streams' details of a specific Bluray disc's playlist like
         :meth:`~.get_all_streams_of_bluray_playlist_as_json`, but only for
         subtitle tracks.
@@ -105,22 +202,119 @@ class FfprobeController(ProgramController, AbstractFfprobeController):
         track, which is especially useful to identify forced subtitles.
         This is only done for subtitles as this is a slow operation.
 
+        Frames can be counted only for some subtitle tracks, but this only
+        makes the analysis faster for a single track. Ffprobe cannot select a
+        list of streams, and running it once per track would read the whole
+        playlist as many times: when several tracks are asked for, all
+        subtitle tracks are decoded, and only the asked ones are returned.
+
         :param str disc_path: Bluray disc's path
         :param int playlist_id: playlist's identifier
+        :param list track_ids: indices of the subtitle tracks to count frames
+                               for. All subtitle tracks if not set
         :return: a list of dictionaries with subtitles' details
         :rtype: list
         """
+        if track_ids is not None:
+            track_ids = set(track_ids)
+            if not track_ids:
+                return []
+
+        # Only a single track can be selected instead of all of them.
+        if track_ids is not None and len(track_ids) == 1:
+            selected_streams = str(next(iter(track_ids)))
+        else:
+            selected_streams = 's'
+
+        # Frames are counted by decoding the whole playlist, whatever the
+        # probing depth: only the output is reduced in fast-probe mode.
+        if self.fast_probe:
+            ffprobe_options = ['-show_entries', 'stream=index,nb_read_frames']
+        else:
+            ffprobe_options = ['-show_streams']
+
+        ffprobe_options.extend([
+            '-select_streams', selected_streams,
+            '-count_frames',
+            '-playlist', str(playlist_id)])
+
+        # The whole playlist is decoded.
+        playlist_duration = get_media_duration([Path(
+            disc_path, 'BDMV', 'PLAYLIST', '{:05d}.mpls'.format(
+                int(playlist_id)))])
+        subtitles = self._analyze_bluray_disc(
+            disc_path, ffprobe_options, json_output=True,
+            media_duration=playlist_duration)['streams']
+
+        if track_ids is None:
+            return subtitles
+        return [
+            subtitle for subtitle in subtitles
+            if subtitle['index'] in track_ids]
+
+    def get_subtitle_packets(self, file_path):
+        """Return subtitle streams and packets of a media file (e.g., a
+        Bluray clip), without decoding them.
+
+        The returned dictionary has two keys:
+        - streams: list of subtitle streams, with their ``index`` and ``id``
+        - packets: list of subtitle packets, with the ``stream_index`` of
+                   their stream and their ``pts``
+
+        :param str file_path: path of the media file
+        :rtype: dict
+        """
         ffprobe_options = [
-            '-show_streams',
             '-select_streams', 's',
-            '-count_frames',
-            '-playlist', str(playlist_id)]
+            '-show_entries', 'stream=index,id:packet=stream_index,pts']
+
+        with self._limit_io(file_path):
+            return self._analyze(
+                file_path, ffprobe_options, json_output=True,
+                media_duration=get_media_duration([file_path]))
+
+    def _probe_bluray_playlist(
+            self, disc_path, playlist_id, show_option, entries, is_complete):
+        """Analyze a Bluray disc's playlist, as JSON.
 
-        return self._analyze_bluray_disc(
-            disc_path, ffprobe_options, json_output=True)['streams']
+        In fast-probe mode, only the given entries are asked for, and the
+        playlist is probed deeper and deeper (see :data:`FAST_PROBE_DEPTHS`)
+        until the analysis is complete. Otherwise, the playlist is probed
+        once, with Ffprobe's default depth.
+
+        :param str disc_path: Bluray disc's path
+        :param int playlist_id: playlist's identifier
+        :param str show_option: Ffprobe's option showing all the details
+                                (e.g., ``-show_streams``)
+        :param str entries: details to show in fast-probe mode, as expected
+                            by Ffprobe's ``-show_entries`` option
+        :param is_complete: called with the analysis, returns whether the
+                            analysis has all the expected details
+        :rtype: dict
+        """
+        if not self.fast_probe:
+            return self._analyze_bluray_disc(
+                disc_path, [show_option, '-playlist', str(playlist_id)],
+                json_output=True)
+
+        for probe_depth in FAST_PROBE_DEPTHS:
+            ffprobe_options = ['-show_entries', entries]
+            if probe_depth is not None:
+                ffprobe_options.extend([
+                    '-probesize', str(probe_depth[0]),
+                    '-analyzeduration', str(probe_depth[1])])
+            ffprobe_options.extend(['-playlist', str(playlist_id)])
+
+            analysis = self._analyze_bluray_disc(
+                disc_path, ffprobe_options, json_output=True)
+            if is_complete(analysis):
+                break
+
+        return analysis
 
     def _analyze_bluray_disc(
-            self, disc_path, ffprobe_options=None, json_output=False):
+            self, disc_path, ffprobe_options=None, json_output=False,
+            media_duration=0):
         """Analyze a Bluray disc by using Ffprobe command-line tool.
 
         The command-line can be customized by filling additional Ffprobe's
@@ -129,26 +323,40 @@ class FfprobeController(ProgramController, AbstractFfprobeController):
         :param str disc_path: Bluray disc's path
         :param list ffprobe_options: Ffprobe's options
         :param bool json_output: define format of Ffprobe's output
+        :param float media_duration: duration in seconds of the analyzed
+                                     media, as expected by
+                                     :meth:`.TimeoutPolicy.get_timeout`
         :return: result of the analysis
         :return type: an unformatted string if `json_output` is false;
                       a dictionary otherwise
         """
-        ffprobe_commandline = [
-            self.executable_path, '-i', 'bluray:{}'.format(disc_path)]
+        with self._limit_io(disc_path):
+            return self._analyze(
+                'bluray:{}'.format(disc_path), ffprobe_options, json_output,
+                media_duration)
+
+    def _analyze(
+            self, input_url, ffprobe_options=None, json_output=False,
+            media_duration=0):
+        """Analyze a media input by using Ffprobe command-line tool.
+
+        See :meth:`._analyze_bluray_disc` for more information.
+
+        :param str input_url: path or URL of the input, as understood by
+                              Ffprobe (e.g., ``bluray:/media/disc``)
+        """
+        ffprobe_commandline = [self.executable_path, '-i', input_url]
         ffprobe_commandline.extend(ffprobe_options or [])
 
         if json_output is False:
-            return subprocess.check_output(
-                ffprobe_commandline,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True)
+            return self._run(
+                ffprobe_commandline, media_duration,
+                stderr=subprocess.STDOUT)
         else:
             ffprobe_commandline.extend([
                 '-loglevel', 'quiet',
                 '-print_format', 'json'])
 
-            ffprobe_output = subprocess.check_output(
-                ffprobe_commandline,
-                universal_newlines=True)
+            ffprobe_output = self._run(ffprobe_commandline, media_duration)
 
             return json.loads(ffprobe_output)
@@ -0,0 +1,210 @@
+"""Checksums of Matroska files, computed while Mkvmerge writes them.
+
+Reading back a Matroska file of tens of gigabytes only to hash it doubles the
+conversion's reads. Instead, the file is hashed as it grows, while its data
+is still in the page cache.
+
+Mkvmerge goes back to the beginning of the file once all clusters are
+written (see :func:`~blu_mkv.matroska.get_first_cluster_position`), so the
+file cannot be hashed as a single stream. It is split into pieces of fixed
+size instead, each one hashed separately: pieces after the first cluster as
+soon as they are written, and the few pieces before it at the end. The
+file's checksum is the hash of its pieces' digests.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from .matroska import MatroskaFileError, get_first_cluster_position
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+
+#: Hash algorithm of the checksums: BLAKE3 if installed, BLAKE2b otherwise.
+DEFAULT_ALGORITHM = 'blake3' if blake3 is not None else 'blake2b'
+
+#: Size of the hashed pieces, in bytes.
+DEFAULT_PIECE_SIZE = 64 * 1024 * 1024
+
+#: Size of the reads, in bytes.
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def new_hash(algorithm=DEFAULT_ALGORITHM):
+    """Return a new hash object.
+
+    :param str algorithm: ``blake3``, or any algorithm of :mod:`hashlib`
+    :raises ValueError: if the algorithm is not available
+    """
+    if algorithm == 'blake3':
+        if blake3 is None:
+            raise ValueError("BLAKE3 needs the blake3 package")
+        return blake3.blake3()
+
+    return hashlib.new(algorithm)
+
+
+def get_checksums_file_path(file_path):
+    """Return the path of the JSON file where a Matroska file's checksums are
+    written (e.g., ``movie.checksums.json`` for ``movie.mkv``).
+
+    :param str file_path: the Matroska file's path
+    :rtype: str
+    """
+    return str(Path(str(file_path)).with_suffix('.checksums.json'))
+
+
+def get_file_checksums(
+        file_path, piece_size=DEFAULT_PIECE_SIZE,
+        algorithm=DEFAULT_ALGORITHM):
+    """Read a whole file, and return its checksums, e.g., to verify an
+    archived Matroska file.
+
+    See :meth:`GrowingFileHasher.finish` for the returned details.
+
+    :param str file_path: path of the file
+    :param int piece_size: size of the hashed pieces, in bytes
+    :param str algorithm: hash algorithm
+    :rtype: dict
+    """
+    hasher = GrowingFileHasher(file_path, piece_size, algorithm)
+    return hasher.finish()
+
+
+class GrowingFileHasher:
+    """Hash a Matroska file while it is written by Mkvmerge.
+
+    :meth:`update` is called periodically while the file is written, and
+    :meth:`finish` once it is complete.
+
+    :param str file_path: path of the Matroska file. It does not need to
+                          exist yet
+    :param int piece_size: size of the hashed pieces, in bytes
+    :param str algorithm: hash algorithm
+    """
+    def __init__(
+            self, file_path, piece_size=DEFAULT_PIECE_SIZE,
+            algorithm=DEFAULT_ALGORITHM):
+        self.file_path = str(file_path)
+        self.piece_size = piece_size
+        self.algorithm = algorithm
+
+        # Digests of the hashed pieces, by index.
+        self.piece_digests = dict()
+        self._file = None
+        self._first_stable_piece = None
+        self._next_piece = 0
+
+    def close(self):
+        """Close the hashed file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def update(self):
+        """Hash the pieces written since the last update, which Mkvmerge
+        does not change anymore."""
+        if self._file is None:
+            try:
+                self._file = open(self.file_path, 'rb', buffering=0)
+            except FileNotFoundError:
+                return
+
+        if self._first_stable_piece is None:
+            try:
+                first_cluster_position =\
+                    get_first_cluster_position(self.file_path)
+            except MatroskaFileError:
+                # Headers are not fully written yet.
+                return
+            if first_cluster_position is None:
+                return
+
+            # The piece holding the first cluster's beginning may be
+            # updated, as it also holds the headers.
+            self._first_stable_piece =\
+                first_cluster_position // self.piece_size + 1
+            self._next_piece = self._first_stable_piece
+
+        file_size = os.fstat(self._file.fileno()).st_size
+        while (self._next_piece + 1) * self.piece_size <= file_size:
+            self._hash_piece(self._next_piece)
+            self._next_piece += 1
+
+    def finish(self):
+        """Hash the pieces not hashed yet, once the file is complete, and
+        return its checksums.
+
+        The returned dictionary has the following keys:
+        - algorithm: `str`, hash algorithm
+        - piece_size: `int`, size of the hashed pieces, in bytes
+        - size: `int`, size of the file, in bytes
+        - pieces: list of the pieces' digests, as hexadecimal digits
+        - checksum: `str`, digest of the pieces' digests, as hexadecimal
+          digits
+
+        :rtype: dict
+        :raises OSError: if the file cannot be read
+        """
+        try:
+            if self._file is None:
+                self._file = open(self.file_path, 'rb', buffering=0)
+
+            file_size = os.fstat(self._file.fileno()).st_size
+            pieces_count = -(-file_size // self.piece_size)
+            for index in range(pieces_count):
+                if index not in self.piece_digests:
+                    self._hash_piece(index)
+        finally:
+            self.close()
+
+        checksum = new_hash(self.algorithm)
+        for index in range(pieces_count):
+            checksum.update(self.piece_digests[index])
+
+        return {
+            'algorithm': self.algorithm,
+            'piece_size': self.piece_size,
+            'size': file_size,
+            'pieces': [
+                self.piece_digests[index].hex()
+                for index in range(pieces_count)],
+            'checksum': checksum.hexdigest()}
+
+    def _hash_piece(self, index):
+        """Hash one piece of the file."""
+        piece_hash = new_hash(self.algorithm)
+        buffer = bytearray(min(DEFAULT_CHUNK_SIZE, self.piece_size))
+        view = memoryview(buffer)
+
+        self._file.seek(index * self.piece_size)
+        remaining_size = self.piece_size
+        while remaining_size:
+            read_size = self._file.readinto(view[:remaining_size])
+            if not read_size:
+                break
+
+            piece_hash.update(view[:read_size])
+            remaining_size -= read_size
+
+        self.piece_digests[index] = piece_hash.digest()
+
+
+def write_checksums_file(file_path, checksums):
+    """Write the checksums of a Matroska file next to it.
+
+    :param str file_path: the Matroska file's path
+    :param dict checksums: as returned by :meth:`GrowingFileHasher.finish`
+    :return: path of the written JSON file
+    :rtype: str
+    """
+    checksums_file_path = get_checksums_file_path(file_path)
+    with open(checksums_file_path, 'w') as checksums_file:
+        json.dump(checksums, checksums_file, indent=2, sort_keys=True)
+
+    return checksums_file_path
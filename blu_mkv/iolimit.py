@@ -0,0 +1,454 @@
+"""Limit the number of programs reading at once from the same device.
+
+Optical drives and hard disk drives are much slower with concurrent readers
+than with serial access, because of seeks. Paths read by external programs
+are thus resolved to their underlying block device (following mounted disk
+images to the device storing them), and programs reading from the same
+device share a semaphore, whose width depends on the kind of device.
+
+Devices are found through the sysfs file system, i.e., only on Linux.
+Elsewhere, all paths fall back to a per-file-system limit.
+
+Semaphores are shared between the threads of a process. With a lock
+directory, each device also has as many lock files (aka slots) as its width,
+and each reader holds one of them with :func:`fcntl.flock`: processes using
+the same lock directory (e.g., several jobs on the same host) are thus
+limited together.
+
+Widths can be changed while programs are running (see
+:class:`~blu_mkv.autotune.ThroughputTuner`). With a lock directory, a changed
+width is also written there (e.g., ``sr0.width``), and used for a while by
+the other processes reading the device.
+"""
+
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import stat
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+SYSFS_PATH = '/sys'
+
+#: SCSI peripheral device type of CD/DVD/Blu-ray drives.
+SCSI_OPTICAL_DEVICE_TYPE = '5'
+
+OPTICAL_DEVICE = 'optical'
+ROTATIONAL_DEVICE = 'rotational'
+SOLID_STATE_DEVICE = 'solid_state'
+
+#: Default directory of the devices' slots, shared by the processes of the
+#: host.
+DEFAULT_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'blu_mkv-io')
+
+#: How many seconds between two attempts to take a slot of a device, when
+#: all its slots are held by other processes.
+SLOT_POLL_INTERVAL = 0.1
+
+#: How many seconds between two checks of the cancellation token, when
+#: waiting for a device read by other programs of the process.
+CANCELLATION_POLL_INTERVAL = 0.5
+
+#: Number of seconds during which a width written to the lock directory is
+#: used by the processes reading the device, after it was last set (e.g.,
+#: until the process tuning it ends).
+SHARED_WIDTH_LIFETIME = 300
+
+#: Size of the sectors counted in the devices' statistics, in bytes,
+#: whatever the devices' actual sector size.
+STATISTICS_SECTOR_SIZE = 512
+
+
+def get_block_device(path, sysfs_path=SYSFS_PATH):
+    """Return the name of the block device storing a file (e.g., ``sr0`` or
+    ``sda``).
+
+    Partitions are resolved to their disk, and loop devices (e.g., mounted
+    disk images) to the device storing their backing file. Block device files
+    (e.g., ``/dev/sr0``) are resolved to themselves.
+
+    :param str path: path of the file
+    :param str sysfs_path: mount point of the sysfs file system
+    :return: the device's name, or `None` if the file is not stored on a
+             block device (e.g., on a network share)
+    :rtype: str
+    :raises OSError: if the file does not exist
+    """
+    file_stat = os.stat(str(path))
+    if stat.S_ISBLK(file_stat.st_mode):
+        device_id = file_stat.st_rdev
+    else:
+        device_id = file_stat.st_dev
+
+    device_link = Path(
+        sysfs_path, 'dev', 'block',
+        '{}:{}'.format(os.major(device_id), os.minor(device_id)))
+
+    try:
+        device_path = Path(os.path.realpath(str(device_link)))
+        if not device_path.exists():
+            return None
+
+        if device_path.joinpath('partition').exists():
+            device_path = device_path.parent
+
+        backing_file = device_path.joinpath('loop', 'backing_file')
+        if backing_file.exists():
+            backing_file_path = backing_file.read_text().strip()
+            # A loop device cannot be stored on itself.
+            if os.stat(backing_file_path).st_dev != device_id:
+                return (
+                    get_block_device(backing_file_path, sysfs_path) or
+                    device_path.name)
+    except OSError:
+        return None
+
+    return device_path.name
+
+
+def get_device_kind(device_name, sysfs_path=SYSFS_PATH):
+    """Return the kind of a block device.
+
+    :param str device_name: name of the device (e.g., ``sda``)
+    :param str sysfs_path: mount point of the sysfs file system
+    :return: :data:`OPTICAL_DEVICE`, :data:`ROTATIONAL_DEVICE` or
+             :data:`SOLID_STATE_DEVICE`
+    :rtype: str
+    """
+    device_path = Path(sysfs_path, 'block', device_name)
+
+    try:
+        scsi_type = device_path.joinpath('device', 'type').read_text()
+    except OSError:
+        scsi_type = None
+    if scsi_type is not None and scsi_type.strip() == SCSI_OPTICAL_DEVICE_TYPE:
+        return OPTICAL_DEVICE
+
+    try:
+        rotational =\
+            device_path.joinpath('queue', 'rotational').read_text().strip()
+    except OSError:
+        rotational = None
+    if rotational == '1':
+        return ROTATIONAL_DEVICE
+
+    return SOLID_STATE_DEVICE
+
+
+def get_device_statistics(device_name, sysfs_path=SYSFS_PATH):
+    """Return the number of bytes read from and written to a block device
+    since it was attached, by all processes.
+
+    :param str device_name: name of the device (e.g., ``sda``)
+    :param str sysfs_path: mount point of the sysfs file system
+    :return: the numbers of bytes read and written, or `None` if the
+             device's statistics are not available
+    :rtype: tuple or None
+    """
+    try:
+        fields = Path(sysfs_path, 'block', device_name, 'stat')\
+            .read_text().split()
+        return (
+            int(fields[2]) * STATISTICS_SECTOR_SIZE,
+            int(fields[6]) * STATISTICS_SECTOR_SIZE)
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class AdjustableSemaphore:
+    """Semaphore whose width can be changed while it is held.
+
+    When the width is reduced, holders are not interrupted, but no new
+    holders are let in until there are fewer holders than the new width.
+
+    :param int width: maximum number of holders at once
+    """
+    def __init__(self, width):
+        self._condition = threading.Condition()
+        self._width = width
+        #: Number of holders of the semaphore.
+        self.holders = 0
+
+    @property
+    def width(self):
+        """Return the maximum number of holders at once.
+
+        :rtype: int
+        """
+        return self._width
+
+    @width.setter
+    def width(self, width):
+        with self._condition:
+            self._width = width
+            self._condition.notify_all()
+
+    def acquire(self, cancellation_token=None):
+        """Wait until the semaphore can be held, and hold it.
+
+        :param cancellation_token: if set, instance of
+                                   :class:`~blu_mkv.process.CancellationToken`
+                                   stopping the wait once cancelled
+        :raises ~blu_mkv.process.OperationCancelled: if the cancellation
+                                                     token is cancelled
+        """
+        with self._condition:
+            while self.holders >= self._width:
+                if cancellation_token is not None:
+                    cancellation_token.raise_if_cancelled()
+                self._condition.wait(CANCELLATION_POLL_INTERVAL)
+            self.holders += 1
+
+    def release(self):
+        """Stop holding the semaphore."""
+        with self._condition:
+            self.holders -= 1
+            self._condition.notify()
+
+
+class DeviceLimiter:
+    """Limit the number of concurrent readers of each device.
+
+    Limits are shared between the threads of a process, and with the other
+    processes using the same lock directory, if any (see :mod:`.iolimit`).
+    Such processes should use the same widths, unless set with
+    :meth:`.set_width`, which shares them through the lock directory. Slots
+    are not supported on platforms without :mod:`fcntl`, where the lock
+    directory is ignored.
+
+    :param int optical_width: maximum number of concurrent readers of an
+                              optical drive
+    :param int rotational_width: maximum number of concurrent readers of a
+                                 hard disk drive
+    :param int solid_state_width: maximum number of concurrent readers of a
+                                  solid-state drive, and of any file system
+                                  not stored on a block device
+    :param dict device_widths: maximum number of concurrent readers of some
+                               devices, with devices' names as keys (e.g.,
+                               ``{'sdb': 2}``). Overrides the other widths
+    :param str sysfs_path: mount point of the sysfs file system
+    :param str lock_dir: if set, directory of the devices' slots shared with
+                         other processes, created if missing
+    """
+    def __init__(
+            self, optical_width=1, rotational_width=1, solid_state_width=4,
+            device_widths=None, sysfs_path=SYSFS_PATH, lock_dir=None):
+        self.widths = {
+            OPTICAL_DEVICE: optical_width,
+            ROTATIONAL_DEVICE: rotational_width,
+            SOLID_STATE_DEVICE: solid_state_width}
+        self.device_widths = dict(device_widths or dict())
+        self.sysfs_path = sysfs_path
+        self.lock_dir = lock_dir
+
+        self._semaphores = dict()
+        self._semaphores_lock = threading.Lock()
+        # Tuners of the devices' widths, by device.
+        self._tuners = dict()
+
+    def get_device(self, path):
+        """Return the device storing a file.
+
+        :param str path: path of the file
+        :return: the device's name, or an identifier of the file system if the
+                 file is not stored on a block device
+        :rtype: str
+        :raises OSError: if the file does not exist
+        """
+        device_name = get_block_device(path, self.sysfs_path)
+        if device_name is None:
+            device_id = os.stat(str(path)).st_dev
+            return '{}:{}'.format(os.major(device_id), os.minor(device_id))
+
+        return device_name
+
+    def get_width(self, device):
+        """Return the maximum number of concurrent readers of a device.
+
+        A width shared by another process through the lock directory takes
+        precedence.
+
+        :param str device: as returned by :meth:`.get_device`
+        :rtype: int
+        """
+        shared_width = self._get_shared_width(device)
+        if shared_width is not None:
+            return shared_width
+
+        try:
+            return self.device_widths[device]
+        except KeyError:
+            pass
+
+        if ':' in device:
+            return self.widths[SOLID_STATE_DEVICE]
+        return self.widths[get_device_kind(device, self.sysfs_path)]
+
+    def set_width(self, device, width):
+        """Change the maximum number of concurrent readers of a device,
+        including for the programs already waiting for it, and for the other
+        processes using the same lock directory.
+
+        :param str device: as returned by :meth:`.get_device`
+        :param int width: maximum number of concurrent readers, at least 1
+        """
+        with self._semaphores_lock:
+            self.device_widths[device] = width
+            semaphore = self._semaphores.get(device)
+        if semaphore is not None:
+            semaphore.width = width
+
+        if self.lock_dir is None or fcntl is None:
+            return
+
+        width_path = self._get_width_path(device)
+        temporary_path = width_path.with_name(
+            '.{}.{}.tmp'.format(width_path.name, os.getpid()))
+        try:
+            Path(self.lock_dir).mkdir(parents=True, exist_ok=True)
+            temporary_path.write_text(str(width))
+            os.replace(str(temporary_path), str(width_path))
+        except OSError:
+            # Other processes keep their own width.
+            pass
+
+    def _get_width_path(self, device):
+        """Return the path of the file sharing the width of a device."""
+        return Path(self.lock_dir, '{}.width'.format(device))
+
+    def _get_shared_width(self, device):
+        """Return the width of a device set by any process using the lock
+        directory, if set recently enough (see
+        :data:`SHARED_WIDTH_LIFETIME`), or `None`."""
+        if self.lock_dir is None or fcntl is None:
+            return None
+
+        width_path = self._get_width_path(device)
+        try:
+            if time.time() - width_path.stat().st_mtime >\
+                    SHARED_WIDTH_LIFETIME:
+                return None
+            return int(width_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def count_readers(self, device):
+        """Return the number of programs of this process reading a device.
+
+        :param str device: as returned by :meth:`.get_device`
+        :rtype: int
+        """
+        with self._semaphores_lock:
+            semaphore = self._semaphores.get(device)
+        return semaphore.holders if semaphore is not None else 0
+
+    def tune(self, tuner):
+        """Let a tuner adjust the width of a device, according to the
+        throughput measured while the device is read.
+
+        :param tuner: instance of :class:`~blu_mkv.autotune.ThroughputTuner`
+        """
+        self._tuners[tuner.device] = tuner
+
+    def _get_semaphore(self, device):
+        """Return the semaphore limiting readers of a device."""
+        with self._semaphores_lock:
+            try:
+                return self._semaphores[device]
+            except KeyError:
+                semaphore = AdjustableSemaphore(self.get_width(device))
+                self._semaphores[device] = semaphore
+                return semaphore
+
+    def _acquire_slot(self, device, width, cancellation_token=None):
+        """Wait until one of the first slots of a device is not held by any
+        other process, and hold it.
+
+        :param str device: as returned by :meth:`.get_device`
+        :param int width: number of slots which can be held
+        :param cancellation_token: if set, stops the wait once cancelled
+        :return: the slot's open lock file, to be closed to release the
+                 slot, or `None` if slots are not shared
+        :raises ~blu_mkv.process.OperationCancelled: if the cancellation
+                                                     token is cancelled
+        """
+        if self.lock_dir is None or fcntl is None:
+            return None
+
+        Path(self.lock_dir).mkdir(parents=True, exist_ok=True)
+        while True:
+            for slot in range(width):
+                slot_file = open(str(Path(
+                    self.lock_dir, '{}.{}.lock'.format(device, slot))), 'a')
+                try:
+                    fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    slot_file.close()
+                    continue
+                return slot_file
+
+            if cancellation_token is not None:
+                cancellation_token.raise_if_cancelled()
+            time.sleep(SLOT_POLL_INTERVAL)
+
+    @contextmanager
+    def limit(self, *paths, cancellation_token=None):
+        """Wait until the devices storing some files can be read, and hold
+        them while in the context.
+
+        Devices are always acquired in the same order, so that readers of
+        several devices cannot deadlock. Missing files are ignored.
+
+        :param str paths: paths of the files to read
+        :param cancellation_token: if set, instance of
+                                   :class:`~blu_mkv.process.CancellationToken`
+                                   stopping the wait once cancelled
+        :raises OSError: if a slot's lock file cannot be opened
+        :raises ~blu_mkv.process.OperationCancelled: if the cancellation
+                                                     token is cancelled
+                                                     while waiting
+        """
+        devices = set()
+        for path in paths:
+            try:
+                devices.add(self.get_device(path))
+            except OSError:
+                continue
+
+        semaphores = [
+            (device, self._get_semaphore(device), self._tuners.get(device))
+            for device in sorted(devices)]
+
+        acquired_semaphores = list()
+        slot_files = list()
+        try:
+            for (device, semaphore, tuner) in semaphores:
+                # Follow the width changed by other processes.
+                shared_width = self._get_shared_width(device)
+                if shared_width is not None and\
+                        shared_width != semaphore.width:
+                    semaphore.width = shared_width
+                semaphore.acquire(cancellation_token)
+                acquired_semaphores.append((semaphore, tuner))
+                slot_file = self._acquire_slot(
+                    device, semaphore.width, cancellation_token)
+                if slot_file is not None:
+                    slot_files.append(slot_file)
+                # Throughput is only measured while the device is read.
+                if tuner is not None and semaphore.holders == 1:
+                    tuner.restart()
+            yield
+        finally:
+            for slot_file in slot_files:
+                slot_file.close()
+            for (semaphore, tuner) in reversed(acquired_semaphores):
+                if tuner is not None:
+                    tuner.update()
+                semaphore.release()
@@ -0,0 +1,417 @@
+"""Persistent queue of discs to convert, stored in a SQLite database.
+
+Jobs survive restarts of the processes converting them: a job is only done
+once explicitly completed, and jobs held by workers which died are put back
+in the queue. The same disc is never queued twice, as long as its file is
+not modified.
+
+Workers on other hosts, whose processes cannot be checked, hold their jobs
+with leases instead: a job whose lease is not renewed in time is put back in
+the queue (see :meth:`JobQueue.requeue_expired_leases`).
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import os
+from pathlib import Path
+import socket
+import sqlite3
+import time
+
+from .utils import is_process_alive
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    queued_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    lease_expires_at REAL,
+    progress REAL,
+    UNIQUE (path, size, mtime_ns)
+);
+
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+#: Columns added to the jobs' table since its creation, with their type.
+ADDED_COLUMNS = [('lease_expires_at', 'REAL'), ('progress', 'REAL')]
+
+
+#: Identifier of the current boot, on Linux.
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+
+def get_process_start(pid):
+    """Return an identifier of when a process started, which differs
+    between processes given the same PID, even across reboots.
+
+    :param int pid: process' identifier
+    :return: the boot's identifier and the process' start time, or `None` if
+             the process does not exist, or if it cannot be told (i.e.,
+             elsewhere than on Linux)
+    :rtype: str or None
+    """
+    try:
+        boot_id = Path(BOOT_ID_PATH).read_text().strip()
+        process_stat = Path('/proc/{}/stat'.format(pid)).read_text()
+    except OSError:
+        return None
+
+    # Fields follow the command's name, in parentheses, which may contain
+    # spaces. The start time, in clock ticks since the boot, is the 22nd.
+    start_time = process_stat.rpartition(')')[2].split()[19]
+    return '{}/{}'.format(boot_id, start_time)
+
+
+def get_worker_name(pid=None):
+    """Return the name identifying a worker process, across hosts.
+
+    The process' start is part of the name, when known (see
+    :func:`get_process_start`), so that a process reusing the PID of a dead
+    worker (e.g., after a reboot, or PID 1 in containers) is not mistaken for
+    it.
+
+    :param int pid: process' identifier. Defaults to the current process
+    :return: the worker's name, like ``<hostname>:<pid>:<start>``, or
+             ``<hostname>:<pid>`` if the process' start is not known
+    :rtype: str
+    """
+    pid = pid or os.getpid()
+    worker = '{}:{}'.format(socket.gethostname(), pid)
+
+    process_start = get_process_start(pid)
+    if process_start is not None:
+        worker = '{}:{}'.format(worker, process_start)
+
+    return worker
+
+
+class JobQueue:
+    """Persistent queue of discs to convert.
+
+    Each job is a dictionary with the following keys:
+    - id: `int`, identifier of the job
+    - path: `str`, absolute path of the disc
+    - state: `str`, :data:`PENDING`, :data:`RUNNING`, :data:`DONE` or
+             :data:`FAILED`
+    - worker: `str`, name of the worker running (or having run) the job, as
+              returned by :func:`get_worker_name`
+    - attempts: `int`, number of times the job has been started
+    - error: `str`, why the job failed, if so
+    - lease_expires_at: `float`, time since the Epoch after which the job is
+                        put back in the queue, unless its lease is renewed.
+                        `None` if the job is not leased
+    - progress: `float`, part of the job done, between 0 and 1, as last
+                reported by its worker
+
+    Like :class:`~blu_mkv.catalog.BlurayCatalog`, the database is opened in
+    WAL mode, so that several processes can use the same queue. Jobs are
+    claimed in a single transaction, so that a job is never run by two
+    workers at once.
+
+    :param str database_path: path of the SQLite database, created if missing
+    :param float timeout: how many seconds to wait for a database lock held
+                          by another process
+    """
+    def __init__(self, database_path, timeout=30):
+        self.database_path = database_path
+        # Transactions are explicitly handled, to be immediate when claiming
+        # jobs.
+        self.connection = sqlite3.connect(
+            database_path, timeout=timeout, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self._add_missing_columns()
+
+    def close(self):
+        """Close the connection to the database."""
+        self.connection.close()
+
+    def _add_missing_columns(self):
+        """Upgrade a queue created by a previous version."""
+        columns = [
+            row['name'] for row in
+            self.connection.execute('PRAGMA table_info(jobs)')]
+        for (column, column_type) in ADDED_COLUMNS:
+            if column not in columns:
+                self.connection.execute(
+                    'ALTER TABLE jobs ADD COLUMN {} {}'.format(
+                        column, column_type))
+
+    @contextmanager
+    def _transaction(self):
+        """Run queries in a transaction, holding the database's write lock
+        from its beginning."""
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        else:
+            self.connection.execute('COMMIT')
+
+    def add(self, disc_path):
+        """Queue a disc, unless already queued.
+
+        A disc is identified by its path, size and modification time: a disc
+        modified since it has been queued is queued again.
+
+        :param str disc_path: path of the disc (e.g., a disk image)
+        :return: identifier of the new job, or `None` if already queued
+        :rtype: int or None
+        :raises OSError: if the disc does not exist
+        """
+        disc_path = Path(str(disc_path)).resolve()
+        disc_stat = disc_path.stat()
+
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO jobs '
+                '(path, size, mtime_ns, state, queued_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (
+                    str(disc_path), disc_stat.st_size, disc_stat.st_mtime_ns,
+                    PENDING, self._now()))
+
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, worker=None, lease_duration=None):
+        """Take the oldest pending job, and mark it as running.
+
+        :param str worker: name of the worker running the job. Defaults to
+                           the current process, as returned by
+                           :func:`get_worker_name`
+        :param float lease_duration: if set, number of seconds after which
+                                     the job is put back in the queue, unless
+                                     its lease is renewed (see
+                                     :meth:`.renew_lease`)
+        :return: the job, or `None` if there are no pending jobs
+        :rtype: dict or None
+        """
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT id FROM jobs WHERE state = ? ORDER BY id LIMIT 1',
+                (PENDING,)).fetchone()
+            if row is None:
+                return None
+
+            connection.execute(
+                'UPDATE jobs SET state = ?, worker = ?, '
+                'attempts = attempts + 1, error = NULL, started_at = ?, '
+                'finished_at = NULL, lease_expires_at = ?, progress = NULL '
+                'WHERE id = ?',
+                (
+                    RUNNING, worker or get_worker_name(), self._now(),
+                    self._get_lease_expiration(lease_duration), row['id']))
+
+        return self.get_job(row['id'])
+
+    def complete(self, job_id, worker=None):
+        """Mark a job as done.
+
+        :param int job_id: job's identifier
+        :param str worker: if set, the job is only marked as done if still
+                           run by this worker
+        :return: whether the job has been marked as done
+        :rtype: bool
+        """
+        return self._finish(job_id, DONE, worker=worker)
+
+    def fail(self, job_id, error=None, worker=None):
+        """Mark a job as failed. Failed jobs are not run again, unless
+        retried.
+
+        :param int job_id: job's identifier
+        :param str error: why the job failed
+        :param str worker: if set, the job is only marked as failed if still
+                           run by this worker
+        :return: whether the job has been marked as failed
+        :rtype: bool
+        """
+        return self._finish(job_id, FAILED, error, worker)
+
+    def _finish(self, job_id, state, error=None, worker=None):
+        """Set the final state of a job."""
+        query = (
+            'UPDATE jobs SET state = ?, error = ?, finished_at = ?, '
+            'lease_expires_at = NULL WHERE id = ?')
+        parameters = (state, error, self._now(), job_id)
+        if worker is not None:
+            query += ' AND state = ? AND worker = ?'
+            parameters += (RUNNING, worker)
+
+        with self._transaction() as connection:
+            cursor = connection.execute(query, parameters)
+
+        return cursor.rowcount > 0
+
+    def renew_lease(self, job_id, worker, lease_duration, progress=None):
+        """Extend the lease of a running job, and record its progress.
+
+        :param int job_id: job's identifier
+        :param str worker: name of the worker running the job
+        :param float lease_duration: number of seconds after which the job is
+                                     put back in the queue, unless its lease
+                                     is renewed again
+        :param float progress: if set, part of the job done, between 0 and 1
+        :return: whether the lease has been renewed. If not, the job has been
+                 given to another worker, or is not running anymore
+        :rtype: bool
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE jobs SET lease_expires_at = ?, '
+                'progress = COALESCE(?, progress) '
+                'WHERE id = ? AND state = ? AND worker = ?',
+                (
+                    self._get_lease_expiration(lease_duration), progress,
+                    job_id, RUNNING, worker))
+
+        return cursor.rowcount > 0
+
+    def requeue_expired_leases(self):
+        """Put back in the queue the running jobs whose lease expired, as
+        their worker is likely dead (or cut off).
+
+        :return: identifiers of the jobs put back in the queue
+        :rtype: list
+        """
+        with self._transaction() as connection:
+            rows = connection.execute(
+                'SELECT id FROM jobs WHERE state = ? AND '
+                'lease_expires_at < ? ORDER BY id',
+                (RUNNING, time.time())).fetchall()
+            expired_jobs = [row['id'] for row in rows]
+
+            connection.executemany(
+                'UPDATE jobs SET state = ?, lease_expires_at = NULL '
+                'WHERE id = ?',
+                [(PENDING, job_id) for job_id in expired_jobs])
+
+        return expired_jobs
+
+    def retry(self, job_id, worker=None):
+        """Put a job back in the queue (e.g., a failed job, or a running job
+        which was interrupted).
+
+        :param int job_id: job's identifier
+        :param str worker: if set, the job is only put back in the queue if
+                           still run by this worker
+        :return: whether the job has been put back in the queue
+        :rtype: bool
+        """
+        query = (
+            'UPDATE jobs SET state = ?, lease_expires_at = NULL WHERE id = ?')
+        parameters = (PENDING, job_id)
+        if worker is not None:
+            query += ' AND state = ? AND worker = ?'
+            parameters += (RUNNING, worker)
+
+        with self._transaction() as connection:
+            cursor = connection.execute(query, parameters)
+
+        return cursor.rowcount > 0
+
+    def requeue_abandoned_jobs(self):
+        """Put back in the queue the running jobs whose worker died, among
+        the workers of the current host.
+
+        Meant to be called when a worker starts, so that jobs interrupted by a
+        crash or a reboot are run again. Jobs held by a worker with the same
+        name as the current process are thus abandoned too. A worker is dead
+        if its process is not running anymore, or if another process got its
+        PID (when the process' start is part of its name).
+
+        :return: identifiers of the jobs put back in the queue
+        :rtype: list
+        """
+        worker_prefix = '{}:'.format(socket.gethostname())
+        current_worker = get_worker_name()
+        abandoned_jobs = list()
+
+        with self._transaction() as connection:
+            rows = connection.execute(
+                'SELECT id, worker FROM jobs WHERE state = ? ORDER BY id',
+                (RUNNING,)).fetchall()
+
+            for row in rows:
+                worker = row['worker'] or ''
+                if not worker.startswith(worker_prefix):
+                    continue
+
+                if (worker != current_worker and
+                        self._is_worker_alive(worker[len(worker_prefix):])):
+                    continue
+
+                connection.execute(
+                    'UPDATE jobs SET state = ? WHERE id = ?',
+                    (PENDING, row['id']))
+                abandoned_jobs.append(row['id'])
+
+        return abandoned_jobs
+
+    @staticmethod
+    def _is_worker_alive(worker_process):
+        """Return whether a worker of the current host is alive, from the
+        end of its name (``<pid>[:<start>]``)."""
+        (pid, _, process_start) = worker_process.partition(':')
+        if not pid.isdigit() or not is_process_alive(int(pid)):
+            return False
+
+        return (
+            not process_start or
+            get_process_start(int(pid)) in (None, process_start))
+
+    def get_job(self, job_id):
+        """Return a job.
+
+        :param int job_id: job's identifier
+        :return: the job, or `None` if it does not exist
+        :rtype: dict or None
+        """
+        row = self.connection.execute(
+            'SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_jobs(self, state=None):
+        """Return jobs, in the order they were queued.
+
+        :param str state: only return jobs in this state, if set
+        :rtype: list
+        """
+        if state is None:
+            rows = self.connection.execute('SELECT * FROM jobs ORDER BY id')
+        else:
+            rows = self.connection.execute(
+                'SELECT * FROM jobs WHERE state = ? ORDER BY id', (state,))
+
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _get_lease_expiration(lease_duration):
+        """Return when a lease given now expires, as stored in the
+        database."""
+        if lease_duration is None:
+            return None
+        return time.time() + lease_duration
+
+    @staticmethod
+    def _now():
+        """Return the current time, as stored in the database."""
+        return datetime.utcnow().isoformat()
@@ -1,7 +1,6 @@
 from abc import ABCMeta, abstractmethod
 from enum import Enum
 import re
-import subprocess
 
 from . import ProgramController
 
@@ -74,12 +73,22 @@ class MakemkvController(ProgramController, AbstractMakemkvController):
     :param str executable_path: absolute path of the Makemkv command-line's
                                 executable file
     """
-    def __init__(self, executable_file='makemkvcon'):
+    def __init__(
+            self, executable_file='makemkvcon', io_limiter=None,
+            resource_policy=None, timeout_policy=None):
         """
         :param str executable_file: name or absolute path of the Makemkv
                                     command-line's executable
+        :param io_limiter: limits concurrent readers of the devices storing
+                           input files, instance of
+                           :class:`~blu_mkv.iolimit.DeviceLimiter`
+        :param resource_policy: resources allowed to the program, instance of
+                                :class:`~blu_mkv.resources.ResourcePolicy`
+        :param timeout_policy: timeouts of the program's operations, instance
+                               of :class:`~blu_mkv.process.TimeoutPolicy`
         """
-        super().__init__(executable_file)
+        super().__init__(
+            executable_file, io_limiter, resource_policy, timeout_policy)
 
     def get_disc_info(self, source_type, source_name):
         """Return details about a Blu-ray disc.
@@ -98,11 +107,17 @@ class MakemkvController(ProgramController, AbstractMakemkvController):
         :param str source_name: path or identifier of the disc
         :rtype: dict
         """
-        makemkv_output = subprocess.check_output([
-            self.executable_path,
-            '-r', 'info',
-            '{}:{}'.format(source_type, source_name)],
-            universal_newlines=True)
+        # Only files and devices can be resolved to a device to limit.
+        if source_type in ('dev', 'file'):
+            io_limit = self._limit_io(source_name)
+        else:
+            io_limit = self._limit_io()
+
+        with io_limit:
+            makemkv_output = self._run([
+                self.executable_path,
+                '-r', 'info',
+                '{}:{}'.format(source_type, source_name)])
 
         # Regex for lines related to titles. Example: TINFO:0,8,0,"22"
         title_regex = re.compile(
@@ -0,0 +1,219 @@
+"""Fast inspection of Matroska files, without reading their clusters.
+
+Only the EBML header, the segment's size and the tracks are checked, which is
+enough to detect files truncated by an interrupted conversion: Mkvmerge
+writes the segment's size last. The part of files Mkvmerge may still update
+while writing them can also be located.
+"""
+
+import os
+
+
+EBML_ID = 0x1A45DFA3
+DOC_TYPE_ID = 0x4282
+SEGMENT_ID = 0x18538067
+TRACKS_ID = 0x1654AE6B
+TRACK_ENTRY_ID = 0xAE
+CLUSTER_ID = 0x1F43B675
+
+#: Document types of the Matroska files.
+MATROSKA_DOC_TYPES = (b'matroska', b'webm')
+
+
+class MatroskaFileError(ValueError):
+    """Raised when a Matroska file is invalid, or truncated."""
+
+
+def _read_variable_integer(matroska_file, is_id=False):
+    """Read an EBML variable-length integer.
+
+    :param matroska_file: file object opened in binary mode
+    :param bool is_id: whether the integer is an element's identifier, whose
+                       length marker is kept
+    :return: the integer, or `None` if it is an unknown size
+    :rtype: int or None
+    :raises MatroskaFileError: if the integer is invalid or truncated
+    """
+    first_byte = matroska_file.read(1)
+    if not first_byte:
+        raise MatroskaFileError("Unexpected end of file")
+
+    first_byte = first_byte[0]
+    length = 1
+    while length <= 8 and not first_byte & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise MatroskaFileError("Invalid variable-length integer")
+
+    other_bytes = matroska_file.read(length - 1)
+    if len(other_bytes) != length - 1:
+        raise MatroskaFileError("Unexpected end of file")
+
+    if is_id:
+        value = first_byte
+    else:
+        value = first_byte & (0xFF >> length)
+    for byte in other_bytes:
+        value = (value << 8) | byte
+
+    if not is_id and value == (1 << (7 * length)) - 1:
+        return None
+    return value
+
+
+def _read_element_header(matroska_file):
+    """Read an EBML element's identifier and data size.
+
+    :rtype: tuple
+    :raises MatroskaFileError: if the header is invalid or truncated
+    """
+    element_id = _read_variable_integer(matroska_file, is_id=True)
+    return (element_id, _read_variable_integer(matroska_file))
+
+
+def _read_children(matroska_file, end):
+    """Read the headers of an element's children, skipping their data.
+
+    :param matroska_file: file object opened in binary mode, positioned at
+                          the parent element's data
+    :param int end: position of the end of the parent element
+    :return: iterator of ``(element_id, data_position, size)`` tuples
+    :raises MatroskaFileError: if a child is invalid or exceeds its parent
+    """
+    position = matroska_file.tell()
+    while position < end:
+        matroska_file.seek(position)
+        (element_id, size) = _read_element_header(matroska_file)
+        data_position = matroska_file.tell()
+        if size is None or data_position + size > end:
+            raise MatroskaFileError(
+                "Element {:X} exceeds its parent".format(element_id))
+
+        yield (element_id, data_position, size)
+        position = data_position + size
+
+
+def _read_segment_header(matroska_file, file_path):
+    """Check the EBML header of a Matroska file, and read its segment's
+    header.
+
+    :return: position of the segment's data, and its size, or `None` if
+             unknown
+    :rtype: tuple
+    :raises MatroskaFileError: if the headers are invalid or truncated
+    """
+    (element_id, size) = _read_element_header(matroska_file)
+    if element_id != EBML_ID or size is None:
+        raise MatroskaFileError(
+            "{} does not start with an EBML header".format(file_path))
+
+    header_end = matroska_file.tell() + size
+    doc_type = None
+    for (element_id, data_position, size) in\
+            _read_children(matroska_file, header_end):
+        if element_id == DOC_TYPE_ID:
+            matroska_file.seek(data_position)
+            doc_type = matroska_file.read(size).rstrip(b'\0')
+    if doc_type not in MATROSKA_DOC_TYPES:
+        raise MatroskaFileError(
+            "{} is not a Matroska file".format(file_path))
+
+    matroska_file.seek(header_end)
+    (element_id, size) = _read_element_header(matroska_file)
+    if element_id != SEGMENT_ID:
+        raise MatroskaFileError(
+            "{} has no Matroska segment".format(file_path))
+
+    return (matroska_file.tell(), size)
+
+
+def get_tracks_count(file_path):
+    """Check a Matroska file's structure, and return its number of tracks.
+
+    The file must start with an EBML header of a Matroska document, followed
+    by a segment whose size is known and matches the file's size.
+
+    :param str file_path: path of the Matroska file
+    :return: number of tracks, 0 for files without tracks (e.g., with
+             ordered chapters only)
+    :rtype: int
+    :raises MatroskaFileError: if the file is invalid or truncated
+    :raises OSError: if the file cannot be read
+    """
+    with open(str(file_path), 'rb') as matroska_file:
+        file_size = os.fstat(matroska_file.fileno()).st_size
+
+        (segment_position, size) =\
+            _read_segment_header(matroska_file, file_path)
+        segment_end = segment_position + (size or 0)
+        if size is None or segment_end != file_size:
+            raise MatroskaFileError(
+                "{} is truncated: segment of {} bytes, file of {} bytes"
+                .format(file_path, size, file_size))
+
+        for (element_id, data_position, size) in\
+                _read_children(matroska_file, segment_end):
+            if element_id == TRACKS_ID:
+                matroska_file.seek(data_position)
+                return sum(
+                    1 for (child_id, _, _) in _read_children(
+                        matroska_file, data_position + size)
+                    if child_id == TRACK_ENTRY_ID)
+            elif element_id == CLUSTER_ID:
+                # Tracks are always written before the clusters.
+                break
+
+    return 0
+
+
+def get_first_cluster_position(file_path):
+    """Return the position of the first cluster of a Matroska file, which
+    may still be written.
+
+    Mkvmerge writes clusters one after another, and only goes back to the
+    part of the file before the first cluster (segment's size, duration,
+    seek head, etc.) once all clusters are written: data after this position
+    does not change anymore once written.
+
+    :param str file_path: path of the Matroska file
+    :return: position in bytes, or `None` if no cluster has been written yet
+    :rtype: int or None
+    :raises MatroskaFileError: if the file is invalid
+    :raises OSError: if the file cannot be read
+    """
+    with open(str(file_path), 'rb') as matroska_file:
+        file_size = os.fstat(matroska_file.fileno()).st_size
+
+        (position, _) = _read_segment_header(matroska_file, file_path)
+        while position < file_size:
+            matroska_file.seek(position)
+            (element_id, size) = _read_element_header(matroska_file)
+            if element_id == CLUSTER_ID:
+                return position
+            elif size is None:
+                raise MatroskaFileError(
+                    "Element {:X} has an unknown size".format(element_id))
+
+            position = matroska_file.tell() + size
+
+    return None
+
+
+def verify_matroska_file(file_path, expected_tracks_count=None):
+    """Return whether a Matroska file is complete.
+
+    See :func:`get_tracks_count` for the checks done.
+
+    :param str file_path: path of the Matroska file
+    :param int expected_tracks_count: number of tracks the file must have, if
+                                      set
+    :rtype: bool
+    """
+    try:
+        tracks_count = get_tracks_count(file_path)
+    except (MatroskaFileError, OSError):
+        return False
+
+    return (
+        expected_tracks_count is None or
+        tracks_count == expected_tracks_count)
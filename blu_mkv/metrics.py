@@ -0,0 +1,386 @@
+"""Metrics of conversions, exported in Prometheus' text format.
+
+Metrics are written to a file for the textfile collector of Prometheus' node
+exporter (see :meth:`Metrics.write_textfile`), or served over HTTP while
+converting (see :meth:`Metrics.serve`), so that conversions can be compared
+across hosts.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+#: Buckets of the durations' histograms, in seconds.
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 1800, 3600, 7200)
+
+#: Buckets of the throughputs' histograms, in bytes per second.
+THROUGHPUT_BUCKETS = tuple(
+    size * 1024 * 1024 for size in (5, 10, 25, 50, 100, 200, 400, 800, 1600))
+
+#: Exported metrics, by name, with their type, description and buckets (for
+#: histograms).
+METRICS = OrderedDict([
+    ('blu_mkv_discs_processed_total', (
+        'counter', "Discs successfully converted.", None)),
+    ('blu_mkv_playlists_probed_total', (
+        'counter', "Playlists found on the analyzed discs.", None)),
+    ('blu_mkv_files_written_total', (
+        'counter', "Matroska files written, by kind (playlist or segment).",
+        None)),
+    ('blu_mkv_program_runs_total', (
+        'counter',
+        "Runs of the external programs, by program and status (success, "
+        "failure, timeout or cancelled).",
+        None)),
+    ('blu_mkv_program_duration_seconds', (
+        'histogram', "Duration of the external programs' runs.",
+        DURATION_BUCKETS)),
+    ('blu_mkv_remuxed_bytes_total', (
+        'counter', "Size of the written Matroska files.", None)),
+    ('blu_mkv_remux_throughput_bytes_per_second', (
+        'histogram', "Size of the written Matroska files per second of "
+        "remux.", THROUGHPUT_BUCKETS)),
+    ('blu_mkv_analysis_cache_requests_total', (
+        'counter', "Lookups in the analysis cache, by result (hit or miss).",
+        None)),
+    ('blu_mkv_failures_total', (
+        'counter', "Failed conversions, by stage (e.g., analysis or remux).",
+        None)),
+    ('blu_mkv_last_run_timestamp_seconds', (
+        'gauge', "Time of the last update of the metrics, since the Epoch.",
+        None)),
+])
+
+#: Content type of Prometheus' text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    """Format a sample's value, or a bucket's bound."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    """Format the labels of a sample, sorted by name.
+
+    :param labels: iterable of ``(name, value)`` tuples
+    :rtype: str
+    """
+    labels = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for (name, value) in sorted(labels)]
+    return '{{{}}}'.format(','.join(labels)) if labels else ''
+
+
+class Metrics:
+    """Counters, gauges and histograms of the conversions (see
+    :data:`METRICS`), shared by threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Samples of each metric, by labels. Histograms' samples are the
+        # counts of their buckets, followed by their sum and count.
+        self._samples = {name: OrderedDict() for name in METRICS}
+        # Samples already added to the totals of the textfile.
+        self._written_samples = {name: dict() for name in METRICS}
+
+    @staticmethod
+    def _get_metric(name, metric_type):
+        """Return the description of a metric, checking its type."""
+        try:
+            metric = METRICS[name]
+        except KeyError:
+            raise KeyError("Unknown metric {}".format(name))
+
+        if metric[0] != metric_type:
+            raise ValueError("{} is a {}".format(name, metric[0]))
+        return metric
+
+    def increment(self, name, value=1, **labels):
+        """Increment a counter.
+
+        :param str name: name of the counter
+        :param float value: added to the counter
+        :param labels: labels of the counter's sample
+        :raises KeyError: if the metric is unknown
+        """
+        self._get_metric(name, 'counter')
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._samples[name]
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge's value.
+
+        :param str name: name of the gauge
+        :param float value: new value of the gauge
+        :param labels: labels of the gauge's sample
+        :raises KeyError: if the metric is unknown
+        """
+        self._get_metric(name, 'gauge')
+        with self._lock:
+            self._samples[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram.
+
+        :param str name: name of the histogram
+        :param float value: observed value
+        :param labels: labels of the histogram's sample
+        :raises KeyError: if the metric is unknown
+        """
+        (_, _, buckets) = self._get_metric(name, 'histogram')
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._samples[name]
+            counts = samples.setdefault(key, [0] * (len(buckets) + 2))
+            for (index, bound) in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def get(self, name, **labels):
+        """Return the value of a counter or gauge.
+
+        :param str name: name of the metric
+        :param labels: labels of the metric's sample
+        :return: value of the sample, 0 if never updated
+        :rtype: float
+        """
+        with self._lock:
+            return self._samples[name].get(tuple(sorted(labels.items())), 0)
+
+    @contextmanager
+    def count_failures(self, stage):
+        """Return a context manager counting a failure of a conversion's
+        stage if an exception is raised (including :class:`SystemExit`).
+
+        :param str stage: name of the stage (e.g., ``analysis``)
+        """
+        try:
+            yield
+        except BaseException:
+            self.increment('blu_mkv_failures_total', stage=stage)
+            raise
+
+    def render(self):
+        """Return the metrics in Prometheus' text format.
+
+        :rtype: str
+        """
+        self.set('blu_mkv_last_run_timestamp_seconds', time.time())
+
+        lines = list()
+        with self._lock:
+            for (name, (metric_type, description, buckets)) in\
+                    METRICS.items():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+                for (labels, value) in self._samples[name].items():
+                    if metric_type != 'histogram':
+                        lines.append('{}{} {}'.format(
+                            name, _format_labels(labels),
+                            _format_value(value)))
+                        continue
+
+                    # Buckets' counts are cumulative, the last bucket
+                    # holding all values.
+                    for (bound, count) in zip(
+                            buckets + (float('inf'),),
+                            value[:len(buckets)] + [value[-1]]):
+                        lines.append('{}_bucket{} {}'.format(
+                            name,
+                            _format_labels(
+                                labels + (('le', _format_value(bound)),)),
+                            count))
+                    lines.append('{}_sum{} {}'.format(
+                        name, _format_labels(labels),
+                        _format_value(value[-2])))
+                    lines.append('{}_count{} {}'.format(
+                        name, _format_labels(labels), value[-1]))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, file_path):
+        """Write the metrics to a file read by the textfile collector of
+        Prometheus' node exporter (e.g., ``blu_mkv.prom``).
+
+        The file is shared by all the conversions of the host (e.g., one
+        process per disc, or long-running workers writing it after each
+        disc): counters and histograms are added to the totals written by
+        previous calls, from this process or others, so that they never
+        decrease. Totals are kept in a JSON file next to it (e.g.,
+        ``.blu_mkv.prom.json``), locked while they are updated.
+
+        The file is replaced atomically, so that the collector never reads
+        it partially written.
+
+        :param str file_path: path of the file
+        """
+        file_path = Path(str(file_path))
+        totals_path = file_path.with_name('.{}.json'.format(file_path.name))
+        with open(str(totals_path), 'a+') as totals_file:
+            if fcntl is not None:
+                fcntl.flock(totals_file, fcntl.LOCK_EX)
+
+            totals = Metrics()
+            totals_file.seek(0)
+            try:
+                totals._add_samples(self._load_samples(totals_file))
+            except ValueError:
+                # Left partially written: counters start over.
+                pass
+            (unwritten_samples, written_samples) =\
+                self._get_unwritten_samples()
+            totals._add_samples(unwritten_samples)
+
+            self._replace_file(file_path, totals.render())
+            totals_file.seek(0)
+            totals_file.truncate()
+            json.dump(totals._dump_samples(), totals_file)
+
+        self._written_samples = written_samples
+
+    @staticmethod
+    def _replace_file(file_path, content):
+        """Replace a file atomically by the given text."""
+        temporary_path = file_path.with_name(
+            '.{}.{}.tmp'.format(file_path.name, os.getpid()))
+        try:
+            with open(str(temporary_path), 'w') as metrics_file:
+                metrics_file.write(content)
+            os.replace(str(temporary_path), str(file_path))
+        except BaseException:
+            try:
+                os.remove(str(temporary_path))
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _get_unwritten_samples(self):
+        """Return the increments of the counters and histograms since the
+        last write of the textfile, and the gauges' values, along with the
+        samples to record as written."""
+        unwritten_samples = dict()
+        written_samples = dict()
+        with self._lock:
+            for (name, samples) in self._samples.items():
+                metric_type = METRICS[name][0]
+                previous_samples = self._written_samples[name]
+                unwritten_samples[name] = OrderedDict()
+                written_samples[name] = dict()
+                for (labels, value) in samples.items():
+                    if metric_type == 'histogram':
+                        previous_value = previous_samples.get(
+                            labels, [0] * len(value))
+                        unwritten_samples[name][labels] = [
+                            count - previous_count for (count, previous_count)
+                            in zip(value, previous_value)]
+                        value = list(value)
+                    elif metric_type == 'counter':
+                        unwritten_samples[name][labels] =\
+                            value - previous_samples.get(labels, 0)
+                    else:
+                        unwritten_samples[name][labels] = value
+                    written_samples[name][labels] = value
+
+        return (unwritten_samples, written_samples)
+
+    def _add_samples(self, samples):
+        """Add samples to the counters and histograms, and set the gauges.
+
+        :param dict samples: samples of each metric, by labels. Unknown
+                             metrics are ignored
+        """
+        with self._lock:
+            for (name, metric_samples) in samples.items():
+                if name not in METRICS:
+                    continue
+                (metric_type, _, buckets) = METRICS[name]
+                for (labels, value) in metric_samples.items():
+                    if metric_type == 'histogram':
+                        counts = self._samples[name].setdefault(
+                            labels, [0] * (len(buckets) + 2))
+                        if len(value) != len(counts):
+                            # Buckets changed since the totals were written.
+                            continue
+                        for (index, count) in enumerate(value):
+                            counts[index] += count
+                    elif metric_type == 'counter':
+                        self._samples[name][labels] =\
+                            self._samples[name].get(labels, 0) + value
+                    else:
+                        self._samples[name][labels] = value
+
+    def _dump_samples(self):
+        """Return the samples as a JSON-serializable dictionary."""
+        with self._lock:
+            return {
+                name: [
+                    [[list(label) for label in labels], value]
+                    for (labels, value) in samples.items()]
+                for (name, samples) in self._samples.items()}
+
+    @staticmethod
+    def _load_samples(samples_file):
+        """Load samples dumped by :meth:`_dump_samples`.
+
+        :raises ValueError: if the file is not valid
+        """
+        content = samples_file.read()
+        if not content:
+            return dict()
+
+        try:
+            return {
+                name: OrderedDict(
+                    (tuple(tuple(label) for label in labels), value)
+                    for (labels, value) in samples)
+                for (name, samples) in json.loads(content).items()}
+        except (AttributeError, TypeError) as exc:
+            raise ValueError(str(exc))
+
+    def serve(self, port, address='127.0.0.1'):
+        """Serve the metrics over HTTP, from a background thread.
+
+        :param int port: port to listen to. If 0, any free port is used
+        :param str address: address to listen to. Defaults to the loopback
+                            address
+        :return: the server, whose ``server_port`` is the listened port, and
+                 which is stopped with ``shutdown()``, instance of
+                 :class:`http.server.HTTPServer`
+        """
+        metrics = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer((address, port), MetricsRequestHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
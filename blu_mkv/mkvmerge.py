@@ -1,9 +1,23 @@
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import json
-import subprocess
+import os
+from pathlib import Path
+from xml.etree import ElementTree
 
-from . import ProgramController
+from . import ProgramController, clpi, mpls
+from .integrity import (
+    GrowingFileHasher, get_file_checksums, write_checksums_file)
+from .process import get_media_duration
+
+
+#: How many seconds between two hashes of the Matroska file being written.
+HASH_POLL_INTERVAL = 1
+
+#: Part of the linked streams muxed into files made of ordered chapters, as
+#: expected by Mkvmerge's ``--split parts:`` option.
+LINKING_PART = '00:00:00-00:00:01'
 
 
 class AbstractMkvmergeController(metaclass=ABCMeta):
@@ -14,6 +28,18 @@ class AbstractMkvmergeController(metaclass=ABCMeta):
     @abstractmethod
     def write(
             self, output_file_path, input_tracks, title=None,
+            attachments=None, segment_uid=None):
+        pass
+
+    @abstractmethod
+    def write_chunked(
+            self, output_file_path, input_streams, title=None,
+            attachments=None, segment_uid=None, max_workers=None):
+        pass
+
+    @abstractmethod
+    def write_ordered_chapters(
+            self, output_file_path, chapters, input_streams, title=None,
             attachments=None):
         pass
 
@@ -23,12 +49,29 @@ class MkvmergeController(ProgramController, AbstractMkvmergeController):
 
     :param str executable_path: absolute path of the Mkvmerge's executable file
     """
-    def __init__(self, executable_file='mkvmerge'):
+    def __init__(
+            self, executable_file='mkvmerge', io_limiter=None,
+            resource_policy=None, timeout_policy=None, hash_outputs=False):
         """
         :param str executable_file: name or absolute path of the Mkvmerge's
                                     executable file
+        :param io_limiter: limits concurrent readers of the devices storing
+                           input files, instance of
+                           :class:`~blu_mkv.iolimit.DeviceLimiter`
+        :param resource_policy: resources allowed to the program, instance of
+                                :class:`~blu_mkv.resources.ResourcePolicy`
+        :param timeout_policy: timeouts of the program's operations, instance
+                               of :class:`~blu_mkv.process.TimeoutPolicy`.
+                               Remuxes are allowed more time for longer
+                               playlists and clips
+        :param bool hash_outputs: whether written Matroska files are hashed
+                                  while being written, and their checksums
+                                  written next to them (see
+                                  :mod:`blu_mkv.integrity`)
         """
-        super().__init__(executable_file)
+        super().__init__(
+            executable_file, io_limiter, resource_policy, timeout_policy)
+        self.hash_outputs = hash_outputs
 
     def get_file_info(self, file_path):
         """Return details about a media file.
@@ -40,18 +83,18 @@ class MkvmergeController(ProgramController, AbstractMkvmergeController):
         :param str file_path: path of the file to probe
         :rtype: dict
         """
-        mkvmerge_output = subprocess.check_output([
-            self.executable_path,
-            '--identify',
-            '--identification-format', 'json',
-            file_path],
-            universal_newlines=True)
+        with self._limit_io(file_path):
+            mkvmerge_output = self._run([
+                self.executable_path,
+                '--identify',
+                '--identification-format', 'json',
+                file_path])
 
         return json.loads(mkvmerge_output)
 
     def write(
             self, output_file_path, input_streams, title=None,
-            attachments=None):
+            attachments=None, segment_uid=None):
         """Remux several streams into a Matroska file.
 
         Each stream is a dictionary with following information:
@@ -68,6 +111,16 @@ class MkvmergeController(ProgramController, AbstractMkvmergeController):
         - forced: `bool`, set or unset the forced flag
         - name: `str`, name of the stream
 
+        The command-line options are written into a JSON file, next to the
+        Matroska file (e.g., ``movie.mkvmerge.json`` for ``movie.mkv``), and
+        given to Mkvmerge with the ``@options.json`` syntax. This way, the
+        command-line never exceeds the system's limits, even with a lot of
+        streams and attachments, and the remux can be reproduced later.
+
+        If the controller hashes its outputs, the Matroska file is hashed while
+        being written, and its checksums are written next to it (e.g.,
+        ``movie.checksums.json`` for ``movie.mkv``).
+
         Additionally, attachments (i.e., cover arts) can be embedded inside the
         Matroska file. They must have the following details:
         - type: `str`, mime-type of the attachment, as defined by the IANA
@@ -82,6 +135,11 @@ class MkvmergeController(ProgramController, AbstractMkvmergeController):
         :param str title: title of the Matroska file (e.g., movie name)
         :param attachments: list of dictionaries, covert arts to embed in the
                             Matroska file
+        :param str segment_uid: UID of the Matroska segment, as 32 hexadecimal
+                                digits. Needed to reference the Matroska file
+                                from other ones (see
+                                :meth:`.write_ordered_chapters`). Randomly
+                                generated by Mkvmerge if not set
         :raises AssertionError: if ``input_streams`` is empty
         """
         assert input_streams, \
@@ -89,13 +147,15 @@ class MkvmergeController(ProgramController, AbstractMkvmergeController):
 
         # Command-line options for Mkvmerge must be ordered in a specific way.
         # Global options are defined at first.
-        mkvmerge_commandline = [
-            self.executable_path,
+        mkvmerge_options = [
             '--output', output_file_path,
             '--title', title or '']
 
+        if segment_uid:
+            mkvmerge_options.extend(['--segment-uid', segment_uid])
+
         if attachments:
-            mkvmerge_commandline.extend(self._add_attachments(attachments))
+            mkvmerge_options.extend(self._add_attachments(attachments))
 
         # Streams' options are grouped together, according to their source
         # file, and their original order is memorized. They will be added
@@ -104,16 +164,447 @@ class MkvmergeController(ProgramController, AbstractMkvmergeController):
             self._group_input_streams_by_source_file(input_streams)
 
         # Streams' order belongs also to global options.
-        mkvmerge_commandline.extend(self._set_streams_order(streams_order))
+        mkvmerge_options.extend(self._set_streams_order(streams_order))
 
         # Options related to input streams are at last added to the
         # command-line.
         for (source_file_id, (source_file_path, streams)) in enumerate(grouped_streams.items()):  # noqa
-            mkvmerge_commandline.extend(
+            mkvmerge_options.extend(
                 self._add_streams(source_file_id, source_file_path, streams))
 
         # And the complete command-line is executed.
-        subprocess.check_call(mkvmerge_commandline)
+        options_file_path =\
+            self._write_options_file(output_file_path, mkvmerge_options)
+        with self._limit_io(*grouped_streams):
+            self._run_writer(
+                output_file_path, options_file_path,
+                get_media_duration(grouped_streams))
+
+    def write_chunked(
+            self, output_file_path, input_streams, title=None,
+            attachments=None, segment_uid=None, max_workers=None):
+        """Remux a Blu-ray playlist into a Matroska file, like
+        :meth:`.write`, but with several Mkvmerge processes at once.
+
+        A single Mkvmerge process is limited by the CPU, well below the
+        bandwidth of fast drives. The playlist is thus split at its play items
+        (i.e., clips), which are remuxed concurrently into temporary Matroska
+        files (e.g., ``movie.part-001.mkv`` for ``movie.mkv``). They are then
+        joined with Mkvmerge's append mode, along with the playlist's
+        chapters. The Matroska file has the same streams, and chapters at
+        the same times, as with :meth:`.write`. Chapters are named
+        generically though (e.g., "Chapter 01"), and their names and
+        languages may differ from the ones Mkvmerge gives them in a single
+        pass.
+
+        Chunks, and the chapters' XML file, are removed once joined.
+
+        Streams must all belong to the same playlist file. Playlists which
+        cannot be split this way (e.g., with a single play item, several
+        angles, or sub-paths like 3D video) are remuxed by :meth:`.write`.
+
+        :param str output_file_path: the Matroska file's path
+        :param input_streams: list of dictionaries, streams to remux into the
+                              Matroska file, as expected by :meth:`.write`
+        :param str title: title of the Matroska file (e.g., movie name)
+        :param attachments: list of dictionaries, covert arts to embed in the
+                            Matroska file, as expected by :meth:`.write`
+        :param str segment_uid: UID of the Matroska segment, as expected by
+                                :meth:`.write`
+        :param int max_workers: maximum number of Mkvmerge processes at once.
+                                Defaults to the number of CPUs
+        :raises AssertionError: if ``input_streams`` is empty
+        """
+        assert input_streams, \
+            "The 'input_streams' argument cannot be an empty list"
+
+        playlist_chunks =\
+            self._get_playlist_chunks(output_file_path, input_streams)
+        if playlist_chunks is None:
+            self.write(
+                output_file_path, input_streams, title=title,
+                attachments=attachments, segment_uid=segment_uid)
+            return
+
+        (chunks, chapters) = playlist_chunks
+        chunk_file_paths = [
+            chunk['output_file_path'] for chunk in chunks]
+        try:
+            with ThreadPoolExecutor(
+                    max_workers or os.cpu_count() or 1) as executor:
+                # Consume results, for errors to be raised.
+                list(executor.map(self._write_chunk, chunks))
+
+            self._append_chunks(
+                output_file_path, chunk_file_paths, chapters, title,
+                attachments, segment_uid,
+                get_media_duration(
+                    stream['file_path'] for stream in input_streams))
+        finally:
+            temporary_file_paths = [
+                self.get_chapters_file_path(output_file_path)]
+            for chunk_file_path in chunk_file_paths:
+                temporary_file_paths.extend([
+                    chunk_file_path,
+                    self.get_options_file_path(chunk_file_path)])
+
+            for file_path in temporary_file_paths:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+    def _get_playlist_chunks(self, output_file_path, input_streams):
+        """Return the chunks of a playlist to remux concurrently, and the
+        playlist's chapters, or `None` if the playlist cannot be split at its
+        play items.
+
+        Each chunk is a dictionary with the following keys:
+        - output_file_path: `str`, path of the chunk's Matroska file
+        - input_streams: `list`, streams of the chunk's clip, as expected by
+                         :meth:`.write`
+        - split: `str`, value of Mkvmerge's ``--split`` option keeping only
+                 the played part of the clip, or `None` if the whole clip is
+                 played
+        Chapters are as expected by :meth:`._write_chapters_file`.
+        """
+        source_file_paths = {stream['file_path'] for stream in input_streams}
+        if len(source_file_paths) != 1:
+            return None
+
+        playlist_path = Path(source_file_paths.pop())
+        if playlist_path.suffix.lower() != '.mpls':
+            return None
+
+        playlist = mpls.parse_playlist_file(playlist_path)
+        play_items = playlist['play_items']
+        if (len(play_items) < 2 or playlist['sub_paths'] or
+                any(item['angle_clip_names'] for item in play_items)):
+            return None
+
+        # Streams are matched between the playlist and its clips by their
+        # PID.
+        streams_pids = {
+            track['id']: track['properties']['ts_pid']
+            for track in self.get_file_info(str(playlist_path))['tracks']}
+
+        disc_path = playlist_path.parent.parent
+        output_path = Path(output_file_path)
+
+        chunks = list()
+        for (play_item_index, play_item) in enumerate(play_items, start=1):
+            clip_path = disc_path.joinpath(
+                'STREAM', '{}.m2ts'.format(play_item['clip_name']))
+            clip_information = clpi.parse_clip_information_file(
+                disc_path.joinpath(
+                    'CLIPINF', '{}.clpi'.format(play_item['clip_name'])))
+
+            clip_tracks = dict()
+            for track in self.get_file_info(str(clip_path))['tracks']:
+                clip_tracks.setdefault(
+                    track['properties']['ts_pid'], track['id'])
+
+            chunk_streams = list()
+            for stream in input_streams:
+                try:
+                    clip_track_id = clip_tracks[streams_pids[stream['id']]]
+                except KeyError:
+                    # A stream is missing from a clip.
+                    return None
+
+                chunk_stream = stream.copy()
+                chunk_stream['file_path'] = str(clip_path)
+                chunk_stream['id'] = clip_track_id
+                chunk_streams.append(chunk_stream)
+
+            chunks.append({
+                'output_file_path': str(output_path.with_name(
+                    '{}.part-{:03d}{}'.format(
+                        output_path.stem, play_item_index,
+                        output_path.suffix))),
+                'input_streams': chunk_streams,
+                'split': self._get_play_item_split(
+                    play_item, clip_information)})
+
+        return (chunks, self._get_playlist_chapters(playlist))
+
+    @classmethod
+    def _get_play_item_split(cls, play_item, clip_information):
+        """Return the value of Mkvmerge's ``--split`` option keeping only
+        the played part of a clip, or `None` if the whole clip is played."""
+        clip_start = clip_information['presentation_start_time']
+        clip_end = clip_information['presentation_end_time']
+        if (play_item['in_time'] <= clip_start and
+                play_item['out_time'] >= clip_end):
+            return None
+
+        return 'parts:{}-{}'.format(
+            cls._format_timestamp(cls._ticks_to_nanoseconds(
+                play_item['in_time'] - clip_start)),
+            cls._format_timestamp(cls._ticks_to_nanoseconds(
+                play_item['out_time'] - clip_start)))
+
+    @classmethod
+    def _get_playlist_chapters(cls, playlist):
+        """Return chapters of a playlist, i.e., its entry marks, with their
+        start relatively to the beginning of the playlist."""
+        play_items_starts = [0]
+        for play_item in playlist['play_items']:
+            play_items_starts.append(
+                play_items_starts[-1] +
+                play_item['out_time'] - play_item['in_time'])
+
+        chapters = list()
+        for mark in playlist['marks']:
+            if mark['type'] != mpls.ENTRY_MARK_TYPE:
+                continue
+
+            play_item = playlist['play_items'][mark['play_item']]
+            chapters.append({'start': cls._ticks_to_nanoseconds(
+                play_items_starts[mark['play_item']] +
+                mark['time'] - play_item['in_time'])})
+
+        return sorted(chapters, key=lambda chapter: chapter['start'])
+
+    @staticmethod
+    def _ticks_to_nanoseconds(ticks):
+        """Convert a duration from playlists' ticks to nanoseconds."""
+        return max(0, ticks) * 10 ** 9 // mpls.TICKS_PER_SECOND
+
+    def _write_chunk(self, chunk):
+        """Remux a chunk of a playlist into its own Matroska file."""
+        (grouped_streams, streams_order) =\
+            self._group_input_streams_by_source_file(chunk['input_streams'])
+
+        mkvmerge_options = ['--output', chunk['output_file_path']]
+        if chunk['split'] is not None:
+            mkvmerge_options.extend(['--split', chunk['split']])
+        mkvmerge_options.extend(self._set_streams_order(streams_order))
+        for (source_file_id, (source_file_path, streams)) in enumerate(grouped_streams.items()):  # noqa
+            mkvmerge_options.extend(
+                self._add_streams(source_file_id, source_file_path, streams))
+
+        options_file_path = self._write_options_file(
+            chunk['output_file_path'], mkvmerge_options)
+        with self._limit_io(*grouped_streams):
+            self._run(
+                [self.executable_path, '@{}'.format(options_file_path)],
+                get_media_duration(grouped_streams), capture_output=False)
+
+        if chunk['split'] is not None:
+            self._rename_split_file(chunk['output_file_path'])
+
+    @staticmethod
+    def _rename_split_file(output_file_path):
+        """Give back its name to a Matroska file split in a single part.
+
+        Mkvmerge numbers the files it splits, even when there is only one.
+        """
+        split_file_path = Path(output_file_path)
+        split_file_path = split_file_path.with_name('{}-001{}'.format(
+            split_file_path.stem, split_file_path.suffix))
+        if split_file_path.exists():
+            os.replace(str(split_file_path), output_file_path)
+
+    def _append_chunks(
+            self, output_file_path, chunk_file_paths, chapters, title,
+            attachments, segment_uid, media_duration):
+        """Join the Matroska files of a playlist's chunks."""
+        mkvmerge_options = [
+            '--output', output_file_path,
+            '--title', title or '']
+
+        if segment_uid:
+            mkvmerge_options.extend(['--segment-uid', segment_uid])
+
+        if attachments:
+            mkvmerge_options.extend(self._add_attachments(attachments))
+
+        if chapters:
+            chapters_file_path = self.get_chapters_file_path(output_file_path)
+            self._write_chapters_file(
+                chapters_file_path, chapters, ordered=False)
+            mkvmerge_options.extend(['--chapters', chapters_file_path])
+
+        mkvmerge_options.append(chunk_file_paths[0])
+        for chunk_file_path in chunk_file_paths[1:]:
+            mkvmerge_options.extend(['+', chunk_file_path])
+
+        options_file_path =\
+            self._write_options_file(output_file_path, mkvmerge_options)
+        self._run_writer(output_file_path, options_file_path, media_duration)
+
+    def write_ordered_chapters(
+            self, output_file_path, chapters, input_streams, title=None,
+            attachments=None):
+        """Write a Matroska file made of ordered chapters linking parts of
+        other Matroska files (aka linked segments).
+
+        Media players supporting ordered chapters play the linked parts one
+        after another, as if they were a single file. Linked Matroska files
+        must be in the same directory. This way, parts shared by several
+        Matroska files (e.g., theatrical and extended cuts of a movie) are
+        only stored once.
+
+        Each chapter is a dictionary with the following information:
+        - segment_uid: `str`, UID of the linked Matroska file's segment, as
+                       32 hexadecimal digits
+        - start: `int`, start of the linked part, in nanoseconds
+        - end: `int`, end of the linked part, in nanoseconds
+
+        Mkvmerge needs input files, and media players take the tracks'
+        layout from the file itself: the file thus carries the streams of the
+        first linked segment, as expected by :meth:`.write`. Only their
+        first second is muxed (see :data:`LINKING_PART`), which is never
+        played, as all the chapters link other files.
+
+        Chapters are written into a XML file, next to the Matroska file (e.g.,
+        ``movie.chapters.xml`` for ``movie.mkv``), which is given to Mkvmerge
+        like with :meth:`.write`.
+
+        :param str output_file_path: the Matroska file's path
+        :param chapters: list of dictionaries, parts of other Matroska files
+                         to link
+        :param input_streams: list of dictionaries, streams of the first
+                              linked segment
+        :param str title: title of the Matroska file (e.g., movie name)
+        :param attachments: list of dictionaries, covert arts to embed in the
+                            Matroska file, as expected by :meth:`.write`
+        :raises AssertionError: if ``chapters`` or ``input_streams`` is
+                                empty
+        """
+        assert chapters, "The 'chapters' argument cannot be an empty list"
+        assert input_streams, \
+            "The 'input_streams' argument cannot be an empty list"
+
+        chapters_file_path = self.get_chapters_file_path(output_file_path)
+        self._write_chapters_file(chapters_file_path, chapters)
+
+        mkvmerge_options = [
+            '--output', output_file_path,
+            '--title', title or '']
+
+        if attachments:
+            mkvmerge_options.extend(self._add_attachments(attachments))
+
+        mkvmerge_options.extend([
+            '--chapters', chapters_file_path,
+            '--split', 'parts:{}'.format(LINKING_PART)])
+
+        (grouped_streams, streams_order) =\
+            self._group_input_streams_by_source_file(input_streams)
+        mkvmerge_options.extend(self._set_streams_order(streams_order))
+        for (source_file_id, (source_file_path, streams)) in enumerate(grouped_streams.items()):  # noqa
+            mkvmerge_options.extend(
+                self._add_streams(source_file_id, source_file_path, streams))
+
+        options_file_path =\
+            self._write_options_file(output_file_path, mkvmerge_options)
+        # Only the linked part is read: the file is written at once.
+        with self._limit_io(*grouped_streams):
+            self._run(
+                [self.executable_path, '@{}'.format(options_file_path)], 0,
+                capture_output=False)
+
+        self._rename_split_file(output_file_path)
+        # The file is too small to be worth hashing while being written.
+        if self.hash_outputs:
+            write_checksums_file(
+                output_file_path, get_file_checksums(output_file_path))
+
+    def _run_writer(self, output_file_path, options_file_path, media_duration):
+        """Run Mkvmerge to write a Matroska file, and hash the file meanwhile
+        if requested."""
+        command = [self.executable_path, '@{}'.format(options_file_path)]
+        if not self.hash_outputs:
+            self._run(command, media_duration, capture_output=False)
+            return
+
+        # Remove the previous file first, so that it is not hashed before
+        # being overwritten by Mkvmerge.
+        try:
+            os.remove(output_file_path)
+        except FileNotFoundError:
+            pass
+
+        hasher = GrowingFileHasher(output_file_path)
+        try:
+            self._run(
+                command, media_duration, capture_output=False,
+                on_poll=hasher.update, poll_interval=HASH_POLL_INTERVAL)
+            write_checksums_file(output_file_path, hasher.finish())
+        finally:
+            hasher.close()
+
+    @staticmethod
+    def get_chapters_file_path(output_file_path):
+        """Return the path of the XML file where ordered chapters are written,
+        when writing them into a Matroska file.
+
+        :param str output_file_path: the Matroska file's path
+        :rtype: str
+        """
+        return str(Path(output_file_path).with_suffix('.chapters.xml'))
+
+    @classmethod
+    def _write_chapters_file(cls, chapters_file_path, chapters, ordered=True):
+        """Write chapters into a XML file, in Mkvmerge's format.
+
+        Chapters' ends and segments' UIDs are optional, as only ordered
+        chapters need them.
+        """
+        root = ElementTree.Element('Chapters')
+        edition = ElementTree.SubElement(root, 'EditionEntry')
+        ElementTree.SubElement(edition, 'EditionFlagDefault').text = '1'
+        if ordered:
+            ElementTree.SubElement(edition, 'EditionFlagOrdered').text = '1'
+
+        for (chapter_number, chapter) in enumerate(chapters, start=1):
+            atom = ElementTree.SubElement(edition, 'ChapterAtom')
+            ElementTree.SubElement(atom, 'ChapterTimeStart').text =\
+                cls._format_timestamp(chapter['start'])
+            if 'end' in chapter:
+                ElementTree.SubElement(atom, 'ChapterTimeEnd').text =\
+                    cls._format_timestamp(chapter['end'])
+            if 'segment_uid' in chapter:
+                ElementTree.SubElement(
+                    atom, 'ChapterSegmentUID', format='hex').text =\
+                    chapter['segment_uid']
+
+            display = ElementTree.SubElement(atom, 'ChapterDisplay')
+            ElementTree.SubElement(display, 'ChapterString').text =\
+                'Chapter {:02d}'.format(chapter_number)
+
+        with open(chapters_file_path, 'wb') as chapters_file:
+            chapters_file.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+            chapters_file.write(ElementTree.tostring(root, encoding='utf-8'))
+
+    @staticmethod
+    def _format_timestamp(nanoseconds):
+        """Format a timestamp like ``HH:MM:SS.nnnnnnnnn``."""
+        (seconds, nanoseconds) = divmod(nanoseconds, 10 ** 9)
+        (minutes, seconds) = divmod(seconds, 60)
+        (hours, minutes) = divmod(minutes, 60)
+        return '{:02d}:{:02d}:{:02d}.{:09d}'.format(
+            hours, minutes, seconds, nanoseconds)
+
+    @staticmethod
+    def get_options_file_path(output_file_path):
+        """Return the path of the JSON file where Mkvmerge's options are
+        written, when remuxing streams into a Matroska file.
+
+        :param str output_file_path: the Matroska file's path
+        :rtype: str
+        """
+        return str(Path(output_file_path).with_suffix('.mkvmerge.json'))
+
+    def _write_options_file(self, output_file_path, mkvmerge_options):
+        """Write Mkvmerge's options into a JSON file, and return its
+        path."""
+        options_file_path = self.get_options_file_path(output_file_path)
+
+        with open(options_file_path, 'w') as options_file:
+            json.dump(mkvmerge_options, options_file, indent=2)
+
+        return options_file_path
 
     @staticmethod
     def _group_input_streams_by_source_file(input_streams):
@@ -121,14 +612,15 @@ class MkvmergeController(ProgramController, AbstractMkvmergeController):
         order."""
         streams_order = []
         grouped_streams = OrderedDict()
+        source_files_ids = dict()
 
         for stream in input_streams:
-            source_files = list(grouped_streams.keys())
             source_file_path = stream['file_path']
             try:
-                source_file_id = source_files.index(source_file_path)
-            except ValueError:
-                source_file_id = len(source_files)
+                source_file_id = source_files_ids[source_file_path]
+            except KeyError:
+                source_file_id = len(source_files_ids)
+                source_files_ids[source_file_path] = source_file_id
                 grouped_streams[source_file_path] = list()
 
             streams_order.append((source_file_id, stream['id']))
@@ -0,0 +1,177 @@
+"""Parser of Blu-ray playlist files (``BDMV/PLAYLIST/*.mpls``).
+
+Only the parts of the format needed to know which clips are played, and
+when, are decoded: play items (with their angles), sub-paths and marks.
+"""
+
+import struct
+
+
+#: Frequency of the clock used by playlists' timestamps.
+TICKS_PER_SECOND = 45000
+
+#: Type of marks used as chapters.
+ENTRY_MARK_TYPE = 1
+
+
+class PlaylistFileError(ValueError):
+    """Raised when a playlist file cannot be parsed."""
+
+
+def parse_playlist_file(file_path):
+    """Parse a Blu-ray playlist file.
+
+    The returned dictionary has the following keys:
+    - play_items: list of play items, in play order. Each play item is a
+      dictionary with the following keys:
+      - clip_name: `str`, name of the played clip (e.g., "00001"), without
+                   file extension
+      - in_time: `int`, start of the played part of the clip, in
+                 :data:`TICKS_PER_SECOND` ticks
+      - out_time: `int`, end of the played part of the clip, in
+                  :data:`TICKS_PER_SECOND` ticks
+      - connection_condition: `int`, how the play item is connected to the
+                              previous one (5 or 6 for seamless connections)
+      - angle_clip_names: list of `str`, names of the clips played by other
+                          angles, if any
+    - sub_paths: list of sub-paths (e.g., 3D video or secondary audio).
+      Each sub-path is a dictionary with the following keys:
+      - type: `int`, type of the sub-path
+      - clip_names: list of `str`, names of the clips played by the sub-path
+    - marks: list of marks. Each mark is a dictionary with the following
+      keys:
+      - type: `int`, type of the mark (:data:`ENTRY_MARK_TYPE` for chapters)
+      - play_item: `int`, index of the play item containing the mark
+      - time: `int`, timestamp of the mark in the play item's clip, in
+              :data:`TICKS_PER_SECOND` ticks
+
+    :param str file_path: path of the playlist file
+    :rtype: dict
+    :raises PlaylistFileError: if the file is not a valid playlist file
+    """
+    with open(str(file_path), 'rb') as playlist_file:
+        data = playlist_file.read()
+
+    try:
+        return parse_playlist(data)
+    except struct.error as exc:
+        raise PlaylistFileError(
+            "{} is truncated: {}".format(file_path, exc)) from exc
+
+
+def parse_playlist(data):
+    """Parse the content of a Blu-ray playlist file.
+
+    See :func:`parse_playlist_file` for the returned details.
+
+    :param bytes data: content of the playlist file
+    :rtype: dict
+    :raises PlaylistFileError: if the content is not a valid playlist
+    :raises struct.error: if the content is truncated
+    """
+    if data[:4] != b'MPLS':
+        raise PlaylistFileError("Missing MPLS signature")
+
+    (playlist_address, marks_address) = struct.unpack_from('>II', data, 8)
+
+    (play_items, sub_paths) = _parse_playlist_section(data, playlist_address)
+    marks = _parse_marks_section(data, marks_address)
+
+    return {
+        'play_items': play_items,
+        'sub_paths': sub_paths,
+        'marks': marks}
+
+
+def get_clip_names(playlist):
+    """Return names of all the clips a playlist plays, including other angles
+    and sub-paths.
+
+    :param dict playlist: as returned by :func:`parse_playlist`
+    :rtype: set
+    """
+    clip_names = set()
+    for play_item in playlist['play_items']:
+        clip_names.add(play_item['clip_name'])
+        clip_names.update(play_item['angle_clip_names'])
+    for sub_path in playlist['sub_paths']:
+        clip_names.update(sub_path['clip_names'])
+
+    return clip_names
+
+
+def _parse_playlist_section(data, address):
+    """Return play items and sub-paths of a playlist."""
+    (play_items_count, sub_paths_count) =\
+        struct.unpack_from('>HH', data, address + 6)
+
+    play_items = list()
+    offset = address + 10
+    for _ in range(play_items_count):
+        (length,) = struct.unpack_from('>H', data, offset)
+        play_items.append(_parse_play_item(data, offset + 2))
+        offset += 2 + length
+
+    sub_paths = list()
+    for _ in range(sub_paths_count):
+        (length,) = struct.unpack_from('>I', data, offset)
+        sub_paths.append(_parse_sub_path(data, offset + 4))
+        offset += 4 + length
+
+    return (play_items, sub_paths)
+
+
+def _parse_play_item(data, offset):
+    """Return details of a play item."""
+    clip_name = data[offset:offset + 5].decode('ascii')
+    (flags, _, in_time, out_time) =\
+        struct.unpack_from('>HBII', data, offset + 9)
+
+    is_multi_angle = bool(flags & 0x10)
+    connection_condition = flags & 0x0f
+
+    angle_clip_names = list()
+    if is_multi_angle:
+        (angles_count,) = struct.unpack_from('>B', data, offset + 32)
+        angle_offset = offset + 34
+        # The first angle is the play item's clip itself.
+        for _ in range(angles_count - 1):
+            angle_clip_names.append(
+                data[angle_offset:angle_offset + 5].decode('ascii'))
+            angle_offset += 10
+
+    return {
+        'clip_name': clip_name,
+        'in_time': in_time,
+        'out_time': out_time,
+        'connection_condition': connection_condition,
+        'angle_clip_names': angle_clip_names}
+
+
+def _parse_sub_path(data, offset):
+    """Return details of a sub-path."""
+    (sub_path_type,) = struct.unpack_from('>B', data, offset + 1)
+    (sub_play_items_count,) = struct.unpack_from('>B', data, offset + 5)
+
+    clip_names = list()
+    sub_play_item_offset = offset + 6
+    for _ in range(sub_play_items_count):
+        (length,) = struct.unpack_from('>H', data, sub_play_item_offset)
+        start = sub_play_item_offset + 2
+        clip_names.append(data[start:start + 5].decode('ascii'))
+        sub_play_item_offset += 2 + length
+
+    return {'type': sub_path_type, 'clip_names': clip_names}
+
+
+def _parse_marks_section(data, address):
+    """Return marks of a playlist."""
+    (marks_count,) = struct.unpack_from('>H', data, address + 4)
+
+    marks = list()
+    for mark_index in range(marks_count):
+        (mark_type, play_item, time) = struct.unpack_from(
+            '>xBHI', data, address + 6 + 14 * mark_index)
+        marks.append({'type': mark_type, 'play_item': play_item, 'time': time})
+
+    return marks
@@ -0,0 +1,1061 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
+import json
+import os
+from pathlib import Path, PurePath
+import time
+import uuid
+
+from . import ProgramController, helpers
+from .bluray import STREAMS_RELATIVE_PATH
+from .matroska import verify_matroska_file
+from .transfer import move_file, remove_stale_partial_files
+
+
+#: Version of the serialized conversion plans' format.
+PLAN_FORMAT_VERSION = 1
+
+#: Version of the checkpoint manifests' format.
+CHECKPOINT_FORMAT_VERSION = 1
+
+#: Suffixes of the files written next to Matroska files (e.g., Mkvmerge's
+#: options, or checksums), moved along with them from a scratch directory.
+SIDECAR_FILE_SUFFIXES = ('.mkvmerge.json', '.chapters.xml', '.checksums.json')
+
+#: Keys of the plan's tracks which are not given to Mkvmerge.
+PLAN_ONLY_TRACK_KEYS = ('bitrate', 'source')
+
+#: Language codes of audio tracks which are always kept: multi-languages
+#: tracks, as it is not possible to know which languages they contain, and
+#: tracks with undetermined language.
+ALWAYS_KEPT_AUDIO_LANGUAGES = ["mis", "mul", "und"]
+
+
+class ConversionPlanError(ValueError):
+    """Raised when a conversion plan cannot be made or loaded."""
+
+
+class ConversionPlan:
+    """Conversion plan of a Blu-ray disc to Matroska files.
+
+    A plan describes everything needed to remux a disc, without the need to
+    analyze it again: Matroska files to write, tracks to keep with their
+    flags, attachments, etc. Plans can be serialized to JSON, in order to be
+    reviewed or executed later, on another host, by a
+    :class:`.ConversionPlanExecutor`.
+
+    Paths of the tracks' sources and attachments are relative to the disc's
+    path, so that the disc can be moved (or mounted elsewhere) before
+    executing the plan.
+
+    Each output (i.e., Matroska file to write) is a dictionary with the
+    following keys:
+    - playlist_number: `int`, number of the converted playlist
+    - file_name: `str`, name of the Matroska file
+    - title: `str`, title of the Matroska file
+    - tracks: list of tracks to remux, as expected by
+      :meth:`~blu_mkv.mkvmerge.MkvmergeController.write`, except that their
+      source is given by a ``source`` key, relative to the disc's path,
+      instead of ``file_path``. When the disc's streams have been scanned,
+      tracks also have a ``bitrate``, in bits per second
+    - dropped_tracks: list of identifiers of the tracks dropped because their
+      bitrate was too low (e.g., silent placeholder tracks)
+    - attachments: list of attachments to embed, as expected by
+      :meth:`~blu_mkv.mkvmerge.MkvmergeController.write`, except that their
+      source is given by a ``source`` key, relative to the disc's path,
+      instead of ``path``
+    - estimated_size: `int`, estimated size of the Matroska file in bytes
+    - chapters: only for linked segments (see below), ordered chapters
+      linking the segments played by the playlist, as expected by
+      :meth:`~blu_mkv.mkvmerge.MkvmergeController.write_ordered_chapters`
+
+    With linked segments, each clip played by the converted playlists is
+    remuxed once, into its own Matroska file (aka segment). Outputs are then
+    made of ordered chapters referencing parts of these segments, and only
+    carry the tracks of their first segment: their own tracks are only listed
+    for information. Each segment is a
+    dictionary with the following keys:
+    - clip_name: `str`, name of the remuxed clip
+    - file_name: `str`, name of the segment's Matroska file
+    - segment_uid: `str`, UID of the segment, as 32 hexadecimal digits
+    - tracks: list of the clip's tracks to remux, like outputs' tracks
+    - estimated_size: `int`, estimated size of the segment in bytes
+
+    :param str disc_path: path of the disc (directory or disk image)
+    :param str dst_dir: directory where to write the Matroska files
+    :param list outputs: Matroska files to write
+    :param list skipped_playlists: movie playlists which are not converted,
+                                   as dictionaries with ``playlist_number``
+                                   and ``reason`` keys
+    :param list segments: Matroska files to write for linked segments, before
+                          the outputs
+    """
+    def __init__(
+            self, disc_path, dst_dir, outputs, skipped_playlists=None,
+            segments=None):
+        self.disc_path = disc_path
+        self.dst_dir = dst_dir
+        self.outputs = outputs
+        self.skipped_playlists = skipped_playlists or []
+        self.segments = segments or []
+
+    def __eq__(self, other):
+        return self.to_dict() == other.to_dict()
+
+    @property
+    def estimated_size(self):
+        """Return the estimated size in bytes of all the Matroska files.
+
+        :rtype: int
+        """
+        return (
+            sum(output['estimated_size'] for output in self.outputs) +
+            sum(segment['estimated_size'] for segment in self.segments))
+
+    @classmethod
+    def from_disc(
+            cls, bluray_disc, title, dst_dir, disc_path=None,
+            playlists_count=1, audio_languages=None, subtitle_languages=None,
+            forced_subtitle_names=None, skip_multiview=False,
+            min_bitrate=None, linked_segments=False):
+        """Analyze a Blu-ray disc and make a plan to convert all its movie
+        playlists (not bonuses).
+
+        :param bluray_disc: instance of :class:`~blu_mkv.bluray.BlurayDisc`
+        :param str title: movie title, used for the Matroska files' titles and
+                          names
+        :param str dst_dir: directory where to write the Matroska files
+        :param str disc_path: path under which the disc is recorded. Defaults
+                              to the disc's path, but should be set to the
+                              disk image's path for mounted disk images
+        :param int playlists_count: maximum number of movie playlists to
+                                    convert. If set to 0, all movie playlists
+                                    are converted
+        :param list audio_languages: language codes of audio tracks to keep.
+            See :data:`ALWAYS_KEPT_AUDIO_LANGUAGES` for tracks always kept.
+            All audio tracks are kept if not set
+        :param list subtitle_languages: language codes of subtitle tracks to
+                                        keep. All subtitle tracks are kept if
+                                        not set
+        :param str forced_subtitle_names: name given to forced subtitle
+                                          tracks
+        :param bool skip_multiview: do not convert playlists with multiview
+                                    tracks (like 3D video tracks)
+        :param float min_bitrate: if set, the playlists' streams are scanned,
+                                  and audio and subtitle tracks with a lower
+                                  bitrate (in bits per second) are dropped.
+                                  Requires NumPy
+        :param bool linked_segments: remux each clip only once, and link clips
+                                     together with ordered chapters. Saves a
+                                     lot of space when playlists share clips
+                                     (e.g., theatrical and extended cuts)
+        :rtype: instance of :class:`.ConversionPlan`
+        :raises ConversionPlanError: if the disc has more movie playlists than
+                                     ``playlists_count``
+        """
+        movie_playlists = bluray_disc.get_movie_playlists()
+        movie_playlists_count = len(movie_playlists)
+
+        if playlists_count and movie_playlists_count > playlists_count:
+            raise ConversionPlanError(
+                "Only {} playlist(s) can be converted, but {} movie "
+                "playlist(s) have been found".format(
+                    playlists_count, movie_playlists_count))
+
+        # Only the biggest disc cover is kept.
+        cover_art = bluray_disc.get_biggest_cover()
+        if cover_art is not None:
+            attachments = [{
+                'type': 'jpeg',
+                'name': 'cover.jpg',
+                'source': cls._get_relative_path(
+                    bluray_disc, cover_art['path'])}]
+        else:
+            attachments = []
+
+        outputs = list()
+        skipped_playlists = list()
+        segments = OrderedDict()
+        for (playlist_count, playlist) in enumerate(movie_playlists, start=1):
+            if skip_multiview and playlist.has_multiview():
+                skipped_playlists.append({
+                    'playlist_number': playlist.number,
+                    'reason': "conversion of 3D playlists is currently not "
+                              "supported"})
+                continue
+
+            if movie_playlists_count > 1:
+                file_name = "{} - {}.mkv".format(title, playlist_count)
+            else:
+                file_name = "{}.mkv".format(title)
+
+            tracks = cls._select_tracks(
+                bluray_disc, playlist, audio_languages, subtitle_languages,
+                forced_subtitle_names)
+            dropped_tracks = list()
+
+            if min_bitrate is not None:
+                tracks_bitrates = playlist.get_tracks_bitrates()
+                for track in tracks:
+                    track['bitrate'] = tracks_bitrates[track['id']]
+
+                dropped_tracks = [
+                    track['id'] for track in tracks
+                    if track['type'] != 'video' and
+                    track['bitrate'] is not None and
+                    track['bitrate'] < min_bitrate]
+                tracks = [
+                    track for track in tracks
+                    if track['id'] not in dropped_tracks]
+
+            output = {
+                'playlist_number': playlist.number,
+                'file_name': file_name,
+                'title': title,
+                'tracks': tracks,
+                'dropped_tracks': dropped_tracks,
+                'attachments': attachments,
+                'estimated_size': playlist.size}
+
+            if linked_segments:
+                output['chapters'] = cls._link_segments(
+                    bluray_disc, playlist, title, tracks, segments)
+                # Ordered chapters only take a few kilobytes.
+                output['estimated_size'] = 0
+
+            outputs.append(output)
+
+        return cls(
+            disc_path=str(disc_path or bluray_disc.path),
+            dst_dir=str(dst_dir),
+            outputs=outputs,
+            skipped_playlists=skipped_playlists,
+            segments=list(segments.values()))
+
+    @staticmethod
+    def _get_relative_path(bluray_disc, file_path):
+        """Return the path of a disc's file, relatively to the disc."""
+        relative_path = PurePath(file_path).relative_to(str(bluray_disc.path))
+        return relative_path.as_posix()
+
+    @classmethod
+    def _link_segments(cls, bluray_disc, playlist, title, tracks, segments):
+        """Add the clips played by a playlist to the segments to remux, and
+        return ordered chapters linking them.
+
+        :param dict segments: segments already planned for other playlists,
+                              with clips' names as keys. Updated in place
+        :rtype: list
+        """
+        tracks_pids = playlist.get_tracks_pids()
+        chapters = list()
+
+        for part in playlist.segments:
+            clip_name = part['clip_name']
+            stream_path = PurePath(
+                bluray_disc.path, STREAMS_RELATIVE_PATH,
+                '{}.m2ts'.format(clip_name))
+
+            segment = segments.get(clip_name)
+            if segment is None:
+                try:
+                    estimated_size =\
+                        bluray_disc.bluray_analyzer.get_clip_size(
+                            bluray_disc.path, clip_name)
+                except OSError:
+                    estimated_size = 0
+
+                segment = segments[clip_name] = {
+                    'clip_name': clip_name,
+                    'file_name': "{} - {}.mkv".format(title, clip_name),
+                    'segment_uid': uuid.uuid4().hex,
+                    'tracks': [],
+                    'estimated_size': estimated_size}
+
+            # Tracks are matched by PID, as their identifiers in the clip
+            # differ from their identifiers in the playlist. Tracks only
+            # kept by other playlists sharing the clip are remuxed too.
+            clip_tracks = bluray_disc.bluray_analyzer.get_clip_tracks(
+                bluray_disc.path, clip_name)
+            remuxed_tracks = {track['id'] for track in segment['tracks']}
+            source = cls._get_relative_path(bluray_disc, stream_path)
+
+            for track in tracks:
+                clip_track_id = clip_tracks.get(tracks_pids[track['id']])
+                if clip_track_id is None or clip_track_id in remuxed_tracks:
+                    continue
+
+                remuxed_tracks.add(clip_track_id)
+                segment['tracks'].append({
+                    'source': source,
+                    'id': clip_track_id,
+                    'type': track['type'],
+                    'properties': track['properties'].copy()})
+
+            chapters.append({
+                'segment_uid': segment['segment_uid'],
+                'start': part['start'],
+                'end': part['end']})
+
+        return chapters
+
+    @classmethod
+    def _select_tracks(
+            cls, bluray_disc, playlist, audio_languages, subtitle_languages,
+            forced_subtitle_names):
+        """Return tracks of a playlist to remux, with their properties."""
+        source = cls._get_relative_path(bluray_disc, playlist.path)
+        tracks = []
+
+        # Video tracks are kept unchanged.
+        for (track_count, track_id) in enumerate(playlist.video_tracks):
+            tracks.append({
+                'source': source,
+                'id': track_id,
+                'type': 'video',
+                'properties': {
+                    'default': True if track_count == 0 else False}})
+
+        # Audio tracks are filtered/sorted by language.
+        audio_filters = dict()
+        if audio_languages:
+            audio_filters['language_code'] =\
+                ALWAYS_KEPT_AUDIO_LANGUAGES + list(audio_languages)
+
+        audio_tracks = helpers.filter_tracks(
+            playlist.audio_tracks, **audio_filters)
+        audio_tracks = helpers.sort_tracks(
+            audio_tracks, properties=['language_code'])
+
+        for track_id in audio_tracks:
+            tracks.append({
+                'source': source,
+                'id': track_id,
+                'type': 'audio',
+                'properties': {
+                    'default': False}})
+
+        # Subtitle tracks are filtered/sorted by language.
+        subtitle_filters = dict()
+        if subtitle_languages:
+            subtitle_filters['language_code'] = list(subtitle_languages)
+
+        subtitle_tracks = helpers.filter_tracks(
+            playlist.subtitle_tracks, **subtitle_filters)
+        subtitle_tracks = helpers.sort_tracks(
+            subtitle_tracks, properties=['language_code'])
+
+        # Forced subtitles are only identified among kept subtitles.
+        forced_subtitles_ids = set(
+            playlist.get_forced_subtitles(track_ids=list(subtitle_tracks)))
+
+        for track_id in subtitle_tracks:
+            if track_id in forced_subtitles_ids:
+                forced_flag = True
+                # Forced subtitles are tagged to be easily identified on
+                # media players which do not display forced flags.
+                track_name = forced_subtitle_names or ''
+            else:
+                forced_flag = False
+                track_name = ''
+
+            tracks.append({
+                'source': source,
+                'id': track_id,
+                'type': 'subtitle',
+                'properties': {
+                    'default': False,
+                    'forced': forced_flag,
+                    'name': track_name}})
+
+        return tracks
+
+    def get_forced_subtitles(self):
+        """Return the forced flags of the planned subtitle tracks.
+
+        Subtitle tracks dropped from the outputs are not listed.
+
+        :return: dictionaries of forced flags by track identifier, by
+                 playlist number
+        :rtype: dict
+        """
+        return {
+            output['playlist_number']: {
+                track['id']: track['properties']['forced']
+                for track in output['tracks'] if track['type'] == 'subtitle'}
+            for output in self.outputs}
+
+    def to_dict(self):
+        """Return the plan as a JSON-serializable dictionary.
+
+        :rtype: dict
+        """
+        return {
+            'version': PLAN_FORMAT_VERSION,
+            'disc_path': self.disc_path,
+            'dst_dir': self.dst_dir,
+            'outputs': self.outputs,
+            'skipped_playlists': self.skipped_playlists,
+            'segments': self.segments}
+
+    @classmethod
+    def from_dict(cls, plan):
+        """Return a plan from its dictionary representation.
+
+        :param dict plan: as returned by :meth:`to_dict`
+        :rtype: instance of :class:`.ConversionPlan`
+        :raises ConversionPlanError: if the plan's format is not supported
+        """
+        if plan.get('version') != PLAN_FORMAT_VERSION:
+            raise ConversionPlanError(
+                "Unsupported conversion plan version: {}"
+                .format(plan.get('version')))
+
+        return cls(
+            disc_path=plan['disc_path'],
+            dst_dir=plan['dst_dir'],
+            outputs=plan['outputs'],
+            skipped_playlists=plan['skipped_playlists'],
+            segments=plan.get('segments'))
+
+    def save(self, file_path):
+        """Save the plan to a JSON file.
+
+        :param str file_path: path of the JSON file
+        """
+        with open(str(file_path), 'w') as plan_file:
+            json.dump(self.to_dict(), plan_file, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, file_path):
+        """Load a plan from a JSON file.
+
+        :param str file_path: path of the JSON file
+        :rtype: instance of :class:`.ConversionPlan`
+        :raises ConversionPlanError: if the plan's format is not supported
+        """
+        with open(str(file_path)) as plan_file:
+            return cls.from_dict(json.load(plan_file))
+
+
+class ConversionCheckpoint:
+    """Manifest of the Matroska files of a conversion plan already written,
+    so that an interrupted conversion can be resumed.
+
+    The manifest records the plan itself, so that the disc does not need to
+    be analyzed again, and the size of each written file. On resume, a file
+    is only skipped if it still has this size, and is a complete Matroska
+    file with the planned number of tracks (see
+    :func:`~blu_mkv.matroska.verify_matroska_file`): truncated files are
+    written again.
+
+    The manifest is saved after each written file, by replacing it
+    atomically, so that it is never left half written.
+
+    :param str manifest_path: path of the JSON manifest
+    :param plan: instance of :class:`.ConversionPlan`
+    :param dict completed: sizes in bytes of the written files, by file name
+    """
+    def __init__(self, manifest_path, plan, completed=None):
+        self.manifest_path = str(manifest_path)
+        self.plan = plan
+        self.completed = completed or dict()
+
+    @classmethod
+    def load(cls, manifest_path):
+        """Load a checkpoint manifest.
+
+        :param str manifest_path: path of the JSON manifest
+        :rtype: instance of :class:`.ConversionCheckpoint`
+        :raises ConversionPlanError: if the manifest's format is not
+                                     supported
+        :raises OSError: if the manifest cannot be read
+        """
+        with open(str(manifest_path)) as manifest_file:
+            try:
+                manifest = json.load(manifest_file)
+            except ValueError as exc:
+                raise ConversionPlanError(
+                    "Invalid checkpoint manifest: {}".format(exc)) from exc
+
+        if manifest.get('version') != CHECKPOINT_FORMAT_VERSION:
+            raise ConversionPlanError(
+                "Unsupported checkpoint manifest version: {}"
+                .format(manifest.get('version')))
+
+        return cls(
+            manifest_path,
+            ConversionPlan.from_dict(manifest['plan']),
+            manifest['completed'])
+
+    def save(self):
+        """Save the manifest, replacing the previous one atomically."""
+        temporary_path = '{}.tmp'.format(self.manifest_path)
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(
+                {
+                    'version': CHECKPOINT_FORMAT_VERSION,
+                    'plan': self.plan.to_dict(),
+                    'completed': self.completed},
+                manifest_file, indent=2, sort_keys=True)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+
+        os.replace(temporary_path, self.manifest_path)
+
+    def remove(self):
+        """Remove the manifest, e.g., once the conversion is complete."""
+        try:
+            os.remove(self.manifest_path)
+        except FileNotFoundError:
+            pass
+
+    def is_completed(self, file_name, file_path, expected_tracks_count):
+        """Return whether a Matroska file has been completely written.
+
+        :param str file_name: name of the file, as in the plan
+        :param str file_path: path of the file
+        :param int expected_tracks_count: number of tracks the file must
+                                          have
+        :rtype: bool
+        """
+        if file_name not in self.completed:
+            return False
+
+        try:
+            file_size = os.path.getsize(str(file_path))
+        except OSError:
+            return False
+
+        return (
+            file_size == self.completed[file_name] and
+            verify_matroska_file(file_path, expected_tracks_count))
+
+    def mark_completed(self, file_name, file_path):
+        """Record a Matroska file as written, and save the manifest.
+
+        :param str file_name: name of the file, as in the plan
+        :param str file_path: path of the file
+        """
+        self.completed[file_name] = os.path.getsize(str(file_path))
+        self.save()
+
+
+class ConversionPlanExecutor:
+    """Execute conversion plans, by remuxing Blu-ray discs with Mkvmerge.
+
+    :param mkvmerge_controller:
+        interface with Mkvmerge, instance of subclass of
+        :class:`~blu_mkv.mkvmerge.AbstractMkvmergeController`
+    :param resource_policy:
+        resources allowed to Mkvmerge for this job, overriding the
+        controller's ones, instance of
+        :class:`~blu_mkv.resources.ResourcePolicy`
+    :param int parallel_chunks:
+        if set, playlists are remuxed in chunks, by this number of Mkvmerge
+        processes at once (see
+        :meth:`~blu_mkv.mkvmerge.MkvmergeController.write_chunked`)
+    :param checkpoint:
+        if set, records the written Matroska files, which are skipped when
+        already written, instance of :class:`.ConversionCheckpoint`
+    :param str scratch_dir:
+        if set, Matroska files are written to this directory (e.g., on a fast
+        local drive), and moved to their destination in the background,
+        while the next ones are written. Partial copies left in the
+        destination directories by interrupted executions are removed. See
+        :meth:`.wait_for_transfers`
+    :param metrics:
+        if set, records the written Matroska files, their size and the remux
+        throughput, and Mkvmerge's runs, instance of
+        :class:`~blu_mkv.metrics.Metrics`
+    """
+    def __init__(
+            self, mkvmerge_controller, resource_policy=None,
+            parallel_chunks=None, checkpoint=None, scratch_dir=None,
+            metrics=None):
+        if resource_policy is not None:
+            mkvmerge_controller = mkvmerge_controller.using(resource_policy)
+        if (metrics is not None and
+                isinstance(mkvmerge_controller, ProgramController)):
+            mkvmerge_controller = mkvmerge_controller.reporting_to(metrics)
+
+        self.mkvmerge_controller = mkvmerge_controller
+        self.parallel_chunks = parallel_chunks
+        self.checkpoint = checkpoint
+        self.scratch_dir = scratch_dir
+        self.metrics = metrics
+
+        # Matroska files being moved from the scratch directory, with their
+        # output. Files are moved one at a time, to write them sequentially.
+        self._transfers = dict()
+        self._transfer_executor = None
+        # Destination directories cleaned of stale partial copies.
+        self._cleaned_dst_dirs = set()
+        if scratch_dir is not None:
+            self._transfer_executor = ThreadPoolExecutor(max_workers=1)
+
+    def execute(self, plan, disc_path=None, dst_dir=None):
+        """Write all the Matroska files of a conversion plan.
+
+        :param plan: instance of :class:`.ConversionPlan`
+        :param str disc_path: directory of the disc, if different from the
+                              plan's one (e.g., mount point of a disk image)
+        :param str dst_dir: directory where to write the Matroska files, if
+                            different from the plan's one
+        :return: paths of the written Matroska files, segments first
+        :rtype: list
+        """
+        disc_path = Path(str(disc_path or plan.disc_path))
+        dst_dir = Path(str(dst_dir or plan.dst_dir))
+
+        written_files = [
+            self.execute_segment(segment, disc_path, dst_dir)
+            for segment in plan.segments]
+        written_files.extend(
+            self.execute_output(output, disc_path, dst_dir, plan.segments)
+            for output in plan.outputs)
+
+        self.wait_for_transfers()
+        return written_files
+
+    def execute_segment(self, segment, disc_path, dst_dir):
+        """Write one segment of a conversion plan with linked segments.
+
+        :param dict segment: segment of a conversion plan
+        :param str disc_path: directory of the disc
+        :param str dst_dir: directory where to write the Matroska file
+        :return: path of the written Matroska file, which may still be moved
+                 from the scratch directory
+        :rtype: str
+        """
+        segment_file_path = str(Path(str(dst_dir), segment['file_name']))
+        if self._is_completed(
+                segment, segment_file_path, len(segment['tracks'])):
+            return segment_file_path
+
+        start_time = time.monotonic()
+        written_file_path = self._get_written_file_path(segment, dst_dir)
+        self.mkvmerge_controller.write(
+            written_file_path,
+            self.get_input_streams(segment, disc_path),
+            segment_uid=segment['segment_uid'])
+
+        self._record_remux('segment', written_file_path, start_time)
+        self._finish_output(segment, dst_dir)
+        return segment_file_path
+
+    def execute_output(self, output, disc_path, dst_dir, segments=()):
+        """Write one Matroska file of a conversion plan.
+
+        :param dict output: output of a conversion plan
+        :param str disc_path: directory of the disc
+        :param str dst_dir: directory where to write the Matroska file
+        :param list segments: segments of the conversion plan, needed if the
+                              output links them
+        :return: path of the written Matroska file, which may still be moved
+                 from the scratch directory
+        :rtype: str
+        :raises ConversionPlanError: if the output links a segment missing
+                                     from ``segments``
+        """
+        output_file_path = str(Path(str(dst_dir), output['file_name']))
+        if output.get('chapters'):
+            # Files with ordered chapters carry the first segment's tracks.
+            linking_segment = self._get_linked_segment(
+                output['chapters'][0]['segment_uid'], segments)
+            expected_tracks_count = len(linking_segment['tracks'])
+        else:
+            expected_tracks_count = len(output['tracks'])
+        if self._is_completed(
+                output, output_file_path, expected_tracks_count):
+            return output_file_path
+
+        start_time = time.monotonic()
+        written_file_path = self._get_written_file_path(output, dst_dir)
+        if output.get('chapters'):
+            self.mkvmerge_controller.write_ordered_chapters(
+                written_file_path,
+                output['chapters'],
+                self.get_input_streams(linking_segment, disc_path),
+                title=output['title'],
+                attachments=self.get_attachments(output, disc_path))
+        elif self.parallel_chunks:
+            self.mkvmerge_controller.write_chunked(
+                written_file_path,
+                self.get_input_streams(output, disc_path),
+                title=output['title'],
+                attachments=self.get_attachments(output, disc_path),
+                max_workers=self.parallel_chunks)
+        else:
+            self.mkvmerge_controller.write(
+                written_file_path,
+                self.get_input_streams(output, disc_path),
+                title=output['title'],
+                attachments=self.get_attachments(output, disc_path))
+
+        self._record_remux('playlist', written_file_path, start_time)
+        self._finish_output(output, dst_dir)
+        return output_file_path
+
+    @staticmethod
+    def _get_linked_segment(segment_uid, segments):
+        """Return the segment of a conversion plan with the given UID."""
+        for segment in segments:
+            if segment['segment_uid'] == segment_uid:
+                return segment
+
+        raise ConversionPlanError(
+            "Linked segment {} is missing from the plan".format(segment_uid))
+
+    def wait_for_transfers(self):
+        """Wait for the Matroska files written to the scratch directory to be
+        moved to their destination.
+
+        :raises OSError: if a file could not be moved
+        """
+        wait(self._transfers)
+        self._record_finished_transfers()
+
+    def _record_remux(self, kind, written_file_path, start_time):
+        """Record a written Matroska file, its size and the remux throughput
+        in the metrics, if any."""
+        if self.metrics is None:
+            return
+
+        file_size = os.stat(written_file_path).st_size
+        duration = time.monotonic() - start_time
+        self.metrics.increment('blu_mkv_files_written_total', kind=kind)
+        self.metrics.increment('blu_mkv_remuxed_bytes_total', file_size)
+        if duration > 0:
+            self.metrics.observe(
+                'blu_mkv_remux_throughput_bytes_per_second',
+                file_size / duration)
+
+    def _get_written_file_path(self, output, dst_dir):
+        """Return where Mkvmerge writes the Matroska file of an output (or
+        segment)."""
+        return str(Path(
+            str(self.scratch_dir or dst_dir), output['file_name']))
+
+    def _finish_output(self, output, dst_dir):
+        """Record an output (or segment) as written, or start moving it to
+        its destination if written to the scratch directory."""
+        file_path = str(Path(str(dst_dir), output['file_name']))
+        if self.scratch_dir is None:
+            self._mark_completed(output, file_path)
+            return
+
+        if str(dst_dir) not in self._cleaned_dst_dirs:
+            remove_stale_partial_files(str(dst_dir))
+            self._cleaned_dst_dirs.add(str(dst_dir))
+
+        self._record_finished_transfers()
+        future = self._transfer_executor.submit(
+            self._move_to_destination,
+            self._get_written_file_path(output, dst_dir), file_path)
+        self._transfers[future] = (output, file_path)
+
+    @classmethod
+    def _move_to_destination(cls, written_file_path, file_path):
+        """Move a Matroska file, and the files written next to it, from the
+        scratch directory to their destination."""
+        sidecar_file_paths = dict()
+        for suffix in SIDECAR_FILE_SUFFIXES:
+            sidecar_file_path =\
+                str(Path(written_file_path).with_suffix(suffix))
+            if os.path.exists(sidecar_file_path):
+                sidecar_file_paths[sidecar_file_path] =\
+                    str(Path(file_path).with_suffix(suffix))
+
+        options_file_path =\
+            str(Path(written_file_path).with_suffix('.mkvmerge.json'))
+        if options_file_path in sidecar_file_paths:
+            cls._rewrite_options_file(
+                options_file_path,
+                dict(sidecar_file_paths, **{written_file_path: file_path}))
+
+        # The Matroska file is moved last, so that its sidecar files are
+        # there when it appears.
+        for (sidecar_file_path, dst_path) in sidecar_file_paths.items():
+            move_file(sidecar_file_path, dst_path)
+
+        move_file(written_file_path, file_path)
+
+    @staticmethod
+    def _rewrite_options_file(options_file_path, moved_file_paths):
+        """Replace, in Mkvmerge's options, the paths of the files moved from
+        the scratch directory (e.g., output, or chapters) by their
+        destination, so that the remux can be reproduced from there."""
+        with open(options_file_path) as options_file:
+            mkvmerge_options = json.load(options_file)
+
+        mkvmerge_options = [
+            moved_file_paths.get(option, option)
+            for option in mkvmerge_options]
+        with open(options_file_path, 'w') as options_file:
+            json.dump(mkvmerge_options, options_file, indent=2)
+
+    def _record_finished_transfers(self):
+        """Record the outputs moved to their destination as written."""
+        for future in [
+                future for future in self._transfers if future.done()]:
+            (output, file_path) = self._transfers.pop(future)
+            future.result()
+            self._mark_completed(output, file_path)
+
+    def _is_completed(self, output, file_path, expected_tracks_count):
+        """Return whether an output (or segment) has been written by an
+        interrupted execution."""
+        return (
+            self.checkpoint is not None and
+            self.checkpoint.is_completed(
+                output['file_name'], file_path, expected_tracks_count))
+
+    def _mark_completed(self, output, file_path):
+        """Record an output (or segment) as written."""
+        if self.checkpoint is not None:
+            self.checkpoint.mark_completed(output['file_name'], file_path)
+
+    @staticmethod
+    def get_input_streams(output, disc_path):
+        """Return the streams of a plan's output (or segment), as expected
+        by :meth:`~blu_mkv.mkvmerge.MkvmergeController.write`.
+
+        :param dict output: output (or segment) of a conversion plan
+        :param str disc_path: directory of the disc
+        :rtype: list
+        """
+        input_streams = list()
+        for track in output['tracks']:
+            input_stream = {
+                key: value for (key, value) in track.items()
+                if key not in PLAN_ONLY_TRACK_KEYS}
+            input_stream['file_path'] =\
+                str(Path(str(disc_path), track['source']))
+            input_streams.append(input_stream)
+
+        return input_streams
+
+    @staticmethod
+    def get_attachments(output, disc_path):
+        """Return the attachments of a plan's output, as expected by
+        :meth:`~blu_mkv.mkvmerge.MkvmergeController.write`.
+
+        :param dict output: output of a conversion plan
+        :param str disc_path: directory of the disc
+        :return: the attachments, or `None` if there are no attachments
+        :rtype: list or None
+        """
+        attachments = list()
+        for attachment in output['attachments']:
+            attachment = attachment.copy()
+            attachment['path'] =\
+                str(Path(str(disc_path), attachment.pop('source')))
+            attachments.append(attachment)
+
+        return attachments or None
+
+
+def add_arguments(parser):
+    """Add the command-line options of a conversion plan to a parser, as read
+    by :func:`get_plan_options`.
+
+    :param parser: instance of :class:`argparse.ArgumentParser`
+    """
+    parser.add_argument(
+        '-pc', '--playlists_count',
+        type=int, default=1,
+        help=(
+            "Set the maximum number of movie playlists to convert. "
+            "Defaults to 1. If set to 0, all movie playlists are converted."))
+    parser.add_argument(
+        '-al', '--audio_languages',
+        type=str, nargs='*',
+        help=(
+            "Audio tracks to keep according to their language. "
+            "Multi-languages tracks or tracks with undetermined language are "
+            "always kept."))
+    parser.add_argument(
+        '-sl', '--subtitle_languages',
+        type=str, nargs='*',
+        help="Subtitle tracks to keep according to their language.")
+    parser.add_argument(
+        '-fsn', '--forced_subtitle_names',
+        help="Description given to forced subtitle tracks.")
+    parser.add_argument(
+        '-3d', '--detect_3d',
+        action='store_true',
+        help="Detect 3D video tracks. Makemkv need to be installed.")
+    parser.add_argument(
+        '-mb', '--min_bitrate',
+        type=float,
+        help=(
+            "Drop audio and subtitle tracks with a lower bitrate, in bits per "
+            "second (e.g., silent placeholder tracks). NumPy need to be "
+            "installed."))
+    parser.add_argument(
+        '-ls', '--linked_segments',
+        action='store_true',
+        help=(
+            "Remux each clip only once, and link clips together with ordered "
+            "chapters. Saves space when playlists share clips (e.g., "
+            "theatrical and extended cuts)."))
+
+
+def get_plan_options(args):
+    """Return the options of :meth:`ConversionPlan.from_disc` set on the
+    command-line, with the options added by :func:`add_arguments`.
+
+    :param args: parsed arguments, instance of :class:`argparse.Namespace`
+    :rtype: dict
+    """
+    return {
+        'playlists_count': args.playlists_count,
+        'audio_languages': args.audio_languages,
+        'subtitle_languages': args.subtitle_languages,
+        'forced_subtitle_names': args.forced_subtitle_names,
+        'skip_multiview': args.detect_3d,
+        'min_bitrate': args.min_bitrate,
+        'linked_segments': args.linked_segments}
+
+
+def convert_disc(
+        bluray_disc, title, dst_dir, disc_path=None, plan_options=None,
+        checkpoint_path=None, execute=True, parallel_remux=None,
+        scratch_dir=None, metrics=None, on_planned=None, on_progress=None,
+        on_message=None):
+    """Plan the conversion of a Blu-ray disc, and convert it with the
+    disc's Mkvmerge controller.
+
+    With a checkpoint, an interrupted conversion of the same disc is resumed
+    from it, without analyzing the disc again. Otherwise, the plan is saved
+    to the checkpoint, which is removed once the disc is converted.
+
+    :param bluray_disc: instance of :class:`~blu_mkv.bluray.BlurayDisc`
+    :param str title: movie title, used for the Matroska files' titles and
+                      names
+    :param str dst_dir: directory where to write the Matroska files
+    :param str disc_path: path under which the disc is recorded. Defaults to
+                          the disc's path, but should be set to the disk
+                          image's path for mounted disk images
+    :param dict plan_options: other options of
+                              :meth:`ConversionPlan.from_disc` (see
+                              :func:`get_plan_options`)
+    :param str checkpoint_path: if set, path of the checkpoint's manifest
+                                (see :class:`.ConversionCheckpoint`)
+    :param bool execute: whether to convert the disc, or only to plan its
+                         conversion
+    :param int parallel_remux: if set, number of Mkvmerge processes remuxing
+                               chunks of a playlist at once
+    :param str scratch_dir: if set, directory where to write the Matroska
+                            files before moving them to the destination
+    :param metrics: if set, records the failures of each stage, and the
+                    conversion, instance of :class:`~blu_mkv.metrics.Metrics`
+    :param on_planned: if set, called with the plan before converting the
+                       disc (e.g., to save it)
+    :param on_progress: if set, called with the part of the Matroska files
+                        written (between 0 and 1)
+    :param on_message: if set, called with messages describing the
+                       conversion's steps (e.g., :func:`print`)
+    :return: the plan, and whether it has been resumed from the checkpoint
+    :rtype: tuple
+    :raises ConversionPlanError: if the conversion cannot be planned
+    """
+    on_message = on_message or (lambda message: None)
+    on_progress = on_progress or (lambda progress: None)
+    disc_path = str(disc_path or bluray_disc.path)
+    dst_dir = str(dst_dir)
+
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = _load_checkpoint(checkpoint_path, disc_path, on_message)
+
+    resumed = checkpoint is not None
+    if resumed:
+        on_message("Resume conversion from {}".format(checkpoint_path))
+        plan = checkpoint.plan
+    else:
+        on_message("Start disc analysis")
+        with _count_failures(metrics, 'analysis'):
+            plan = ConversionPlan.from_disc(
+                bluray_disc, title, dst_dir, disc_path=disc_path,
+                **(plan_options or dict()))
+
+        for skipped_playlist in plan.skipped_playlists:
+            on_message("Skip playlist {playlist_number}: {reason}".format(
+                **skipped_playlist))
+        for output in plan.outputs:
+            if output['dropped_tracks']:
+                on_message(
+                    "Drop tracks {} of playlist {}: bitrate too low".format(
+                        ', '.join(map(str, output['dropped_tracks'])),
+                        output['playlist_number']))
+
+        if checkpoint_path is not None and execute:
+            checkpoint = ConversionCheckpoint(checkpoint_path, plan)
+            checkpoint.save()
+
+    if on_planned is not None:
+        on_planned(plan)
+    if not execute:
+        return (plan, resumed)
+
+    plan_executor = ConversionPlanExecutor(
+        bluray_disc.bluray_analyzer.mkvmerge_controller,
+        parallel_chunks=parallel_remux, checkpoint=checkpoint,
+        scratch_dir=scratch_dir, metrics=metrics)
+    files_count = len(plan.segments) + len(plan.outputs)
+    on_progress(0)
+
+    with _count_failures(metrics, 'remux'):
+        for (index, segment) in enumerate(plan.segments):
+            on_message("Convert clip {}".format(segment['clip_name']))
+            plan_executor.execute_segment(
+                segment, str(bluray_disc.path), dst_dir)
+            on_progress((index + 1) / files_count)
+
+        for (index, output) in enumerate(plan.outputs, len(plan.segments)):
+            on_message("Convert playlist {}".format(
+                output['playlist_number']))
+            plan_executor.execute_output(
+                output, str(bluray_disc.path), dst_dir, plan.segments)
+            on_progress((index + 1) / files_count)
+
+    if plan_executor.scratch_dir is not None:
+        on_message("Wait for the files to be moved to {}".format(dst_dir))
+    with _count_failures(metrics, 'transfer'):
+        plan_executor.wait_for_transfers()
+
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    return (plan, resumed)
+
+
+def _load_checkpoint(checkpoint_path, disc_path, on_message):
+    """Return the checkpoint of an interrupted conversion of a disc, or
+    `None` if there is none."""
+    if not Path(str(checkpoint_path)).is_file():
+        return None
+
+    try:
+        checkpoint = ConversionCheckpoint.load(checkpoint_path)
+    except (OSError, ConversionPlanError) as exc:
+        on_message("Ignore checkpoint {}: {}".format(checkpoint_path, exc))
+        return None
+
+    if checkpoint.plan.disc_path != disc_path:
+        on_message("Ignore checkpoint {}: made for disc {}".format(
+            checkpoint_path, checkpoint.plan.disc_path))
+        return None
+
+    return checkpoint
+
+
+def _count_failures(metrics, stage):
+    """Return a context manager counting a failure of a conversion's stage
+    in the metrics, if any."""
+    if metrics is None:
+        return ExitStack()
+    return metrics.count_failures(stage)
@@ -0,0 +1,190 @@
+"""Timeouts and cancellation of the external programs.
+
+A damaged disc can make a program (e.g., Ffprobe counting frames, or
+Makemkv) hang forever. Programs are thus started in their own process group,
+so that they can be killed along with their children, when they take too
+long or when the operation is cancelled.
+"""
+
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import signal
+import subprocess
+import threading
+
+from . import clpi, mpls
+
+
+#: Signals killing programs because they are stopped (e.g., along with the
+#: service running them), rather than because they crashed.
+TERMINATION_SIGNALS = (
+    signal.SIGHUP, signal.SIGINT, signal.SIGTERM, signal.SIGKILL)
+
+
+class OperationCancelled(Exception):
+    """Raised when an operation is cancelled through its
+    :class:`CancellationToken`."""
+
+
+class CancellationToken:
+    """Cancel running operations, from another thread or a signal handler.
+
+    Programs started by controllers bound to the token (see
+    :meth:`~blu_mkv.ProgramController.cancellable_by`) are killed when the
+    token is cancelled, and no new programs are started.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        # Reentrant, as the token may be cancelled by a signal handler while
+        # callbacks are registered.
+        self._lock = threading.RLock()
+        self._callbacks = dict()
+
+    @property
+    def cancelled(self):
+        """Return whether the token has been cancelled.
+
+        :rtype: bool
+        """
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the running operations."""
+        with self._lock:
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+
+        for callback in callbacks:
+            callback()
+
+    def raise_if_cancelled(self):
+        """Stop the current operation if the token has been cancelled.
+
+        :raises OperationCancelled: if the token has been cancelled
+        """
+        if self.cancelled:
+            raise OperationCancelled("The operation has been cancelled")
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """Return a context manager calling a function if the token is
+        cancelled meanwhile (e.g., to kill a program).
+
+        :param callback: called without arguments
+        """
+        key = object()
+        with self._lock:
+            self._callbacks[key] = callback
+            cancelled = self.cancelled
+        if cancelled:
+            callback()
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._callbacks[key]
+
+
+#: Default number of seconds allowed to operations processing media of unknown
+#: duration, in addition to the base timeout: enough for the longest movies.
+UNKNOWN_DURATION_TIMEOUT = 4 * 3600
+
+
+class TimeoutPolicy:
+    """Timeouts of the operations done by external programs.
+
+    Operations processing media content (e.g., counting frames of a
+    playlist, or remuxing it) are allowed more time for longer media.
+
+    :param float base_timeout: number of seconds allowed to any operation
+    :param float duration_factor: number of seconds additionally allowed per
+                                  second of processed media
+    :param float unknown_duration_timeout: number of seconds additionally
+                                           allowed when the duration of the
+                                           processed media is unknown
+    """
+    def __init__(
+            self, base_timeout, duration_factor=1,
+            unknown_duration_timeout=UNKNOWN_DURATION_TIMEOUT):
+        self.base_timeout = base_timeout
+        self.duration_factor = duration_factor
+        self.unknown_duration_timeout = unknown_duration_timeout
+
+    def get_timeout(self, media_duration=0):
+        """Return the timeout of an operation.
+
+        :param float media_duration: duration in seconds of the media
+                                     processed by the operation, 0 for
+                                     operations not processing media content
+                                     (e.g., probing headers), or `None` if
+                                     unknown
+        :return: number of seconds
+        :rtype: float
+        """
+        if media_duration is None:
+            return self.base_timeout + self.unknown_duration_timeout
+        return self.base_timeout + self.duration_factor * media_duration
+
+
+def get_media_duration(file_paths):
+    """Return the total duration of Blu-ray playlists and clips, as played.
+
+    Durations are read from the playlist files, and from the clip
+    information files of the clips.
+
+    :param list file_paths: paths of playlist files (``*.mpls``), and of
+                            clips (``*.m2ts``)
+    :return: number of seconds, or `None` if the duration of a file is
+             unknown (e.g., another kind of file)
+    :rtype: float or None
+    """
+    ticks = 0
+    for file_path in set(str(file_path) for file_path in file_paths):
+        file_path = Path(file_path)
+        try:
+            if file_path.suffix.lower() == '.mpls':
+                playlist = mpls.parse_playlist_file(file_path)
+                ticks += sum(
+                    play_item['out_time'] - play_item['in_time']
+                    for play_item in playlist['play_items'])
+            elif file_path.suffix.lower() == '.m2ts':
+                clip_information = clpi.parse_clip_information_file(
+                    file_path.parents[1].joinpath(
+                        'CLIPINF', '{}.clpi'.format(file_path.stem)))
+                ticks += (
+                    clip_information['presentation_end_time'] -
+                    clip_information['presentation_start_time'])
+            else:
+                return None
+        except (OSError, ValueError):
+            return None
+
+    return ticks / mpls.TICKS_PER_SECOND
+
+
+def is_killed_by_signal(error):
+    """Return whether an error is raised by a program killed by a
+    termination signal (see :data:`TERMINATION_SIGNALS`), e.g., when the
+    host is shut down. Such programs would likely succeed if run again.
+
+    :param error: instance of :class:`Exception`
+    :rtype: bool
+    """
+    return (
+        isinstance(error, subprocess.CalledProcessError) and
+        error.returncode < 0 and
+        -error.returncode in TERMINATION_SIGNALS)
+
+
+def kill_process_group(process):
+    """Kill a program started in its own process group, along with its
+    children.
+
+    :param process: instance of :class:`subprocess.Popen`
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
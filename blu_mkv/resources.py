@@ -0,0 +1,227 @@
+"""Limit the resources used by external programs, so that batch conversions
+can run in the background of a shared host.
+
+A resource policy is applied to each program when it is started, before it
+executes: scheduling priority (nice level), I/O scheduling class (ionice),
+CPU affinity and maximum size of the address space (RLIMIT_AS).
+
+I/O scheduling classes and CPU affinities are only supported on Linux.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import platform
+import resource
+
+
+IOPRIO_CLASS_REALTIME = 'realtime'
+IOPRIO_CLASS_BEST_EFFORT = 'best-effort'
+IOPRIO_CLASS_IDLE = 'idle'
+
+#: Values of the I/O scheduling classes, as defined by the Linux kernel.
+IOPRIO_CLASSES = {
+    IOPRIO_CLASS_REALTIME: 1,
+    IOPRIO_CLASS_BEST_EFFORT: 2,
+    IOPRIO_CLASS_IDLE: 3}
+
+#: Number of the ``ioprio_set`` system call, per architecture.
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273}
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+
+# The C library and the system call's number are looked up once, when
+# imported: policies are applied between fork and exec, where looking them up
+# (which may run other programs, or take locks held by other threads) could
+# deadlock.
+try:
+    LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    LIBC = None
+IOPRIO_SET_SYSCALL = IOPRIO_SET_SYSCALLS.get(platform.machine())
+
+
+def set_io_priority(ioprio_class, level=None):
+    """Set the I/O scheduling class of the current process.
+
+    :param str ioprio_class: :data:`IOPRIO_CLASS_REALTIME`,
+                             :data:`IOPRIO_CLASS_BEST_EFFORT` or
+                             :data:`IOPRIO_CLASS_IDLE`
+    :param int level: priority inside the class, from 0 (highest) to 7.
+                      Ignored by the idle class. Defaults to 4
+    :raises OSError: if the I/O scheduling class cannot be set
+    """
+    if LIBC is None or IOPRIO_SET_SYSCALL is None:
+        raise OSError(
+            "I/O scheduling classes are not supported on {}".format(
+                platform.machine()))
+
+    if ioprio_class == IOPRIO_CLASS_IDLE:
+        level = 0
+    elif level is None:
+        level = 4
+
+    ioprio = (IOPRIO_CLASSES[ioprio_class] << IOPRIO_CLASS_SHIFT) | level
+
+    if LIBC.syscall(IOPRIO_SET_SYSCALL, IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def parse_cpu_list(cpu_list):
+    """Parse a list of CPUs, as written by ``taskset --cpu-list`` (e.g.,
+    ``0-3,6``).
+
+    :param str cpu_list: comma-separated CPU numbers or ranges
+    :rtype: set
+    :raises ValueError: if the list is malformed
+    """
+    cpus = set()
+    for cpu_range in cpu_list.split(','):
+        (first_cpu, _, last_cpu) = cpu_range.strip().partition('-')
+        cpus.update(range(int(first_cpu), int(last_cpu or first_cpu) + 1))
+
+    return cpus
+
+
+def add_arguments(parser):
+    """Add the command-line options of a resource policy to a parser, as
+    read by :meth:`ResourcePolicy.from_arguments`.
+
+    :param parser: instance of :class:`argparse.ArgumentParser`
+    """
+    parser.add_argument(
+        '-ni', '--nice',
+        type=int,
+        help=(
+            "Nice level of the external programs, from -20 (highest "
+            "priority) to 19 (lowest priority)."))
+    parser.add_argument(
+        '-io', '--ionice',
+        choices=sorted(IOPRIO_CLASSES),
+        help=(
+            "I/O scheduling class of the external programs. Use 'idle' for "
+            "only reading when no other program does."))
+    parser.add_argument(
+        '-ca', '--cpu_affinity',
+        type=parse_cpu_list,
+        help=(
+            "CPUs on which the external programs can run, as a list of "
+            "numbers or ranges (e.g., '0-3,6')."))
+    parser.add_argument(
+        '-ml', '--memory_limit',
+        type=int,
+        help=(
+            "Maximum size of the address space of the external programs, in "
+            "MiB."))
+
+
+class ResourcePolicy:
+    """Resources allowed to external programs.
+
+    Limits which are not set are inherited from the current process.
+
+    :param int nice: nice level, from -20 (highest priority) to 19
+    :param str ioprio_class: I/O scheduling class, one of
+                             :data:`IOPRIO_CLASSES`
+    :param int ioprio_level: priority inside the I/O scheduling class, from 0
+                             (highest) to 7
+    :param cpu_affinity: CPUs on which programs can run, as a set of CPU
+                         numbers
+    :param int memory_limit: maximum size of the address space of programs,
+                             in bytes
+    """
+    def __init__(
+            self, nice=None, ioprio_class=None, ioprio_level=None,
+            cpu_affinity=None, memory_limit=None):
+        if ioprio_class is not None and ioprio_class not in IOPRIO_CLASSES:
+            raise ValueError(
+                "Unknown I/O scheduling class: {}".format(ioprio_class))
+
+        self.nice = nice
+        self.ioprio_class = ioprio_class
+        self.ioprio_level = ioprio_level
+        self.cpu_affinity = cpu_affinity
+        self.memory_limit = memory_limit
+
+    @classmethod
+    def from_arguments(cls, args):
+        """Return the policy set on the command-line, with the options added
+        by :func:`add_arguments`.
+
+        :param args: parsed arguments, instance of
+                     :class:`argparse.Namespace`
+        :rtype: instance of :class:`.ResourcePolicy`
+        """
+        if args.memory_limit is not None:
+            memory_limit = args.memory_limit * 1024 * 1024
+        else:
+            memory_limit = None
+
+        return cls(
+            nice=args.nice,
+            ioprio_class=args.ionice,
+            cpu_affinity=args.cpu_affinity,
+            memory_limit=memory_limit)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ResourcePolicy) and
+            vars(self) == vars(other))
+
+    def __bool__(self):
+        return any(value is not None for value in vars(self).values())
+
+    def combine(self, policy):
+        """Return a new policy, where the limits of another policy override
+        the limits of this one (e.g., job's policy over controller's one).
+
+        :param policy: instance of :class:`.ResourcePolicy`, or `None`
+        :rtype: instance of :class:`.ResourcePolicy`
+        """
+        limits = vars(self).copy()
+        if policy is not None:
+            limits.update(
+                (name, value) for (name, value) in vars(policy).items()
+                if value is not None)
+
+        return ResourcePolicy(**limits)
+
+    def apply(self):
+        """Apply the policy to the current process.
+
+        Meant to be called in a child process, before executing the program.
+
+        :raises OSError: if a limit cannot be applied (e.g., raising the
+                         priority without privileges)
+        """
+        if self.nice is not None:
+            os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+
+        if self.ioprio_class is not None:
+            set_io_priority(self.ioprio_class, self.ioprio_level)
+
+        if self.cpu_affinity is not None:
+            os.sched_setaffinity(0, self.cpu_affinity)
+
+        if self.memory_limit is not None:
+            resource.setrlimit(
+                resource.RLIMIT_AS, (self.memory_limit, self.memory_limit))
+
+    def get_popen_options(self):
+        """Return the options of :class:`subprocess.Popen` applying the
+        policy to a program.
+
+        :rtype: dict
+        """
+        if not self:
+            return dict()
+
+        return {'preexec_fn': self.apply}
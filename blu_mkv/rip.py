@@ -0,0 +1,336 @@
+"""Copy Blu-ray discs to a fast local cache, before analyzing and remuxing
+them.
+
+Ffprobe, Mkvmerge and Makemkv all read the same files, often at random
+positions, which is very slow on optical drives. Copying the disc first,
+sequentially and with large reads, is then much faster overall.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+import shutil
+
+from . import mpls
+from .bluray import PLAYLISTS_RELATIVE_PATH, STREAMS_RELATIVE_PATH
+from .utils import is_process_alive
+
+
+#: Interleaved files of 3D discs, which duplicate the clips' data.
+INTERLEAVED_STREAMS_RELATIVE_PATH = "BDMV/STREAM/SSIF"
+
+#: Size of the reads, in bytes (a multiple of the 2048 bytes of a disc's
+#: sector).
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class DiscCopyError(OSError):
+    """Raised when a disc's file is not copied identically."""
+
+
+def copy_file(src_path, dst_path, chunk_size=DEFAULT_CHUNK_SIZE,
+              on_progress=None):
+    """Copy a file sequentially, and return its checksum.
+
+    The copy keeps the file's permissions and modification time, so that
+    analysis results of the file are still found in an
+    :class:`~blu_mkv.cache.AnalysisCache`. It is flushed to its drive, and
+    dropped from the page cache where supported, so that reading it again
+    (e.g., to verify it) reads it from the drive.
+
+    :param str src_path: path of the file to copy
+    :param str dst_path: path of the copy
+    :param int chunk_size: size of the reads, in bytes
+    :param on_progress: called with the number of bytes copied, after each
+                        chunk
+    :return: SHA-1 checksum of the copied data, as hexadecimal digits
+    :rtype: str
+    """
+    checksum = hashlib.sha1()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    with open(str(src_path), 'rb', buffering=0) as src_file, \
+            open(str(dst_path), 'wb') as dst_file:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(
+                src_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        while True:
+            read_size = src_file.readinto(buffer)
+            if not read_size:
+                break
+
+            checksum.update(view[:read_size])
+            dst_file.write(view[:read_size])
+
+            if on_progress is not None:
+                on_progress(read_size)
+
+        # Dirty pages cannot be dropped: the copy is written back first.
+        dst_file.flush()
+        os.fsync(dst_file.fileno())
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(
+                dst_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+    shutil.copystat(str(src_path), str(dst_path))
+    return checksum.hexdigest()
+
+
+def get_file_checksum(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return the SHA-1 checksum of a file, as hexadecimal digits.
+
+    :param str file_path: path of the file
+    :param int chunk_size: size of the reads, in bytes
+    :rtype: str
+    """
+    checksum = hashlib.sha1()
+    with open(str(file_path), 'rb') as file_:
+        for chunk in iter(lambda: file_.read(chunk_size), b''):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+class DiscCopy:
+    """Local copy of a Blu-ray disc.
+
+    Either the whole disc is copied, or only the clips played by some
+    playlists (along with all the small files of the disc, like other
+    playlists and clip information files). Interleaved files of 3D discs are
+    never copied.
+
+    Each copied file is verified, by comparing the checksum of the read data
+    with the checksum of the copy, read again from the drive where
+    :func:`os.posix_fadvise` is supported (see :func:`copy_file`). Elsewhere,
+    the copy may be read again from the page cache, which only verifies that
+    it was not truncated nor modified meanwhile.
+
+    Copies are done in a directory named after the disc, and keep the files'
+    modification times, so that a disc copied again is found at the same
+    place, with the same files (e.g., to reuse previous analysis results from
+    an :class:`~blu_mkv.cache.AnalysisCache`).
+
+    A copy is thus shared by the jobs converting the same disc at the same
+    time, even from other processes. Next to the copy's directory (e.g.,
+    ``movie-0123456789ab``), are kept:
+    - ``movie-0123456789ab.users``: PIDs of the processes using the copy,
+      one per line
+    - ``movie-0123456789ab.files``: files of the copy already verified, one
+      per line
+    - ``movie-0123456789ab.lock``: locked by processes updating the copy and
+      the two above
+
+    A job only copies the files missing from a copy in use, and a copy is
+    only removed when its last user evicts it (or by the next job, if its
+    users died without evicting it).
+
+    Can be used as a context manager, to copy the disc when entering the
+    context, and evict the copy when leaving it.
+
+    :param str disc_path: path of the Blu-ray disc. Must points to a directory
+    :param str cache_dir: directory where to copy the disc
+    :param list playlist_numbers: if set, only copy the clips played by these
+                                  playlists
+    :param int chunk_size: size of the reads, in bytes
+    :param on_progress: called with the number of copied bytes, the total
+                        number of bytes to copy, and the path of the file being
+                        copied, after each chunk
+    :param str path: path of the copy, once copied
+    """
+    def __init__(
+            self, disc_path, cache_dir, playlist_numbers=None,
+            chunk_size=DEFAULT_CHUNK_SIZE, on_progress=None):
+        self.disc_path = Path(str(disc_path))
+        self.cache_dir = Path(str(cache_dir))
+        self.playlist_numbers = playlist_numbers
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.path = None
+
+    def __enter__(self):
+        self.copy()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.evict()
+
+    def get_copy_path(self):
+        """Return the path where the disc is copied.
+
+        :rtype: str
+        """
+        resolved_path = str(self.disc_path.resolve())
+        return str(self.cache_dir.joinpath('{}-{}'.format(
+            self.disc_path.name,
+            hashlib.sha1(resolved_path.encode()).hexdigest()[:12])))
+
+    def get_files(self):
+        """Return the disc's files to copy, relatively to the disc's path.
+
+        :rtype: list
+        """
+        if self.playlist_numbers is not None:
+            clip_names = set()
+            for playlist_number in self.playlist_numbers:
+                playlist = mpls.parse_playlist_file(self.disc_path.joinpath(
+                    PLAYLISTS_RELATIVE_PATH,
+                    '{:05d}.mpls'.format(playlist_number)))
+                clip_names.update(mpls.get_clip_names(playlist))
+        else:
+            clip_names = None
+
+        files = list()
+        for (directory, _, file_names) in os.walk(str(self.disc_path)):
+            relative_directory =\
+                Path(directory).relative_to(str(self.disc_path))
+            if relative_directory == Path(INTERLEAVED_STREAMS_RELATIVE_PATH):
+                continue
+
+            for file_name in file_names:
+                file_path = relative_directory / file_name
+                is_skipped_clip = (
+                    clip_names is not None and
+                    relative_directory == Path(STREAMS_RELATIVE_PATH) and
+                    file_path.stem not in clip_names)
+
+                if not is_skipped_clip:
+                    files.append(str(file_path))
+
+        return sorted(files)
+
+    def copy(self):
+        """Copy the disc, or the files missing from a copy in use by other
+        jobs, verify the copied files, and register the current process as
+        one of the copy's users.
+
+        A previous copy at the same place, unused, is removed first.
+
+        :return: path of the copy
+        :rtype: str
+        :raises DiscCopyError: if a file is not copied identically
+        """
+        copy_path = Path(self.get_copy_path())
+
+        with self._lock(copy_path):
+            users = self._read_users(copy_path)
+            if users:
+                copied_files = set(self._read_lines(copy_path, '.files'))
+            else:
+                shutil.rmtree(str(copy_path), ignore_errors=True)
+                copied_files = set()
+
+            files = [
+                file_path for file_path in self.get_files()
+                if file_path not in copied_files]
+            try:
+                self._copy_files(copy_path, files)
+            except BaseException:
+                if users:
+                    for file_path in files:
+                        try:
+                            os.remove(str(copy_path.joinpath(file_path)))
+                        except FileNotFoundError:
+                            pass
+                else:
+                    shutil.rmtree(str(copy_path), ignore_errors=True)
+                raise
+
+            self._write_lines(
+                copy_path, '.files', sorted(copied_files.union(files)))
+            users.append(os.getpid())
+            self._write_lines(copy_path, '.users', users)
+
+        self.path = str(copy_path)
+        return self.path
+
+    def _copy_files(self, copy_path, files):
+        """Copy files of the disc, and verify them.
+
+        :raises DiscCopyError: if a file is not copied identically
+        """
+        total_size = sum(
+            self.disc_path.joinpath(file_path).stat().st_size
+            for file_path in files)
+        copied_size = 0
+
+        for file_path in files:
+            src_path = self.disc_path.joinpath(file_path)
+            dst_path = copy_path.joinpath(file_path)
+            dst_path.parent.mkdir(parents=True, exist_ok=True)
+
+            def report_progress(read_size):
+                nonlocal copied_size
+                copied_size += read_size
+                if self.on_progress is not None:
+                    self.on_progress(copied_size, total_size, str(src_path))
+
+            src_checksum = copy_file(
+                src_path, dst_path, self.chunk_size, report_progress)
+            dst_checksum = get_file_checksum(dst_path, self.chunk_size)
+
+            if dst_checksum != src_checksum:
+                raise DiscCopyError(
+                    "Checksum of {} differs from its copy".format(src_path))
+
+    def evict(self):
+        """Unregister the current process from the users of the copy, and
+        remove the copy if nobody else uses it."""
+        if self.path is None:
+            return
+
+        copy_path = Path(self.path)
+        with self._lock(copy_path):
+            users = self._read_users(copy_path)
+            try:
+                users.remove(os.getpid())
+            except ValueError:
+                pass
+
+            if users:
+                self._write_lines(copy_path, '.users', users)
+            else:
+                shutil.rmtree(str(copy_path), ignore_errors=True)
+                for suffix in ('.users', '.files'):
+                    try:
+                        os.remove(str(copy_path) + suffix)
+                    except FileNotFoundError:
+                        pass
+
+        self.path = None
+
+    @staticmethod
+    @contextmanager
+    def _lock(copy_path):
+        """Lock a copy, while in the context."""
+        copy_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(copy_path) + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @classmethod
+    def _read_users(cls, copy_path):
+        """Return PIDs of the living users of a copy."""
+        return [
+            user for user in map(int, cls._read_lines(copy_path, '.users'))
+            if is_process_alive(user)]
+
+    @staticmethod
+    def _read_lines(copy_path, suffix):
+        """Return the lines of a file kept next to a copy."""
+        try:
+            return Path(str(copy_path) + suffix).read_text().splitlines()
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _write_lines(copy_path, suffix, lines):
+        """Write the lines of a file kept next to a copy."""
+        Path(str(copy_path) + suffix).write_text(
+            ''.join('{}\n'.format(line) for line in lines))
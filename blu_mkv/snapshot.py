@@ -0,0 +1,415 @@
+"""Snapshots of Blu-ray discs, to plan their conversion without the discs.
+
+Analyzing a disc only needs its small metadata files (playlists, clip
+information files, covers, etc.), and the results of the programs probing
+its streams. A snapshot packs them into a compressed archive of a few
+megabytes (see :func:`export_snapshot`), from which the disc can be analyzed
+on any host, without moving or mounting the disc (see
+:meth:`~blu_mkv.bluray.BlurayDisc.from_snapshot`).
+
+Analysis results are stored as JSON, so that extracting a snapshot never
+runs code from it (see :func:`encode_result`).
+"""
+
+from datetime import timedelta
+import io
+import json
+import os
+from pathlib import Path, PurePosixPath
+import tarfile
+import time
+
+from . import clpi, mpls
+from .bluray import (
+    CLIPS_RELATIVE_PATH, COVERS_RELATIVE_PATH, PLAYLISTS_RELATIVE_PATH,
+    STREAMS_RELATIVE_PATH, BlurayAnalyzer, BlurayDisc)
+
+
+#: Version of the snapshots' format.
+SNAPSHOT_VERSION = 3
+
+#: Files, and directories of files, kept in the snapshots, relative to the
+#: disc.
+METADATA_RELATIVE_PATHS = (
+    "BDMV/index.bdmv",
+    "BDMV/MovieObject.bdmv",
+    PLAYLISTS_RELATIVE_PATH,
+    CLIPS_RELATIVE_PATH,
+    COVERS_RELATIVE_PATH)
+
+#: Name of the archive's member holding the analysis results.
+RESULTS_MEMBER_NAME = 'snapshot.json'
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is not valid, or misses an analysis result."""
+
+
+def encode_result(result):
+    """Return an analysis result as a JSON-serializable value.
+
+    Values which JSON cannot represent are tagged with their type:
+    dictionaries whose keys are not all strings (e.g., playlists' numbers,
+    or PIDs), tuples, sets and durations.
+
+    :param result: analysis result, made of dictionaries, lists, tuples,
+                   sets, instances of :class:`datetime.timedelta`, strings,
+                   numbers, booleans and `None`
+    :raises TypeError: if the result holds a value of another type
+    """
+    if isinstance(result, dict):
+        if all(isinstance(key, str) for key in result) and\
+                '__type__' not in result:
+            return {
+                key: encode_result(value) for (key, value) in result.items()}
+        return {
+            '__type__': 'dict',
+            'items': [
+                [encode_result(key), encode_result(value)]
+                for (key, value) in result.items()]}
+    if isinstance(result, list):
+        return [encode_result(value) for value in result]
+    if isinstance(result, tuple):
+        return {
+            '__type__': 'tuple',
+            'items': [encode_result(value) for value in result]}
+    if isinstance(result, (set, frozenset)):
+        return {
+            '__type__': 'set',
+            'items': [encode_result(value) for value in result]}
+    if isinstance(result, timedelta):
+        return {
+            '__type__': 'timedelta',
+            'value': [result.days, result.seconds, result.microseconds]}
+    if result is None or isinstance(result, (str, int, float)):
+        return result
+
+    raise TypeError("Unsupported result type {}".format(type(result)))
+
+
+def _decode_object(encoded_object):
+    """Decode a JSON object encoded by :func:`encode_result`."""
+    result_type = encoded_object.get('__type__')
+    if result_type is None:
+        return encoded_object
+    if result_type == 'dict':
+        return {key: value for (key, value) in encoded_object['items']}
+    if result_type == 'tuple':
+        return tuple(encoded_object['items'])
+    if result_type == 'set':
+        return set(encoded_object['items'])
+    if result_type == 'timedelta':
+        (days, seconds, microseconds) = encoded_object['value']
+        return timedelta(
+            days=days, seconds=seconds, microseconds=microseconds)
+
+    raise ValueError("Unsupported result type {}".format(result_type))
+
+
+def decode_result(encoded_result):
+    """Return an analysis result from its JSON representation.
+
+    :param str encoded_result: JSON document of a value returned by
+                               :func:`encode_result`
+    :raises ValueError: if the document is not valid
+    """
+    try:
+        return json.loads(encoded_result, object_hook=_decode_object)
+    except (KeyError, TypeError) as exc:
+        raise ValueError("Invalid result: {}".format(exc))
+
+
+class RecordingCache:
+    """Analysis cache recording the results loaded from or stored in it, on
+    top of another analysis cache, if any.
+
+    :param analysis_cache: instance of :class:`~blu_mkv.cache.AnalysisCache`
+    """
+    def __init__(self, analysis_cache=None):
+        self.analysis_cache = analysis_cache
+        #: Recorded results, by key.
+        self.results = dict()
+
+    def load(self, disc_path, key, fingerprint):
+        """Return a result of the underlying analysis cache, and record it.
+
+        :raises KeyError: if there is no underlying analysis cache, or if the
+                          result is not cached
+        """
+        if self.analysis_cache is None:
+            raise KeyError(key)
+
+        result = self.analysis_cache.load(disc_path, key, fingerprint)
+        self.results[key] = result
+        return result
+
+    def store(self, disc_path, key, fingerprint, result):
+        """Record a result, and store it in the underlying analysis cache."""
+        self.results[key] = result
+        if self.analysis_cache is not None:
+            self.analysis_cache.store(disc_path, key, fingerprint, result)
+
+
+def get_metadata_files(disc_path):
+    """Return the disc's files kept in its snapshots.
+
+    :param str disc_path: path of the Bluray disc. Must points to a
+                          directory
+    :return: paths of the files, relative to the disc
+    :rtype: list
+    """
+    relative_paths = list()
+    for metadata_relative_path in METADATA_RELATIVE_PATHS:
+        metadata_path = Path(str(disc_path), metadata_relative_path)
+        if metadata_path.is_file():
+            relative_paths.append(metadata_relative_path)
+        elif metadata_path.is_dir():
+            relative_paths.extend(
+                '{}/{}'.format(metadata_relative_path, file_path.name)
+                for file_path in sorted(metadata_path.iterdir())
+                if file_path.is_file())
+
+    return relative_paths
+
+
+def export_snapshot(
+        bluray_analyzer, disc_path, snapshot_path, scan_streams=False):
+    """Analyze a disc's movie playlists, and write a snapshot of them.
+
+    All the analyses needed to plan the conversion of the movie playlists
+    are done: playlists' tracks, subtitles' frames counts, clips' tracks (for
+    linked segments), and multiview playlists if Makemkv is available.
+    Results already in the analyzer's analysis cache are reused.
+
+    The snapshot is a gzipped tar archive, replaced atomically.
+
+    :param bluray_analyzer: instance of :class:`~blu_mkv.bluray.BlurayAnalyzer`
+    :param str disc_path: path of the Bluray disc. Must points to a
+                          directory
+    :param str snapshot_path: path of the written snapshot
+                              (e.g., ``movie.snapshot.tar.gz``)
+    :param bool scan_streams: also scan the transport streams of the movie
+                              playlists, for their bitrates. Reads the whole
+                              streams
+    :raises ImportError: if streams are scanned, and NumPy is not installed
+    """
+    recording_cache = RecordingCache(bluray_analyzer.analysis_cache)
+    recording_analyzer = bluray_analyzer.with_analysis_cache(recording_cache)
+    bluray_disc = BlurayDisc(str(disc_path), recording_analyzer)
+
+    if recording_analyzer.makemkv_controller is not None:
+        bluray_disc.multiview_playlists
+
+    clip_names = set()
+    for playlist in bluray_disc.get_movie_playlists():
+        # Frames of all the subtitle tracks are counted: counts of some of
+        # them are taken from these when analyzing the snapshot.
+        playlist.get_forced_subtitles()
+        if scan_streams:
+            playlist.streams_statistics
+
+        try:
+            segments = playlist.segments
+        except (OSError, mpls.PlaylistFileError,
+                clpi.ClipInformationFileError):
+            # Clips cannot be linked without segments anyway.
+            continue
+        clip_names.update(segment['clip_name'] for segment in segments)
+
+    for clip_name in sorted(clip_names):
+        recording_analyzer.get_clip_tracks(str(disc_path), clip_name)
+
+    stream_sizes = {
+        stream_path.stem: stream_path.stat().st_size
+        for stream_path in Path(
+            str(disc_path), STREAMS_RELATIVE_PATH).glob('*.m2ts')}
+
+    results = json.dumps(encode_result({
+        'version': SNAPSHOT_VERSION,
+        'results': recording_cache.results,
+        'stream_sizes': stream_sizes})).encode('utf-8')
+
+    snapshot_path = Path(str(snapshot_path))
+    temporary_path = snapshot_path.with_name(
+        '.{}.{}.tmp'.format(snapshot_path.name, os.getpid()))
+    try:
+        with tarfile.open(str(temporary_path), 'w:gz') as snapshot_file:
+            for relative_path in get_metadata_files(disc_path):
+                snapshot_file.add(
+                    str(Path(str(disc_path), relative_path)),
+                    arcname=relative_path, recursive=False)
+
+            results_info = tarfile.TarInfo(RESULTS_MEMBER_NAME)
+            results_info.size = len(results)
+            results_info.mtime = time.time()
+            snapshot_file.addfile(results_info, io.BytesIO(results))
+
+        os.replace(str(temporary_path), str(snapshot_path))
+    except BaseException:
+        try:
+            os.remove(str(temporary_path))
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class DiscSnapshot:
+    """Snapshot of a Blu-ray disc, extracted to a directory.
+
+    :param str disc_path: directory of the disc's metadata files
+    :param dict results: analysis results, by key (e.g.,
+                         ``playlist_tracks-00800``, see
+                         :class:`~blu_mkv.cache.AnalysisCache`)
+    :param dict stream_sizes: sizes of the clips' stream files in bytes, by
+                              clip name
+    """
+    def __init__(self, disc_path, results, stream_sizes):
+        self.disc_path = disc_path
+        self.results = results
+        self.stream_sizes = stream_sizes
+
+    @classmethod
+    def extract(cls, snapshot_path, directory):
+        """Extract a snapshot written by :func:`export_snapshot`.
+
+        Only the disc's metadata files are extracted, even if the archive
+        holds other files.
+
+        :param str snapshot_path: path of the snapshot
+        :param str directory: directory where the disc's metadata files are
+                              extracted, created if missing
+        :rtype: instance of :class:`.DiscSnapshot`
+        :raises OSError: if the snapshot cannot be read
+        :raises SnapshotError: if the snapshot is not valid
+        """
+        snapshot = None
+        try:
+            with tarfile.open(str(snapshot_path), 'r:gz') as snapshot_file:
+                for member in snapshot_file:
+                    if member.name == RESULTS_MEMBER_NAME:
+                        snapshot = decode_result(
+                            snapshot_file.extractfile(member).read()
+                            .decode('utf-8'))
+                    elif cls._is_metadata_file(member):
+                        file_path = Path(str(directory), member.name)
+                        file_path.parent.mkdir(parents=True, exist_ok=True)
+                        with file_path.open('wb') as metadata_file:
+                            metadata_file.write(
+                                snapshot_file.extractfile(member).read())
+        except (tarfile.TarError, EOFError, ValueError) as exc:
+            raise SnapshotError(
+                "Invalid snapshot {}: {}".format(snapshot_path, exc))
+
+        if (not isinstance(snapshot, dict) or
+                snapshot.get('version') != SNAPSHOT_VERSION):
+            raise SnapshotError(
+                "Invalid snapshot {}: missing or unsupported analysis "
+                "results".format(snapshot_path))
+
+        return cls(
+            str(directory), snapshot['results'], snapshot['stream_sizes'])
+
+    @staticmethod
+    def _is_metadata_file(member):
+        """Return whether an archive's member is a metadata file of the disc,
+        to be extracted.
+
+        Links, and files outside of the disc's metadata directories (e.g.,
+        with absolute paths), are not extracted.
+        """
+        if not member.isfile():
+            return False
+
+        member_path = PurePosixPath(member.name)
+        if member_path.is_absolute() or '..' in member_path.parts:
+            return False
+
+        return any(
+            str(member_path) == metadata_relative_path or
+            str(member_path.parent) == metadata_relative_path
+            for metadata_relative_path in METADATA_RELATIVE_PATHS)
+
+    def get_result(self, key):
+        """Return an analysis result of the disc.
+
+        :param str key: identifier of the analysis on the disc
+        :raises SnapshotError: if the analysis was not done when exporting
+                               the snapshot
+        """
+        try:
+            return self.results[key]
+        except KeyError:
+            raise SnapshotError(
+                "Analysis {} is missing from the snapshot".format(key))
+
+    def get_analyzer(self, **options):
+        """Return an analyzer of the disc, answering from the snapshot.
+
+        :param options: given to :class:`.SnapshotAnalyzer`
+        :rtype: instance of :class:`.SnapshotAnalyzer`
+        """
+        return SnapshotAnalyzer(self, **options)
+
+
+class SnapshotAnalyzer(BlurayAnalyzer):
+    """Blu-ray disc analyzer answering from the analysis results of a
+    snapshot, without running any program.
+
+    Analyses done from the metadata files (e.g., playlists' segments, or
+    covers) are done from the extracted files.
+
+    :param snapshot: instance of :class:`.DiscSnapshot`
+    :param options: given to :class:`~blu_mkv.bluray.BlurayAnalyzer` (e.g.,
+                    progress callbacks)
+    """
+    def __init__(self, snapshot, **options):
+        super().__init__(None, None, **options)
+        self.snapshot = snapshot
+
+    def _get_cached_result(self, disc_path, key, get_dependencies, analyze):
+        """Return an analysis result from the snapshot.
+
+        :raises SnapshotError: if the result is missing from the snapshot
+        """
+        self._raise_if_cancelled()
+        return self.snapshot.get_result(key)
+
+    def _count_subtitles_frames_in_playlist(
+            self, disc_path, playlist_number, track_ids):
+        """Return subtitles' frames counts from the snapshot, taking counts of
+        some tracks from the counts of all the tracks."""
+        try:
+            return super()._count_subtitles_frames_in_playlist(
+                disc_path, playlist_number, track_ids)
+        except SnapshotError:
+            if track_ids is None:
+                raise
+
+        frames_count = super()._count_subtitles_frames_in_playlist(
+            disc_path, playlist_number, None)
+        return {
+            track_id: frames_count[track_id] for track_id in track_ids
+            if track_id in frames_count}
+
+    def identify_multiview_playlists(self, disc_path):
+        """Return numbers of the multiview playlists from the snapshot.
+
+        :raises SnapshotError: if multiview playlists were not identified
+                               when exporting the snapshot (Makemkv not
+                               available)
+        """
+        return self._get_cached_result(
+            disc_path, 'multiview_playlists', None, None)
+
+    def get_clip_size(self, disc_path, clip_name):
+        """Return the size of a clip's stream file, from the snapshot.
+
+        :raises FileNotFoundError: if the stream file was missing when
+                                   exporting the snapshot
+        """
+        try:
+            return self.snapshot.stream_sizes[clip_name]
+        except KeyError:
+            raise FileNotFoundError(
+                "Stream of clip {} is missing from the snapshot".format(
+                    clip_name))
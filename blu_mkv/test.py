@@ -1,3 +1,5 @@
+import struct
+
 from .ffprobe import AbstractFfprobeController
 from .makemkv import AbstractMakemkvController
 from .mkvmerge import AbstractMkvmergeController
@@ -21,7 +23,17 @@ class StubFfprobeController(AbstractFfprobeController):
                 'duration': "7200.000000",
                 'size': "33940936704"}}
 
-    def get_all_bluray_playlist_streams(self, disc_path, playlid_id):
+    def iter_bluray_playlists(self, disc_path):
+        return iter(sorted(self.get_bluray_playlists(disc_path).items()))
+
+    def get_bluray_playlist_numbers(self, disc_path):
+        return sorted(self.get_bluray_playlists(disc_path))
+
+    def get_bluray_playlist(self, disc_path, playlist_number):
+        return self.get_bluray_playlists(disc_path)[playlist_number]
+
+    def get_all_bluray_playlist_streams(
+            self, disc_path, playlid_id, expected_ids=None):
         return [
             {'index': 0, 'codec_type': "video", 'id': "0x1011"},
             {'index': 1, 'codec_type': "audio", 'id': "0x1100"},
@@ -32,12 +44,31 @@ class StubFfprobeController(AbstractFfprobeController):
             {'index': 6, 'codec_type': "subtitle", 'id': "0x1202"}]
 
     def get_bluray_playlist_subtitles_with_frames_count(
-            self, disc_path, playlist_id):
-        return [
+            self, disc_path, playlist_id, track_ids=None):
+        subtitles = [
             {'index': 4, 'nb_read_frames': "999"},
             {'index': 5, 'nb_read_frames': "1000"},
             {'index': 6, 'nb_read_frames': "2000"}]
 
+        return [
+            subtitle for subtitle in subtitles
+            if track_ids is None or subtitle['index'] in track_ids]
+
+    def get_subtitle_packets(self, file_path):
+        # Timestamps are spread over 2 seconds (with a 90 kHz clock).
+        return {
+            'streams': [
+                {'index': 0, 'id': "0x1200"},
+                {'index': 1, 'id': "0x1201"},
+                {'index': 2, 'id': "0x1202"}],
+            'packets': [
+                {'stream_index': 0, 'pts': 0},
+                {'stream_index': 1, 'pts': 0},
+                {'stream_index': 0, 'pts': 30000},
+                {'stream_index': 0, 'pts': 60000},
+                {'stream_index': 1, 'pts': 60000},
+                {'stream_index': 0, 'pts': 120000}]}
+
 
 class StubMkvmergeController(AbstractMkvmergeController):
     def get_file_info(self, file_path):
@@ -113,6 +144,16 @@ class StubMkvmergeController(AbstractMkvmergeController):
 
     def write(
             self, output_file_path, input_tracks, title=None,
+            attachments=None, segment_uid=None):
+        pass
+
+    def write_chunked(
+            self, output_file_path, input_streams, title=None,
+            attachments=None, segment_uid=None, max_workers=None):
+        pass
+
+    def write_ordered_chapters(
+            self, output_file_path, chapters, input_streams, title=None,
             attachments=None):
         pass
 
@@ -143,3 +184,84 @@ class StubMakemkvController(AbstractMakemkvController):
                         0: {'codec_short': "Mpeg4"},
                         1: {'codec_short': "DD"},
                         2: {'codec_short': "PGS"}}}}}
+
+
+def build_playlist(play_items, marks=None):
+    """Return the content of a Blu-ray playlist file.
+
+    :param play_items: list of ``(clip_name, in_time, out_time)`` tuples
+    :param marks: list of ``(play_item, time)`` tuples, for entry marks
+    :rtype: bytes
+    """
+    play_items_data = b''
+    for (clip_name, in_time, out_time) in play_items:
+        play_item = (
+            clip_name.encode('ascii') + b'M2TS' +
+            struct.pack('>HBII', 0x01, 0, in_time, out_time) +
+            bytes(12))
+        play_items_data += struct.pack('>H', len(play_item)) + play_item
+
+    playlist_section = (
+        struct.pack('>HHH', 0, len(play_items), 0) + play_items_data)
+    playlist_section = (
+        struct.pack('>I', len(playlist_section)) + playlist_section)
+
+    marks = marks or []
+    marks_section = struct.pack('>H', len(marks)) + b''.join(
+        struct.pack('>BBHIHI', 0, 1, play_item, time, 0xffff, 0)
+        for (play_item, time) in marks)
+    marks_section = struct.pack('>I', len(marks_section)) + marks_section
+
+    playlist_address = 40
+    marks_address = playlist_address + len(playlist_section)
+    header = (
+        b'MPLS0200' +
+        struct.pack('>III', playlist_address, marks_address, 0))
+    header += bytes(playlist_address - len(header))
+
+    return header + playlist_section + marks_section
+
+
+def build_transport_stream(packets):
+    """Return the content of a Blu-ray transport stream.
+
+    Packets only carry a payload (no adaptation field), filled with zeros.
+
+    :param packets: list of ``(pid, arrival_timestamp, payload_start)``
+                    tuples. Arrival timestamps use a 27 MHz clock
+    :rtype: bytes
+    """
+    transport_stream = b''
+    for (pid, arrival_timestamp, payload_start) in packets:
+        transport_stream += (
+            struct.pack('>I', arrival_timestamp & 0x3fffffff) +
+            struct.pack(
+                '>BHB', 0x47, (0x4000 if payload_start else 0) | pid, 0x10) +
+            bytes(184))
+
+    return transport_stream
+
+
+def build_clip_information(presentation_start_time, presentation_end_time):
+    """Return the content of a Blu-ray clip information file, with a single
+    ATC and STC sequence.
+
+    :param int presentation_start_time: in 45 kHz ticks
+    :param int presentation_end_time: in 45 kHz ticks
+    :rtype: bytes
+    """
+    sequence_info = (
+        struct.pack('>BB', 0, 1) +
+        struct.pack('>IBB', 0, 1, 0) +
+        struct.pack(
+            '>HIII', 0x1001, 0,
+            presentation_start_time, presentation_end_time))
+    sequence_info = struct.pack('>I', len(sequence_info)) + sequence_info
+
+    sequence_info_address = 40
+    header = (
+        b'HDMV0200' +
+        struct.pack('>IIIII', sequence_info_address, 0, 0, 0, 0))
+    header += bytes(sequence_info_address - len(header))
+
+    return header + sequence_info
@@ -0,0 +1,154 @@
+"""Move Matroska files from a local scratch directory to their destination.
+
+Mkvmerge seeks back and forth in the Matroska files it writes, which is
+very slow on network filesystems. Files can instead be written to a local
+scratch directory, and moved afterwards to their destination, sequentially
+and in the kernel as much as possible (with ``copy_file_range`` or
+``sendfile``), without going through user space.
+
+Files only appear at their destination once fully copied, by being renamed
+there atomically. Partial copies left by interrupted moves are removed once
+stale (see :func:`remove_stale_partial_files`).
+"""
+
+import errno
+import os
+from pathlib import Path
+import shutil
+import time
+
+
+#: Size of the copied chunks, in bytes.
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+#: Errors of ``copy_file_range`` and ``sendfile`` meaning they cannot be used
+#: for the given files, rather than a copy failure.
+UNSUPPORTED_COPY_ERRORS = (
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
+
+#: Number of seconds after which a partial copy which is not written anymore
+#: is considered left by an interrupted move.
+STALE_PARTIAL_AGE = 3600
+
+
+def _copy_file_range(src_fd, dst_fd, chunk_size):
+    """Copy a chunk with ``copy_file_range``, from and to the files' current
+    positions."""
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+
+    return os.copy_file_range(src_fd, dst_fd, chunk_size)
+
+
+def _sendfile(src_fd, dst_fd, chunk_size):
+    """Copy a chunk with ``sendfile``, from and to the files' current
+    positions."""
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+
+    offset = os.lseek(src_fd, 0, os.SEEK_CUR)
+    sent_size = os.sendfile(dst_fd, src_fd, offset, chunk_size)
+    os.lseek(src_fd, offset + sent_size, os.SEEK_SET)
+    return sent_size
+
+
+def copy_file_data(src_file, dst_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copy the content of a file into another one, in the kernel if
+    possible.
+
+    ``copy_file_range`` is tried first, then ``sendfile``, and finally a copy
+    through user space.
+
+    :param src_file: file object opened for reading, in binary mode
+    :param dst_file: file object opened for writing, in binary mode
+    :param int chunk_size: size of the copied chunks, in bytes
+    """
+    src_fd = src_file.fileno()
+    dst_fd = dst_file.fileno()
+
+    for copy_chunk in (_copy_file_range, _sendfile):
+        try:
+            while copy_chunk(src_fd, dst_fd, chunk_size):
+                pass
+            return
+        except OSError as exc:
+            if exc.errno not in UNSUPPORTED_COPY_ERRORS:
+                raise
+
+    shutil.copyfileobj(src_file, dst_file, chunk_size)
+
+
+def get_partial_file_path(dst_path):
+    """Return the temporary path of a file copied by :func:`move_file` (e.g.,
+    ``.movie.mkv.partial`` for ``movie.mkv``).
+
+    :param str dst_path: destination path of the file
+    :rtype: str
+    """
+    dst_path = Path(str(dst_path))
+    return str(dst_path.with_name('.{}.partial'.format(dst_path.name)))
+
+
+def remove_stale_partial_files(directory, max_age=STALE_PARTIAL_AGE):
+    """Remove the partial copies left in a directory by interrupted moves
+    (e.g., killed process, or host crash).
+
+    Partial copies modified recently are kept, as they may still be written
+    by another process moving files to the same directory.
+
+    :param str directory: destination directory of moved files
+    :param int max_age: number of seconds since their last modification
+                        after which partial copies are removed
+    :return: paths of the removed files
+    :rtype: list
+    """
+    removed_paths = list()
+    now = time.time()
+    for partial_path in sorted(Path(str(directory)).glob('.*.partial')):
+        try:
+            if now - partial_path.stat().st_mtime < max_age:
+                continue
+            partial_path.unlink()
+        except FileNotFoundError:
+            # Renamed or removed meanwhile.
+            continue
+        removed_paths.append(str(partial_path))
+
+    return removed_paths
+
+
+def move_file(src_path, dst_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Move a file, possibly to another filesystem, so that it only appears
+    at its destination once complete.
+
+    The file is renamed if it stays on the same filesystem. Otherwise, it is
+    copied next to its destination under a temporary name (see
+    :func:`get_partial_file_path`), which is then renamed.
+
+    :param str src_path: path of the file to move
+    :param str dst_path: destination path of the file. Replaced if existing
+    :param int chunk_size: size of the copied chunks, in bytes
+    """
+    try:
+        os.replace(str(src_path), str(dst_path))
+        return
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+
+    temporary_path = get_partial_file_path(dst_path)
+    try:
+        with open(str(src_path), 'rb', buffering=0) as src_file, \
+                open(str(temporary_path), 'wb', buffering=0) as dst_file:
+            copy_file_data(src_file, dst_file, chunk_size)
+            os.fsync(dst_file.fileno())
+
+        os.replace(str(temporary_path), str(dst_path))
+    except BaseException:
+        try:
+            os.remove(str(temporary_path))
+        except FileNotFoundError:
+            pass
+        raise
+
+    os.remove(str(src_path))
@@ -0,0 +1,149 @@
+"""Scanner of Blu-ray transport streams (``BDMV/STREAM/*.m2ts``).
+
+Clips are read by large memory-mapped chunks, and packets' headers are
+parsed as arrays with NumPy: a whole clip is scanned in a single pass, at
+disk speed.
+
+NumPy is an optional dependency, only needed to scan transport streams.
+"""
+
+import os
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+#: Size of a Blu-ray transport stream packet: a 4 bytes header, with the
+#: packet's arrival timestamp, followed by a 188 bytes MPEG-2 TS packet.
+PACKET_SIZE = 192
+
+#: Frequency of the clock used by arrival timestamps.
+ARRIVAL_TICKS_PER_SECOND = 27000000
+
+#: Packets' arrival timestamps are coded on 30 bits, and thus wrap around.
+ARRIVAL_TIMESTAMP_MODULO = 1 << 30
+
+#: PID of null packets, used for padding.
+NULL_PID = 0x1fff
+
+#: Default size of the chunks read at once, in bytes (about 64 MiB).
+DEFAULT_CHUNK_SIZE = 349525 * PACKET_SIZE
+
+
+def scan_transport_stream(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return statistics of each stream (i.e., PID) of a Blu-ray transport
+    stream.
+
+    The returned dictionary has the following keys:
+    - duration: `float`, duration of the transport stream in seconds, based on
+                packets' arrival timestamps
+    - streams: dictionary of streams' statistics, with their PID as key. Each
+      stream's statistics is a dictionary with the following keys:
+      - packets: `int`, number of TS packets
+      - bytes: `int`, size of the payloads carried by these packets
+      - pes_count: `int`, number of PES packets (i.e., of payloads starting
+                   in a TS packet)
+      - bitrate: `float`, average bitrate in bits per second, or `None` if the
+                 duration is unknown
+
+    Null packets and packets without sync byte are skipped.
+
+    :param str file_path: path of the transport stream
+    :param int chunk_size: size in bytes of the chunks read at once
+    :rtype: dict
+    :raises ImportError: if NumPy is not installed
+    """
+    if numpy is None:
+        raise ImportError("NumPy is required to scan transport streams")
+
+    packets_count = os.path.getsize(str(file_path)) // PACKET_SIZE
+    packets_per_chunk = max(1, chunk_size // PACKET_SIZE)
+
+    packets_per_pid = numpy.zeros(NULL_PID + 1, dtype=numpy.int64)
+    bytes_per_pid = numpy.zeros(NULL_PID + 1, dtype=numpy.int64)
+    pes_per_pid = numpy.zeros(NULL_PID + 1, dtype=numpy.int64)
+    arrival_ticks = 0
+    previous_timestamp = None
+
+    for first_packet in range(0, packets_count, packets_per_chunk):
+        chunk = numpy.memmap(
+            str(file_path), dtype=numpy.uint8, mode='r',
+            offset=first_packet * PACKET_SIZE,
+            shape=(min(packets_per_chunk, packets_count - first_packet),
+                   PACKET_SIZE))
+
+        packets = chunk[chunk[:, 4] == 0x47]
+        if len(packets):
+            (pids, payload_sizes, pes_starts) = _parse_packet_headers(packets)
+
+            packets_per_pid += numpy.bincount(pids, minlength=NULL_PID + 1)
+            bytes_per_pid += numpy.bincount(
+                pids, weights=payload_sizes,
+                minlength=NULL_PID + 1).astype(numpy.int64)
+            pes_per_pid += numpy.bincount(
+                pids[pes_starts], minlength=NULL_PID + 1)
+
+            timestamps = _parse_arrival_timestamps(packets)
+            if previous_timestamp is not None:
+                arrival_ticks +=\
+                    (int(timestamps[0]) - previous_timestamp) %\
+                    ARRIVAL_TIMESTAMP_MODULO
+            arrival_ticks += int(numpy.sum(
+                numpy.diff(timestamps) % ARRIVAL_TIMESTAMP_MODULO))
+            previous_timestamp = int(timestamps[-1])
+
+        del chunk
+
+    duration = arrival_ticks / ARRIVAL_TICKS_PER_SECOND
+
+    streams = dict()
+    for pid in numpy.flatnonzero(packets_per_pid[:NULL_PID]):
+        stream_bytes = int(bytes_per_pid[pid])
+        streams[int(pid)] = {
+            'packets': int(packets_per_pid[pid]),
+            'bytes': stream_bytes,
+            'pes_count': int(pes_per_pid[pid]),
+            'bitrate': stream_bytes * 8 / duration if duration else None}
+
+    return {'duration': duration, 'streams': streams}
+
+
+def _parse_packet_headers(packets):
+    """Return PIDs, payload sizes and PES starts of TS packets.
+
+    :param packets: array of packets, with one packet per row
+    :return: a tuple of three arrays
+    """
+    pids = (
+        (packets[:, 5].astype(numpy.int64) & 0x1f) << 8 |
+        packets[:, 6].astype(numpy.int64))
+
+    adaptation_field_control = (packets[:, 7] >> 4) & 0x03
+    has_payload = (adaptation_field_control & 0x01).astype(bool)
+    has_adaptation_field = (adaptation_field_control & 0x02).astype(bool)
+
+    # The adaptation field is preceded by its length, on one byte.
+    adaptation_field_size = numpy.where(
+        has_adaptation_field, packets[:, 8].astype(numpy.int64) + 1, 0)
+    payload_sizes = numpy.where(
+        has_payload,
+        numpy.clip(184 - adaptation_field_size, 0, 184),
+        0)
+
+    pes_starts = has_payload & (packets[:, 5] & 0x40).astype(bool)
+
+    return (pids, payload_sizes, pes_starts)
+
+
+def _parse_arrival_timestamps(packets):
+    """Return arrival timestamps of Blu-ray transport stream packets.
+
+    :param packets: array of packets, with one packet per row
+    :rtype: array
+    """
+    headers = packets[:, :4].astype(numpy.int64)
+    return (
+        headers[:, 0] << 24 | headers[:, 1] << 16 |
+        headers[:, 2] << 8 | headers[:, 3]) & (ARRIVAL_TIMESTAMP_MODULO - 1)
@@ -1,4 +1,17 @@
+from contextlib import contextmanager
+import fcntl
+import os
+from pathlib import Path
 import subprocess
+import tempfile
+import threading
+import time
+
+
+#: Default directory of the pool of mounted disk images.
+DEFAULT_MOUNT_POOL_DIR = os.path.join(tempfile.gettempdir(), 'blu-mkv-mounts')
+
+SYSFS_PATH = '/sys'
 
 
 def mount_disk_image(image_path, mount_point):
@@ -24,3 +37,300 @@ def unmount_disk_image(mount_point):
         'sudo',
         'umount',
         mount_point])
+
+
+def get_backing_file(mount_point, sysfs_path=SYSFS_PATH):
+    """Return the backing file of the loop device mounted on a directory
+    (i.e., the mounted disk image).
+
+    :param str mount_point: directory's path where the loop device is
+                            mounted
+    :param str sysfs_path: mount point of the sysfs file system
+    :return: the backing file's path, or `None` if the directory is not a
+             mounted loop device, or if it cannot be told
+    :rtype: str or None
+    """
+    try:
+        device_id = os.stat(str(mount_point)).st_dev
+        return Path(
+            sysfs_path, 'dev', 'block',
+            '{}:{}'.format(os.major(device_id), os.minor(device_id)),
+            'loop', 'backing_file').read_text().strip()
+    except OSError:
+        return None
+
+
+class MountPool:
+    """Pool of mounted disk images, shared between processes.
+
+    A disk image is only mounted once, even when used by several jobs at the
+    same time or one after another: the mount is reused as long as it is
+    used, and is only unmounted once it has been idle for some time. Disk
+    images are identified by their inode, size and modification time, so
+    that they are found again whatever the path used to reach them, but not
+    mistaken for a replaced image. A mount is also only reused if its loop
+    device is still backed by the disk image.
+
+    Each disk image has its own directory in the pool, with:
+    - ``mnt``: the mount point of the disk image
+    - ``users``: PIDs of the processes using the mount, one per line. Its
+                 modification time tells since when the mount is idle
+    - ``lock``: locked by processes updating the two above
+
+    Users are reference-counted, and processes which died without releasing
+    their mounts are ignored. Idle mounts are unmounted by :meth:`.cleanup`,
+    which should be called when a job starts, and which is called again by
+    a timer once a released disk image has been idle past the timeout
+    (unless the process exits first).
+
+    :param str pool_dir: directory of the pool
+    :param int idle_timeout: number of seconds after which an unused disk
+                             image is unmounted. If set to 0, disk images are
+                             unmounted as soon as they are released
+    :param str sysfs_path: mount point of the sysfs file system, to find the
+                           backing files of the mounts
+    """
+    def __init__(
+            self, pool_dir=DEFAULT_MOUNT_POOL_DIR, idle_timeout=300,
+            sysfs_path=SYSFS_PATH):
+        self.pool_dir = Path(str(pool_dir))
+        self.idle_timeout = idle_timeout
+        self.sysfs_path = sysfs_path
+
+        self._cleanup_timer = None
+        self._cleanup_timer_lock = threading.Lock()
+
+    def get_mount_point(self, image_path):
+        """Return the mount point of a disk image in the pool.
+
+        :param str image_path: disk image's path
+        :rtype: str
+        """
+        return str(self._get_image_dir(image_path).joinpath('mnt'))
+
+    def _get_image_dir(self, image_path):
+        """Return the directory of a disk image in the pool."""
+        image_stat = os.stat(str(image_path))
+        return self.pool_dir.joinpath('{}-{}-{}-{}'.format(
+            image_stat.st_dev, image_stat.st_ino, image_stat.st_size,
+            image_stat.st_mtime_ns))
+
+    @contextmanager
+    def mount(self, image_path):
+        """Use a mounted disk image while in the context.
+
+        :param str image_path: disk image's path
+        :return: the mount point of the disk image
+        """
+        mount_point = self.acquire(image_path)
+        try:
+            yield mount_point
+        finally:
+            self.release(image_path)
+
+    def acquire(self, image_path):
+        """Mount a disk image, or reuse an existing mount, and register the
+        current process as one of its users.
+
+        :param str image_path: disk image's path
+        :return: the mount point of the disk image
+        :rtype: str
+        :raises subprocess.CalledProcessError: if the disk image cannot be
+                                               mounted
+        :raises OSError: if another disk image, still used, is mounted in
+                         place of this one
+        """
+        image_dir = self._get_image_dir(image_path)
+        mount_point = image_dir.joinpath('mnt')
+
+        with self._lock(image_dir):
+            users = self._read_users(image_dir)
+
+            if (os.path.ismount(str(mount_point)) and
+                    not self._is_backed_by(mount_point, image_path)):
+                if users:
+                    raise OSError(
+                        "Another disk image is mounted on {}".format(
+                            mount_point))
+                unmount_disk_image(str(mount_point))
+
+            if not os.path.ismount(str(mount_point)):
+                mount_point.mkdir(exist_ok=True)
+                mount_disk_image(str(image_path), str(mount_point))
+
+            users.append(os.getpid())
+            self._write_users(image_dir, users)
+
+        return str(mount_point)
+
+    def release(self, image_path):
+        """Unregister the current process from the users of a disk image.
+
+        The disk image is unmounted right away only if the idle timeout is
+        0, and if nobody else uses it.
+
+        :param str image_path: disk image's path
+        :raises subprocess.CalledProcessError: if the disk image cannot be
+                                               unmounted
+        """
+        image_dir = self._get_image_dir(image_path)
+
+        with self._lock(image_dir):
+            users = self._read_users(image_dir)
+            try:
+                users.remove(os.getpid())
+            except ValueError:
+                pass
+            self._write_users(image_dir, users)
+
+            if not users and self.idle_timeout == 0:
+                self._unmount(image_dir)
+
+        if self.idle_timeout > 0:
+            self._schedule_cleanup()
+
+    def _is_backed_by(self, mount_point, image_path):
+        """Return whether a mount point is backed by a disk image, or if it
+        cannot be told."""
+        backing_file = get_backing_file(mount_point, self.sysfs_path)
+        if backing_file is None:
+            return True
+
+        try:
+            backing_stat = os.stat(backing_file)
+        except OSError:
+            # E.g., the mounted disk image was deleted meanwhile.
+            return False
+
+        image_stat = os.stat(str(image_path))
+        return (
+            (backing_stat.st_dev, backing_stat.st_ino) ==
+            (image_stat.st_dev, image_stat.st_ino))
+
+    def _schedule_cleanup(self):
+        """Call :meth:`.cleanup` once released disk images have been idle
+        past the timeout, from a background thread not preventing the process
+        from exiting."""
+        with self._cleanup_timer_lock:
+            if self._cleanup_timer is not None:
+                self._cleanup_timer.cancel()
+
+            # A second more, for the idle time to be past the timeout.
+            self._cleanup_timer = threading.Timer(
+                self.idle_timeout + 1, self.cleanup)
+            self._cleanup_timer.daemon = True
+            self._cleanup_timer.start()
+
+    def close(self):
+        """Cancel the scheduled cleanup, if any."""
+        with self._cleanup_timer_lock:
+            if self._cleanup_timer is not None:
+                self._cleanup_timer.cancel()
+                self._cleanup_timer = None
+
+    def cleanup(self):
+        """Unmount disk images which have been idle for too long, including
+        the ones left by processes which died without releasing them.
+
+        Disk images which cannot be unmounted (e.g., still busy) are left
+        mounted.
+
+        :return: mount points of the unmounted disk images
+        :rtype: list
+        """
+        if not self.pool_dir.is_dir():
+            return []
+
+        unmounted_points = list()
+        for image_dir in sorted(self.pool_dir.iterdir()):
+            if not image_dir.is_dir():
+                continue
+
+            with self._lock(image_dir):
+                users = self._read_users(image_dir)
+                self._write_users(image_dir, users, touch=False)
+                if users or not self._is_idle(image_dir):
+                    continue
+
+                try:
+                    if self._unmount(image_dir):
+                        unmounted_points.append(
+                            str(image_dir.joinpath('mnt')))
+                except subprocess.CalledProcessError:
+                    continue
+
+        return unmounted_points
+
+    @staticmethod
+    @contextmanager
+    def _lock(image_dir):
+        """Lock a disk image's directory, while in the context."""
+        image_dir.mkdir(parents=True, exist_ok=True)
+        with open(str(image_dir.joinpath('lock')), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_users(image_dir):
+        """Return PIDs of the living users of a disk image."""
+        try:
+            users = [
+                int(line) for line in
+                image_dir.joinpath('users').read_text().split()]
+        except FileNotFoundError:
+            return []
+
+        return [user for user in users if is_process_alive(user)]
+
+    @staticmethod
+    def _write_users(image_dir, users, touch=True):
+        """Write PIDs of the users of a disk image.
+
+        Unless ``touch`` is false, the idle time of the disk image is reset.
+        """
+        users_file = image_dir.joinpath('users')
+        if users_file.exists():
+            users_stat = users_file.stat()
+        else:
+            users_stat = None
+
+        users_file.write_text(''.join('{}\n'.format(user) for user in users))
+
+        if not touch and users_stat is not None:
+            os.utime(
+                str(users_file),
+                ns=(users_stat.st_atime_ns, users_stat.st_mtime_ns))
+
+    def _is_idle(self, image_dir):
+        """Return whether a disk image is unused since the idle timeout."""
+        try:
+            last_use = image_dir.joinpath('users').stat().st_mtime
+        except FileNotFoundError:
+            return True
+
+        return time.time() - last_use >= self.idle_timeout
+
+    @staticmethod
+    def _unmount(image_dir):
+        """Unmount a disk image, if mounted, and return whether it was."""
+        mount_point = image_dir.joinpath('mnt')
+        if not os.path.ismount(str(mount_point)):
+            return False
+
+        unmount_disk_image(str(mount_point))
+        return True
+
+
+def is_process_alive(pid):
+    """Return whether a process is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
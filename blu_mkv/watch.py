@@ -0,0 +1,338 @@
+"""Watch inbox directories for new discs, and convert them as they arrive.
+
+Directories are watched with inotify on Linux, so that new discs are noticed
+right away; elsewhere, they are scanned periodically. A disc is only queued
+once fully written, i.e., once its file has not changed for some time.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+from pathlib import Path
+import select
+import struct
+import threading
+import time
+
+from .jobqueue import get_worker_name
+from .process import is_killed_by_signal
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+#: Events signaling that a file may have been added or modified.
+INBOX_EVENTS = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """Minimal interface with Linux's inotify.
+
+    :raises OSError: if inotify is not available
+    """
+    def __init__(self):
+        library_name = ctypes.util.find_library('c')
+        if library_name is None:
+            raise OSError("The C library cannot be found")
+
+        self._libc = ctypes.CDLL(library_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("Inotify is not available")
+
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self._raise_error()
+
+        self.watched_directories = dict()
+
+    def _raise_error(self):
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+    def close(self):
+        """Stop watching directories."""
+        os.close(self.fd)
+
+    def add_watch(self, directory, mask=INBOX_EVENTS):
+        """Watch events of files inside a directory.
+
+        :param str directory: path of the directory
+        :param int mask: events to watch
+        """
+        watch_descriptor = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(str(directory)), mask)
+        if watch_descriptor < 0:
+            self._raise_error()
+
+        self.watched_directories[watch_descriptor] = str(directory)
+
+    def read_events(self, timeout=None):
+        """Wait for events, and return them.
+
+        :param float timeout: how many seconds to wait for events, at most
+        :return: list of ``(path, mask)`` tuples. If some events were lost,
+                 an event with a `None` path and the :data:`IN_Q_OVERFLOW`
+                 mask is returned
+        :rtype: list
+        """
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = list()
+        offset = 0
+        while offset < len(data):
+            (watch_descriptor, mask, _, name_length) =\
+                INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+
+            directory = self.watched_directories.get(watch_descriptor)
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif directory is not None and name:
+                events.append((os.path.join(directory, os.fsdecode(name)),
+                               mask))
+
+        return events
+
+
+class InboxWatcher:
+    """Find discs added to inbox directories, once fully written.
+
+    :param list directories: paths of the inbox directories
+    :param list patterns: patterns of the discs' file names
+    :param float settle_time: how many seconds a disc must stay unchanged
+                              before being considered fully written
+    :param float poll_interval: how many seconds between two scans of the
+                                directories, when inotify is not available
+    :param bool use_inotify: whether inotify is used, when available
+    """
+    def __init__(
+            self, directories, patterns=('*.iso',), settle_time=5,
+            poll_interval=10, use_inotify=True):
+        self.directories = [str(directory) for directory in directories]
+        self.patterns = patterns
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+                for directory in self.directories:
+                    self._inotify.add_watch(directory)
+            except OSError:
+                self.close()
+
+        # Files not yet fully written, with their last seen size and
+        # modification time, and since when they did not change.
+        self._candidates = dict()
+        # Files already returned, with their size and modification time then.
+        self._settled_files = dict()
+        self._last_scan = None
+
+    def close(self):
+        """Stop watching the directories."""
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def is_disc(self, file_path):
+        """Return whether a file matches the discs' patterns.
+
+        :param str file_path: path of the file
+        :rtype: bool
+        """
+        file_name = os.path.basename(file_path)
+        return any(
+            fnmatch.fnmatch(file_name, pattern) for pattern in self.patterns)
+
+    def scan(self):
+        """Look for discs in the directories, e.g., added while not
+        watching."""
+        for directory in self.directories:
+            for file_path in Path(directory).iterdir():
+                if self.is_disc(str(file_path)):
+                    self._add_candidate(str(file_path))
+
+        self._last_scan = time.monotonic()
+
+    def _add_candidate(self, file_path):
+        """Wait for a file to be fully written."""
+        self._candidates.setdefault(file_path, None)
+
+    def poll(self, timeout=1):
+        """Wait for new discs, and return the ones which are now fully
+        written.
+
+        Each fully written disc is only returned once.
+
+        :param float timeout: how many seconds to wait for new discs, at most
+        :return: paths of the fully written discs
+        :rtype: list
+        """
+        if self._last_scan is None:
+            self.scan()
+
+        if self._inotify is not None:
+            # Wait less when files are being written, to notice early when
+            # they are done.
+            if self._candidates:
+                timeout = min(timeout, self.settle_time)
+
+            for (file_path, mask) in self._inotify.read_events(timeout):
+                if file_path is None:
+                    self.scan()
+                elif self.is_disc(file_path):
+                    self._add_candidate(file_path)
+        else:
+            time.sleep(timeout)
+            if time.monotonic() - self._last_scan >= self.poll_interval:
+                self.scan()
+
+        return self._pop_settled_files()
+
+    def _pop_settled_files(self):
+        """Return files which did not change for the settle time, and stop
+        waiting for them."""
+        now = time.monotonic()
+        settled_files = list()
+
+        for (file_path, last_seen) in list(self._candidates.items()):
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                # Removed (or renamed) before being fully written.
+                del self._candidates[file_path]
+                continue
+
+            file_state = (file_stat.st_size, file_stat.st_mtime_ns)
+            if (last_seen is None and
+                    self._settled_files.get(file_path) == file_state):
+                # Already returned, and not modified since.
+                del self._candidates[file_path]
+            elif last_seen is None or last_seen[0] != file_state:
+                self._candidates[file_path] = (file_state, now)
+            elif now - last_seen[1] >= self.settle_time:
+                del self._candidates[file_path]
+                self._settled_files[file_path] = file_state
+                settled_files.append(file_path)
+
+        return sorted(settled_files)
+
+
+class ConversionInterrupted(Exception):
+    """Raised when a conversion fails while the daemon is being stopped,
+    likely interrupted by the same signal, or because it was killed by a
+    termination signal."""
+
+
+class InboxDaemon:
+    """Queue discs found in inbox directories, and convert them.
+
+    Discs are queued in a persistent :class:`~blu_mkv.jobqueue.JobQueue`, so
+    that they are neither lost nor converted twice across restarts: when
+    starting, jobs left running by a previous daemon are converted again, and
+    discs already queued are ignored.
+
+    The queue is only used from the thread calling :meth:`.run`, while
+    conversions run in other threads. Conversions failing once the daemon is
+    being stopped are put back in the queue rather than marked as failed, as
+    they were likely interrupted (e.g., by a signal sent to all the
+    processes of a service): they are converted again on the next start.
+    Conversions failing because a program was killed by a termination
+    signal (see :func:`~blu_mkv.process.is_killed_by_signal`) are put back
+    in the queue too.
+
+    :param watcher: finds new discs, instance of :class:`.InboxWatcher`
+    :param job_queue: instance of :class:`~blu_mkv.jobqueue.JobQueue`
+    :param convert: called with the path of a disc to convert it. Must raise
+                    an exception if the conversion fails
+    :param int max_workers: maximum number of discs converted at once
+    """
+    def __init__(self, watcher, job_queue, convert, max_workers=1):
+        self.watcher = watcher
+        self.job_queue = job_queue
+        self.convert = convert
+        self.max_workers = max_workers
+        self.worker = get_worker_name()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Stop queuing and starting conversions. Running conversions are
+        waited for by :meth:`.run`."""
+        self._stop_event.set()
+
+    def run(self, poll_timeout=1):
+        """Watch inbox directories and convert discs, until stopped.
+
+        :param float poll_timeout: how many seconds to wait for new discs,
+                                   before checking for finished conversions
+        """
+        self.job_queue.requeue_abandoned_jobs()
+        running_jobs = dict()
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while not self._stop_event.is_set():
+                for disc_path in self.watcher.poll(poll_timeout):
+                    try:
+                        self.job_queue.add(disc_path)
+                    except OSError:
+                        continue
+
+                self._record_finished_jobs(running_jobs)
+
+                while len(running_jobs) < self.max_workers:
+                    job = self.job_queue.claim(self.worker)
+                    if job is None:
+                        break
+
+                    future = executor.submit(self._convert, job['path'])
+                    running_jobs[future] = job['id']
+
+            wait(running_jobs)
+            self._record_finished_jobs(running_jobs)
+
+    def _convert(self, disc_path):
+        """Convert a disc, telling apart interrupted conversions.
+
+        :raises ConversionInterrupted: if the conversion fails once the
+                                       daemon is being stopped, or because a
+                                       program was killed by a termination
+                                       signal
+        """
+        try:
+            self.convert(disc_path)
+        except Exception as exc:
+            if self._stop_event.is_set() or is_killed_by_signal(exc):
+                raise ConversionInterrupted(str(exc)) from exc
+            raise
+
+    def _record_finished_jobs(self, running_jobs):
+        """Record the result of finished conversions in the queue."""
+        (finished_futures, _) =\
+            wait(running_jobs, timeout=0, return_when=FIRST_COMPLETED)
+
+        for future in finished_futures:
+            job_id = running_jobs.pop(future)
+            error = future.exception()
+            if error is None:
+                self.job_queue.complete(job_id)
+            elif isinstance(error, ConversionInterrupted):
+                self.job_queue.retry(job_id)
+            else:
+                self.job_queue.fail(job_id, str(error) or repr(error))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""Provide a script to record Blu-ray discs in a catalog, and to query it."""
+
+import argparse
+from pathlib import Path
+import sys
+
+
+def add(args):
+    bluray_path = Path(args.src_disc)
+    if not bluray_path.is_dir():
+        sys.exit("{} must points to a directory".format(bluray_path))
+
+    all_controllers = list()
+    for (controller_name, controller_class, controller_options) in [
+            ('Ffprobe', FfprobeController, {'fast_probe': args.fast_probe}),
+            ('Mkvmerge', MkvmergeController, dict()),
+            ('Makemkv', MakemkvController, dict())]:
+        try:
+            all_controllers.append(controller_class(**controller_options))
+        except FileNotFoundError as exc:
+            if controller_class is MakemkvController:
+                # Makemkv is optional: multiview playlists are just not
+                # identified without it.
+                continue
+            sys.exit(
+                "Unable to locate {}'s executable: {}"
+                .format(controller_name, exc))
+
+    bluray_analyzer = bluray.BlurayAnalyzer(*all_controllers)
+    bluray_disc = bluray.BlurayDisc(str(bluray_path), bluray_analyzer)
+
+    catalog = BlurayCatalog(args.catalog)
+    try:
+        print("Start disc analysis")
+        if args.all_playlists:
+            playlists = bluray_disc.playlists
+        else:
+            playlists = None
+
+        catalog.add_disc(
+            bluray_disc,
+            playlists=playlists,
+            detect_forced_subtitles=not args.skip_forced_subtitles)
+        print("Disc {} added to the catalog".format(bluray_path))
+    finally:
+        catalog.close()
+
+
+def search(args):
+    catalog = BlurayCatalog(args.catalog)
+    try:
+        tracks = catalog.search_tracks(
+            track_type=args.type,
+            language_code=args.language,
+            codec=args.codec,
+            forced=True if args.forced else None,
+            movies_only=args.movies_only)
+    finally:
+        catalog.close()
+
+    for track in tracks:
+        print("{disc_path}\t{playlist_number:05d}\t{track_id}\t{type}\t"
+              "{language_code}\t{codec}\t{forced}".format(**track))
+
+
+if __name__ == '__main__':
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+    from blu_mkv import bluray
+    from blu_mkv.catalog import BlurayCatalog
+    from blu_mkv.ffprobe import FfprobeController
+    from blu_mkv.makemkv import MakemkvController
+    from blu_mkv.mkvmerge import MkvmergeController
+
+    parser = argparse.ArgumentParser(
+        description="Record Blu-ray discs in a catalog, and query it.")
+    parser.add_argument(
+        'catalog',
+        help="Path of the catalog's database. Created if missing.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    add_parser = subparsers.add_parser(
+        'add', help="Analyze a Blu-ray disc and record it in the catalog.")
+    add_parser.set_defaults(function=add)
+    add_parser.add_argument(
+        'src_disc',
+        help="Blu-ray source. Must be a directory.")
+    add_parser.add_argument(
+        '-ap', '--all_playlists',
+        action='store_true',
+        help="Record tracks of all playlists, not only movie playlists.")
+    add_parser.add_argument(
+        '-fp', '--fast_probe',
+        action='store_true',
+        help=(
+            "Probe playlists with Ffprobe as little as possible, and deeper "
+            "only if streams are missing."))
+    add_parser.add_argument(
+        '-sfs', '--skip_forced_subtitles',
+        action='store_true',
+        help="Do not identify forced subtitles (time-consuming operation).")
+
+    search_parser = subparsers.add_parser(
+        'search', help="Search tracks in the catalog.")
+    search_parser.set_defaults(function=search)
+    search_parser.add_argument(
+        '-t', '--type',
+        choices=['video', 'audio', 'subtitle'],
+        help="Type of the tracks.")
+    search_parser.add_argument(
+        '-l', '--language',
+        help="Language of the tracks, in ISO639-2 format (e.g., fre).")
+    search_parser.add_argument(
+        '-c', '--codec',
+        help="Codec of the tracks, as named by Mkvmerge "
+             "(e.g., \"DTS-HD Master Audio\").")
+    search_parser.add_argument(
+        '-f', '--forced',
+        action='store_true',
+        help="Only search forced subtitles.")
+    search_parser.add_argument(
+        '-m', '--movies_only',
+        action='store_true',
+        help="Only search in movie playlists.")
+
+    args = parser.parse_args()
+    args.function(args)
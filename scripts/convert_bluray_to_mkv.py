@@ -4,178 +4,293 @@
 
 import argparse
 from pathlib import Path
+import signal
 import subprocess
 import sys
+import tempfile
 
 
-def main(args):
+def print_copy_progress(copied_size, total_size, file_path):
+    print(
+        "\r{:.0%} copied".format(copied_size / total_size),
+        end='', flush=True)
+
+
+def print_probed_playlist(disc_path, playlist_number, playlist_info):
+    print("Found playlist {} ({})".format(
+        playlist_number, playlist_info['duration']))
+
+
+def get_timeout_policy(args):
+    if args.timeout is None:
+        return None
+
+    return TimeoutPolicy(
+        args.timeout, duration_factor=args.timeout_factor,
+        unknown_duration_timeout=args.timeout_unknown_duration)
+
+
+def cancel_on_signals(cancellation_token):
+    # Kill the running programs on Ctrl+C or termination, so that the disk
+    # image is still released.
+    def cancel(signal_number, frame):
+        if cancellation_token.cancelled:
+            # Interrupt anyway on a second signal (e.g., while copying).
+            raise KeyboardInterrupt
+        cancellation_token.cancel()
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, cancel)
+
+
+def tune_io(args, io_limiter, bluray_path, disk_image_path):
+    # Measure the throughputs of the disc (reading the disk image itself
+    # rather than its mount) and of the directory where Mkvmerge writes.
+    print("Measure throughputs")
+    throughputs = preflight(
+        str(disk_image_path or bluray_path),
+        args.scratch_dir or args.dst_dir,
+        max_concurrency=args.autotune)
+    for (concurrency, throughput) in sorted(
+            throughputs['read_throughputs'].items()):
+        print("Read {:.0f} MiB/s with {} readers".format(
+            throughput / 2 ** 20, concurrency))
+    print("Write {:.0f} MiB/s".format(
+        throughputs['write_throughput'] / 2 ** 20))
+
+    # Keep adjusting the number of concurrent readers of the disc while
+    # converting it, for the other conversions reading it too.
+    throughput_tuner = ThroughputTuner.for_path(
+        io_limiter, str(bluray_path), max_width=args.autotune)
+    io_limiter.set_width(
+        throughput_tuner.device, throughputs['read_concurrency'])
+    throughput_tuner.start()
+    return (throughput_tuner, throughputs)
+
+
+def save_plan(args, plan):
+    if args.save_plan:
+        plan.save(args.save_plan)
+        print("Conversion plan saved to {}".format(args.save_plan))
+
+
+def plan_and_convert(args, bluray_disc, metrics, **options):
+    # Plan the conversion of all movie playlists (not bonuses) found on the
+    # disc, and convert them unless only planned.
+    try:
+        return convert_disc(
+            bluray_disc, args.title, args.dst_dir, disc_path=args.src_disc,
+            plan_options=get_plan_options(args), metrics=metrics,
+            on_message=print, **options)
+    except ConversionPlanError as exc:
+        sys.exit(
+            "{}. Consider increasing the value for the "
+            "'--playlists_count' option".format(exc))
+
+
+def plan_from_snapshot(args, metrics):
+    # Plan the conversion from a snapshot of the disc, without reading the
+    # disc itself.
+    with tempfile.TemporaryDirectory(prefix='blu-mkv-snapshot-') as\
+            snapshot_dir:
+        try:
+            snapshot = DiscSnapshot.extract(args.from_snapshot, snapshot_dir)
+        except (OSError, SnapshotError) as exc:
+            sys.exit("Unable to extract snapshot: {}".format(exc))
+
+        bluray_disc = bluray.BlurayDisc.from_snapshot(
+            snapshot, on_playlist_probed=print_probed_playlist)
+        try:
+            plan_and_convert(
+                args, bluray_disc, metrics, execute=False,
+                on_planned=lambda plan: save_plan(args, plan))
+        except SnapshotError as exc:
+            sys.exit("Unable to plan the conversion: {}".format(exc))
+
+
+def convert(args, metrics):
+    if args.from_snapshot:
+        plan_from_snapshot(args, metrics)
+        return
+
     bluray_path = Path(args.src_disc)
     destination_directory = Path(args.dst_dir)
+    cancellation_token = CancellationToken()
+    cancel_on_signals(cancellation_token)
 
-    # Mount the Blu-ray disc if it is a disk image.
+    # Mount the Blu-ray disc if it is a disk image, or reuse an existing
+    # mount of it. Mounts left idle by previous jobs are cleaned up first.
+    mount_pool = utils.MountPool(idle_timeout=args.mount_timeout)
+    mount_pool.cleanup()
     if bluray_path.is_file():
-        mount_point = Path('/tmp', bluray_path.stem)
-
+        disk_image_path = bluray_path
         try:
-            mount_point.mkdir()
-            utils.mount_disk_image(str(bluray_path), str(mount_point))
+            with metrics.count_failures('mount'):
+                bluray_path = Path(mount_pool.acquire(str(disk_image_path)))
         except (OSError, subprocess.CalledProcessError) as exc:
-            mount_point.rmdir()
             sys.exit("Unable to mount disk image: {}".format(exc))
-        else:
-            bluray_path = mount_point
     else:
-        mount_point = None
+        disk_image_path = None
 
+    disc_copy = None
+    throughput_tuner = None
     try:
+        # Copy the disc to a fast local cache, to analyze and remux it from
+        # there.
+        if args.rip_dir:
+            print("Copy disc to {}".format(args.rip_dir))
+            disc_copy = DiscCopy(
+                bluray_path, args.rip_dir, on_progress=print_copy_progress)
+            try:
+                with metrics.count_failures('copy'):
+                    bluray_path = Path(disc_copy.copy())
+            except OSError as exc:
+                sys.exit("Unable to copy disc: {}".format(exc))
+            finally:
+                print()
+
         # Initialize Ffprobe, Makemkv and Mkvmerge controllers
-        # to analyze the disc.
+        # to analyze the disc. They share the same I/O limiter, so that they
+        # do not read the disc concurrently, and the same resource policy.
+        io_limiter = DeviceLimiter(
+            solid_state_width=args.io_width, lock_dir=args.lock_dir)
+        resource_policy = ResourcePolicy.from_arguments(args)
+        timeout_policy = get_timeout_policy(args)
+        if args.autotune:
+            (throughput_tuner, throughputs) = tune_io(
+                args, io_limiter, bluray_path, disk_image_path)
         all_controllers = list()
-        for (controller_name, controller_class) in [
-                ('Ffprobe', FfprobeController),
-                ('Mkvmerge', MkvmergeController),
-                ('Makemkv', MakemkvController)]:
+        for (controller_name, controller_class, controller_options) in [
+                ('Ffprobe', FfprobeController,
+                 {'fast_probe': args.fast_probe}),
+                ('Mkvmerge', MkvmergeController,
+                 {'hash_outputs': args.hash_outputs}),
+                ('Makemkv', MakemkvController, dict())]:
             try:
-                all_controllers.append(controller_class())
+                all_controllers.append(controller_class(
+                    io_limiter=io_limiter, resource_policy=resource_policy,
+                    timeout_policy=timeout_policy, **controller_options))
             except FileNotFoundError as exc:
                 sys.exit(
                     "Unable to locate {}'s executable: {}"
                     .format(controller_name, exc))
 
-        bluray_analyzer = bluray.BlurayAnalyzer(*all_controllers)
+        if args.cache_dir:
+            analysis_cache = AnalysisCache(args.cache_dir)
+        else:
+            analysis_cache = None
+
+        bluray_analyzer = bluray.BlurayAnalyzer(
+            *all_controllers, analysis_cache=analysis_cache,
+            on_playlist_probed=print_probed_playlist,
+            cancellation_token=cancellation_token, metrics=metrics)
         bluray_disc = bluray.BlurayDisc(bluray_path, bluray_analyzer)
 
-        # Convert all movie playlists (not bonuses) found on the disc.
-        print("Start disc analysis")
-        movie_playlists = bluray_disc.get_movie_playlists()
-        movie_playlists_count = len(movie_playlists)
-        print("Found {} movie playlist(s)".format(movie_playlists_count))
-        if (args.playlists_count and
-                movie_playlists_count > args.playlists_count):
-            sys.exit(
-                "Only {} playlist(s) can be converted. "
-                "Consider increasing the value for the '--playlists_count' "
-                "option".format(args.playlists_count))
-
-        for (playlist_count, playlist) in enumerate(
-                bluray_disc.get_movie_playlists(), start=1):
-            print("Start analysis of playlist {}".format(playlist.number))
-
-            if args.detect_3d is True and playlist.has_multiview():
-                print(
-                    "Skip playlist {}: "
-                    "conversion of 3D playlists is currently not supported"
-                    .format(playlist.number))
-                continue
-
-            # Only the biggest disc cover is kept.
-            cover_art = bluray_disc.get_biggest_cover()
-            if cover_art is not None:
-                attachments = [{
-                    'type': 'jpeg',
-                    'name': 'cover.jpg',
-                    'path': cover_art['path']}]
-            else:
-                attachments = None
-
-            mkv_tracks = []
-            # Video tracks are kept unchanged.
-            for (track_count, track_id) in enumerate(playlist.video_tracks):
-                mkv_tracks.append({
-                    'file_path': playlist.path,
-                    'id': track_id,
-                    'type': 'video',
-                    'properties': {
-                        'default': True if track_count == 0 else False}})
-
-            # Audio tracks are filtered/sorted by language.
-            #  Multi-languages tracks are always kept, as it is not possible to
-            #  know which languages they contain. The same behavior is applied
-            #  for tracks with undetermined language.
-            audio_filters = {'language_code': ["mis", "mul", "und"]}
-            if args.audio_languages:
-                audio_filters['language_code'].extend(args.audio_languages)
-
-            audio_tracks = helpers.filter_tracks(
-                playlist.audio_tracks, **audio_filters)
-            audio_tracks = helpers.sort_tracks(
-                audio_tracks, properties=['language_code'])
-
-            for track_id in audio_tracks:
-                mkv_tracks.append({
-                    'file_path': playlist.path,
-                    'id': track_id,
-                    'type': 'audio',
-                    'properties': {
-                        'default': False}})
-
-            # Subtitle tracks are filtered/sorted by language.
-            subtitle_filters = dict()
-            if args.subtitle_languages:
-                subtitle_filters['language_code'] = args.subtitle_languages
-
-            subtitle_tracks = helpers.filter_tracks(
-                playlist.subtitle_tracks, **subtitle_filters)
-            subtitle_tracks = helpers.sort_tracks(
-                subtitle_tracks, properties=['language_code'])
-
-            # Forced subtitles are identified and filtered by language.
-            print("Identifying forced subtitles...")
-            forced_subtitles_ids =\
-                set(playlist.get_forced_subtitles()) & set(subtitle_tracks)
-
-            for track_id in subtitle_tracks:
-                if track_id in forced_subtitles_ids:
-                    forced_flag = True
-                    # Forced subtitles are tagged to be easily identified on
-                    # media players which do not display forced flags.
-                    track_name = args.forced_subtitle_names or ''
-                else:
-                    forced_flag = False
-                    track_name = ''
-
-                mkv_tracks.append({
-                    'file_path': playlist.path,
-                    'id': track_id,
-                    'type': 'subtitle',
-                    'properties': {
-                        'default': False,
-                        'forced': forced_flag,
-                        'name': track_name}})
-
-            if movie_playlists_count > 1:
-                mkv_file_name =\
-                    "{} - {}.mkv".format(args.title, playlist_count)
-            else:
-                mkv_file_name = "{}.mkv".format(args.title)
-            mkv_file_path = str(destination_directory / mkv_file_name)
-
-            # Convert the playlist with Mkvmerge.
-            print("Convert playlist {}".format(playlist.number))
-            bluray_analyzer.mkvmerge_controller.write(
-                mkv_file_path,
-                mkv_tracks,
-                title=args.title,
-                attachments=attachments)
+        # Remux in chunks if several remuxes are worth it, letting the tuner
+        # add remuxes up to its maximum.
+        parallel_remux = args.parallel_remux
+        if args.autotune and not parallel_remux and\
+                throughputs['remux_concurrency'] > 1:
+            parallel_remux = throughput_tuner.max_width
+
+        def on_planned(plan):
+            save_plan(args, plan)
+            if args.autotune and not args.analyze_only:
+                io_limiter.set_width(
+                    throughput_tuner.device, throughputs['remux_concurrency'])
+                print("Remux with {} Mkvmerge processes at once".format(
+                    throughputs['remux_concurrency']))
+
+        # Resume an interrupted conversion from its checkpoint, without
+        # analyzing the disc again, or plan the conversion. Then convert the
+        # playlists with Mkvmerge.
+        if args.resume:
+            checkpoint_path = destination_directory.joinpath(
+                '{}.checkpoint.json'.format(args.title))
+        else:
+            checkpoint_path = None
+        (plan, resumed) = plan_and_convert(
+            args, bluray_disc, metrics, checkpoint_path=checkpoint_path,
+            execute=not args.analyze_only, parallel_remux=parallel_remux,
+            scratch_dir=args.scratch_dir, on_planned=on_planned)
+
+        # Record the disc analysis, for further library-wide queries. The
+        # planned playlists are recorded with the plan's forced subtitles,
+        # without analyzing them again. Resumed conversions are not recorded,
+        # as the disc has not been analyzed.
+        if args.catalog and resumed:
+            print("Skip catalog: conversion resumed from {}".format(
+                checkpoint_path))
+        elif args.catalog:
+            planned_playlists_numbers = {
+                output['playlist_number'] for output in plan.outputs}
+            catalog = BlurayCatalog(args.catalog)
+            try:
+                with metrics.count_failures('catalog'):
+                    catalog.add_disc(
+                        bluray_disc,
+                        playlists=[
+                            playlist for playlist in bluray_disc.playlists
+                            if playlist.number in planned_playlists_numbers],
+                        disc_path=args.src_disc,
+                        forced_subtitles=plan.get_forced_subtitles(),
+                        identify_multiview=args.detect_3d)
+            finally:
+                catalog.close()
+
+        metrics.increment('blu_mkv_discs_processed_total')
     finally:
-        # Unmount the Blu-ray disc if it is a disk image.
-        if mount_point is not None:
+        if throughput_tuner is not None:
+            throughput_tuner.stop()
+        if disc_copy is not None:
+            disc_copy.evict()
+
+        # Release the Blu-ray disc if it is a disk image. It is only
+        # unmounted once idle for long enough.
+        if disk_image_path is not None:
             try:
-                utils.unmount_disk_image(str(mount_point))
-            except subprocess.CalledProcessError as exc:
+                mount_pool.release(str(disk_image_path))
+            except (OSError, subprocess.CalledProcessError) as exc:
                 sys.exit("Unable to unmount disk image: {}".format(exc))
 
-            mount_point.rmdir()
+
+def main(args):
+    # Record metrics of the conversion, for Prometheus.
+    metrics = Metrics()
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = metrics.serve(args.metrics_port)
+
+    try:
+        convert(args, metrics)
+    finally:
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
 if __name__ == '__main__':
     sys.path.append(str(Path(__file__).resolve().parents[1]))
 
     from blu_mkv import bluray
-    from blu_mkv import helpers
+    from blu_mkv import resources
     from blu_mkv import utils
+    from blu_mkv.autotune import ThroughputTuner, preflight
+    from blu_mkv.cache import AnalysisCache
+    from blu_mkv.catalog import BlurayCatalog
     from blu_mkv.ffprobe import FfprobeController
+    from blu_mkv.iolimit import DEFAULT_LOCK_DIR, DeviceLimiter
     from blu_mkv.makemkv import MakemkvController
+    from blu_mkv.metrics import Metrics
     from blu_mkv.mkvmerge import MkvmergeController
+    from blu_mkv.plan import (
+        ConversionPlanError, add_arguments as add_plan_arguments,
+        convert_disc, get_plan_options)
+    from blu_mkv.process import (
+        CancellationToken, OperationCancelled, TimeoutPolicy)
+    from blu_mkv.resources import ResourcePolicy
+    from blu_mkv.rip import DiscCopy
+    from blu_mkv.snapshot import DiscSnapshot, SnapshotError
 
     parser = argparse.ArgumentParser(
         description=(
@@ -190,30 +305,140 @@ if __name__ == '__main__':
     parser.add_argument(
         'dst_dir',
         help="Destination directory for the Matroska file.")
+    add_plan_arguments(parser)
+    parser.add_argument(
+        '-c', '--catalog',
+        help="Record the disc analysis in this catalog's database.")
+    parser.add_argument(
+        '-cd', '--cache_dir',
+        help=(
+            "Directory where to cache the disc analysis. Playlists are only "
+            "probed again if the files they depend on have changed."))
+    parser.add_argument(
+        '-fp', '--fast_probe',
+        action='store_true',
+        help=(
+            "Probe playlists with Ffprobe as little as possible, and deeper "
+            "only if streams are missing. Speeds up the disc analysis."))
     parser.add_argument(
-        '-pc', '--playlists_count',
-        type=int, default=1,
+        '-iw', '--io_width',
+        type=int, default=4,
         help=(
-            "Set the maximum number of movie playlists to convert. "
-            "Defaults to 1. If set to 0, all movie playlists are converted."))
+            "Maximum number of programs reading at once from the same "
+            "solid-state drive. Defaults to 4. Optical and hard disk drives "
+            "are always read by one program at a time."))
     parser.add_argument(
-        '-al', '--audio_languages',
-        type=str, nargs='*',
+        '-ld', '--lock_dir',
+        default=DEFAULT_LOCK_DIR,
         help=(
-            "Audio tracks to keep according to their language. "
-            "Multi-languages tracks or tracks with undetermined language are "
-            "always kept."))
+            "Directory of the lock files limiting the programs reading at "
+            "once from the same drive, across all the conversions of the "
+            "host. Defaults to '{}'.".format(DEFAULT_LOCK_DIR)))
     parser.add_argument(
-        '-sl', '--subtitle_languages',
-        type=str, nargs='*',
-        help="Subtitle tracks to keep according to their language.")
+        '-rd', '--rip_dir',
+        help=(
+            "Copy the disc to this directory (e.g., on a fast local drive) "
+            "before analyzing and remuxing it, and remove the copy "
+            "afterwards."))
+    parser.add_argument(
+        '-sp', '--save_plan',
+        help="Save the conversion plan to this JSON file.")
+    parser.add_argument(
+        '-ao', '--analyze_only',
+        action='store_true',
+        help=(
+            "Only analyze the disc, without converting it. Useful with "
+            "'--save_plan'."))
     parser.add_argument(
-        '-fsn', '--forced_subtitle_names',
-        help="Description given to forced subtitle tracks.")
+        '-fs', '--from_snapshot',
+        help=(
+            "Plan the conversion from this snapshot of the disc (see the "
+            "'export_disc_snapshot.py' script), without reading the disc. "
+            "The disc is not converted: save the plan with '--save_plan'."))
+    parser.add_argument(
+        '-mt', '--mount_timeout',
+        type=int, default=300,
+        help=(
+            "Number of seconds after which a mounted disk image, unused by "
+            "other jobs, is unmounted by the next job. Defaults to 300. If "
+            "set to 0, the disk image is unmounted at the end of the job."))
+    parser.add_argument(
+        '-pr', '--parallel_remux',
+        type=int,
+        help=(
+            "Remux each playlist in chunks (one per clip), with this number "
+            "of Mkvmerge processes at once, and join them afterwards. Faster "
+            "on fast drives."))
+    resources.add_arguments(parser)
     parser.add_argument(
-        '-3d', '--detect_3d',
+        '-ho', '--hash_outputs',
         action='store_true',
-        help="Detect 3D video tracks. Makemkv need to be installed.")
+        help=(
+            "Hash the Matroska files while they are written, and write their "
+            "checksums next to them (e.g., 'movie.checksums.json')."))
+    parser.add_argument(
+        '-sd', '--scratch_dir',
+        help=(
+            "Write the Matroska files to this directory (e.g., on a fast "
+            "local drive), and move them to the destination directory in the "
+            "background, while the next ones are written. Much faster when "
+            "the destination is a network filesystem."))
+    parser.add_argument(
+        '-r', '--resume',
+        action='store_true',
+        help=(
+            "Record the converted files in a checkpoint next to them, and "
+            "resume the conversion from it if interrupted. Files already "
+            "converted are only checked, and the disc is not analyzed "
+            "again."))
+    parser.add_argument(
+        '-to', '--timeout',
+        type=float,
+        help=(
+            "Kill the external programs taking more than this number of "
+            "seconds (e.g., hanging on a damaged disc), plus the time allowed "
+            "per second of processed media. Disabled by default."))
+    parser.add_argument(
+        '-tf', '--timeout_factor',
+        type=float, default=1,
+        help=(
+            "Number of seconds allowed to the external programs per second of "
+            "processed media, with '--timeout'. Defaults to 1."))
+    parser.add_argument(
+        '-tu', '--timeout_unknown_duration',
+        type=float, default=4 * 3600,
+        help=(
+            "Number of seconds allowed to the external programs processing "
+            "media of unknown duration, with '--timeout'. Defaults to 4 "
+            "hours."))
+    parser.add_argument(
+        '-at', '--autotune',
+        type=int, nargs='?', const=8,
+        help=(
+            "Measure the read throughput of the disc and the write throughput "
+            "of the destination before converting, to choose how many "
+            "programs read the disc at once (up to this number, 8 if not "
+            "given), and keep adjusting it while converting. Overrides "
+            "'--io_width' for the disc."))
+    parser.add_argument(
+        '-mf', '--metrics_file',
+        help=(
+            "Write metrics of the conversion (programs' durations, remux "
+            "throughput, cache hits, failures, etc.) to this file, in the "
+            "format of Prometheus' textfile collector (e.g., "
+            "'/var/lib/node_exporter/blu_mkv.prom')."))
+    parser.add_argument(
+        '-mp', '--metrics_port',
+        type=int,
+        help=(
+            "Serve metrics of the conversion over HTTP on this local port, "
+            "while converting."))
 
     args = parser.parse_args()
-    main(args)
+    try:
+        main(args)
+    except OperationCancelled:
+        sys.exit("Conversion cancelled")
+    except subprocess.TimeoutExpired as exc:
+        sys.exit("{} took more than {:.0f} seconds, and was killed".format(
+            Path(exc.cmd[0]).name, exc.timeout))
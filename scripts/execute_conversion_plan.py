@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""Provide a script to execute a conversion plan of a Blu-ray disc, made by
+the 'convert_bluray_to_mkv.py' script."""
+
+import argparse
+from pathlib import Path
+import signal
+import subprocess
+import sys
+
+
+def print_copy_progress(copied_size, total_size, file_path):
+    print(
+        "\r{:.0%} copied".format(copied_size / total_size),
+        end='', flush=True)
+
+
+def get_timeout_policy(args):
+    if args.timeout is None:
+        return None
+
+    return TimeoutPolicy(
+        args.timeout, duration_factor=args.timeout_factor,
+        unknown_duration_timeout=args.timeout_unknown_duration)
+
+
+def cancel_on_signals(cancellation_token):
+    # Kill the running programs on Ctrl+C or termination, so that the disk
+    # image is still released.
+    def cancel(signal_number, frame):
+        if cancellation_token.cancelled:
+            # Interrupt anyway on a second signal (e.g., while copying).
+            raise KeyboardInterrupt
+        cancellation_token.cancel()
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, cancel)
+
+
+def load_checkpoint(checkpoint_path, plan):
+    if checkpoint_path.is_file():
+        try:
+            checkpoint = ConversionCheckpoint.load(str(checkpoint_path))
+        except (OSError, ConversionPlanError) as exc:
+            print("Ignore checkpoint {}: {}".format(checkpoint_path, exc))
+        else:
+            if checkpoint.plan == plan:
+                print("Resume conversion from {}".format(checkpoint_path))
+                return checkpoint
+
+    # Start over if the plan changed since the checkpoint.
+    checkpoint = ConversionCheckpoint(checkpoint_path, plan)
+    checkpoint.save()
+    return checkpoint
+
+
+def execute_plan(args, metrics):
+    try:
+        plan = ConversionPlan.load(args.plan)
+    except (OSError, ValueError) as exc:
+        sys.exit("Unable to load conversion plan: {}".format(exc))
+
+    bluray_path = Path(args.src_disc or plan.disc_path)
+    destination_directory = Path(args.dst_dir or plan.dst_dir)
+    cancellation_token = CancellationToken()
+    cancel_on_signals(cancellation_token)
+
+    # Mount the Blu-ray disc if it is a disk image, or reuse an existing
+    # mount of it. Mounts left idle by previous jobs are cleaned up first.
+    mount_pool = utils.MountPool(idle_timeout=args.mount_timeout)
+    mount_pool.cleanup()
+    if bluray_path.is_file():
+        disk_image_path = bluray_path
+        try:
+            with metrics.count_failures('mount'):
+                bluray_path = Path(mount_pool.acquire(str(disk_image_path)))
+        except (OSError, subprocess.CalledProcessError) as exc:
+            sys.exit("Unable to mount disk image: {}".format(exc))
+    else:
+        disk_image_path = None
+
+    disc_copy = None
+    try:
+        # Copy the planned playlists to a fast local cache, to remux them
+        # from there.
+        if args.rip_dir:
+            print("Copy clips of the planned playlists to {}".format(
+                args.rip_dir))
+            disc_copy = DiscCopy(
+                bluray_path, args.rip_dir,
+                playlist_numbers=[
+                    output['playlist_number'] for output in plan.outputs],
+                on_progress=print_copy_progress)
+            try:
+                with metrics.count_failures('copy'):
+                    bluray_path = Path(disc_copy.copy())
+            except (OSError, ValueError) as exc:
+                sys.exit("Unable to copy disc: {}".format(exc))
+            finally:
+                print()
+
+        try:
+            mkvmerge_controller = MkvmergeController(
+                resource_policy=ResourcePolicy.from_arguments(args),
+                timeout_policy=get_timeout_policy(args),
+                hash_outputs=args.hash_outputs)
+        except FileNotFoundError as exc:
+            sys.exit("Unable to locate Mkvmerge's executable: {}".format(exc))
+        mkvmerge_controller = mkvmerge_controller.cancellable_by(
+            cancellation_token)
+
+        if args.resume:
+            checkpoint = load_checkpoint(
+                Path(args.plan).with_suffix('.checkpoint.json'), plan)
+        else:
+            checkpoint = None
+
+        plan_executor = ConversionPlanExecutor(
+            mkvmerge_controller, parallel_chunks=args.parallel_remux,
+            checkpoint=checkpoint, scratch_dir=args.scratch_dir,
+            metrics=metrics)
+        with metrics.count_failures('remux'):
+            for segment in plan.segments:
+                print("Convert clip {}".format(segment['clip_name']))
+                plan_executor.execute_segment(
+                    segment, str(bluray_path), str(destination_directory))
+
+            for output in plan.outputs:
+                print("Convert playlist {}".format(
+                    output['playlist_number']))
+                plan_executor.execute_output(
+                    output, str(bluray_path), str(destination_directory),
+                    plan.segments)
+
+        if plan_executor.scratch_dir is not None:
+            print("Wait for the files to be moved to {}".format(
+                destination_directory))
+        with metrics.count_failures('transfer'):
+            plan_executor.wait_for_transfers()
+
+        if checkpoint is not None:
+            checkpoint.remove()
+        metrics.increment('blu_mkv_discs_processed_total')
+    finally:
+        if disc_copy is not None:
+            disc_copy.evict()
+
+        # Release the Blu-ray disc if it is a disk image. It is only
+        # unmounted once idle for long enough.
+        if disk_image_path is not None:
+            try:
+                mount_pool.release(str(disk_image_path))
+            except (OSError, subprocess.CalledProcessError) as exc:
+                sys.exit("Unable to unmount disk image: {}".format(exc))
+
+
+def main(args):
+    # Record metrics of the conversion, for Prometheus.
+    metrics = Metrics()
+    try:
+        execute_plan(args, metrics)
+    finally:
+        if args.metrics_file:
+            metrics.write_textfile(args.metrics_file)
+
+
+if __name__ == '__main__':
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+    from blu_mkv import resources
+    from blu_mkv import utils
+    from blu_mkv.metrics import Metrics
+    from blu_mkv.mkvmerge import MkvmergeController
+    from blu_mkv.plan import (
+        ConversionCheckpoint, ConversionPlan, ConversionPlanError,
+        ConversionPlanExecutor)
+    from blu_mkv.process import (
+        CancellationToken, OperationCancelled, TimeoutPolicy)
+    from blu_mkv.resources import ResourcePolicy
+    from blu_mkv.rip import DiscCopy
+
+    parser = argparse.ArgumentParser(
+        description="Execute a conversion plan of a Blu-ray disc.")
+    parser.add_argument(
+        'plan',
+        help="Conversion plan, saved as JSON file.")
+    parser.add_argument(
+        '-s', '--src_disc',
+        help=(
+            "Blu-ray source, if not at the same location than during the "
+            "analysis. Can be a disk image or directory."))
+    parser.add_argument(
+        '-d', '--dst_dir',
+        help="Destination directory, if different from the planned one.")
+    parser.add_argument(
+        '-rd', '--rip_dir',
+        help=(
+            "Copy the clips of the planned playlists to this directory "
+            "before remuxing them, and remove the copy afterwards."))
+    parser.add_argument(
+        '-mt', '--mount_timeout',
+        type=int, default=300,
+        help=(
+            "Number of seconds after which a mounted disk image, unused by "
+            "other jobs, is unmounted by the next job. Defaults to 300. If "
+            "set to 0, the disk image is unmounted at the end of the job."))
+    parser.add_argument(
+        '-pr', '--parallel_remux',
+        type=int,
+        help=(
+            "Remux each playlist in chunks (one per clip), with this number "
+            "of Mkvmerge processes at once, and join them afterwards. Faster "
+            "on fast drives."))
+    resources.add_arguments(parser)
+    parser.add_argument(
+        '-ho', '--hash_outputs',
+        action='store_true',
+        help=(
+            "Hash the Matroska files while they are written, and write their "
+            "checksums next to them (e.g., 'movie.checksums.json')."))
+    parser.add_argument(
+        '-sd', '--scratch_dir',
+        help=(
+            "Write the Matroska files to this directory (e.g., on a fast "
+            "local drive), and move them to the destination directory in the "
+            "background, while the next ones are written. Much faster when "
+            "the destination is a network filesystem."))
+    parser.add_argument(
+        '-r', '--resume',
+        action='store_true',
+        help=(
+            "Record the converted files in a checkpoint next to the plan, "
+            "and resume the conversion from it if interrupted. Files already "
+            "converted are only checked."))
+    parser.add_argument(
+        '-to', '--timeout',
+        type=float,
+        help=(
+            "Kill the external programs taking more than this number of "
+            "seconds (e.g., hanging on a damaged disc), plus the time allowed "
+            "per second of processed media. Disabled by default."))
+    parser.add_argument(
+        '-tf', '--timeout_factor',
+        type=float, default=1,
+        help=(
+            "Number of seconds allowed to the external programs per second of "
+            "processed media, with '--timeout'. Defaults to 1."))
+    parser.add_argument(
+        '-tu', '--timeout_unknown_duration',
+        type=float, default=4 * 3600,
+        help=(
+            "Number of seconds allowed to the external programs processing "
+            "media of unknown duration, with '--timeout'. Defaults to 4 "
+            "hours."))
+    parser.add_argument(
+        '-mf', '--metrics_file',
+        help=(
+            "Add metrics of the conversion (programs' durations, remux "
+            "throughput, failures, etc.) to this file, in the format of "
+            "Prometheus' textfile collector (e.g., "
+            "'/var/lib/node_exporter/blu_mkv.prom')."))
+
+    args = parser.parse_args()
+    try:
+        main(args)
+    except OperationCancelled:
+        sys.exit("Conversion cancelled")
+    except subprocess.TimeoutExpired as exc:
+        sys.exit("{} took more than {:.0f} seconds, and was killed".format(
+            Path(exc.cmd[0]).name, exc.timeout))
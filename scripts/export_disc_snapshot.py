@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""Provide a script to export a snapshot of a Blu-ray disc's metadata and
+analysis, to plan its conversion on another host with the
+'convert_bluray_to_mkv.py' script."""
+
+import argparse
+from pathlib import Path
+import subprocess
+import sys
+
+
+def print_probed_playlist(disc_path, playlist_number, playlist_info):
+    print("Found playlist {} ({})".format(
+        playlist_number, playlist_info['duration']))
+
+
+def main(args):
+    bluray_path = Path(args.src_disc)
+
+    # Mount the Blu-ray disc if it is a disk image, or reuse an existing
+    # mount of it.
+    mount_pool = utils.MountPool(idle_timeout=args.mount_timeout)
+    mount_pool.cleanup()
+    if bluray_path.is_file():
+        disk_image_path = bluray_path
+        try:
+            bluray_path = Path(mount_pool.acquire(str(disk_image_path)))
+        except (OSError, subprocess.CalledProcessError) as exc:
+            sys.exit("Unable to mount disk image: {}".format(exc))
+    else:
+        disk_image_path = None
+
+    try:
+        all_controllers = list()
+        for (controller_name, controller_class, controller_options) in [
+                ('Ffprobe', FfprobeController,
+                 {'fast_probe': args.fast_probe}),
+                ('Mkvmerge', MkvmergeController, dict()),
+                ('Makemkv', MakemkvController, dict())]:
+            try:
+                all_controllers.append(
+                    controller_class(**controller_options))
+            except FileNotFoundError as exc:
+                if controller_class is MakemkvController:
+                    # Makemkv is optional: multiview playlists are just not
+                    # identified without it.
+                    continue
+                sys.exit(
+                    "Unable to locate {}'s executable: {}"
+                    .format(controller_name, exc))
+
+        if args.cache_dir:
+            analysis_cache = AnalysisCache(args.cache_dir)
+        else:
+            analysis_cache = None
+
+        bluray_analyzer = bluray.BlurayAnalyzer(
+            *all_controllers, analysis_cache=analysis_cache,
+            on_playlist_probed=print_probed_playlist)
+
+        print("Start disc analysis")
+        try:
+            export_snapshot(
+                bluray_analyzer, str(bluray_path), args.snapshot,
+                scan_streams=args.scan_streams)
+        except ImportError as exc:
+            sys.exit("Unable to scan streams: {}".format(exc))
+        print("Snapshot saved to {}".format(args.snapshot))
+    finally:
+        if disk_image_path is not None:
+            try:
+                mount_pool.release(str(disk_image_path))
+            except (OSError, subprocess.CalledProcessError) as exc:
+                sys.exit("Unable to unmount disk image: {}".format(exc))
+
+
+if __name__ == '__main__':
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+    from blu_mkv import bluray
+    from blu_mkv import utils
+    from blu_mkv.cache import AnalysisCache
+    from blu_mkv.ffprobe import FfprobeController
+    from blu_mkv.makemkv import MakemkvController
+    from blu_mkv.mkvmerge import MkvmergeController
+    from blu_mkv.snapshot import export_snapshot
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Export a snapshot of a Blu-ray disc's metadata files and "
+            "analysis, to plan its conversion without the disc."))
+    parser.add_argument(
+        'src_disc',
+        help="Blu-ray source. Can be a directory or a disk image.")
+    parser.add_argument(
+        'snapshot',
+        help="Path of the snapshot (e.g., 'movie.snapshot.tar.gz').")
+    parser.add_argument(
+        '-cd', '--cache_dir',
+        help=(
+            "Directory where to cache the disc analysis. Playlists are only "
+            "probed again if the files they depend on have changed."))
+    parser.add_argument(
+        '-fp', '--fast_probe',
+        action='store_true',
+        help=(
+            "Probe playlists with Ffprobe as little as possible, and deeper "
+            "only if streams are missing."))
+    parser.add_argument(
+        '-ss', '--scan_streams',
+        action='store_true',
+        help=(
+            "Also scan the transport streams of the movie playlists, so that "
+            "'--min_bitrate' can be used when planning the conversion. Reads "
+            "the whole streams. NumPy need to be installed."))
+    parser.add_argument(
+        '-mt', '--mount_timeout',
+        type=int, default=300,
+        help=(
+            "Number of seconds after which a mounted disk image, unused by "
+            "other jobs, is unmounted by the next job. Defaults to 300. If "
+            "set to 0, the disk image is unmounted at the end of the job."))
+
+    args = parser.parse_args()
+    main(args)
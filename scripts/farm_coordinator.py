@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Provide a coordinator of a conversion farm, leasing discs to convert to
+workers on several hosts, running the 'farm_worker.py' script."""
+
+import argparse
+from pathlib import Path
+import signal
+import sys
+import threading
+
+
+def main(args):
+    coordinator = Coordinator(
+        args.queue, address=args.address, port=args.port,
+        lease_duration=args.lease_duration)
+
+    # Queue the given discs, before serving the workers.
+    job_queue = JobQueue(args.queue)
+    try:
+        for disc_path in args.discs:
+            try:
+                if job_queue.add(disc_path) is None:
+                    print("Already queued {}".format(disc_path))
+            except OSError as exc:
+                sys.exit("Unable to queue {}: {}".format(disc_path, exc))
+    finally:
+        job_queue.close()
+
+    # The server is shut down from another thread, as shutting it down
+    # blocks until it stops.
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(
+            signal_number,
+            lambda *_: threading.Thread(target=coordinator.shutdown).start())
+
+    print("Serve jobs at {}".format(coordinator.url), flush=True)
+    coordinator.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+    from blu_mkv.farm import DEFAULT_LEASE_DURATION, Coordinator
+    from blu_mkv.jobqueue import JobQueue
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Lease discs to convert to the workers of a conversion farm."))
+    parser.add_argument(
+        'queue',
+        help=(
+            "Path of the job queue's database. Created if missing. Keeps "
+            "track of the converted discs across restarts."))
+    parser.add_argument(
+        'discs',
+        nargs='*',
+        help=(
+            "Discs to queue. They must be at the same location on the "
+            "workers (e.g., on a shared filesystem)."))
+    parser.add_argument(
+        '-a', '--address',
+        default='127.0.0.1',
+        help=(
+            "Address to listen to. Defaults to '127.0.0.1'. Use '0.0.0.0' "
+            "for workers on other hosts."))
+    parser.add_argument(
+        '-p', '--port',
+        type=int, default=8470,
+        help="Port to listen to. Defaults to 8470.")
+    parser.add_argument(
+        '-ld', '--lease_duration',
+        type=float, default=DEFAULT_LEASE_DURATION,
+        help=(
+            "Number of seconds after which a job is given to another worker, "
+            "unless its worker renews its lease. Defaults to {}."
+            .format(DEFAULT_LEASE_DURATION)))
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+"""Provide a worker of a conversion farm, converting discs leased by the
+'farm_coordinator.py' script to Matroska files."""
+
+import argparse
+from pathlib import Path
+import signal
+import subprocess
+import sys
+
+
+def get_timeout_policy(args):
+    if args.timeout is None:
+        return None
+
+    return TimeoutPolicy(
+        args.timeout, duration_factor=args.timeout_factor,
+        unknown_duration_timeout=args.timeout_unknown_duration)
+
+
+def convert_job(
+        args, controllers, analysis_cache, memory_cache, metrics, disc_path,
+        cancellation_token, report_progress):
+    # Disk images are named after their movie.
+    title = Path(disc_path).stem
+    bluray_path = Path(disc_path)
+    destination_directory = Path(args.dst_dir)
+    print("Convert {}".format(disc_path), flush=True)
+
+    # Mount the Blu-ray disc if it is a disk image, or reuse an existing
+    # mount of it, possibly shared with other workers of the host.
+    mount_pool = utils.MountPool(idle_timeout=args.mount_timeout)
+    mount_pool.cleanup()
+    if bluray_path.is_file():
+        disk_image_path = bluray_path
+        with metrics.count_failures('mount'):
+            bluray_path = Path(mount_pool.acquire(str(disk_image_path)))
+    else:
+        disk_image_path = None
+
+    try:
+        # Analyze the disc, stopping the analysis if the job is given to
+        # another worker. Analyses are kept in memory, for a disc converted
+        # again (e.g., after a failure).
+        bluray_analyzer = bluray.BlurayAnalyzer(
+            *controllers, analysis_cache=analysis_cache,
+            cancellation_token=cancellation_token, memory_cache=memory_cache,
+            metrics=metrics)
+        bluray_disc = bluray.BlurayDisc(bluray_path, bluray_analyzer)
+
+        # Plan the conversion, or resume it if interrupted (e.g., when the
+        # job was leased by a stopped worker), and convert the playlists,
+        # reporting the part of the Matroska files written.
+        if args.resume:
+            checkpoint_path = destination_directory.joinpath(
+                '{}.checkpoint.json'.format(title))
+        else:
+            checkpoint_path = None
+        convert_disc(
+            bluray_disc, title, destination_directory, disc_path=disc_path,
+            plan_options=get_plan_options(args),
+            checkpoint_path=checkpoint_path,
+            parallel_remux=args.parallel_remux, scratch_dir=args.scratch_dir,
+            metrics=metrics, on_progress=report_progress,
+            on_message=lambda message: print(message, flush=True))
+        metrics.increment('blu_mkv_discs_processed_total')
+    finally:
+        if disk_image_path is not None:
+            try:
+                mount_pool.release(str(disk_image_path))
+            except (OSError, subprocess.CalledProcessError) as exc:
+                print("Unable to unmount disk image: {}".format(exc))
+
+    print("Converted {}".format(disc_path), flush=True)
+
+
+def main(args):
+    # Initialize Ffprobe, Mkvmerge and Makemkv controllers, shared by the
+    # conversions.
+    io_limiter = DeviceLimiter(
+        solid_state_width=args.io_width, lock_dir=args.lock_dir)
+    resource_policy = ResourcePolicy.from_arguments(args)
+    timeout_policy = get_timeout_policy(args)
+    controllers = list()
+    for (controller_name, controller_class, controller_options) in [
+            ('Ffprobe', FfprobeController, {'fast_probe': args.fast_probe}),
+            ('Mkvmerge', MkvmergeController,
+             {'hash_outputs': args.hash_outputs}),
+            ('Makemkv', MakemkvController, dict())]:
+        try:
+            controllers.append(controller_class(
+                io_limiter=io_limiter, resource_policy=resource_policy,
+                timeout_policy=timeout_policy, **controller_options))
+        except FileNotFoundError as exc:
+            sys.exit(
+                "Unable to locate {}'s executable: {}"
+                .format(controller_name, exc))
+
+    if args.cache_dir:
+        analysis_cache = AnalysisCache(args.cache_dir)
+    else:
+        analysis_cache = None
+
+    # Record metrics of the conversions, for Prometheus, adding them to the
+    # metrics file after each conversion.
+    metrics = Metrics()
+
+    def convert(*job_args):
+        try:
+            convert_job(
+                args, controllers, analysis_cache, memory_cache, metrics,
+                *job_args)
+        finally:
+            if args.metrics_file:
+                metrics.write_textfile(args.metrics_file)
+
+    memory_cache = MemoryCache()
+    worker = FarmWorker(args.coordinator_url, convert)
+
+    # Stop gracefully, after the running conversion.
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: worker.stop())
+
+    print("Lease jobs from {} as {}".format(
+        args.coordinator_url, worker.worker), flush=True)
+    worker.run(poll_interval=args.poll_interval)
+
+
+if __name__ == '__main__':
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+    from blu_mkv import bluray
+    from blu_mkv import resources
+    from blu_mkv import utils
+    from blu_mkv.cache import AnalysisCache, MemoryCache
+    from blu_mkv.farm import FarmWorker
+    from blu_mkv.ffprobe import FfprobeController
+    from blu_mkv.iolimit import DEFAULT_LOCK_DIR, DeviceLimiter
+    from blu_mkv.makemkv import MakemkvController
+    from blu_mkv.metrics import Metrics
+    from blu_mkv.mkvmerge import MkvmergeController
+    from blu_mkv.plan import (
+        add_arguments as add_plan_arguments, convert_disc, get_plan_options)
+    from blu_mkv.process import TimeoutPolicy
+    from blu_mkv.resources import ResourcePolicy
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Convert discs leased by the coordinator of a conversion farm to "
+            "Matroska files."))
+    parser.add_argument(
+        'coordinator_url',
+        help="URL of the coordinator (e.g., 'http://farm-host:8470').")
+    parser.add_argument(
+        'dst_dir',
+        help="Destination directory for the Matroska files.")
+    add_plan_arguments(parser)
+    parser.add_argument(
+        '-cd', '--cache_dir',
+        help=(
+            "Directory where to cache the discs' analysis. Playlists are only "
+            "probed again if the files they depend on have changed."))
+    parser.add_argument(
+        '-fp', '--fast_probe',
+        action='store_true',
+        help=(
+            "Probe playlists with Ffprobe as little as possible, and deeper "
+            "only if streams are missing. Speeds up the discs' analysis."))
+    parser.add_argument(
+        '-iw', '--io_width',
+        type=int, default=4,
+        help=(
+            "Maximum number of programs reading at once from the same "
+            "solid-state drive. Defaults to 4."))
+    parser.add_argument(
+        '-ld', '--lock_dir',
+        default=DEFAULT_LOCK_DIR,
+        help=(
+            "Directory of the lock files limiting the programs reading at "
+            "once from the same drive, across all the conversions of the "
+            "host. Defaults to '{}'.".format(DEFAULT_LOCK_DIR)))
+    parser.add_argument(
+        '-mt', '--mount_timeout',
+        type=int, default=300,
+        help=(
+            "Number of seconds after which a mounted disk image, unused by "
+            "other jobs, is unmounted by the next job. Defaults to 300."))
+    parser.add_argument(
+        '-pr', '--parallel_remux',
+        type=int,
+        help=(
+            "Remux each playlist in chunks (one per clip), with this number "
+            "of Mkvmerge processes at once, and join them afterwards."))
+    resources.add_arguments(parser)
+    parser.add_argument(
+        '-ho', '--hash_outputs',
+        action='store_true',
+        help=(
+            "Hash the Matroska files while they are written, and write their "
+            "checksums next to them (e.g., 'movie.checksums.json')."))
+    parser.add_argument(
+        '-sd', '--scratch_dir',
+        help=(
+            "Write the Matroska files to this directory (e.g., on a fast "
+            "local drive), and move them to the destination directory in the "
+            "background."))
+    parser.add_argument(
+        '-r', '--resume',
+        action='store_true',
+        help=(
+            "Record the converted files in a checkpoint next to them, and "
+            "resume the conversion from it if interrupted (e.g., when the "
+            "job is leased again after the worker was stopped). Files already "
+            "converted are only checked, and the disc is not analyzed "
+            "again."))
+    parser.add_argument(
+        '-to', '--timeout',
+        type=float,
+        help=(
+            "Kill the external programs taking more than this number of "
+            "seconds, plus the time allowed per second of processed media. "
+            "Disabled by default."))
+    parser.add_argument(
+        '-tf', '--timeout_factor',
+        type=float, default=1,
+        help=(
+            "Number of seconds allowed to the external programs per second of "
+            "processed media, with '--timeout'. Defaults to 1."))
+    parser.add_argument(
+        '-tu', '--timeout_unknown_duration',
+        type=float, default=4 * 3600,
+        help=(
+            "Number of seconds allowed to the external programs processing "
+            "media of unknown duration, with '--timeout'. Defaults to 4 "
+            "hours."))
+    parser.add_argument(
+        '-pi', '--poll_interval',
+        type=float, default=5,
+        help=(
+            "Number of seconds to wait before asking the coordinator for a "
+            "job again, when there are none. Defaults to 5."))
+    parser.add_argument(
+        '-mf', '--metrics_file',
+        help=(
+            "Add metrics of the conversions (programs' durations, remux "
+            "throughput, failures, etc.) to this file after each of them, in "
+            "the format of Prometheus' textfile collector (e.g., "
+            "'/var/lib/node_exporter/blu_mkv.prom')."))
+
+    args = parser.parse_args()
+    main(args)
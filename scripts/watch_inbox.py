@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""Provide a daemon converting Blu-ray disk images as soon as they are
+dropped into inbox directories, with the 'convert_bluray_to_mkv.py'
+script."""
+
+import argparse
+from pathlib import Path
+import signal
+import subprocess
+import sys
+
+
+CONVERT_SCRIPT_PATH = Path(__file__).resolve().with_name(
+    'convert_bluray_to_mkv.py')
+
+
+def main(args):
+    for inbox_dir in args.inbox_dirs:
+        if not Path(inbox_dir).is_dir():
+            sys.exit("{} must points to a directory".format(inbox_dir))
+
+    # Conversions add their metrics to the same file.
+    convert_options = list(args.convert_options)
+    if args.metrics_file:
+        convert_options.extend(['--metrics_file', args.metrics_file])
+
+    def convert(disc_path):
+        # Disk images are named after their movie. Conversions run in their
+        # own session, so that Ctrl+C on the daemon does not interrupt them.
+        print("Convert {}".format(disc_path), flush=True)
+        subprocess.check_call([
+            sys.executable, str(CONVERT_SCRIPT_PATH),
+            Path(disc_path).stem, disc_path, args.dst_dir,
+            *convert_options], start_new_session=True)
+        print("Converted {}".format(disc_path), flush=True)
+
+    job_queue = JobQueue(args.queue)
+    watcher = InboxWatcher(
+        args.inbox_dirs, patterns=args.patterns,
+        settle_time=args.settle_time)
+    daemon = InboxDaemon(
+        watcher, job_queue, convert, max_workers=args.workers)
+
+    # Stop gracefully, after the running conversions.
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: daemon.stop())
+
+    print("Watch {}".format(', '.join(args.inbox_dirs)), flush=True)
+    try:
+        daemon.run()
+    finally:
+        watcher.close()
+        job_queue.close()
+
+
+if __name__ == '__main__':
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+    from blu_mkv.jobqueue import JobQueue
+    from blu_mkv.watch import InboxDaemon, InboxWatcher
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Convert Blu-ray disk images dropped into inbox directories. "
+            "Options after '--' are given to 'convert_bluray_to_mkv.py'."))
+    parser.add_argument(
+        'queue',
+        help=(
+            "Path of the job queue's database. Created if missing. Keeps "
+            "track of the converted disk images across restarts."))
+    parser.add_argument(
+        'dst_dir',
+        help="Destination directory for the Matroska files.")
+    parser.add_argument(
+        'inbox_dirs',
+        nargs='+',
+        help="Directories to watch.")
+    parser.add_argument(
+        '-w', '--workers',
+        type=int, default=1,
+        help="Maximum number of disk images converted at once. Defaults to 1.")
+    parser.add_argument(
+        '-p', '--patterns',
+        nargs='+', default=['*.iso'],
+        help="Patterns of the disk images' file names. Defaults to '*.iso'.")
+    parser.add_argument(
+        '-st', '--settle_time',
+        type=float, default=5,
+        help=(
+            "Number of seconds a disk image must stay unchanged before being "
+            "converted, to be sure it is fully written. Defaults to 5."))
+    parser.add_argument(
+        '-mf', '--metrics_file',
+        help=(
+            "Add metrics of each conversion to this file, in the format of "
+            "Prometheus' textfile collector (e.g., "
+            "'/var/lib/node_exporter/blu_mkv.prom')."))
+
+    argv = sys.argv[1:]
+    if '--' in argv:
+        convert_options = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    else:
+        convert_options = []
+
+    args = parser.parse_args(argv)
+    args.convert_options = convert_options
+    main(args)
@@ -9,3 +9,18 @@ class TestFfprobeController:
             ffprobe.get_default_bluray_playlist_number(bluray_path)
 
         assert isinstance(default_playlist, int)
+
+    def test_get_bluray_playlist_subtitles_with_frames_count_of_one_track(
+            self, ffprobe, bluray_path):
+        default_playlist =\
+            ffprobe.get_default_bluray_playlist_number(bluray_path)
+        all_streams = ffprobe.get_all_bluray_playlist_streams(
+            bluray_path, default_playlist)
+        subtitle_id = next(
+            stream['index'] for stream in all_streams
+            if stream['codec_type'] == 'subtitle')
+
+        subtitles = ffprobe.get_bluray_playlist_subtitles_with_frames_count(
+            bluray_path, default_playlist, track_ids=[subtitle_id])
+
+        assert [subtitle['index'] for subtitle in subtitles] == [subtitle_id]
@@ -38,3 +38,31 @@ def bluray_playlist(bluray_disc):
         number=419,
         duration=timedelta(hours=2),
         size=33940936704)
+
+
+def encode_element(element_id, data):
+    size = len(data)
+    return element_id + b'\x01' + size.to_bytes(7, 'big') + data
+
+
+@pytest.fixture
+def make_matroska_file():
+    """Return a function writing a minimal Matroska file, with the given
+    number of tracks."""
+    def write_matroska_file(file_path, tracks_count, truncated_size=0):
+        ebml_header = encode_element(
+            b'\x1a\x45\xdf\xa3',
+            encode_element(b'\x42\x82', b'matroska'))
+        tracks = encode_element(
+            b'\x16\x54\xae\x6b',
+            b''.join(
+                encode_element(b'\xae', encode_element(b'\xd7', bytes([i])))
+                for i in range(1, tracks_count + 1)))
+        cluster = encode_element(b'\x1f\x43\xb6\x75', b'\x00' * 64)
+        content = ebml_header + encode_element(
+            b'\x18\x53\x80\x67', tracks + cluster)
+
+        with open(str(file_path), 'wb') as matroska_file:
+            matroska_file.write(content[:len(content) - truncated_size])
+
+    return write_matroska_file
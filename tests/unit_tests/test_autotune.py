@@ -0,0 +1,138 @@
+import os
+import time
+
+import pytest
+
+from blu_mkv import autotune
+from blu_mkv.autotune import ThroughputTuner
+from blu_mkv.iolimit import DeviceLimiter
+
+
+@pytest.fixture
+def bluray_tree(tmpdir):
+    """Blu-ray disc with streams of different sizes."""
+    streams_dir = tmpdir.mkdir('bluray_tree').ensure_dir('BDMV', 'STREAM')
+    for (clip_name, size) in [('00010', 3000), ('00011', 1000)]:
+        streams_dir.join('{}.m2ts'.format(clip_name)).write_binary(
+            os.urandom(size))
+    return tmpdir.join('bluray_tree')
+
+
+class TestPreflight:
+    def test_get_sample_files(self, bluray_tree, tmpdir):
+        streams_dir = bluray_tree.join('BDMV', 'STREAM')
+        assert autotune.get_sample_files(str(bluray_tree)) == [
+            str(streams_dir.join('00010.m2ts')),
+            str(streams_dir.join('00011.m2ts'))]
+
+        disk_image = tmpdir.join('bluray.iso')
+        disk_image.write_binary(b'disc')
+        assert autotune.get_sample_files(str(disk_image)) ==\
+            [str(disk_image)]
+
+    def test_split_files_into_regions(self, bluray_tree):
+        file_paths = autotune.get_sample_files(str(bluray_tree))
+
+        assert autotune._get_sample_regions(file_paths, 4) == [
+            (file_paths[0], 0, 1000),
+            (file_paths[0], 1000, 2000),
+            (file_paths[0], 2000, 3000),
+            (file_paths[1], 0, 1000)]
+        assert autotune._get_sample_regions(file_paths, 2) == [
+            (file_paths[0], 0, 2000),
+            (file_paths[1], 0, 1000)]
+
+    def test_measure_throughputs(self, bluray_tree, tmpdir):
+        file_paths = autotune.get_sample_files(str(bluray_tree))
+        dst_dir = tmpdir.mkdir('videos')
+
+        assert autotune.measure_read_throughput(
+            file_paths, concurrency=2, duration=0.1) > 0
+        assert autotune.measure_write_throughput(
+            str(dst_dir), duration=0.1) > 0
+        assert dst_dir.listdir() == []
+
+    def test_choose_concurrency(self, bluray_tree, tmpdir, mock):
+        read_throughputs = {1: 100, 2: 190, 4: 200, 8: 400}
+        mock.patch.object(
+            autotune, 'measure_read_throughput',
+            side_effect=lambda file_paths, concurrency, duration:
+            read_throughputs[concurrency])
+        mock.patch.object(
+            autotune, 'measure_write_throughput', return_value=300)
+
+        # Four readers are not worth it, and the destination writes as fast
+        # as three readers read.
+        assert autotune.preflight(str(bluray_tree), str(tmpdir)) == {
+            'read_throughputs': {1: 100, 2: 190, 4: 200},
+            'write_throughput': 300,
+            'read_concurrency': 2,
+            'remux_concurrency': 2}
+
+        mock.patch.object(
+            autotune, 'measure_write_throughput', return_value=120)
+        assert autotune.preflight(
+            str(bluray_tree), str(tmpdir))['remux_concurrency'] == 1
+
+
+class TestThroughputTuner:
+    def test_adjust_width_to_throughput(self, tmpdir):
+        stat_file = tmpdir.ensure('sys', 'block', 'sda', 'stat')
+        io_limiter = DeviceLimiter(
+            device_widths={'sda': 2}, sysfs_path=str(tmpdir.join('sys')))
+        tuner = ThroughputTuner(
+            io_limiter, 'sda', max_width=4, interval=0.05)
+        io_limiter.tune(tuner)
+
+        def read(sectors_count):
+            stat_file.write('0 0 {} 0 0 0 0 0 0 0 0\n'.format(sectors_count))
+            time.sleep(0.06)
+
+        read(0)
+        tuner.restart()
+        # Additive increase, as long as the throughput does not drop.
+        read(10 ** 6)
+        assert tuner.update() == 3
+        read(3 * 10 ** 6)
+        assert tuner.update() == 4
+        read(7 * 10 ** 6)
+        assert tuner.update() == 4
+        # Multiplicative decrease otherwise.
+        read(7 * 10 ** 6 + 10)
+        assert tuner.update() == 2
+        assert io_limiter.get_width('sda') == 2
+
+        # Not adjusted before the end of the interval.
+        assert tuner.update() is None
+
+    def test_adjust_width_while_device_is_read(self, tmpdir):
+        disc_file = tmpdir.join('bluray.iso')
+        disc_file.write_binary(b'disc')
+        io_limiter = DeviceLimiter(sysfs_path=str(tmpdir.join('sys')))
+        device = io_limiter.get_device(str(disc_file))
+        stat_file = tmpdir.ensure('sys', 'block', device, 'stat')
+        stat_file.write('0 0 0 0 0 0 0 0 0 0 0\n')
+        tuner = ThroughputTuner.for_path(
+            io_limiter, str(disc_file), max_width=8, interval=0.05)
+
+        tuner.start()
+        try:
+            # Adjusted while the device is read, before being released.
+            with io_limiter.limit(str(disc_file)):
+                for sectors_count in range(1, 100):
+                    stat_file.write('0 0 {} 0 0 0 0 0 0 0 0\n'.format(
+                        sectors_count * 10 ** 6))
+                    time.sleep(0.02)
+                    if io_limiter.get_width(device) != 4:
+                        break
+                assert io_limiter.get_width(device) == 5
+        finally:
+            tuner.stop()
+
+    def test_keep_width_without_device_statistics(self, tmpdir):
+        io_limiter = DeviceLimiter(sysfs_path=str(tmpdir))
+        tuner = ThroughputTuner(io_limiter, '0:42', interval=0)
+
+        tuner.restart()
+        assert tuner.update() is None
+        assert io_limiter.get_width('0:42') == 4
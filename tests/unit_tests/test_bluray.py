@@ -1,9 +1,58 @@
 from collections import OrderedDict
 from datetime import timedelta
+import threading
 
 import pytest
 
+from blu_mkv import test
 from blu_mkv.bluray import BlurayAnalyzer, BlurayDisc, BlurayPlaylist
+from blu_mkv.cache import AnalysisCache, MemoryCache
+from blu_mkv.metrics import Metrics
+from blu_mkv.mkvmerge import MkvmergeController
+from blu_mkv.process import CancellationToken, OperationCancelled
+
+
+class CountingFfprobeController(test.StubFfprobeController):
+    def __init__(self):
+        self.calls_count = 0
+        self.expected_ids = None
+        self.probed_files = list()
+        self.probed_playlists = list()
+
+    def get_bluray_playlist(self, disc_path, playlist_number):
+        self.probed_playlists.append(playlist_number)
+        return super().get_bluray_playlist(disc_path, playlist_number)
+
+    def get_all_bluray_playlist_streams(
+            self, disc_path, playlist_id, expected_ids=None):
+        self.calls_count += 1
+        self.expected_ids = expected_ids
+        return super().get_all_bluray_playlist_streams(
+            disc_path, playlist_id, expected_ids)
+
+    def get_subtitle_packets(self, file_path):
+        self.probed_files.append(file_path)
+        return super().get_subtitle_packets(file_path)
+
+
+@pytest.fixture
+def bluray_tree(tmpdir):
+    """Blu-ray disc with a playlist (number 1) playing two clips, and
+    another playlist (number 2) playing a part of one of these clips."""
+    bdmv_dir = tmpdir.mkdir('bluray_tree').mkdir('BDMV')
+    playlists_dir = bdmv_dir.mkdir('PLAYLIST')
+    playlists_dir.join('00001.mpls').write_binary(
+        test.build_playlist([('00010', 0, 45000), ('00011', 0, 45000)]))
+    playlists_dir.join('00002.mpls').write_binary(
+        test.build_playlist([('00011', 0, 22500)]))
+
+    for clip_name in ['00010', '00011', '00012']:
+        bdmv_dir.ensure('CLIPINF', '{}.clpi'.format(clip_name)).write_binary(
+            test.build_clip_information(0, 90000))
+        bdmv_dir.ensure('STREAM', '{}.m2ts'.format(clip_name)).write_binary(
+            b'stream')
+
+    return bdmv_dir.dirpath()
 
 
 class TestBlurayAnalyzer:
@@ -30,6 +79,48 @@ class TestBlurayAnalyzer:
 
         assert actual_playlists == expected_playlists
 
+    def test_iter_playlists_with_progress_callback(
+            self, mkvmerge, bluray_dir, tmpdir):
+        probed_playlists = list()
+        ffprobe = CountingFfprobeController()
+        bluray_analyzer = BlurayAnalyzer(
+            ffprobe, mkvmerge,
+            analysis_cache=AnalysisCache(str(tmpdir.join('cache'))),
+            on_playlist_probed=lambda disc_path, number, info:
+                probed_playlists.append(number))
+
+        playlists = bluray_analyzer.iter_playlists(str(bluray_dir))
+        assert next(playlists)[0] == 28
+        assert ffprobe.probed_playlists == [0, 28]
+        assert probed_playlists == [28]
+
+        assert [number for (number, _) in playlists] == [29, 419, 420]
+        assert probed_playlists == [28, 29, 419, 420]
+
+        # Once all probed, playlists are loaded from the analysis cache.
+        assert bluray_analyzer.get_playlists(str(bluray_dir)) ==\
+            bluray_analyzer.get_playlists(str(bluray_dir))
+        assert ffprobe.probed_playlists == [0, 28, 29, 419, 420]
+        assert probed_playlists == [28, 29, 419, 420] * 3
+
+    def test_tracks_and_frames_progress_callbacks(
+            self, ffprobe, mkvmerge, bluray_dir):
+        progress = list()
+        bluray_analyzer = BlurayAnalyzer(
+            ffprobe, mkvmerge,
+            on_tracks_resolved=lambda disc_path, number, tracks:
+                progress.append(('tracks', number, sorted(tracks))),
+            on_frames_counted=lambda disc_path, number, frames_count:
+                progress.append(('frames', number, frames_count)))
+
+        bluray_analyzer.get_playlist_tracks(str(bluray_dir), 419)
+        bluray_analyzer.get_subtitles_frames_count(
+            str(bluray_dir), 419, track_ids=[4, 5])
+
+        assert progress == [
+            ('tracks', 419, ['audio', 'subtitle', 'video']),
+            ('frames', 419, {4: 999, 5: 1000})]
+
     def test_get_covers(self, bluray_analyzer, bluray_dir, bluray_covers):
         actual_covers = bluray_analyzer.get_covers(str(bluray_dir))
         expected_covers = [
@@ -44,15 +135,36 @@ class TestBlurayAnalyzer:
 
         expected_tracks = {
             'video': {
-                0: {'language_code': None, 'uid': 4113}},
+                0: {
+                    'codec': "MPEG-4p10/AVC/h.264",
+                    'language_code': None,
+                    'uid': 4113}},
             'audio': {
-                1: {'language_code': 'fre', 'uid': 4352},
-                2: {'language_code': 'fre', 'uid': 4352},
-                3: {'language_code': 'chi', 'uid': 4353}},
+                1: {
+                    'codec': "DTS-HD Master Audio",
+                    'language_code': 'fre',
+                    'uid': 4352},
+                2: {
+                    'codec': "DTS",
+                    'language_code': 'fre',
+                    'uid': 4352},
+                3: {
+                    'codec': "DTS-HD Master Audio",
+                    'language_code': 'chi',
+                    'uid': 4353}},
             'subtitle': {
-                4: {'language_code': 'fre', 'uid': 4608},
-                5: {'language_code': 'fre', 'uid': 4609},
-                6: {'language_code': 'chi', 'uid': 4610}}}
+                4: {
+                    'codec': "HDMV PGS",
+                    'language_code': 'fre',
+                    'uid': 4608},
+                5: {
+                    'codec': "HDMV PGS",
+                    'language_code': 'fre',
+                    'uid': 4609},
+                6: {
+                    'codec': "HDMV PGS",
+                    'language_code': 'chi',
+                    'uid': 4610}}}
 
         assert actual_tracks == expected_tracks
 
@@ -64,6 +176,95 @@ class TestBlurayAnalyzer:
 
         assert actual_frames_count == expected_frames_count
 
+    def test_get_subtitles_frames_count_of_some_tracks(
+            self, bluray_analyzer, bluray_dir):
+        actual_frames_count = bluray_analyzer.get_subtitles_frames_count(
+            str(bluray_dir), 419, track_ids=[5, 4])
+
+        expected_frames_count = {4: 999, 5: 1000}
+
+        assert actual_frames_count == expected_frames_count
+
+    def test_get_subtitles_frames_count_from_clips(
+            self, mkvmerge, bluray_tree):
+        ffprobe = CountingFfprobeController()
+        bluray_analyzer = BlurayAnalyzer(ffprobe, mkvmerge)
+
+        first_frames_count =\
+            bluray_analyzer.get_subtitles_frames_count(str(bluray_tree), 1)
+        assert first_frames_count == {4: 6, 5: 4, 6: 0}
+
+        second_frames_count = bluray_analyzer.get_subtitles_frames_count(
+            str(bluray_tree), 2, track_ids=[4, 5])
+        assert second_frames_count == {4: 2, 5: 1}
+
+        # Clips shared by playlists are only probed once.
+        assert ffprobe.probed_files == [
+            str(bluray_tree.join('BDMV', 'STREAM', clip_file))
+            for clip_file in ['00010.m2ts', '00011.m2ts']]
+
+        # Unless they changed since.
+        bluray_tree.join('BDMV', 'STREAM', '00010.m2ts').write_binary(
+            b'repaired stream')
+        bluray_analyzer.get_subtitles_frames_count(str(bluray_tree), 1)
+        assert ffprobe.probed_files[2:] == [
+            str(bluray_tree.join('BDMV', 'STREAM', '00010.m2ts'))]
+
+    def test_get_playlist_streams_statistics(
+            self, bluray_analyzer, bluray_tree):
+        pytest.importorskip('numpy')
+
+        # Clips last 2 seconds, and carry a video stream only during the
+        # first second.
+        for clip_name in ['00010', '00011']:
+            bluray_tree.join(
+                'BDMV', 'STREAM', '{}.m2ts'.format(clip_name)).write_binary(
+                    test.build_transport_stream([
+                        (0x1011, 0, True),
+                        (0x1011, 27000000, False),
+                        (0x1100, 54000000, True)]))
+
+        # The playlist only plays the first half of each clip.
+        actual_statistics = bluray_analyzer.get_playlist_streams_statistics(
+            str(bluray_tree), 1)
+        expected_statistics = {
+            'duration': 2.0,
+            'streams': {
+                0x1011: {'bytes': 368, 'pes_count': 1, 'bitrate': 1472.0},
+                0x1100: {'bytes': 184, 'pes_count': 1, 'bitrate': 736.0}}}
+
+        assert actual_statistics == expected_statistics
+
+    def test_get_clip_tracks(self, bluray_analyzer, bluray_tree):
+        actual_clip_tracks =\
+            bluray_analyzer.get_clip_tracks(str(bluray_tree), '00010')
+
+        # The lossy core of the first audio track (with ID 2) shares its PID.
+        expected_clip_tracks = {
+            0x1011: 0, 0x1100: 1, 0x1101: 3,
+            0x1200: 4, 0x1201: 5, 0x1202: 6}
+
+        assert actual_clip_tracks == expected_clip_tracks
+
+    def test_get_playlist_segments(self, bluray_analyzer, bluray_tree):
+        # The clip's presentation starts at 20 seconds, and the playlist
+        # plays it from 30 to 50 seconds, with a chapter at 40 seconds.
+        bluray_tree.join('BDMV', 'CLIPINF', '00012.clpi').write_binary(
+            test.build_clip_information(900000, 2700000))
+        bluray_tree.join('BDMV', 'PLAYLIST', '00003.mpls').write_binary(
+            test.build_playlist(
+                [('00010', 0, 45000), ('00012', 1350000, 2250000)],
+                marks=[(0, 0), (1, 1350000), (1, 1800000)]))
+
+        actual_segments =\
+            bluray_analyzer.get_playlist_segments(str(bluray_tree), 3)
+        expected_segments = [
+            {'clip_name': '00010', 'start': 0, 'end': 1000000000},
+            {'clip_name': '00012', 'start': 10000000000, 'end': 20000000000},
+            {'clip_name': '00012', 'start': 20000000000, 'end': 30000000000}]
+
+        assert actual_segments == expected_segments
+
     def test_identify_multiview_playlists(self, bluray_analyzer, bluray_dir):
         actual_multiview_playlists =\
             bluray_analyzer.identify_multiview_playlists(str(bluray_dir))
@@ -72,6 +273,163 @@ class TestBlurayAnalyzer:
 
         assert actual_multiview_playlists == expected_multiview_playlists
 
+    def test_get_playlist_dependencies(self, bluray_analyzer, bluray_tree):
+        actual_dependencies =\
+            bluray_analyzer.get_playlist_dependencies(str(bluray_tree), 1)
+        expected_dependencies = [
+            str(bluray_tree.join(relative_path)) for relative_path in [
+                'BDMV/PLAYLIST/00001.mpls',
+                'BDMV/CLIPINF/00010.clpi',
+                'BDMV/STREAM/00010.m2ts',
+                'BDMV/CLIPINF/00011.clpi',
+                'BDMV/STREAM/00011.m2ts']]
+
+        assert actual_dependencies == expected_dependencies
+
+    def test_get_dependencies_of_invalid_playlist(
+            self, bluray_analyzer, bluray_tree):
+        bluray_tree.join('BDMV', 'PLAYLIST', '00001.mpls').write_binary(
+            b'invalid')
+
+        actual_dependencies =\
+            bluray_analyzer.get_playlist_dependencies(str(bluray_tree), 1)
+        expected_dependencies =\
+            bluray_analyzer.get_disc_dependencies(str(bluray_tree))
+
+        assert len(expected_dependencies) == 8
+        assert actual_dependencies == expected_dependencies
+
+    def test_reuse_cached_results(
+            self, mkvmerge, bluray_tree, tmpdir):
+        ffprobe = CountingFfprobeController()
+        metrics = Metrics()
+        bluray_analyzer = BlurayAnalyzer(
+            ffprobe, mkvmerge,
+            analysis_cache=AnalysisCache(str(tmpdir.join('cache'))),
+            metrics=metrics)
+
+        first_tracks =\
+            bluray_analyzer.get_playlist_tracks(str(bluray_tree), 1)
+        misses_count = metrics.get(
+            'blu_mkv_analysis_cache_requests_total', result='miss')
+        second_tracks =\
+            bluray_analyzer.get_playlist_tracks(str(bluray_tree), 1)
+
+        assert second_tracks == first_tracks
+        assert ffprobe.calls_count == 1
+        assert misses_count > 0
+        assert metrics.get(
+            'blu_mkv_analysis_cache_requests_total', result='miss') ==\
+            misses_count
+        assert metrics.get(
+            'blu_mkv_analysis_cache_requests_total', result='hit') > 0
+
+        # Modifying a clip played by another playlist has no impact.
+        bluray_tree.join('BDMV', 'STREAM', '00012.m2ts').write_binary(
+            b'repaired stream')
+        bluray_analyzer.get_playlist_tracks(str(bluray_tree), 1)
+        assert ffprobe.calls_count == 1
+
+        # But modifying a clip played by the playlist does.
+        bluray_tree.join('BDMV', 'STREAM', '00011.m2ts').write_binary(
+            b'repaired stream')
+        bluray_analyzer.get_playlist_tracks(str(bluray_tree), 1)
+        assert ffprobe.calls_count == 2
+
+    def test_reuse_cached_playlists(self, mkvmerge, bluray_tree, tmpdir):
+        class TreeFfprobeController(CountingFfprobeController):
+            def get_bluray_playlists(self, disc_path):
+                return {
+                    1: {'duration': "2.000000", 'size': "12"},
+                    2: {'duration': "0.500000", 'size': "6"}}
+
+        ffprobe = TreeFfprobeController()
+        bluray_analyzer = BlurayAnalyzer(
+            ffprobe, mkvmerge,
+            analysis_cache=AnalysisCache(str(tmpdir.join('cache'))))
+
+        playlists = bluray_analyzer.get_playlists(str(bluray_tree))
+        assert bluray_analyzer.get_playlists(str(bluray_tree)) == playlists
+        assert ffprobe.probed_playlists == [1, 2]
+
+        # Only the playlist playing the modified clip is probed again.
+        bluray_tree.join('BDMV', 'STREAM', '00010.m2ts').write_binary(
+            b'repaired stream')
+        assert bluray_analyzer.get_playlists(str(bluray_tree)) == playlists
+        assert ffprobe.probed_playlists == [1, 2, 1]
+
+    def test_share_results_in_memory(self, mkvmerge, bluray_tree):
+        ffprobe = CountingFfprobeController()
+        memory_cache = MemoryCache()
+        first_analyzer = BlurayAnalyzer(
+            ffprobe, mkvmerge, memory_cache=memory_cache)
+        second_analyzer = BlurayAnalyzer(
+            ffprobe, mkvmerge, memory_cache=memory_cache)
+
+        first_tracks =\
+            first_analyzer.get_playlist_tracks(str(bluray_tree), 1)
+        second_tracks =\
+            second_analyzer.get_playlist_tracks(str(bluray_tree), 1)
+        assert second_tracks == first_tracks
+        assert ffprobe.calls_count == 1
+
+        # Results depending on modified files are not reused.
+        bluray_tree.join('BDMV', 'STREAM', '00011.m2ts').write_binary(
+            b'repaired stream')
+        second_analyzer.get_playlist_tracks(str(bluray_tree), 1)
+        assert ffprobe.calls_count == 2
+
+    def test_share_playlists_in_memory(self, mkvmerge, bluray_dir):
+        ffprobe = CountingFfprobeController()
+        memory_cache = MemoryCache()
+        probed_playlists = list()
+        bluray_analyzer = BlurayAnalyzer(
+            ffprobe, mkvmerge, memory_cache=memory_cache,
+            on_playlist_probed=lambda disc_path, number, info:
+                probed_playlists.append(number))
+
+        playlists = bluray_analyzer.get_playlists(str(bluray_dir))
+        assert BlurayAnalyzer(ffprobe, mkvmerge, memory_cache=memory_cache)\
+            .get_playlists(str(bluray_dir)) == playlists
+        assert bluray_analyzer.get_playlists(str(bluray_dir)) == playlists
+        assert ffprobe.probed_playlists == [0, 28, 29, 419, 420]
+        assert probed_playlists == [28, 29, 419, 420] * 2
+
+    def test_iterate_playlists_without_blocking_analyzers(
+            self, mkvmerge, bluray_dir):
+        ffprobe = CountingFfprobeController()
+        memory_cache = MemoryCache()
+        slow_analyzer = BlurayAnalyzer(
+            ffprobe, mkvmerge, memory_cache=memory_cache)
+        # Consumer stopping after the first playlist, e.g., to analyze it.
+        playlists_iterator = slow_analyzer.iter_playlists(str(bluray_dir))
+        next(playlists_iterator)
+
+        playlists = dict()
+
+        def get_playlists():
+            playlists.update(
+                BlurayAnalyzer(ffprobe, mkvmerge, memory_cache=memory_cache)
+                .get_playlists(str(bluray_dir)))
+
+        analysis = threading.Thread(target=get_playlists)
+        analysis.start()
+        analysis.join(5)
+        assert not analysis.is_alive()
+        assert sorted(playlists) == [28, 29, 419, 420]
+
+        # Playlists probed meanwhile are not probed again.
+        assert sorted(dict(playlists_iterator)) == [29, 419, 420]
+        assert ffprobe.probed_playlists == [0, 28, 29, 419, 420]
+
+    def test_expect_streams_found_by_mkvmerge(self, mkvmerge, bluray_dir):
+        ffprobe = CountingFfprobeController()
+        bluray_analyzer = BlurayAnalyzer(ffprobe, mkvmerge)
+        bluray_analyzer.get_playlist_tracks(str(bluray_dir), 1)
+
+        assert ffprobe.expected_ids ==\
+            {0x1011, 0x1100, 0x1101, 0x1200, 0x1201, 0x1202}
+
     def test_multiview_playlists_identification_needs_makemkv(
             self, ffprobe, mkvmerge, bluray_dir):
         bluray_analyzer = BlurayAnalyzer(ffprobe, mkvmerge)
@@ -100,6 +458,27 @@ class TestBlurayDisc:
 
         assert bluray_disc.playlists == expected_playlists
 
+    def test_cancel_disc_analysis(self, bluray_analyzer, bluray_dir, mock):
+        mock.patch.object(
+            MkvmergeController, '_get_executable_path',
+            return_value='/mkvmerge')
+        mkvmerge = MkvmergeController()
+        bluray_analyzer = BlurayAnalyzer(
+            test.StubFfprobeController(), mkvmerge)
+        cancellation_token = CancellationToken()
+        bluray_disc = BlurayDisc(
+            str(bluray_dir), bluray_analyzer,
+            cancellation_token=cancellation_token)
+
+        # Programs of the disc's analysis are bound to the token.
+        assert bluray_disc.bluray_analyzer.mkvmerge_controller\
+            .cancellation_token is cancellation_token
+        assert mkvmerge.cancellation_token is None
+
+        cancellation_token.cancel()
+        with pytest.raises(OperationCancelled):
+            bluray_disc.playlists
+
     def test_multiview_playlists(self, bluray_disc):
         actual_multiview_playlists = bluray_disc.multiview_playlists
         expected_multiview_playlists = [
@@ -111,6 +490,24 @@ class TestBlurayDisc:
 
         assert actual_multiview_playlists == expected_multiview_playlists
 
+    def test_iter_playlists(self, mkvmerge, bluray_dir):
+        ffprobe = CountingFfprobeController()
+        bluray_disc = BlurayDisc(
+            str(bluray_dir), BlurayAnalyzer(ffprobe, mkvmerge))
+
+        playlists = bluray_disc.iter_playlists()
+        assert next(playlists).number == 28
+        assert ffprobe.probed_playlists == [0, 28]
+
+        # Playlist 420 is a duplicate of playlist 419.
+        assert [playlist.number for playlist in playlists] == [29, 419]
+
+        # Once all yielded, playlists are kept, and not probed again.
+        assert [playlist.number for playlist in bluray_disc.playlists] ==\
+            [28, 29, 419]
+        assert list(bluray_disc.iter_playlists()) == bluray_disc.playlists
+        assert ffprobe.probed_playlists == [0, 28, 29, 419, 420]
+
     def test_get_movie_playlists(self, bluray_disc):
         actual_movie_playlists =\
             bluray_disc.get_movie_playlists(duration_factor=0.5)
@@ -176,7 +573,10 @@ class TestBlurayPlaylist:
     def test_video_tracks(self, bluray_playlist):
         actual_video_tracks = bluray_playlist.video_tracks
         expected_video_tracks = OrderedDict([
-            (0, {'language_code': None, 'uid': 4113})])
+            (0, {
+                'codec': "MPEG-4p10/AVC/h.264",
+                'language_code': None,
+                'uid': 4113})])
 
         assert isinstance(actual_video_tracks, OrderedDict)
         assert actual_video_tracks == expected_video_tracks
@@ -184,8 +584,14 @@ class TestBlurayPlaylist:
     def test_audio_tracks(self, bluray_playlist):
         actual_audio_tracks = bluray_playlist.audio_tracks
         expected_audio_tracks = OrderedDict([
-            (1, {'language_code': 'fre', 'uid': 4352}),
-            (3, {'language_code': 'chi', 'uid': 4353})])
+            (1, {
+                'codec': "DTS-HD Master Audio",
+                'language_code': 'fre',
+                'uid': 4352}),
+            (3, {
+                'codec': "DTS-HD Master Audio",
+                'language_code': 'chi',
+                'uid': 4353})])
 
         assert isinstance(actual_audio_tracks, OrderedDict)
         assert actual_audio_tracks == expected_audio_tracks
@@ -193,9 +599,18 @@ class TestBlurayPlaylist:
     def test_subtitle_tracks(self, bluray_playlist):
         actual_subtitle_tracks = bluray_playlist.subtitle_tracks
         expected_subtitle_tracks = OrderedDict([
-            (4, {'language_code': 'fre', 'uid': 4608}),
-            (5, {'language_code': 'fre', 'uid': 4609}),
-            (6, {'language_code': 'chi', 'uid': 4610})])
+            (4, {
+                'codec': "HDMV PGS",
+                'language_code': 'fre',
+                'uid': 4608}),
+            (5, {
+                'codec': "HDMV PGS",
+                'language_code': 'fre',
+                'uid': 4609}),
+            (6, {
+                'codec': "HDMV PGS",
+                'language_code': 'chi',
+                'uid': 4610})])
 
         assert isinstance(actual_subtitle_tracks, OrderedDict)
         assert actual_subtitle_tracks == expected_subtitle_tracks
@@ -205,7 +620,10 @@ class TestBlurayPlaylist:
             bluray_playlist.get_forced_subtitles(frames_count_factor=0.5)
 
         expected_forced_subtitles =\
-            OrderedDict([(4, {'language_code': 'fre', 'uid': 4608})])
+            OrderedDict([(4, {
+                'codec': "HDMV PGS",
+                'language_code': 'fre',
+                'uid': 4608})])
 
         assert isinstance(actual_forced_subtitles, OrderedDict)
         assert actual_forced_subtitles == expected_forced_subtitles
@@ -229,6 +647,55 @@ class TestBlurayPlaylist:
         assert isinstance(forced_subtitles, OrderedDict)
         assert forced_subtitles == OrderedDict()
 
+    def test_get_forced_subtitles_among_candidates(self, bluray_playlist):
+        actual_forced_subtitles = bluray_playlist.get_forced_subtitles(
+            frames_count_factor=1, track_ids=[4, 5, 6])
+
+        # The chinese subtitle is the only chinese candidate, and is thus
+        # compared with all the playlist's subtitles: it is the biggest one.
+        expected_forced_subtitles =\
+            OrderedDict([(4, {
+                'codec': "HDMV PGS",
+                'language_code': 'fre',
+                'uid': 4608})])
+
+        assert isinstance(actual_forced_subtitles, OrderedDict)
+        assert actual_forced_subtitles == expected_forced_subtitles
+
+    def test_get_forced_subtitles_of_single_candidate(self, bluray_playlist):
+        # The french subtitle is the only french candidate, and is thus
+        # compared with all the playlist's subtitles.
+        actual_forced_subtitles = bluray_playlist.get_forced_subtitles(
+            frames_count_factor=0.6, track_ids=[5])
+
+        expected_forced_subtitles =\
+            OrderedDict([(5, {
+                'codec': "HDMV PGS",
+                'language_code': 'fre',
+                'uid': 4609})])
+
+        assert actual_forced_subtitles == expected_forced_subtitles
+
+    def test_get_tracks_bitrates(self, bluray_disc):
+        bluray_playlist = BlurayPlaylist(
+            disc=bluray_disc,
+            number=419,
+            duration=timedelta(hours=2),
+            size=33940936704)
+        bluray_playlist.streams_statistics = {
+            'duration': 7200.0,
+            'streams': {
+                4113: {'bitrate': 20000000.0},
+                4352: {'bitrate': 3000000.0},
+                4608: {'bitrate': 30000.0}}}
+
+        actual_bitrates = bluray_playlist.get_tracks_bitrates()
+        expected_bitrates = {
+            0: 20000000.0, 1: 3000000.0, 2: 3000000.0, 3: 0.0,
+            4: 30000.0, 5: 0.0, 6: 0.0}
+
+        assert actual_bitrates == expected_bitrates
+
     def test_has_multiview(self, bluray_playlist):
         assert bluray_playlist.has_multiview() is True
 
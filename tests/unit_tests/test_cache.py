@@ -0,0 +1,137 @@
+import os
+import threading
+
+import pytest
+
+from blu_mkv.cache import AnalysisCache, MemoryCache, get_files_fingerprint
+from blu_mkv.process import CancellationToken, OperationCancelled
+
+
+class TestGetFilesFingerprint:
+    def test_fingerprint_changes_with_metadata_content(self, tmpdir):
+        clip_file = tmpdir.join('00001.clpi')
+        clip_file.write_binary(b'first')
+        first_fingerprint = get_files_fingerprint([str(clip_file)])
+
+        clip_file.write_binary(b'other')
+        os.utime(str(clip_file), ns=(0, 0))
+        second_fingerprint = get_files_fingerprint([str(clip_file)])
+
+        assert first_fingerprint != second_fingerprint
+
+    def test_fingerprint_changes_with_stream_modification_time(self, tmpdir):
+        stream_file = tmpdir.join('00001.m2ts')
+        stream_file.write_binary(b'stream')
+        os.utime(str(stream_file), ns=(0, 0))
+        first_fingerprint = get_files_fingerprint([str(stream_file)])
+
+        os.utime(str(stream_file), ns=(0, 1))
+        second_fingerprint = get_files_fingerprint([str(stream_file)])
+
+        assert first_fingerprint != second_fingerprint
+
+    def test_fingerprint_of_missing_files(self, tmpdir):
+        missing_file = str(tmpdir.join('00001.m2ts'))
+        assert get_files_fingerprint([missing_file]) ==\
+            get_files_fingerprint([missing_file])
+        assert get_files_fingerprint([missing_file]) !=\
+            get_files_fingerprint([])
+
+
+class TestAnalysisCache:
+    def test_store_and_load_result(self, tmpdir):
+        cache = AnalysisCache(str(tmpdir.join('cache')))
+        cache.store('/bluray', 'playlists', 'abc', {419: 'details'})
+
+        assert cache.load('/bluray', 'playlists', 'abc') == {419: 'details'}
+
+    def test_load_missing_result(self, tmpdir):
+        cache = AnalysisCache(str(tmpdir))
+
+        with pytest.raises(KeyError):
+            cache.load('/bluray', 'playlists', 'abc')
+
+    def test_load_result_with_outdated_fingerprint(self, tmpdir):
+        cache = AnalysisCache(str(tmpdir))
+        cache.store('/bluray', 'playlists', 'abc', {419: 'details'})
+
+        with pytest.raises(KeyError):
+            cache.load('/bluray', 'playlists', 'def')
+
+
+class TestMemoryCache:
+    def test_drop_least_recently_used_results(self):
+        cache = MemoryCache(max_entries=2)
+        cache.get('first', lambda: 1)
+        cache.get('second', lambda: 2)
+        assert cache.get('first', lambda: None) == 1
+
+        cache.get('third', lambda: 3)
+
+        assert len(cache) == 2
+        assert cache.get('first', lambda: None) == 1
+        assert cache.get('second', lambda: None) is None
+
+    def test_compute_concurrently_missing_result_once(self):
+        cache = MemoryCache()
+        computing = threading.Event()
+        release = threading.Event()
+        calls = list()
+
+        def compute():
+            calls.append(threading.get_ident())
+            computing.set()
+            release.wait(5)
+            return 'result'
+
+        results = list()
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cache.get('key', compute)))
+            for _ in range(4)]
+        threads[0].start()
+        computing.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert len(calls) == 1
+        assert results == ['result'] * 4
+
+    def test_compute_again_after_failure(self):
+        cache = MemoryCache()
+
+        def fail():
+            raise OSError("probe failed")
+
+        with pytest.raises(OSError):
+            cache.get('key', fail)
+
+        assert cache.get('key', lambda: 'result') == 'result'
+        assert len(cache) == 1
+
+    def test_stop_waiting_when_cancelled(self):
+        cache = MemoryCache()
+        cancellation_token = CancellationToken()
+
+        with cache.single_flight('key') as flight:
+            assert not flight.done
+            waiter_errors = list()
+
+            def wait_for_result():
+                try:
+                    cache.get('key', lambda: None, cancellation_token)
+                except OperationCancelled as exc:
+                    waiter_errors.append(exc)
+
+            waiter = threading.Thread(target=wait_for_result)
+            waiter.start()
+            cancellation_token.cancel()
+            waiter.join(5)
+
+            assert len(waiter_errors) == 1
+            flight.set_result('result')
+
+        assert cache.get('key', lambda: None) == 'result'
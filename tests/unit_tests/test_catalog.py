@@ -0,0 +1,146 @@
+import pytest
+
+from blu_mkv.bluray import BlurayAnalyzer, BlurayDisc, BlurayPlaylist
+from blu_mkv.catalog import BlurayCatalog
+
+
+@pytest.fixture
+def catalog(tmpdir):
+    catalog = BlurayCatalog(str(tmpdir.join('catalog.db')))
+    yield catalog
+    catalog.close()
+
+
+class TestBlurayCatalog:
+    def test_database_uses_wal_mode(self, catalog):
+        journal_mode =\
+            catalog.connection.execute('PRAGMA journal_mode').fetchone()[0]
+        assert journal_mode == 'wal'
+
+    def test_add_disc(self, catalog, bluray_disc, bluray_dir):
+        catalog.add_disc(bluray_disc, detect_forced_subtitles=False)
+
+        discs = catalog.get_discs()
+        assert [disc['path'] for disc in discs] == [str(bluray_dir)]
+
+        actual_playlists = catalog.search_playlists()
+        expected_playlists = [
+            {
+                'disc_path': str(bluray_dir),
+                'number': 28,
+                'duration': 3599.0,
+                'size': 16970468350,
+                'is_movie': True,
+                'has_multiview': False},
+            {
+                'disc_path': str(bluray_dir),
+                'number': 29,
+                'duration': 3600.0,
+                'size': 16970468352,
+                'is_movie': True,
+                'has_multiview': False},
+            {
+                'disc_path': str(bluray_dir),
+                'number': 419,
+                'duration': 7200.0,
+                'size': 33940936704,
+                'is_movie': True,
+                'has_multiview': True}]
+
+        assert actual_playlists == expected_playlists
+
+    def test_add_disc_twice(self, catalog, bluray_disc):
+        catalog.add_disc(bluray_disc, detect_forced_subtitles=False)
+        catalog.add_disc(bluray_disc, detect_forced_subtitles=False)
+
+        assert len(catalog.get_discs()) == 1
+        assert len(catalog.search_playlists()) == 3
+
+    def test_add_disc_without_makemkv(
+            self, catalog, ffprobe, mkvmerge, bluray_dir):
+        bluray_analyzer = BlurayAnalyzer(ffprobe, mkvmerge)
+        bluray_disc = BlurayDisc(str(bluray_dir), bluray_analyzer)
+        catalog.add_disc(bluray_disc, detect_forced_subtitles=False)
+
+        playlists = catalog.search_playlists()
+        assert all(
+            playlist['has_multiview'] is None for playlist in playlists)
+
+    def test_add_disc_with_specific_playlists(self, catalog, bluray_disc):
+        catalog.add_disc(
+            bluray_disc, playlists=bluray_disc.playlists[-1:],
+            detect_forced_subtitles=False)
+
+        # All playlists are recorded, but only tracks of the given ones.
+        assert len(catalog.search_playlists()) == 3
+
+        tracks = catalog.search_tracks()
+        assert {track['playlist_number'] for track in tracks} == {419}
+
+    def test_search_tracks(self, catalog, bluray_disc, bluray_dir):
+        catalog.add_disc(
+            bluray_disc, playlists=bluray_disc.playlists[-1:],
+            frames_count_factor=0.5)
+
+        actual_tracks = catalog.search_tracks(
+            track_type='audio', language_code='fre',
+            codec="DTS-HD Master Audio")
+        expected_tracks = [{
+            'disc_path': str(bluray_dir),
+            'playlist_number': 419,
+            'track_id': 1,
+            'type': 'audio',
+            'uid': 4352,
+            'language_code': 'fre',
+            'codec': "DTS-HD Master Audio",
+            'forced': None}]
+
+        assert actual_tracks == expected_tracks
+
+    def test_search_forced_subtitles(self, catalog, bluray_disc):
+        catalog.add_disc(
+            bluray_disc, playlists=bluray_disc.playlists[-1:],
+            frames_count_factor=0.5)
+
+        forced_subtitles = catalog.search_tracks(
+            track_type='subtitle', language_code='fre', forced=True)
+        assert [track['track_id'] for track in forced_subtitles] == [4]
+
+        other_subtitles = catalog.search_tracks(
+            track_type='subtitle', forced=False)
+        assert [track['track_id'] for track in other_subtitles] == [5, 6]
+
+    def test_search_tracks_with_known_forced_subtitles(
+            self, catalog, bluray_disc, monkeypatch):
+        monkeypatch.setattr(
+            BlurayPlaylist, 'get_forced_subtitles',
+            lambda playlist, **kwargs: pytest.fail(
+                "Forced subtitles identified again"))
+        catalog.add_disc(
+            bluray_disc, playlists=bluray_disc.playlists[-1:],
+            forced_subtitles={419: {4: False, 5: True}})
+
+        subtitles = catalog.search_tracks(track_type='subtitle')
+        assert [
+            (track['track_id'], track['forced']) for track in subtitles] ==\
+            [(4, False), (5, True), (6, None)]
+
+    def test_add_disc_without_multiview_identification(
+            self, catalog, bluray_disc):
+        catalog.add_disc(
+            bluray_disc, detect_forced_subtitles=False,
+            identify_multiview=False)
+
+        playlists = catalog.search_playlists()
+        assert all(
+            playlist['has_multiview'] is None for playlist in playlists)
+
+    def test_search_tracks_without_forced_subtitles_detection(
+            self, catalog, bluray_disc):
+        catalog.add_disc(
+            bluray_disc, playlists=bluray_disc.playlists[-1:],
+            detect_forced_subtitles=False)
+
+        subtitles = catalog.search_tracks(track_type='subtitle')
+        assert len(subtitles) == 3
+        assert all(track['forced'] is None for track in subtitles)
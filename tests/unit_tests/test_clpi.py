@@ -0,0 +1,28 @@
+import pytest
+
+from blu_mkv import clpi, test
+
+
+class TestParseClipInformation:
+    def test_parse_presentation_times(self):
+        clip_information_data = test.build_clip_information(900000, 1800000)
+
+        actual_clip_information =\
+            clpi.parse_clip_information(clip_information_data)
+        expected_clip_information = {
+            'presentation_start_time': 900000,
+            'presentation_end_time': 1800000}
+
+        assert actual_clip_information == expected_clip_information
+
+    def test_parse_file_without_signature(self):
+        with pytest.raises(clpi.ClipInformationFileError):
+            clpi.parse_clip_information(b'MPLS0200' + bytes(32))
+
+    def test_parse_truncated_file(self, tmpdir):
+        clip_information_file = tmpdir.join('00001.clpi')
+        clip_information_file.write_binary(
+            test.build_clip_information(0, 45000)[:50])
+
+        with pytest.raises(clpi.ClipInformationFileError):
+            clpi.parse_clip_information_file(str(clip_information_file))
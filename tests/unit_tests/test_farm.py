@@ -0,0 +1,184 @@
+import json
+import signal
+import subprocess
+import threading
+import time
+from urllib.request import urlopen
+
+import pytest
+
+from blu_mkv import jobqueue
+from blu_mkv.farm import Coordinator, FarmWorker, LeaseLost
+
+
+@pytest.fixture
+def disc_files(tmpdir):
+    disc_files = list()
+    for disc_name in ('first.iso', 'second.iso', 'third.iso', 'fourth.iso'):
+        disc_file = tmpdir.join(disc_name)
+        disc_file.write_binary(b'disc')
+        disc_files.append(str(disc_file))
+    return disc_files
+
+
+@pytest.fixture
+def coordinator(tmpdir):
+    coordinator = Coordinator(
+        str(tmpdir.join('queue.db')), lease_duration=0.5)
+    thread = threading.Thread(
+        target=coordinator.serve_forever, args=(0.05,))
+    thread.start()
+    yield coordinator
+    coordinator.shutdown()
+    thread.join()
+
+
+def get_jobs(coordinator):
+    with urlopen(coordinator.url + '/jobs') as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def add_jobs(coordinator, disc_files):
+    worker = FarmWorker(coordinator.url, convert=None)
+    return [
+        worker._request('/jobs', {'path': disc_file})['id']
+        for disc_file in disc_files]
+
+
+class TestConversionFarm:
+    def test_convert_discs_with_several_workers(
+            self, coordinator, disc_files):
+        assert len(set(add_jobs(coordinator, disc_files))) == 4
+        assert add_jobs(coordinator, disc_files[:1]) == [None]
+
+        converted_discs = list()
+
+        def convert(disc_path, cancellation_token, report_progress):
+            converted_discs.append(disc_path)
+            report_progress(0.5)
+            time.sleep(0.3)
+            if disc_path.endswith('third.iso'):
+                raise RuntimeError("Unable to mount disk image")
+
+        workers = [
+            FarmWorker(
+                coordinator.url, convert, worker='localhost:{}'.format(index),
+                heartbeat_interval=0.05)
+            for index in range(3)]
+        threads = [
+            threading.Thread(target=worker.run, args=(0.05,))
+            for worker in workers]
+        for thread in threads:
+            thread.start()
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and any(
+                job['state'] in (jobqueue.PENDING, jobqueue.RUNNING)
+                for job in get_jobs(coordinator)):
+            time.sleep(0.05)
+        for worker in workers:
+            worker.stop()
+        for thread in threads:
+            thread.join()
+
+        # Each disc is converted once, even though conversions take longer
+        # than a lease.
+        assert sorted(converted_discs) == sorted(disc_files)
+        jobs = get_jobs(coordinator)
+        assert [(job['state'], job['error']) for job in jobs] == [
+            (jobqueue.DONE, None),
+            (jobqueue.DONE, None),
+            (jobqueue.FAILED, "Unable to mount disk image"),
+            (jobqueue.DONE, None)]
+        assert all(job['attempts'] == 1 for job in jobs)
+        assert len(set(job['worker'] for job in jobs)) > 1
+
+    def test_give_job_of_dead_worker_to_another_worker(
+            self, coordinator, disc_files):
+        (job_id,) = add_jobs(coordinator, disc_files[:1])
+
+        # The first worker dies without renewing its lease.
+        dead_worker = FarmWorker(
+            coordinator.url, convert=None, worker='remote:1')
+        assert dead_worker.lease()['id'] == job_id
+
+        converted_discs = list()
+        worker = FarmWorker(
+            coordinator.url,
+            lambda disc_path, *_: converted_discs.append(disc_path),
+            worker='localhost:1')
+        deadline = time.monotonic() + 5
+        job = worker.lease()
+        while job is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = worker.lease()
+
+        assert job['id'] == job_id
+        assert job['attempts'] == 2
+        assert worker.run_job(job)
+        assert converted_discs == disc_files[:1]
+
+        # The dead worker's late result is rejected.
+        with pytest.raises(LeaseLost):
+            dead_worker._request(
+                '/jobs/{}/fail'.format(job_id), {'worker': 'remote:1'})
+        assert get_jobs(coordinator)[0]['state'] == jobqueue.DONE
+
+    def test_cancel_conversion_when_lease_is_lost(
+            self, coordinator, disc_files):
+        add_jobs(coordinator, disc_files[:1])
+        other_worker = FarmWorker(
+            coordinator.url, convert=None, worker='localhost:2')
+        cancelled = list()
+
+        def convert(disc_path, cancellation_token, report_progress):
+            # The lease expires before being renewed (e.g., the worker is
+            # cut off from the coordinator), and the job is given to another
+            # worker.
+            deadline = time.monotonic() + 5
+            while other_worker.lease() is None:
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+
+            while not cancellation_token.cancelled:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            cancelled.append(disc_path)
+
+        worker = FarmWorker(
+            coordinator.url, convert, worker='localhost:1',
+            heartbeat_interval=1)
+        job = worker.lease()
+
+        assert not worker.run_job(job)
+        assert cancelled == disc_files[:1]
+        assert get_jobs(coordinator)[0]['worker'] == 'localhost:2'
+
+    @pytest.mark.parametrize('stop_worker', [False, True])
+    def test_release_job_of_interrupted_conversion(
+            self, coordinator, disc_files, stop_worker):
+        (job_id,) = add_jobs(coordinator, disc_files[:1])
+
+        def convert(disc_path, cancellation_token, report_progress):
+            if stop_worker:
+                worker.stop()
+                raise RuntimeError("Mkvmerge failed")
+            raise subprocess.CalledProcessError(
+                -signal.SIGTERM, ['mkvmerge'])
+
+        worker = FarmWorker(coordinator.url, convert, worker='localhost:1')
+        assert worker.run_job(worker.lease())
+
+        # The job is not failed, but leased again.
+        job = get_jobs(coordinator)[0]
+        assert (job['state'], job['error']) == (jobqueue.PENDING, None)
+        assert worker.lease()['id'] == job_id
+
+    def test_reject_invalid_requests(self, coordinator):
+        worker = FarmWorker(coordinator.url, convert=None)
+        with pytest.raises(OSError):
+            worker._request('/jobs', {'path': '/nonexistent/disc.iso'})
+        with pytest.raises(OSError):
+            worker._request('/leases', dict())
+        with pytest.raises(OSError):
+            worker._request('/discs', dict())
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from blu_mkv.ffprobe import FfprobeController
+
+
+@pytest.fixture
+def recorded_commands(mock):
+    """Fake Ffprobe, which misses streams and details unless probing with
+    its default depth, and records its command-lines."""
+    recorded_commands = list()
+
+    def run(command, media_duration=0, **options):
+        recorded_commands.append(command)
+        if 'json' not in command:
+            return "[bluray @ 0x555da3c70e60] playlist 00800.mpls (1:00:00)"
+        if '-probesize' in command:
+            return json.dumps({
+                'format': {'size': "16970468352"},
+                'streams': [
+                    {'index': 0, 'codec_type': "video", 'id': "0x1011"},
+                    {'index': 1, 'codec_type': "audio", 'id': "0x1100"}]})
+
+        return json.dumps({
+            'format': {'duration': "3600.000000", 'size': "16970468352"},
+            'streams': [
+                {'index': 0, 'codec_type': "video", 'id': "0x1011"},
+                {'index': 1, 'codec_type': "audio", 'id': "0x1100"},
+                {'index': 2, 'codec_type': "subtitle", 'id': "0x1200"}]})
+
+    mock.patch.object(FfprobeController, '_run', side_effect=run)
+    return recorded_commands
+
+
+class TestFastProbe:
+    def test_probe_streams_with_default_depth(self, recorded_commands):
+        ffprobe = FfprobeController('/ffprobe')
+        streams =\
+            ffprobe.get_all_bluray_playlist_streams('/bluray', 800, {0x1200})
+
+        assert len(streams) == 3
+        assert recorded_commands == [[
+            '/ffprobe', '-i', 'bluray:/bluray',
+            '-show_streams', '-playlist', '800',
+            '-loglevel', 'quiet', '-print_format', 'json']]
+
+    def test_probe_streams_deeper_when_expected_ones_are_missing(
+            self, recorded_commands):
+        ffprobe = FfprobeController('/ffprobe', fast_probe=True)
+        streams = ffprobe.get_all_bluray_playlist_streams(
+            '/bluray', 800, {0x1011, 0x1100, 0x1200})
+
+        assert [stream['index'] for stream in streams] == [0, 1, 2]
+        assert [command[3:-4] for command in recorded_commands] == [
+            [
+                '-show_entries', 'stream=index,codec_type,id',
+                '-probesize', '1000000', '-analyzeduration', '500000',
+                '-playlist', '800'],
+            [
+                '-show_entries', 'stream=index,codec_type,id',
+                '-probesize', '10000000', '-analyzeduration', '5000000',
+                '-playlist', '800'],
+            [
+                '-show_entries', 'stream=index,codec_type,id',
+                '-playlist', '800']]
+
+    def test_probe_streams_once_when_expected_ones_are_found(
+            self, recorded_commands):
+        ffprobe = FfprobeController('/ffprobe', fast_probe=True)
+        streams = ffprobe.get_all_bluray_playlist_streams(
+            '/bluray', 800, {0x1011, 0x1100})
+
+        assert len(streams) == 2
+        assert len(recorded_commands) == 1
+
+    def test_probe_playlist_deeper_without_duration(
+            self, recorded_commands):
+        ffprobe = FfprobeController('/ffprobe', fast_probe=True)
+        playlists = ffprobe.get_bluray_playlists('/bluray')
+
+        assert playlists == {
+            800: {'duration': "3600.000000", 'size': "16970468352"}}
+
+        # The disc is scanned, then the playlist is probed 3 times.
+        assert len(recorded_commands) == 4
+        assert [command[4] for command in recorded_commands[1:]] ==\
+            ['format=duration,size'] * 3
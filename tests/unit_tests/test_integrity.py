@@ -0,0 +1,85 @@
+import json
+import os
+import stat
+import sys
+
+from blu_mkv import mkvmerge
+from blu_mkv.integrity import (
+    GrowingFileHasher, get_checksums_file_path, get_file_checksums)
+from blu_mkv.mkvmerge import MkvmergeController
+
+
+class TestGrowingFileHasher:
+    def test_hash_file_while_written(self, make_matroska_file, tmpdir):
+        complete_file = tmpdir.join('complete.mkv')
+        make_matroska_file(complete_file, 2)
+        content = complete_file.read_binary()
+        # Segment's size is written last, like Mkvmerge does.
+        segment_size_position = content.index(b'\x18\x53\x80\x67') + 4
+        written_content = bytearray(content)
+        written_content[segment_size_position:segment_size_position + 8] =\
+            b'\x01\xff\xff\xff\xff\xff\xff\xff'
+
+        file_path = tmpdir.join('movie.mkv')
+        hasher = GrowingFileHasher(str(file_path), piece_size=16)
+        hasher.update()
+
+        with open(str(file_path), 'wb') as matroska_file:
+            for offset in range(0, len(written_content), 24):
+                matroska_file.write(written_content[offset:offset + 24])
+                matroska_file.flush()
+                hasher.update()
+
+            # Pieces after the first cluster are hashed as they are written.
+            assert hasher.piece_digests
+
+            matroska_file.seek(segment_size_position)
+            matroska_file.write(
+                content[segment_size_position:segment_size_position + 8])
+
+        checksums = hasher.finish()
+        assert checksums == get_file_checksums(str(file_path), piece_size=16)
+        assert checksums['size'] == len(content)
+        assert len(checksums['pieces']) == -(-len(content) // 16)
+
+    def test_hash_file_which_is_not_matroska(self, tmpdir):
+        file_path = tmpdir.join('movie.mkv')
+        file_path.write_binary(b'\x00' * 100)
+
+        hasher = GrowingFileHasher(str(file_path), piece_size=16)
+        hasher.update()
+        assert not hasher.piece_digests
+
+        assert hasher.finish() ==\
+            get_file_checksums(str(file_path), piece_size=16)
+
+
+def test_hash_outputs_of_mkvmerge(
+        make_matroska_file, monkeypatch, tmpdir):
+    # Fake Mkvmerge, writing the Matroska file given in its options file.
+    reference_file = tmpdir.join('reference.mkv')
+    make_matroska_file(reference_file, 1)
+    executable_file = tmpdir.join('mkvmerge')
+    executable_file.write(
+        "#!{}\n"
+        "import json, shutil, sys\n"
+        "with open(sys.argv[1][1:]) as options_file:\n"
+        "    options = json.load(options_file)\n"
+        "shutil.copyfile({!r}, options[options.index('--output') + 1])\n"
+        .format(sys.executable, str(reference_file)))
+    os.chmod(str(executable_file), stat.S_IRWXU)
+    monkeypatch.setattr(mkvmerge, 'HASH_POLL_INTERVAL', 0.01)
+
+    controller = MkvmergeController(
+        str(executable_file), hash_outputs=True)
+    output_file_path = str(tmpdir.join('movie.mkv'))
+    controller.write(output_file_path, [{
+        'file_path': "/tmp/bluray",
+        'id': 0,
+        'type': "video",
+        'properties': dict()}])
+
+    with open(get_checksums_file_path(output_file_path)) as checksums_file:
+        checksums = json.load(checksums_file)
+
+    assert checksums == get_file_checksums(output_file_path)
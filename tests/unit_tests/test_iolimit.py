@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+
+import pytest
+
+from blu_mkv import iolimit
+from blu_mkv.iolimit import DeviceLimiter
+from blu_mkv.process import CancellationToken, OperationCancelled
+
+
+def add_block_device(sysfs_dir, device_id, device_name, partition=None,
+                     rotational=False, scsi_type='0', backing_file=None):
+    """Add a block device to a fake sysfs tree.
+
+    :param int device_id: device number of the disk or of its partition
+    """
+    disk_dir = sysfs_dir.ensure_dir('devices', 'block', device_name)
+    disk_dir.ensure('queue', 'rotational').write('1' if rotational else '0')
+    disk_dir.ensure('device', 'type').write(scsi_type)
+    if backing_file is not None:
+        disk_dir.ensure('loop', 'backing_file').write(backing_file + '\n')
+    sysfs_dir.ensure_dir('block').join(device_name).mksymlinkto(disk_dir)
+
+    if partition is not None:
+        device_dir = disk_dir.ensure_dir(partition)
+        device_dir.ensure('partition').write('1')
+    else:
+        device_dir = disk_dir
+
+    sysfs_dir.ensure_dir('dev', 'block').join('{}:{}'.format(
+        os.major(device_id), os.minor(device_id))).mksymlinkto(device_dir)
+
+
+@pytest.fixture
+def sysfs_dir(tmpdir):
+    return tmpdir.mkdir('sys')
+
+
+@pytest.fixture
+def disc_file(tmpdir):
+    disc_file = tmpdir.join('bluray.iso')
+    disc_file.write_binary(b'disc')
+    return disc_file
+
+
+class TestGetBlockDevice:
+    def test_get_device_of_partition(self, sysfs_dir, disc_file):
+        add_block_device(
+            sysfs_dir, disc_file.stat().dev, 'sda', partition='sda1',
+            rotational=True)
+
+        assert iolimit.get_block_device(
+            str(disc_file), str(sysfs_dir)) == 'sda'
+        assert iolimit.get_device_kind('sda', str(sysfs_dir)) ==\
+            iolimit.ROTATIONAL_DEVICE
+
+    def test_get_device_of_mounted_disk_image(self, sysfs_dir, disc_file):
+        # The disc's files are on a loop device, whose backing file (i.e.,
+        # the disk image) is stored on an optical drive.
+        disk_image = os.devnull
+        add_block_device(
+            sysfs_dir, disc_file.stat().dev, 'loop0', backing_file=disk_image)
+        add_block_device(
+            sysfs_dir, os.stat(disk_image).st_dev, 'sr0', scsi_type='5')
+
+        assert iolimit.get_block_device(
+            str(disc_file), str(sysfs_dir)) == 'sr0'
+        assert iolimit.get_device_kind('sr0', str(sysfs_dir)) ==\
+            iolimit.OPTICAL_DEVICE
+
+    def test_get_device_outside_of_block_devices(self, sysfs_dir, disc_file):
+        assert iolimit.get_block_device(str(disc_file), str(sysfs_dir)) is None
+
+
+class TestDeviceLimiter:
+    def test_get_width_according_to_device_kind(self, sysfs_dir):
+        add_block_device(sysfs_dir, os.makedev(11, 0), 'sr0', scsi_type='5')
+        add_block_device(sysfs_dir, os.makedev(8, 0), 'sda', rotational=True)
+        add_block_device(sysfs_dir, os.makedev(259, 0), 'nvme0n1')
+
+        io_limiter = DeviceLimiter(
+            optical_width=1, rotational_width=2, solid_state_width=8,
+            device_widths={'nvme0n1': 16}, sysfs_path=str(sysfs_dir))
+
+        assert io_limiter.get_width('sr0') == 1
+        assert io_limiter.get_width('sda') == 2
+        assert io_limiter.get_width('nvme0n1') == 16
+        assert io_limiter.get_width('0:42') == 8
+
+    def test_limit_concurrent_readers(self, sysfs_dir, disc_file):
+        add_block_device(
+            sysfs_dir, disc_file.stat().dev, 'sr0', scsi_type='5')
+        io_limiter = DeviceLimiter(sysfs_path=str(sysfs_dir))
+
+        readers = {'current': 0, 'max': 0}
+        readers_lock = threading.Lock()
+
+        def read_disc():
+            with io_limiter.limit(str(disc_file), '/missing/file'):
+                with readers_lock:
+                    readers['current'] += 1
+                    readers['max'] = max(readers['max'], readers['current'])
+                time.sleep(0.01)
+                with readers_lock:
+                    readers['current'] -= 1
+
+        threads = [threading.Thread(target=read_disc) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert readers == {'current': 0, 'max': 1}
+
+    def test_change_width_of_waited_device(self, sysfs_dir, disc_file):
+        add_block_device(
+            sysfs_dir, disc_file.stat().dev, 'sr0', scsi_type='5')
+        io_limiter = DeviceLimiter(sysfs_path=str(sysfs_dir))
+        read_discs = list()
+
+        def read_disc():
+            with io_limiter.limit(str(disc_file)):
+                read_discs.append(str(disc_file))
+
+        with io_limiter.limit(str(disc_file)):
+            reader = threading.Thread(target=read_disc)
+            reader.start()
+            reader.join(0.1)
+            assert read_discs == []
+
+            # The waiting reader is let in.
+            io_limiter.set_width('sr0', 2)
+            reader.join(5)
+            assert read_discs == [str(disc_file)]
+
+        assert io_limiter.get_width('sr0') == 2
+
+    def test_share_slots_between_processes(
+            self, sysfs_dir, disc_file, tmpdir):
+        add_block_device(
+            sysfs_dir, disc_file.stat().dev, 'sr0', scsi_type='5')
+        # Limiters of two processes, sharing the same lock directory.
+        (first_limiter, second_limiter) = [
+            DeviceLimiter(
+                sysfs_path=str(sysfs_dir), lock_dir=str(tmpdir.join('locks')))
+            for _ in range(2)]
+        read_discs = list()
+
+        def read_disc():
+            with second_limiter.limit(str(disc_file)):
+                read_discs.append(str(disc_file))
+
+        with first_limiter.limit(str(disc_file)):
+            reader = threading.Thread(target=read_disc)
+            reader.start()
+            reader.join(0.3)
+            assert read_discs == []
+
+        # The slot is taken once released by the other process.
+        reader.join(5)
+        assert read_discs == [str(disc_file)]
+        assert tmpdir.join('locks', 'sr0.0.lock').check()
+
+    def test_cancel_wait_for_device(self, sysfs_dir, disc_file, tmpdir):
+        add_block_device(
+            sysfs_dir, disc_file.stat().dev, 'sr0', scsi_type='5')
+        # Waits for the process' semaphore and for another process' slot.
+        io_limiter = DeviceLimiter(
+            sysfs_path=str(sysfs_dir), lock_dir=str(tmpdir.join('locks')))
+        other_limiter = DeviceLimiter(
+            sysfs_path=str(sysfs_dir), lock_dir=str(tmpdir.join('locks')))
+        errors = list()
+
+        def read_disc(limiter, cancellation_token):
+            try:
+                with limiter.limit(
+                        str(disc_file),
+                        cancellation_token=cancellation_token):
+                    pass
+            except OperationCancelled as exc:
+                errors.append(exc)
+
+        with io_limiter.limit(str(disc_file)):
+            cancellation_token = CancellationToken()
+            readers = [
+                threading.Thread(
+                    target=read_disc, args=(limiter, cancellation_token))
+                for limiter in (io_limiter, other_limiter)]
+            for reader in readers:
+                reader.start()
+                reader.join(0.2)
+                assert reader.is_alive()
+
+            cancellation_token.cancel()
+            for reader in readers:
+                reader.join(5)
+                assert not reader.is_alive()
+            assert len(errors) == 2
+
+        # The cancelled readers do not hold the device.
+        assert io_limiter.count_readers('sr0') == 0
+        with other_limiter.limit(str(disc_file)):
+            pass
+
+    def test_share_width_between_processes(
+            self, sysfs_dir, disc_file, tmpdir):
+        add_block_device(
+            sysfs_dir, disc_file.stat().dev, 'sr0', scsi_type='5')
+        (first_limiter, second_limiter) = [
+            DeviceLimiter(
+                sysfs_path=str(sysfs_dir), lock_dir=str(tmpdir.join('locks')))
+            for _ in range(2)]
+        with second_limiter.limit(str(disc_file)):
+            pass
+
+        # Width tuned by the first process.
+        first_limiter.set_width('sr0', 3)
+        assert tmpdir.join('locks', 'sr0.width').read() == '3'
+        assert second_limiter.get_width('sr0') == 3
+        with second_limiter.limit(str(disc_file)):
+            assert second_limiter._get_semaphore('sr0').width == 3
+
+        # Until the process stops setting it.
+        os.utime(str(tmpdir.join('locks', 'sr0.width')), (0, 0))
+        assert second_limiter.get_width('sr0') == 1
+
+    def test_get_device_statistics(self, sysfs_dir):
+        add_block_device(sysfs_dir, os.makedev(8, 0), 'sda')
+        sysfs_dir.join('block', 'sda', 'stat').write(
+            '  1200  30  8000  500  40  2  16  90  0  600  590\n')
+
+        assert iolimit.get_device_statistics('sda', str(sysfs_dir)) ==\
+            (8000 * 512, 16 * 512)
+        assert iolimit.get_device_statistics('sdb', str(sysfs_dir)) is None
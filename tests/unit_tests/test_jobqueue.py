@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import socket
+import subprocess
+
+import pytest
+
+from blu_mkv import jobqueue
+from blu_mkv.jobqueue import JobQueue
+
+
+@pytest.fixture
+def queue_path(tmpdir):
+    return str(tmpdir.join('queue.db'))
+
+
+@pytest.fixture
+def disc_files(tmpdir):
+    disc_files = list()
+    for disc_name in ('first.iso', 'second.iso'):
+        disc_file = tmpdir.join(disc_name)
+        disc_file.write_binary(b'disc')
+        disc_files.append(str(disc_file))
+    return disc_files
+
+
+class TestJobQueue:
+    def test_do_not_queue_same_disc_twice(self, queue_path, disc_files):
+        job_queue = JobQueue(queue_path)
+
+        job_id = job_queue.add(disc_files[0])
+        assert job_id is not None
+        assert job_queue.add(disc_files[0]) is None
+
+        # Unless the disc has been modified since.
+        with open(disc_files[0], 'ab') as disc_file:
+            disc_file.write(b' repaired')
+        assert job_queue.add(disc_files[0]) is not None
+
+    def test_claim_jobs_in_queuing_order(self, queue_path, disc_files):
+        job_queue = JobQueue(queue_path)
+        for disc_file in disc_files:
+            job_queue.add(disc_file)
+
+        first_job = job_queue.claim('host:1')
+        second_job = job_queue.claim('host:2')
+
+        assert first_job['path'] == disc_files[0]
+        assert first_job['state'] == jobqueue.RUNNING
+        assert first_job['worker'] == 'host:1'
+        assert first_job['attempts'] == 1
+        assert second_job['path'] == disc_files[1]
+        assert job_queue.claim() is None
+
+        job_queue.complete(first_job['id'])
+        job_queue.fail(second_job['id'], "Unable to mount disk image")
+
+        assert [
+            (job['state'], job['error']) for job in job_queue.get_jobs()] == [
+                (jobqueue.DONE, None),
+                (jobqueue.FAILED, "Unable to mount disk image")]
+
+    def test_keep_jobs_across_restarts(self, queue_path, disc_files):
+        job_queue = JobQueue(queue_path)
+        job_queue.add(disc_files[0])
+        job_queue.close()
+
+        job_queue = JobQueue(queue_path)
+        assert job_queue.add(disc_files[0]) is None
+        assert job_queue.claim()['path'] == disc_files[0]
+
+    def test_requeue_jobs_of_dead_workers(self, queue_path, disc_files):
+        dead_process = subprocess.Popen(['true'])
+        dead_process.wait()
+
+        job_queue = JobQueue(queue_path)
+        for disc_file in disc_files:
+            job_queue.add(disc_file)
+
+        abandoned_job = job_queue.claim(
+            jobqueue.get_worker_name(dead_process.pid))
+        running_job = job_queue.claim(jobqueue.get_worker_name(os.getpid()))
+        # Workers of other hosts are not checked.
+        job_queue.retry(running_job['id'])
+        remote_job = job_queue.claim('remote-host:{}'.format(dead_process.pid))
+
+        assert job_queue.requeue_abandoned_jobs() == [abandoned_job['id']]
+
+        requeued_job = job_queue.claim()
+        assert requeued_job['id'] == abandoned_job['id']
+        assert requeued_job['attempts'] == 2
+        assert job_queue.get_job(remote_job['id'])['state'] ==\
+            jobqueue.RUNNING
+
+    def test_requeue_jobs_of_reused_worker_names(
+            self, queue_path, disc_files):
+        job_queue = JobQueue(queue_path)
+        for disc_file in disc_files:
+            job_queue.add(disc_file)
+
+        # A job of the current process, claimed before it restarted with the
+        # same name (e.g., PID 1 in a container).
+        own_job = job_queue.claim()
+        assert own_job['worker'] == jobqueue.get_worker_name()
+        # A job of a process which got the same PID before a reboot.
+        previous_boot_job = job_queue.claim('{}:{}:previous-boot/1'.format(
+            socket.gethostname(), os.getpid()))
+
+        assert job_queue.requeue_abandoned_jobs() == [
+            own_job['id'], previous_boot_job['id']]
+
+    def test_requeue_jobs_whose_lease_expired(self, queue_path, disc_files):
+        job_queue = JobQueue(queue_path)
+        for disc_file in disc_files:
+            job_queue.add(disc_file)
+
+        expired_job = job_queue.claim('host-1:1', lease_duration=-1)
+        leased_job = job_queue.claim('host-2:1', lease_duration=60)
+        assert job_queue.renew_lease(
+            leased_job['id'], 'host-2:1', 60, progress=0.5)
+
+        assert job_queue.requeue_expired_leases() == [expired_job['id']]
+        assert job_queue.get_job(leased_job['id'])['progress'] == 0.5
+
+        # The job is given to another worker, and its first worker cannot
+        # renew its lease nor report its result anymore.
+        assert job_queue.claim('host-3:1')['id'] == expired_job['id']
+        assert not job_queue.renew_lease(expired_job['id'], 'host-1:1', 60)
+        assert not job_queue.complete(expired_job['id'], 'host-1:1')
+        assert job_queue.complete(expired_job['id'], 'host-3:1')
+        assert job_queue.get_job(expired_job['id'])['worker'] == 'host-3:1'
+
+    def test_retry_job_of_worker(self, queue_path, disc_files):
+        job_queue = JobQueue(queue_path)
+        job_queue.add(disc_files[0])
+        job = job_queue.claim('host-1:1', lease_duration=60)
+
+        # Only the worker running the job can put it back in the queue.
+        assert not job_queue.retry(job['id'], 'host-2:1')
+        assert job_queue.retry(job['id'], 'host-1:1')
+        assert job_queue.get_job(job['id'])['state'] == jobqueue.PENDING
+        assert not job_queue.retry(job['id'], 'host-1:1')
+
+    def test_upgrade_queue_without_leases(self, queue_path, disc_files):
+        connection = sqlite3.connect(queue_path)
+        connection.executescript(
+            jobqueue.SCHEMA.replace('    lease_expires_at REAL,\n', '')
+            .replace('    progress REAL,\n', ''))
+        connection.close()
+
+        job_queue = JobQueue(queue_path)
+        job_queue.add(disc_files[0])
+        assert job_queue.claim(lease_duration=60)['lease_expires_at']
@@ -0,0 +1,38 @@
+import pytest
+
+from blu_mkv.matroska import (
+    MatroskaFileError, get_tracks_count, verify_matroska_file)
+
+
+class TestVerifyMatroskaFile:
+    def test_count_tracks(self, make_matroska_file, tmpdir):
+        file_path = tmpdir.join('movie.mkv')
+        make_matroska_file(file_path, 3)
+
+        assert get_tracks_count(str(file_path)) == 3
+        assert verify_matroska_file(str(file_path), 3)
+        assert not verify_matroska_file(str(file_path), 2)
+
+    def test_file_without_tracks(self, make_matroska_file, tmpdir):
+        file_path = tmpdir.join('chapters.mkv')
+        make_matroska_file(file_path, 0)
+
+        assert verify_matroska_file(str(file_path), 0)
+
+    def test_truncated_file(self, make_matroska_file, tmpdir):
+        file_path = tmpdir.join('movie.mkv')
+        make_matroska_file(file_path, 3, truncated_size=10)
+
+        with pytest.raises(MatroskaFileError):
+            get_tracks_count(str(file_path))
+        assert not verify_matroska_file(str(file_path))
+
+    def test_file_which_is_not_matroska(self, tmpdir):
+        file_path = tmpdir.join('movie.mkv')
+        file_path.write_binary(b'RIFF\x00\x00\x00\x00AVI ')
+
+        with pytest.raises(MatroskaFileError):
+            get_tracks_count(str(file_path))
+
+    def test_missing_file(self, tmpdir):
+        assert not verify_matroska_file(str(tmpdir.join('movie.mkv')))
@@ -0,0 +1,118 @@
+from urllib.request import urlopen
+
+import pytest
+
+from blu_mkv.metrics import CONTENT_TYPE, Metrics
+
+
+class TestMetrics:
+    def test_render_counters(self):
+        metrics = Metrics()
+        metrics.increment('blu_mkv_discs_processed_total')
+        metrics.increment('blu_mkv_remuxed_bytes_total', 1024)
+        metrics.increment('blu_mkv_remuxed_bytes_total', 512)
+        metrics.increment(
+            'blu_mkv_program_runs_total', program='mkvmerge',
+            status='success')
+
+        lines = metrics.render().splitlines()
+        assert '# TYPE blu_mkv_discs_processed_total counter' in lines
+        assert 'blu_mkv_discs_processed_total 1' in lines
+        assert 'blu_mkv_remuxed_bytes_total 1536' in lines
+        assert (
+            'blu_mkv_program_runs_total{program="mkvmerge",status="success"} '
+            '1') in lines
+
+    def test_render_histograms(self):
+        metrics = Metrics()
+        for duration in (0.2, 3, 10000):
+            metrics.observe(
+                'blu_mkv_program_duration_seconds', duration,
+                program='ffprobe')
+
+        lines = metrics.render().splitlines()
+        for (bound, count) in [
+                ('0.1', 0), ('0.5', 1), ('5', 2), ('7200', 2), ('+Inf', 3)]:
+            assert (
+                'blu_mkv_program_duration_seconds_bucket'
+                '{{le="{}",program="ffprobe"}} {}'.format(bound, count)
+                in lines)
+        assert 'blu_mkv_program_duration_seconds_sum{program="ffprobe"} '\
+            '10003.2' in lines
+        assert 'blu_mkv_program_duration_seconds_count{program="ffprobe"} '\
+            '3' in lines
+
+    def test_escape_labels(self):
+        metrics = Metrics()
+        metrics.increment('blu_mkv_failures_total', stage='re"mux\\\n')
+
+        assert 'blu_mkv_failures_total{stage="re\\"mux\\\\\\n"} 1' in\
+            metrics.render().splitlines()
+
+    def test_reject_unknown_metrics(self):
+        metrics = Metrics()
+        with pytest.raises(KeyError):
+            metrics.increment('blu_mkv_unknown_total')
+        with pytest.raises(ValueError):
+            metrics.observe('blu_mkv_discs_processed_total', 1)
+
+    def test_count_failures(self):
+        metrics = Metrics()
+        with metrics.count_failures('analysis'):
+            pass
+        with pytest.raises(SystemExit):
+            with metrics.count_failures('remux'):
+                raise SystemExit("Mkvmerge failed")
+
+        assert metrics.get('blu_mkv_failures_total', stage='analysis') == 0
+        assert metrics.get('blu_mkv_failures_total', stage='remux') == 1
+
+    def test_write_textfile(self, tmpdir):
+        metrics = Metrics()
+        metrics.increment('blu_mkv_playlists_probed_total', 3)
+        metrics_file = tmpdir.join('blu_mkv.prom')
+
+        metrics.write_textfile(str(metrics_file))
+
+        assert 'blu_mkv_playlists_probed_total 3' in\
+            metrics_file.read().splitlines()
+        assert 'blu_mkv_last_run_timestamp_seconds' in metrics_file.read()
+        assert sorted(tmpdir.listdir()) == [
+            tmpdir.join('.blu_mkv.prom.json'), metrics_file]
+
+    def test_add_up_textfile_writes(self, tmpdir):
+        metrics_file = tmpdir.join('blu_mkv.prom')
+        # Conversion of a disc, by its own process.
+        disc_metrics = Metrics()
+        disc_metrics.increment('blu_mkv_discs_processed_total')
+        disc_metrics.observe(
+            'blu_mkv_program_duration_seconds', 3, program='mkvmerge')
+        disc_metrics.write_textfile(str(metrics_file))
+        # Worker converting several discs.
+        worker_metrics = Metrics()
+        for _ in range(2):
+            worker_metrics.increment('blu_mkv_discs_processed_total')
+            worker_metrics.observe(
+                'blu_mkv_program_duration_seconds', 3, program='mkvmerge')
+            worker_metrics.write_textfile(str(metrics_file))
+
+        lines = metrics_file.read().splitlines()
+        assert 'blu_mkv_discs_processed_total 3' in lines
+        assert 'blu_mkv_program_duration_seconds_count{program="mkvmerge"} '\
+            '3' in lines
+        assert 'blu_mkv_program_duration_seconds_sum{program="mkvmerge"} '\
+            '9' in lines
+
+    def test_serve_metrics(self):
+        metrics = Metrics()
+        metrics.increment('blu_mkv_discs_processed_total')
+        server = metrics.serve(0)
+        try:
+            with urlopen('http://127.0.0.1:{}/metrics'.format(
+                    server.server_port)) as response:
+                assert response.headers['Content-Type'] == CONTENT_TYPE
+                assert 'blu_mkv_discs_processed_total 1' in\
+                    response.read().decode('utf-8').splitlines()
+        finally:
+            server.shutdown()
+            server.server_close()
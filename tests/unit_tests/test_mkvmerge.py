@@ -1,13 +1,15 @@
-import subprocess
+import json
+from xml.etree import ElementTree
 
 import pytest
 
+from blu_mkv import test
 from blu_mkv.mkvmerge import MkvmergeController
 
 
 @pytest.fixture
 def mock_mkvmerge(mock):
-    mock.patch.object(subprocess, 'check_call')
+    mock.patch.object(MkvmergeController, '_run')
     return MkvmergeController(executable_file='/mkvmerge')
 
 
@@ -16,18 +18,27 @@ class TestMkvmergeController:
         with pytest.raises(AssertionError):
             mock_mkvmerge.write('/movie.mkv', [])
 
-    def test_write_with_only_required_options_set(self, mock_mkvmerge):
+    def test_write_with_only_required_options_set(
+            self, mock_mkvmerge, tmpdir):
+        output_file_path = str(tmpdir.join('movie.mkv'))
+        options_file_path = str(tmpdir.join('movie.mkvmerge.json'))
         input_streams = [{
             'file_path': "/tmp/bluray",
             'id': 0,
             'type': "video",
             'properties': dict()}]
 
-        mock_mkvmerge.write('/movie.mkv', input_streams)
+        mock_mkvmerge.write(output_file_path, input_streams)
 
-        subprocess.check_call.assert_called_once_with([
-            '/mkvmerge',
-            '--output', '/movie.mkv',
+        MkvmergeController._run.assert_called_once_with(
+            ['/mkvmerge', '@{}'.format(options_file_path)], None,
+            capture_output=False)
+
+        with open(options_file_path) as options_file:
+            mkvmerge_options = json.load(options_file)
+
+        assert mkvmerge_options == [
+            '--output', output_file_path,
             '--title', '',
             '--track-order', '0:0',
             '--default-track', '0:0',
@@ -36,9 +47,11 @@ class TestMkvmergeController:
             '--audio-tracks', '',
             '--subtitle-tracks', '',
             '--video-tracks', '0',
-            '/tmp/bluray'])
+            '/tmp/bluray']
 
-    def test_write_with_all_options_set(self, mock_mkvmerge):
+    def test_write_with_all_options_set(self, mock_mkvmerge, tmpdir):
+        output_file_path = str(tmpdir.join('movie.mkv'))
+        options_file_path = str(tmpdir.join('movie.mkvmerge.json'))
         input_streams = [
             {
                 'file_path': "/tmp/bluray_1",
@@ -98,14 +111,19 @@ class TestMkvmergeController:
         ]
 
         mock_mkvmerge.write(
-            '/movie.mkv', input_streams, title='Super Movie',
+            output_file_path, input_streams, title='Super Movie',
             attachments=attachments)
 
-        subprocess.check_call.assert_called_once_with([
-            '/mkvmerge',
+        MkvmergeController._run.assert_called_once_with(
+            ['/mkvmerge', '@{}'.format(options_file_path)], None,
+            capture_output=False)
 
+        with open(options_file_path) as options_file:
+            mkvmerge_options = json.load(options_file)
+
+        assert mkvmerge_options == [
             # Global options
-            '--output', '/movie.mkv',
+            '--output', output_file_path,
             '--title', 'Super Movie',
 
             '--attachment-mime-type', 'jpeg',
@@ -166,4 +184,236 @@ class TestMkvmergeController:
             '--video-tracks', '',
 
             #  Second disc's path
-            '/tmp/bluray_2'])
+            '/tmp/bluray_2']
+
+    def test_write_with_segment_uid(self, mock_mkvmerge, tmpdir):
+        output_file_path = str(tmpdir.join('00010.mkv'))
+        input_streams = [{
+            'file_path': "/tmp/00010.m2ts",
+            'id': 0,
+            'type': "video",
+            'properties': dict()}]
+
+        mock_mkvmerge.write(
+            output_file_path, input_streams,
+            segment_uid='0123456789abcdef0123456789abcdef')
+
+        options_file_path = str(tmpdir.join('00010.mkvmerge.json'))
+        with open(options_file_path) as options_file:
+            mkvmerge_options = json.load(options_file)
+
+        assert mkvmerge_options[4:6] == [
+            '--segment-uid', '0123456789abcdef0123456789abcdef']
+
+    def test_write_ordered_chapters(self, mock_mkvmerge, tmpdir):
+        output_file_path = str(tmpdir.join('movie.mkv'))
+        options_file_path = str(tmpdir.join('movie.mkvmerge.json'))
+        chapters_file_path = str(tmpdir.join('movie.chapters.xml'))
+        chapters = [
+            {
+                'segment_uid': '0123456789abcdef0123456789abcdef',
+                'start': 0,
+                'end': 3723500000000},
+            {
+                'segment_uid': 'fedcba9876543210fedcba9876543210',
+                'start': 1000000,
+                'end': 60000000000}]
+
+        input_streams = [
+            {
+                'file_path': '/bluray/BDMV/STREAM/00010.m2ts',
+                'id': 0,
+                'type': 'video',
+                'properties': {}}]
+
+        mock_mkvmerge.write_ordered_chapters(
+            output_file_path, chapters, input_streams, title='Super Movie')
+
+        MkvmergeController._run.assert_called_once_with(
+            ['/mkvmerge', '@{}'.format(options_file_path)], 0,
+            capture_output=False)
+
+        with open(options_file_path) as options_file:
+            mkvmerge_options = json.load(options_file)
+
+        # Only the first second of the first segment's streams is muxed.
+        assert mkvmerge_options[:10] == [
+            '--output', output_file_path,
+            '--title', 'Super Movie',
+            '--chapters', chapters_file_path,
+            '--split', 'parts:00:00:00-00:00:01',
+            '--track-order', '0:0']
+        assert mkvmerge_options[-1] == '/bluray/BDMV/STREAM/00010.m2ts'
+
+        edition = ElementTree.parse(chapters_file_path).find('EditionEntry')
+        assert edition.findtext('EditionFlagOrdered') == '1'
+
+        actual_chapters = [
+            (
+                atom.findtext('ChapterTimeStart'),
+                atom.findtext('ChapterTimeEnd'),
+                atom.findtext('ChapterSegmentUID'),
+                atom.find('ChapterSegmentUID').get('format'))
+            for atom in edition.findall('ChapterAtom')]
+        expected_chapters = [
+            (
+                '00:00:00.000000000', '01:02:03.500000000',
+                '0123456789abcdef0123456789abcdef', 'hex'),
+            (
+                '00:00:00.001000000', '00:01:00.000000000',
+                'fedcba9876543210fedcba9876543210', 'hex')]
+
+        assert actual_chapters == expected_chapters
+
+    def test_write_ordered_chapters_without_chapters(self, mock_mkvmerge):
+        with pytest.raises(AssertionError):
+            mock_mkvmerge.write_ordered_chapters('/movie.mkv', [], [])
+
+
+class TestWriteChunked:
+    @pytest.fixture
+    def disc_dir(self, tmpdir):
+        """Blu-ray disc with a playlist of 2 clips, the second one being only
+        partially played."""
+        disc_dir = tmpdir.mkdir('bluray')
+        disc_dir.ensure('BDMV', 'PLAYLIST', '00001.mpls').write_binary(
+            test.build_playlist(
+                [('00010', 45000, 450000), ('00020', 90000, 180000)],
+                marks=[(0, 45000), (1, 135000)]))
+        disc_dir.ensure('BDMV', 'CLIPINF', '00010.clpi').write_binary(
+            test.build_clip_information(45000, 450000))
+        disc_dir.ensure('BDMV', 'CLIPINF', '00020.clpi').write_binary(
+            test.build_clip_information(45000, 450000))
+        disc_dir.ensure('BDMV', 'STREAM', '00010.m2ts')
+        disc_dir.ensure('BDMV', 'STREAM', '00020.m2ts')
+        return disc_dir
+
+    @pytest.fixture
+    def chunked_mkvmerge(self, mock):
+        """Mkvmerge whose playlists' and clips' tracks have different
+        identifiers, and which records the options of each remux, and the
+        starts of the chapters given to it."""
+        mkvmerge = MkvmergeController(executable_file='/mkvmerge')
+        mkvmerge.remuxes = list()
+        mkvmerge.media_durations = list()
+        mkvmerge.chapters_starts = None
+
+        def get_file_info(file_path):
+            pids = [4113, 4352]
+            if file_path.endswith('.m2ts'):
+                pids.reverse()
+            return {'tracks': [
+                {'id': track_id, 'properties': {'ts_pid': pid}}
+                for (track_id, pid) in enumerate(pids)]}
+
+        def run(command, media_duration=0, **options):
+            with open(command[1][1:]) as options_file:
+                mkvmerge_options = json.load(options_file)
+            mkvmerge.remuxes.append(mkvmerge_options)
+            mkvmerge.media_durations.append(media_duration)
+
+            if '--chapters' in mkvmerge_options:
+                edition = ElementTree.parse(mkvmerge_options[
+                    mkvmerge_options.index('--chapters') + 1]).find(
+                        'EditionEntry')
+                assert edition.find('EditionFlagOrdered') is None
+                mkvmerge.chapters_starts = [
+                    atom.findtext('ChapterTimeStart')
+                    for atom in edition.findall('ChapterAtom')]
+
+        mkvmerge.get_file_info = get_file_info
+        mock.patch.object(mkvmerge, '_run', side_effect=run)
+        return mkvmerge
+
+    def test_write_playlist_in_chunks(
+            self, chunked_mkvmerge, disc_dir, tmpdir):
+        playlist_path = str(disc_dir.join('BDMV', 'PLAYLIST', '00001.mpls'))
+        output_file_path = str(tmpdir.join('movie.mkv'))
+        input_streams = [
+            {
+                'file_path': playlist_path,
+                'id': 1,
+                'type': "audio",
+                'properties': {'default': True, 'name': "Stereo"}},
+            {
+                'file_path': playlist_path,
+                'id': 0,
+                'type': "video",
+                'properties': dict()}]
+
+        chunked_mkvmerge.write_chunked(
+            output_file_path, input_streams, title='Super Movie',
+            max_workers=2)
+
+        (*chunk_remuxes, append_remux) = chunked_mkvmerge.remuxes
+        chunk_remuxes.sort()
+        first_chunk = str(tmpdir.join('movie.part-001.mkv'))
+        second_chunk = str(tmpdir.join('movie.part-002.mkv'))
+        first_clip = str(disc_dir.join('BDMV', 'STREAM', '00010.m2ts'))
+        second_clip = str(disc_dir.join('BDMV', 'STREAM', '00020.m2ts'))
+
+        # Streams are matched in clips by their PID, and keep their flags.
+        assert chunk_remuxes == [
+            [
+                '--output', first_chunk,
+                '--track-order', '0:0,0:1',
+                '--default-track', '0:1',
+                '--forced-track', '0:0',
+                '--track-name', '0:Stereo',
+                '--default-track', '1:0',
+                '--forced-track', '1:0',
+                '--track-name', '1:',
+                '--audio-tracks', '0',
+                '--subtitle-tracks', '',
+                '--video-tracks', '1',
+                first_clip],
+            [
+                '--output', second_chunk,
+                '--split', 'parts:00:00:01.000000000-00:00:03.000000000',
+                '--track-order', '0:0,0:1',
+                '--default-track', '0:1',
+                '--forced-track', '0:0',
+                '--track-name', '0:Stereo',
+                '--default-track', '1:0',
+                '--forced-track', '1:0',
+                '--track-name', '1:',
+                '--audio-tracks', '0',
+                '--subtitle-tracks', '',
+                '--video-tracks', '1',
+                second_clip]]
+
+        chapters_file_path = str(tmpdir.join('movie.chapters.xml'))
+        assert append_remux == [
+            '--output', output_file_path,
+            '--title', 'Super Movie',
+            '--chapters', chapters_file_path,
+            first_chunk, '+', second_chunk]
+
+        # Remuxes are allowed time according to the clips' and playlist's
+        # durations.
+        assert sorted(chunked_mkvmerge.media_durations) == [9, 9, 11]
+
+        # Chapters start relatively to the beginning of the playlist.
+        assert chunked_mkvmerge.chapters_starts == [
+            '00:00:00.000000000', '00:00:10.000000000']
+
+        # Chunks and chapters are removed once joined.
+        assert sorted(tmpdir.listdir()) == sorted([
+            disc_dir, tmpdir.join('movie.mkvmerge.json')])
+
+    def test_write_playlist_with_single_clip_in_one_pass(
+            self, chunked_mkvmerge, disc_dir, tmpdir):
+        disc_dir.join('BDMV', 'PLAYLIST', '00002.mpls').write_binary(
+            test.build_playlist([('00010', 45000, 450000)]))
+        playlist_path = str(disc_dir.join('BDMV', 'PLAYLIST', '00002.mpls'))
+
+        chunked_mkvmerge.write_chunked(
+            str(tmpdir.join('movie.mkv')),
+            [{
+                'file_path': playlist_path,
+                'id': 0,
+                'type': "video",
+                'properties': dict()}])
+
+        assert len(chunked_mkvmerge.remuxes) == 1
+        assert chunked_mkvmerge.remuxes[0][-1] == playlist_path
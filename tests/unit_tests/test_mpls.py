@@ -0,0 +1,60 @@
+import pytest
+
+from blu_mkv import mpls, test
+
+
+class TestParsePlaylist:
+    def test_parse_play_items_and_marks(self):
+        playlist_data = test.build_playlist(
+            [('00001', 900000, 1800000), ('00002', 0, 450000)],
+            marks=[(0, 900000), (1, 0)])
+
+        actual_playlist = mpls.parse_playlist(playlist_data)
+        expected_playlist = {
+            'play_items': [
+                {
+                    'clip_name': '00001',
+                    'in_time': 900000,
+                    'out_time': 1800000,
+                    'connection_condition': 1,
+                    'angle_clip_names': []},
+                {
+                    'clip_name': '00002',
+                    'in_time': 0,
+                    'out_time': 450000,
+                    'connection_condition': 1,
+                    'angle_clip_names': []}],
+            'sub_paths': [],
+            'marks': [
+                {'type': mpls.ENTRY_MARK_TYPE, 'play_item': 0, 'time': 900000},
+                {'type': mpls.ENTRY_MARK_TYPE, 'play_item': 1, 'time': 0}]}
+
+        assert actual_playlist == expected_playlist
+
+    def test_parse_invalid_playlist(self):
+        with pytest.raises(mpls.PlaylistFileError):
+            mpls.parse_playlist(b'INDX0200')
+
+    def test_parse_truncated_playlist_file(self, tmpdir):
+        playlist_file = tmpdir.join('00001.mpls')
+        playlist_file.write_binary(
+            test.build_playlist([('00001', 0, 45000)])[:50])
+
+        with pytest.raises(mpls.PlaylistFileError):
+            mpls.parse_playlist_file(str(playlist_file))
+
+
+class TestGetClipNames:
+    def test_get_clips_of_angles_and_sub_paths(self):
+        playlist = {
+            'play_items': [
+                {
+                    'clip_name': '00001',
+                    'angle_clip_names': ['00002', '00003']},
+                {
+                    'clip_name': '00004',
+                    'angle_clip_names': []}],
+            'sub_paths': [{'type': 8, 'clip_names': ['00005']}]}
+
+        assert mpls.get_clip_names(playlist) ==\
+            {'00001', '00002', '00003', '00004', '00005'}
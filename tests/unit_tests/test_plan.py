@@ -0,0 +1,495 @@
+import json
+import os
+
+import pytest
+
+from blu_mkv import test
+from blu_mkv.bluray import BlurayAnalyzer, BlurayDisc, BlurayPlaylist
+from blu_mkv.metrics import Metrics
+from blu_mkv.plan import (
+    ConversionCheckpoint, ConversionPlan, ConversionPlanError,
+    ConversionPlanExecutor, convert_disc)
+
+
+class RecordingMkvmergeController(test.StubMkvmergeController):
+    def __init__(self):
+        self.written_files = list()
+        self.written_segments = list()
+        self.written_chapters = list()
+        self.chunked_files = list()
+
+    def write(
+            self, output_file_path, input_tracks, title=None,
+            attachments=None, segment_uid=None):
+        if segment_uid is None:
+            self.written_files.append(
+                (output_file_path, input_tracks, title, attachments))
+        else:
+            self.written_segments.append(
+                (output_file_path, input_tracks, segment_uid))
+
+    def write_chunked(
+            self, output_file_path, input_streams, title=None,
+            attachments=None, segment_uid=None, max_workers=None):
+        self.chunked_files.append((output_file_path, max_workers))
+
+    def write_ordered_chapters(
+            self, output_file_path, chapters, input_streams, title=None,
+            attachments=None):
+        self.written_chapters.append(
+            (output_file_path, chapters, input_streams, title, attachments))
+
+
+@pytest.fixture
+def conversion_plan(bluray_disc, bluray_covers):
+    return ConversionPlan.from_disc(
+        bluray_disc, "Super Movie", '/videos', playlists_count=0,
+        audio_languages=['chi'], subtitle_languages=['fre'])
+
+
+@pytest.fixture
+def linked_conversion_plan(bluray_disc, bluray_covers, monkeypatch):
+    # Playlists share the clip 00010, and play it fully.
+    playlists_segments = {
+        28: [('00010', 0, 10), ('00011', 0, 5)],
+        29: [('00010', 0, 10), ('00012', 5, 10)],
+        419: [('00010', 0, 10), ('00011', 0, 10)]}
+    monkeypatch.setattr(
+        BlurayPlaylist, 'segments',
+        property(lambda playlist: [
+            {'clip_name': clip_name, 'start': start, 'end': end}
+            for (clip_name, start, end) in playlists_segments[
+                playlist.number]]))
+
+    return ConversionPlan.from_disc(
+        bluray_disc, "Super Movie", '/videos', playlists_count=0,
+        audio_languages=['chi'], subtitle_languages=['fre'],
+        linked_segments=True)
+
+
+class TestConversionPlan:
+    def test_make_plan_from_disc(self, conversion_plan, bluray_dir):
+        assert conversion_plan.disc_path == str(bluray_dir)
+        assert conversion_plan.dst_dir == '/videos'
+        assert conversion_plan.estimated_size == 67881873406
+
+        assert [
+            output['file_name'] for output in conversion_plan.outputs] == [
+                "Super Movie - 1.mkv",
+                "Super Movie - 2.mkv",
+                "Super Movie - 3.mkv"]
+
+        output = conversion_plan.outputs[-1]
+        assert output['playlist_number'] == 419
+        assert output['attachments'] == [{
+            'type': 'jpeg',
+            'name': 'cover.jpg',
+            'source': 'BDMV/META/DL/big_cover.jpg'}]
+
+        source = 'BDMV/PLAYLIST/00419.mpls'
+        assert output['tracks'] == [
+            {
+                'source': source,
+                'id': 0,
+                'type': 'video',
+                'properties': {'default': True}},
+            {
+                'source': source,
+                'id': 3,
+                'type': 'audio',
+                'properties': {'default': False}},
+            {
+                'source': source,
+                'id': 4,
+                'type': 'subtitle',
+                'properties': {
+                    'default': False, 'forced': False, 'name': ''}},
+            {
+                'source': source,
+                'id': 5,
+                'type': 'subtitle',
+                'properties': {
+                    'default': False, 'forced': False, 'name': ''}}]
+
+    def test_make_plan_with_too_many_movie_playlists(self, bluray_disc):
+        with pytest.raises(ConversionPlanError):
+            ConversionPlan.from_disc(
+                bluray_disc, "Super Movie", '/videos', playlists_count=2)
+
+    def test_make_plan_without_multiview_playlists(self, bluray_disc):
+        plan = ConversionPlan.from_disc(
+            bluray_disc, "Super Movie", '/videos', playlists_count=0,
+            skip_multiview=True)
+
+        assert [output['playlist_number'] for output in plan.outputs] ==\
+            [28, 29]
+        assert [
+            skipped_playlist['playlist_number']
+            for skipped_playlist in plan.skipped_playlists] == [419]
+
+    def test_make_plan_dropping_tracks_with_low_bitrate(
+            self, bluray_disc, monkeypatch):
+        monkeypatch.setattr(
+            BlurayPlaylist, 'get_tracks_bitrates',
+            lambda playlist: {
+                0: 20000000.0, 1: 3000000.0, 2: 1000000.0, 3: 0.0,
+                4: 30000.0, 5: 100.0, 6: 0.0})
+
+        plan = ConversionPlan.from_disc(
+            bluray_disc, "Super Movie", '/videos', playlists_count=0,
+            min_bitrate=1000)
+        output = plan.outputs[-1]
+
+        assert output['dropped_tracks'] == [3, 6, 5]
+        kept_tracks = [
+            (track['id'], track['bitrate']) for track in output['tracks']]
+        assert kept_tracks == [(0, 20000000.0), (1, 3000000.0), (4, 30000.0)]
+
+        # Bitrates are not given to Mkvmerge.
+        input_streams = ConversionPlanExecutor.get_input_streams(
+            output, '/mnt/bluray')
+        assert all('bitrate' not in stream for stream in input_streams)
+
+    def test_make_plan_with_linked_segments(self, linked_conversion_plan):
+        segments = linked_conversion_plan.segments
+
+        # Each clip is remuxed only once.
+        assert [segment['clip_name'] for segment in segments] ==\
+            ['00010', '00011', '00012']
+        assert [segment['file_name'] for segment in segments] == [
+            "Super Movie - 00010.mkv",
+            "Super Movie - 00011.mkv",
+            "Super Movie - 00012.mkv"]
+        assert len({segment['segment_uid'] for segment in segments}) == 3
+
+        # Tracks are identified by their PID in clips.
+        source = 'BDMV/STREAM/00010.m2ts'
+        assert segments[0]['tracks'] == [
+            {
+                'source': source,
+                'id': 0,
+                'type': 'video',
+                'properties': {'default': True}},
+            {
+                'source': source,
+                'id': 3,
+                'type': 'audio',
+                'properties': {'default': False}},
+            {
+                'source': source,
+                'id': 4,
+                'type': 'subtitle',
+                'properties': {
+                    'default': False, 'forced': False, 'name': ''}},
+            {
+                'source': source,
+                'id': 5,
+                'type': 'subtitle',
+                'properties': {
+                    'default': False, 'forced': False, 'name': ''}}]
+
+        # Playlists only link parts of segments.
+        output = linked_conversion_plan.outputs[-1]
+        assert output['playlist_number'] == 419
+        assert output['estimated_size'] == 0
+        assert output['chapters'] == [
+            {'segment_uid': segments[0]['segment_uid'], 'start': 0, 'end': 10},
+            {'segment_uid': segments[1]['segment_uid'], 'start': 0, 'end': 10}]
+
+    def test_get_forced_subtitles(self, conversion_plan):
+        conversion_plan.outputs[-1]['tracks'][-1]['properties']['forced'] =\
+            True
+
+        assert conversion_plan.get_forced_subtitles() == {
+            28: {4: False, 5: False},
+            29: {4: False, 5: False},
+            419: {4: False, 5: True}}
+
+    def test_save_and_load_plan(self, conversion_plan, tmpdir):
+        plan_file = str(tmpdir.join('plan.json'))
+        conversion_plan.save(plan_file)
+
+        assert ConversionPlan.load(plan_file) == conversion_plan
+
+    def test_save_and_load_plan_with_linked_segments(
+            self, linked_conversion_plan, tmpdir):
+        plan_file = str(tmpdir.join('plan.json'))
+        linked_conversion_plan.save(plan_file)
+
+        assert ConversionPlan.load(plan_file) == linked_conversion_plan
+
+    def test_load_plan_with_unsupported_version(self):
+        with pytest.raises(ConversionPlanError):
+            ConversionPlan.from_dict({'version': 0})
+
+
+class TestConversionPlanExecutor:
+    def test_execute_plan(self, conversion_plan):
+        mkvmerge = RecordingMkvmergeController()
+        plan_executor = ConversionPlanExecutor(mkvmerge)
+
+        written_files = plan_executor.execute(
+            conversion_plan, disc_path='/mnt/bluray', dst_dir='/archive')
+
+        assert written_files == [
+            '/archive/Super Movie - 1.mkv',
+            '/archive/Super Movie - 2.mkv',
+            '/archive/Super Movie - 3.mkv']
+
+        (output_file_path, input_tracks, title, attachments) =\
+            mkvmerge.written_files[-1]
+        assert title == "Super Movie"
+        assert attachments == [{
+            'type': 'jpeg',
+            'name': 'cover.jpg',
+            'path': '/mnt/bluray/BDMV/META/DL/big_cover.jpg'}]
+        assert input_tracks[0] == {
+            'file_path': '/mnt/bluray/BDMV/PLAYLIST/00419.mpls',
+            'id': 0,
+            'type': 'video',
+            'properties': {'default': True}}
+
+    def test_execute_plan_in_chunks(self, conversion_plan):
+        mkvmerge = RecordingMkvmergeController()
+        plan_executor = ConversionPlanExecutor(mkvmerge, parallel_chunks=4)
+
+        plan_executor.execute(
+            conversion_plan, disc_path='/mnt/bluray', dst_dir='/archive')
+
+        assert mkvmerge.written_files == []
+        assert mkvmerge.chunked_files == [
+            ('/archive/Super Movie - 1.mkv', 4),
+            ('/archive/Super Movie - 2.mkv', 4),
+            ('/archive/Super Movie - 3.mkv', 4)]
+
+    def test_resume_plan_from_checkpoint(
+            self, conversion_plan, make_matroska_file, tmpdir):
+        manifest_path = str(tmpdir.join('checkpoint.json'))
+        outputs = conversion_plan.outputs
+
+        # The first output is complete, the second one has been truncated
+        # by an interruption.
+        checkpoint = ConversionCheckpoint(manifest_path, conversion_plan)
+        for output in outputs[:2]:
+            file_path = tmpdir.join(output['file_name'])
+            make_matroska_file(file_path, len(output['tracks']))
+            checkpoint.mark_completed(output['file_name'], str(file_path))
+        make_matroska_file(
+            tmpdir.join(outputs[1]['file_name']), len(outputs[1]['tracks']),
+            truncated_size=10)
+
+        class WritingMkvmergeController(RecordingMkvmergeController):
+            def write(self, output_file_path, input_tracks, **options):
+                super().write(output_file_path, input_tracks, **options)
+                make_matroska_file(output_file_path, len(input_tracks))
+
+        mkvmerge = WritingMkvmergeController()
+        checkpoint = ConversionCheckpoint.load(manifest_path)
+        assert checkpoint.plan == conversion_plan
+
+        plan_executor = ConversionPlanExecutor(mkvmerge, checkpoint=checkpoint)
+        written_files = plan_executor.execute(
+            conversion_plan, disc_path='/mnt/bluray', dst_dir=str(tmpdir))
+
+        assert len(written_files) == 3
+        assert [
+            output_file_path for (output_file_path, _, _, _)
+            in mkvmerge.written_files] == [
+                str(tmpdir.join(output['file_name']))
+                for output in outputs[1:]]
+        assert sorted(ConversionCheckpoint.load(manifest_path).completed) ==\
+            [output['file_name'] for output in outputs]
+
+    def test_execute_plan_in_scratch_dir(
+            self, conversion_plan, make_matroska_file, tmpdir):
+        class WritingMkvmergeController(RecordingMkvmergeController):
+            def write(self, output_file_path, input_tracks, **options):
+                super().write(output_file_path, input_tracks, **options)
+                make_matroska_file(output_file_path, len(input_tracks))
+                with open(output_file_path[:-4] + '.mkvmerge.json', 'w') as\
+                        options_file:
+                    json.dump(['--output', output_file_path], options_file)
+
+        scratch_dir = tmpdir.mkdir('scratch')
+        dst_dir = tmpdir.mkdir('videos')
+        # Left by an interrupted execution.
+        partial_file = dst_dir.join('.movie.mkv.partial')
+        partial_file.write_binary(b'mov')
+        os.utime(str(partial_file), (0, 0))
+        mkvmerge = WritingMkvmergeController()
+        checkpoint = ConversionCheckpoint(
+            str(tmpdir.join('checkpoint.json')), conversion_plan)
+        metrics = Metrics()
+        plan_executor = ConversionPlanExecutor(
+            mkvmerge, checkpoint=checkpoint, scratch_dir=str(scratch_dir),
+            metrics=metrics)
+
+        written_files = plan_executor.execute(
+            conversion_plan, disc_path='/mnt/bluray', dst_dir=str(dst_dir))
+
+        # Files are written to the scratch directory, and moved afterwards.
+        assert [
+            output_file_path for (output_file_path, _, _, _)
+            in mkvmerge.written_files] == [
+                str(scratch_dir.join(output['file_name']))
+                for output in conversion_plan.outputs]
+        assert written_files == [
+            str(dst_dir.join(output['file_name']))
+            for output in conversion_plan.outputs]
+        # Along with the files written next to them.
+        assert sorted(dst_dir.listdir()) == sorted(
+            dst_dir.join(output['file_name'][:-4] + extension)
+            for output in conversion_plan.outputs
+            for extension in ('.mkv', '.mkvmerge.json'))
+        assert scratch_dir.listdir() == []
+        assert sorted(checkpoint.completed) == [
+            output['file_name'] for output in conversion_plan.outputs]
+        # Mkvmerge's options point at the destination.
+        for output in conversion_plan.outputs:
+            options_file = dst_dir.join(
+                output['file_name'][:-4] + '.mkvmerge.json')
+            assert json.loads(options_file.read()) == [
+                '--output', str(dst_dir.join(output['file_name']))]
+
+        assert metrics.get('blu_mkv_files_written_total', kind='playlist') ==\
+            len(conversion_plan.outputs)
+        assert metrics.get('blu_mkv_remuxed_bytes_total') == sum(
+            dst_dir.join(output['file_name']).size()
+            for output in conversion_plan.outputs)
+
+    def test_load_checkpoint_with_unsupported_version(self, tmpdir):
+        manifest_path = tmpdir.join('checkpoint.json')
+        manifest_path.write('{"version": 0}')
+
+        with pytest.raises(ConversionPlanError):
+            ConversionCheckpoint.load(str(manifest_path))
+
+    def test_execute_plan_with_linked_segments(self, linked_conversion_plan):
+        mkvmerge = RecordingMkvmergeController()
+        plan_executor = ConversionPlanExecutor(mkvmerge)
+
+        written_files = plan_executor.execute(
+            linked_conversion_plan, disc_path='/mnt/bluray',
+            dst_dir='/archive')
+
+        # Segments are written before the playlists linking them.
+        assert written_files == [
+            '/archive/Super Movie - 00010.mkv',
+            '/archive/Super Movie - 00011.mkv',
+            '/archive/Super Movie - 00012.mkv',
+            '/archive/Super Movie - 1.mkv',
+            '/archive/Super Movie - 2.mkv',
+            '/archive/Super Movie - 3.mkv']
+        assert mkvmerge.written_files == []
+
+        segment = linked_conversion_plan.segments[0]
+        (segment_file_path, input_tracks, segment_uid) =\
+            mkvmerge.written_segments[0]
+        assert segment_uid == segment['segment_uid']
+        assert input_tracks[0] == {
+            'file_path': '/mnt/bluray/BDMV/STREAM/00010.m2ts',
+            'id': 0,
+            'type': 'video',
+            'properties': {'default': True}}
+
+        (output_file_path, chapters, input_tracks, title, attachments) =\
+            mkvmerge.written_chapters[-1]
+        assert output_file_path == '/archive/Super Movie - 3.mkv'
+        assert chapters == linked_conversion_plan.outputs[-1]['chapters']
+        # The file carries the tracks of its first linked segment.
+        assert input_tracks[0]['file_path'] ==\
+            '/mnt/bluray/BDMV/STREAM/00010.m2ts'
+        assert title == "Super Movie"
+        assert attachments == [{
+            'type': 'jpeg',
+            'name': 'cover.jpg',
+            'path': '/mnt/bluray/BDMV/META/DL/big_cover.jpg'}]
+
+
+class TestConvertDisc:
+    @pytest.fixture
+    def make_bluray_disc(
+            self, ffprobe, makemkv, bluray_dir, bluray_covers,
+            make_matroska_file):
+        def make_bluray_disc(failing_file_name=None):
+            class WritingMkvmergeController(RecordingMkvmergeController):
+                def write(self, output_file_path, input_tracks, **options):
+                    if output_file_path.endswith(str(failing_file_name)):
+                        raise OSError("Disc ejected")
+                    super().write(output_file_path, input_tracks, **options)
+                    make_matroska_file(output_file_path, len(input_tracks))
+
+            mkvmerge = WritingMkvmergeController()
+            return BlurayDisc(
+                str(bluray_dir), BlurayAnalyzer(ffprobe, mkvmerge, makemkv))
+
+        return make_bluray_disc
+
+    def test_convert_disc(self, make_bluray_disc, tmpdir):
+        bluray_disc = make_bluray_disc()
+        planned = list()
+        progress = list()
+
+        (plan, resumed) = convert_disc(
+            bluray_disc, "Super Movie", str(tmpdir), disc_path='/media/movie',
+            plan_options={'playlists_count': 0, 'skip_multiview': True},
+            on_planned=planned.append,
+            on_progress=progress.append)
+
+        assert not resumed
+        assert planned == [plan]
+        assert plan.disc_path == '/media/movie'
+        assert [
+            skipped_playlist['playlist_number']
+            for skipped_playlist in plan.skipped_playlists] == [419]
+        assert progress == [0, 0.5, 1]
+        assert [
+            output_file_path for (output_file_path, _, _, _)
+            in bluray_disc.bluray_analyzer.mkvmerge_controller.written_files
+        ] == [
+            str(tmpdir.join("Super Movie - 1.mkv")),
+            str(tmpdir.join("Super Movie - 2.mkv"))]
+
+    def test_only_plan_conversion(self, make_bluray_disc, tmpdir):
+        bluray_disc = make_bluray_disc()
+        checkpoint_path = tmpdir.join('checkpoint.json')
+
+        (plan, resumed) = convert_disc(
+            bluray_disc, "Super Movie", str(tmpdir),
+            plan_options={'playlists_count': 0},
+            checkpoint_path=str(checkpoint_path), execute=False)
+
+        assert len(plan.outputs) == 3
+        assert not checkpoint_path.check()
+        assert bluray_disc.bluray_analyzer.mkvmerge_controller\
+            .written_files == []
+
+    def test_resume_interrupted_conversion(self, make_bluray_disc, tmpdir):
+        checkpoint_path = tmpdir.join('checkpoint.json')
+        options = {
+            'plan_options': {'playlists_count': 0},
+            'checkpoint_path': str(checkpoint_path)}
+
+        with pytest.raises(OSError):
+            convert_disc(
+                make_bluray_disc(failing_file_name="Super Movie - 2.mkv"),
+                "Super Movie", str(tmpdir), **options)
+        assert checkpoint_path.check()
+
+        # The disc is not analyzed again, and the converted file is skipped.
+        bluray_disc = make_bluray_disc()
+        messages = list()
+        (plan, resumed) = convert_disc(
+            bluray_disc, "Other Title", str(tmpdir),
+            on_message=messages.append, **options)
+
+        assert resumed
+        assert messages[0] == "Resume conversion from {}".format(
+            checkpoint_path)
+        assert [
+            output_file_path for (output_file_path, _, _, _)
+            in bluray_disc.bluray_analyzer.mkvmerge_controller.written_files
+        ] == [
+            str(tmpdir.join("Super Movie - 2.mkv")),
+            str(tmpdir.join("Super Movie - 3.mkv"))]
+        assert not checkpoint_path.check()
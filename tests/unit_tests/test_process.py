@@ -0,0 +1,74 @@
+import signal
+import subprocess
+
+import pytest
+
+from blu_mkv import test
+from blu_mkv.process import (
+    CancellationToken, OperationCancelled, TimeoutPolicy, get_media_duration,
+    is_killed_by_signal)
+
+
+class TestCancellationToken:
+    def test_cancel_running_operations(self):
+        cancellation_token = CancellationToken()
+        cancelled_operations = list()
+
+        with cancellation_token.on_cancel(
+                lambda: cancelled_operations.append('ffprobe')):
+            cancellation_token.raise_if_cancelled()
+            cancellation_token.cancel()
+
+        assert cancelled_operations == ['ffprobe']
+        with pytest.raises(OperationCancelled):
+            cancellation_token.raise_if_cancelled()
+
+        # Operations started once cancelled are cancelled right away.
+        with cancellation_token.on_cancel(
+                lambda: cancelled_operations.append('mkvmerge')):
+            pass
+
+        assert cancelled_operations == ['ffprobe', 'mkvmerge']
+
+
+class TestTimeoutPolicy:
+    def test_scale_timeout_with_media_duration(self):
+        timeout_policy = TimeoutPolicy(60, duration_factor=0.5)
+
+        assert timeout_policy.get_timeout() == 60
+        assert timeout_policy.get_timeout(7200) == 3660
+
+    def test_timeout_for_unknown_media_duration(self):
+        assert TimeoutPolicy(60).get_timeout(None) == 60 + 4 * 3600
+        assert TimeoutPolicy(
+            60, unknown_duration_timeout=600).get_timeout(None) == 660
+
+
+def test_is_killed_by_signal():
+    def program_error(returncode):
+        return subprocess.CalledProcessError(returncode, ['mkvmerge'])
+
+    assert is_killed_by_signal(program_error(-signal.SIGTERM))
+    assert is_killed_by_signal(program_error(-signal.SIGKILL))
+    # Crashed or failed programs.
+    assert not is_killed_by_signal(program_error(-signal.SIGSEGV))
+    assert not is_killed_by_signal(program_error(2))
+    assert not is_killed_by_signal(OSError("Disc ejected"))
+
+
+def test_get_media_duration(tmpdir):
+    disc_dir = tmpdir.mkdir('bluray')
+    disc_dir.ensure('BDMV', 'PLAYLIST', '00001.mpls').write_binary(
+        test.build_playlist(
+            [('00010', 45000, 450000), ('00020', 90000, 180000)]))
+    disc_dir.ensure('BDMV', 'CLIPINF', '00010.clpi').write_binary(
+        test.build_clip_information(45000, 450000))
+    playlist_path = str(disc_dir.join('BDMV', 'PLAYLIST', '00001.mpls'))
+    clip_path = str(disc_dir.join('BDMV', 'STREAM', '00010.m2ts'))
+
+    assert get_media_duration([playlist_path]) == 11
+    assert get_media_duration([playlist_path, clip_path]) == 20
+    # Clips without clip information files have an unknown duration.
+    assert get_media_duration([
+        str(disc_dir.join('BDMV', 'STREAM', '00020.m2ts'))]) is None
+    assert get_media_duration(['/videos/movie.mkv']) is None
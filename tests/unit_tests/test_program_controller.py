@@ -1,4 +1,25 @@
+from contextlib import ExitStack
+import subprocess
+import threading
+import time
+
+import pytest
+
 from blu_mkv import ProgramController
+from blu_mkv.metrics import Metrics
+from blu_mkv.process import (
+    CancellationToken, OperationCancelled, TimeoutPolicy)
+from blu_mkv.resources import ResourcePolicy
+from blu_mkv.utils import is_process_alive
+
+
+def is_process_running(pid):
+    """Return whether a process is running, i.e., alive and not a zombie."""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat_file:
+            return stat_file.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return is_process_alive(pid)
 
 
 class TestBaseController:
@@ -6,3 +27,97 @@ class TestBaseController:
         executable_path = '/usr/bin/my_program'
         controller = ProgramController(executable_path)
         assert controller.executable_path == executable_path
+
+    def test_limit_io_of_controller(self):
+        class RecordingLimiter:
+            def __init__(self):
+                self.limited_paths = list()
+
+            def limit(self, *paths, cancellation_token=None):
+                self.limited_paths.append((paths, cancellation_token))
+                return ExitStack()
+
+        io_limiter = RecordingLimiter()
+        cancellation_token = CancellationToken()
+        controller = ProgramController(
+            '/usr/bin/my_program', io_limiter=io_limiter)\
+            .cancellable_by(cancellation_token)
+
+        with controller._limit_io('/media/bluray'):
+            pass
+
+        # Waiting for the device can be cancelled.
+        assert io_limiter.limited_paths ==\
+            [(('/media/bluray',), cancellation_token)]
+
+    def test_do_not_limit_io_by_default(self):
+        controller = ProgramController('/usr/bin/my_program')
+
+        with controller._limit_io('/media/bluray'):
+            pass
+
+    def test_run_program_with_job_resource_policy(self):
+        controller = ProgramController(
+            '/usr/bin/my_program',
+            resource_policy=ResourcePolicy(nice=10, memory_limit=2 ** 30))
+        job_controller = controller.using(ResourcePolicy(nice=19))
+
+        assert job_controller.resource_policy ==\
+            ResourcePolicy(nice=19, memory_limit=2 ** 30)
+        assert job_controller._get_popen_options() ==\
+            {'preexec_fn': job_controller.resource_policy.apply}
+
+        # The original controller is not affected.
+        assert controller.resource_policy.nice == 10
+        assert ProgramController(
+            '/usr/bin/my_program')._get_popen_options() == dict()
+
+    def test_run_program(self):
+        controller = ProgramController('/bin/sh')
+
+        assert controller._run(['/bin/sh', '-c', 'echo movie']) == "movie\n"
+        with pytest.raises(subprocess.CalledProcessError):
+            controller._run(['/bin/sh', '-c', 'exit 2'])
+
+    def test_record_program_runs(self):
+        metrics = Metrics()
+        controller = ProgramController('/bin/sh').reporting_to(metrics)
+
+        controller._run(['/bin/sh', '-c', 'exit 0'])
+        with pytest.raises(subprocess.CalledProcessError):
+            controller._run(['/bin/sh', '-c', 'exit 2'])
+
+        assert metrics.get(
+            'blu_mkv_program_runs_total', program='sh', status='success') == 1
+        assert metrics.get(
+            'blu_mkv_program_runs_total', program='sh', status='failure') == 1
+        assert 'blu_mkv_program_duration_seconds_count{program="sh"} 2' in\
+            metrics.render()
+
+    def test_kill_program_and_its_children_on_timeout(self, tmpdir):
+        pid_file = tmpdir.join('pid')
+        controller = ProgramController(
+            '/bin/sh', timeout_policy=TimeoutPolicy(0.5))
+
+        start_time = time.monotonic()
+        with pytest.raises(subprocess.TimeoutExpired):
+            controller._run([
+                '/bin/sh', '-c',
+                'sleep 30 & echo $! > {}; wait'.format(pid_file)])
+
+        assert time.monotonic() - start_time < 10
+        time.sleep(0.1)
+        assert not is_process_running(int(pid_file.read()))
+
+    def test_kill_program_when_cancelled(self):
+        cancellation_token = CancellationToken()
+        controller = ProgramController('/bin/sh').cancellable_by(
+            cancellation_token)
+        threading.Timer(0.2, cancellation_token.cancel).start()
+
+        with pytest.raises(OperationCancelled):
+            controller._run(['/bin/sh', '-c', 'sleep 30'])
+
+        # No programs are started once cancelled.
+        with pytest.raises(OperationCancelled):
+            controller._run(['/bin/sh', '-c', 'echo movie'])
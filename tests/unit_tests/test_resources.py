@@ -0,0 +1,70 @@
+import argparse
+import os
+import resource
+import subprocess
+import sys
+
+import pytest
+
+from blu_mkv import resources
+from blu_mkv.resources import ResourcePolicy
+
+
+def test_parse_cpu_list():
+    assert resources.parse_cpu_list('0-3,6') == {0, 1, 2, 3, 6}
+    assert resources.parse_cpu_list('2') == {2}
+
+    with pytest.raises(ValueError):
+        resources.parse_cpu_list('0-a')
+
+
+class TestResourcePolicy:
+    def test_reject_unknown_io_scheduling_class(self):
+        with pytest.raises(ValueError):
+            ResourcePolicy(ioprio_class='fastest')
+
+    def test_combine_policies(self):
+        controller_policy = ResourcePolicy(nice=10, memory_limit=2 ** 30)
+        job_policy = ResourcePolicy(nice=19, cpu_affinity={0})
+
+        assert controller_policy.combine(job_policy) == ResourcePolicy(
+            nice=19, cpu_affinity={0}, memory_limit=2 ** 30)
+        assert controller_policy.combine(None) == controller_policy
+
+    def test_policy_from_arguments(self):
+        parser = argparse.ArgumentParser()
+        resources.add_arguments(parser)
+
+        args = parser.parse_args([
+            '--nice', '19', '--ionice', 'idle', '--cpu_affinity', '0-1',
+            '--memory_limit', '1024'])
+        assert ResourcePolicy.from_arguments(args) == ResourcePolicy(
+            nice=19, ioprio_class=resources.IOPRIO_CLASS_IDLE,
+            cpu_affinity={0, 1}, memory_limit=2 ** 30)
+
+        assert not ResourcePolicy.from_arguments(parser.parse_args([]))
+
+    def test_no_popen_options_without_limits(self):
+        assert not ResourcePolicy()
+        assert ResourcePolicy().get_popen_options() == dict()
+
+    def test_apply_policy_to_program(self):
+        cpu = min(os.sched_getaffinity(0))
+        policy = ResourcePolicy(
+            nice=19, ioprio_class=resources.IOPRIO_CLASS_IDLE,
+            cpu_affinity={cpu}, memory_limit=2 ** 32)
+
+        program_output = subprocess.check_output(
+            [sys.executable, '-c', (
+                'import os, resource; '
+                'print(os.getpriority(os.PRIO_PROCESS, 0)); '
+                'print(sorted(os.sched_getaffinity(0))); '
+                'print(resource.getrlimit(resource.RLIMIT_AS)[0])')],
+            universal_newlines=True,
+            **policy.get_popen_options())
+
+        assert program_output.split('\n')[:3] == [
+            '19', str([cpu]), str(2 ** 32)]
+
+        # The current process is not affected.
+        assert resource.getrlimit(resource.RLIMIT_AS)[0] != 2 ** 32
@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import pytest
+
+from blu_mkv import rip, test
+from blu_mkv.rip import DiscCopy, DiscCopyError
+
+
+@pytest.fixture
+def bluray_tree(tmpdir):
+    """Blu-ray disc with a playlist playing one of its two clips."""
+    disc_dir = tmpdir.mkdir('bluray_tree')
+    bdmv_dir = disc_dir.mkdir('BDMV')
+    bdmv_dir.ensure('index.bdmv').write_binary(b'index')
+    bdmv_dir.ensure('PLAYLIST', '00001.mpls').write_binary(
+        test.build_playlist([('00010', 0, 45000)]))
+
+    for clip_name in ['00010', '00011']:
+        bdmv_dir.ensure('CLIPINF', '{}.clpi'.format(clip_name)).write_binary(
+            test.build_clip_information(0, 45000))
+        bdmv_dir.ensure('STREAM', '{}.m2ts'.format(clip_name)).write_binary(
+            bytes(range(256)) * 10)
+
+    bdmv_dir.ensure('STREAM', 'SSIF', '00010.ssif').write_binary(b'3D')
+
+    return disc_dir
+
+
+class TestDiscCopy:
+    def test_copy_whole_disc(self, bluray_tree, tmpdir):
+        progress = list()
+        disc_copy = DiscCopy(
+            str(bluray_tree), str(tmpdir.join('cache')), chunk_size=1024,
+            on_progress=lambda *args: progress.append(args))
+
+        with disc_copy:
+            copy_dir = tmpdir.join('cache', Path(disc_copy.path).name)
+            assert disc_copy.path == str(copy_dir)
+            assert copy_dir.basename.startswith('bluray_tree-')
+
+            copied_files = sorted(
+                copied_file.relto(copy_dir)
+                for copied_file in copy_dir.visit()
+                if copied_file.isfile())
+            assert copied_files == [
+                'BDMV/CLIPINF/00010.clpi',
+                'BDMV/CLIPINF/00011.clpi',
+                'BDMV/PLAYLIST/00001.mpls',
+                'BDMV/STREAM/00010.m2ts',
+                'BDMV/STREAM/00011.m2ts',
+                'BDMV/index.bdmv']
+
+            copied_clip = copy_dir.join('BDMV', 'STREAM', '00011.m2ts')
+            original_clip = bluray_tree.join('BDMV', 'STREAM', '00011.m2ts')
+            assert copied_clip.read_binary() == original_clip.read_binary()
+            # Modification times are kept, for analysis caches to match.
+            assert copied_clip.mtime() == original_clip.mtime()
+
+            # Progress is reported for each read chunk.
+            (copied_size, total_size, _) = progress[-1]
+            assert copied_size == total_size
+            assert len(progress) == 10
+
+        # The copy is evicted when leaving the context.
+        assert not copy_dir.exists()
+        assert disc_copy.path is None
+
+    def test_copy_clips_of_some_playlists(self, bluray_tree, tmpdir):
+        disc_copy = DiscCopy(
+            str(bluray_tree), str(tmpdir.join('cache')), playlist_numbers=[1])
+
+        assert disc_copy.get_files() == [
+            'BDMV/CLIPINF/00010.clpi',
+            'BDMV/CLIPINF/00011.clpi',
+            'BDMV/PLAYLIST/00001.mpls',
+            'BDMV/STREAM/00010.m2ts',
+            'BDMV/index.bdmv']
+
+    def test_copy_disc_with_checksum_mismatch(
+            self, bluray_tree, tmpdir, monkeypatch):
+        monkeypatch.setattr(
+            rip, 'get_file_checksum', lambda *args: 'corrupted')
+        disc_copy = DiscCopy(str(bluray_tree), str(tmpdir.join('cache')))
+
+        with pytest.raises(DiscCopyError):
+            disc_copy.copy()
+
+        assert not Path(disc_copy.get_copy_path()).exists()
+        assert disc_copy.path is None
+
+    def test_share_copy_between_jobs(self, bluray_tree, tmpdir, monkeypatch):
+        copied_files = list()
+        copy_file = rip.copy_file
+
+        def record_copy(src_path, dst_path, *args):
+            copied_files.append(str(dst_path))
+            return copy_file(src_path, dst_path, *args)
+
+        monkeypatch.setattr(rip, 'copy_file', record_copy)
+        # Jobs converting the same disc at the same time.
+        first_copy = DiscCopy(
+            str(bluray_tree), str(tmpdir.join('cache')), playlist_numbers=[1])
+        second_copy = DiscCopy(str(bluray_tree), str(tmpdir.join('cache')))
+
+        first_copy.copy()
+        copied_files.clear()
+        assert second_copy.copy() == first_copy.path
+        # Only the files missing from the copy are copied.
+        assert copied_files == [
+            str(Path(first_copy.path, 'BDMV', 'STREAM', '00011.m2ts'))]
+
+        # The copy is only removed once evicted by all its users.
+        first_copy.evict()
+        assert Path(
+            second_copy.path, 'BDMV', 'STREAM', '00010.m2ts').is_file()
+        copy_path = second_copy.path
+        second_copy.evict()
+        assert not Path(copy_path).exists()
@@ -0,0 +1,97 @@
+from datetime import timedelta
+import json
+import tarfile
+
+import pytest
+
+from blu_mkv import test
+from blu_mkv.bluray import BlurayAnalyzer, BlurayDisc
+from blu_mkv.plan import ConversionPlan
+from blu_mkv.snapshot import (
+    DiscSnapshot, SnapshotError, decode_result, encode_result,
+    export_snapshot)
+
+
+@pytest.fixture
+def snapshot_path(bluray_analyzer, bluray_dir, bluray_covers, tmpdir):
+    snapshot_path = str(tmpdir.join('disc.snapshot.tar.gz'))
+    export_snapshot(bluray_analyzer, str(bluray_dir), snapshot_path)
+    return snapshot_path
+
+
+class TestSnapshot:
+    def test_export_metadata_files(self, snapshot_path):
+        with tarfile.open(snapshot_path) as snapshot_file:
+            assert sorted(snapshot_file.getnames()) == [
+                'BDMV/META/DL/big_cover.jpg',
+                'BDMV/META/DL/small_cover.jpg',
+                'snapshot.json']
+
+    def test_plan_conversion_from_snapshot(
+            self, bluray_disc, bluray_dir, snapshot_path, tmpdir):
+        snapshot = DiscSnapshot.extract(
+            snapshot_path, str(tmpdir.join('snapshot')))
+        snapshot_disc = BlurayDisc.from_snapshot(snapshot)
+
+        assert [
+            (playlist.number, playlist.duration, playlist.size)
+            for playlist in snapshot_disc.playlists] == [
+            (playlist.number, playlist.duration, playlist.size)
+            for playlist in bluray_disc.playlists]
+        assert [
+            playlist.number
+            for playlist in snapshot_disc.multiview_playlists] == [
+            playlist.number for playlist in bluray_disc.multiview_playlists]
+        assert snapshot_disc.get_biggest_cover()['size'] ==\
+            bluray_disc.get_biggest_cover()['size']
+
+        # Forced subtitles of some tracks are identified from the frames
+        # counts of all the tracks.
+        assert ConversionPlan.from_disc(
+            snapshot_disc, "Super Movie", '/videos',
+            disc_path=str(bluray_dir), playlists_count=0,
+            audio_languages=['chi'], subtitle_languages=['fre']) ==\
+            ConversionPlan.from_disc(
+                bluray_disc, "Super Movie", '/videos', playlists_count=0,
+                audio_languages=['chi'], subtitle_languages=['fre'])
+
+    def test_missing_analysis(self, bluray_dir, tmpdir):
+        snapshot_path = str(tmpdir.join('disc.snapshot.tar.gz'))
+        export_snapshot(
+            BlurayAnalyzer(
+                test.StubFfprobeController(), test.StubMkvmergeController()),
+            str(bluray_dir), snapshot_path)
+
+        snapshot = DiscSnapshot.extract(
+            snapshot_path, str(tmpdir.join('snapshot')))
+        with pytest.raises(SnapshotError):
+            BlurayDisc.from_snapshot(snapshot).multiview_playlists
+
+    def test_extract_invalid_snapshot(self, tmpdir):
+        snapshot_path = str(tmpdir.join('disc.snapshot.tar.gz'))
+        with tarfile.open(snapshot_path, 'w:gz') as snapshot_file:
+            snapshot_file.add(
+                str(tmpdir.ensure('BDMV', 'index.bdmv')),
+                arcname='../BDMV/index.bdmv')
+
+        with pytest.raises(SnapshotError):
+            DiscSnapshot.extract(snapshot_path, str(tmpdir.join('snapshot')))
+        assert not tmpdir.join('BDMV', 'index.bdmv').size()
+        assert not tmpdir.join('snapshot', 'BDMV').check()
+
+
+def test_encode_results_as_json():
+    result = {
+        'duration': timedelta(hours=2, microseconds=1),
+        'streams': {0x1011: {'codec': 'h264', 'bitrate': None}},
+        'clips': [('00010', 1.5)],
+        'multiview_playlists': {800, 801},
+        'tagged': {'__type__': 'set'}}
+
+    encoded_result = json.dumps(encode_result(result))
+    assert decode_result(encoded_result) == result
+
+    with pytest.raises(TypeError):
+        encode_result({'path': object()})
+    with pytest.raises(ValueError):
+        decode_result('{"__type__": "function", "name": "os.system"}')
@@ -0,0 +1,98 @@
+import errno
+import os
+import time
+
+import pytest
+
+from blu_mkv import transfer
+from blu_mkv.transfer import (
+    copy_file_data, move_file, remove_stale_partial_files)
+
+
+def replace_across_filesystems(monkeypatch, src_path):
+    """Make renames of a file fail, like across filesystems."""
+    replace = os.replace
+
+    def replace_file(src, dst):
+        if src == src_path:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', replace_file)
+
+
+class TestMoveFile:
+    def test_rename_file_on_same_filesystem(self, tmpdir):
+        src_file = tmpdir.join('scratch', 'movie.mkv')
+        src_file.write_binary(b'movie', ensure=True)
+        dst_file = tmpdir.join('videos', 'movie.mkv')
+        dst_file.dirpath().ensure(dir=True)
+
+        move_file(str(src_file), str(dst_file))
+
+        assert dst_file.read_binary() == b'movie'
+        assert not src_file.exists()
+
+    def test_copy_file_to_another_filesystem(self, monkeypatch, tmpdir):
+        src_file = tmpdir.join('scratch', 'movie.mkv')
+        src_file.write_binary(b'movie' * 1000, ensure=True)
+        dst_file = tmpdir.join('videos', 'movie.mkv')
+        dst_file.write_binary(b'previous movie', ensure=True)
+        replace_across_filesystems(monkeypatch, str(src_file))
+
+        move_file(str(src_file), str(dst_file), chunk_size=1024)
+
+        assert dst_file.read_binary() == b'movie' * 1000
+        assert not src_file.exists()
+        assert tmpdir.join('videos').listdir() == [dst_file]
+
+    def test_keep_destination_when_copy_fails(self, monkeypatch, tmpdir):
+        src_file = tmpdir.join('scratch', 'movie.mkv')
+        src_file.write_binary(b'movie', ensure=True)
+        dst_file = tmpdir.join('videos', 'movie.mkv')
+        dst_file.write_binary(b'previous movie', ensure=True)
+        replace_across_filesystems(monkeypatch, str(src_file))
+
+        def copy_file_data(src_file, dst_file, chunk_size):
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+        monkeypatch.setattr(transfer, 'copy_file_data', copy_file_data)
+
+        with pytest.raises(OSError):
+            move_file(str(src_file), str(dst_file))
+
+        assert dst_file.read_binary() == b'previous movie'
+        assert src_file.exists()
+        assert tmpdir.join('videos').listdir() == [dst_file]
+
+
+def test_copy_file_data_without_copy_file_range(monkeypatch, tmpdir):
+    def copy_file_range(src_fd, dst_fd, chunk_size):
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+
+    monkeypatch.setattr(transfer, '_copy_file_range', copy_file_range)
+    src_file = tmpdir.join('movie.mkv')
+    src_file.write_binary(b'movie' * 1000)
+    dst_file = tmpdir.join('copy.mkv')
+
+    with open(str(src_file), 'rb', buffering=0) as src, \
+            open(str(dst_file), 'wb', buffering=0) as dst:
+        copy_file_data(src, dst, chunk_size=1024)
+
+    assert dst_file.read_binary() == b'movie' * 1000
+
+
+def test_remove_stale_partial_files(tmpdir):
+    stale_file = tmpdir.join('.movie.mkv.partial')
+    stale_file.write_binary(b'mov')
+    stale_time = time.time() - 7200
+    os.utime(str(stale_file), (stale_time, stale_time))
+    # Possibly written by another process.
+    written_file = tmpdir.join('.bonus.mkv.partial')
+    written_file.write_binary(b'bon')
+    tmpdir.join('movie.mkv').write_binary(b'movie')
+
+    assert remove_stale_partial_files(str(tmpdir), max_age=3600) ==\
+        [str(stale_file)]
+    assert sorted(file.basename for file in tmpdir.listdir()) == [
+        '.bonus.mkv.partial', 'movie.mkv']
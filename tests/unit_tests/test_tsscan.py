@@ -0,0 +1,56 @@
+import pytest
+
+from blu_mkv import test
+
+tsscan = pytest.importorskip('blu_mkv.tsscan')
+pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def transport_stream(tmpdir):
+    # Arrival timestamps wrap around, and are spread over 1 second.
+    start = tsscan.ARRIVAL_TIMESTAMP_MODULO - 13500000
+    transport_stream = bytearray(test.build_transport_stream([
+        (0x1011, start, True),
+        (0x1100, start + 6750000, True),
+        (0x1011, start + 6750000, False),
+        (0x1fff, 0, False),
+        (0x1200, 0, True),
+        (0x1011, 13500000, False)]))
+
+    # The fifth packet has no sync byte, and is thus skipped.
+    transport_stream[4 * tsscan.PACKET_SIZE + 4] = 0
+
+    stream_file = tmpdir.join('00001.m2ts')
+    stream_file.write_binary(bytes(transport_stream))
+    return stream_file
+
+
+@pytest.mark.parametrize('chunk_size', [
+    tsscan.DEFAULT_CHUNK_SIZE, 2 * tsscan.PACKET_SIZE])
+def test_scan_transport_stream(transport_stream, chunk_size):
+    actual_statistics = tsscan.scan_transport_stream(
+        str(transport_stream), chunk_size=chunk_size)
+    expected_statistics = {
+        'duration': 1.0,
+        'streams': {
+            0x1011: {
+                'packets': 3,
+                'bytes': 552,
+                'pes_count': 1,
+                'bitrate': 4416.0},
+            0x1100: {
+                'packets': 1,
+                'bytes': 184,
+                'pes_count': 1,
+                'bitrate': 1472.0}}}
+
+    assert actual_statistics == expected_statistics
+
+
+def test_scan_empty_transport_stream(tmpdir):
+    stream_file = tmpdir.join('00001.m2ts')
+    stream_file.write_binary(b'')
+
+    statistics = tsscan.scan_transport_stream(str(stream_file))
+    assert statistics == {'duration': 0, 'streams': {}}
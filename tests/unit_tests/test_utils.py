@@ -1,4 +1,9 @@
+import os
+from pathlib import Path
 import subprocess
+import time
+
+import pytest
 
 from blu_mkv import utils
 
@@ -22,3 +27,123 @@ def test_unmount_disk_image(mock):
 
     subprocess.check_call.assert_called_once_with(
         ['sudo', 'umount', mount_point])
+
+
+class TestMountPool:
+    @pytest.fixture
+    def mounted_points(self, monkeypatch):
+        """Fake mounting, by recording mount points."""
+        mounted_points = list()
+
+        def mount_disk_image(image_path, mount_point):
+            mounted_points.append(mount_point)
+
+        def unmount_disk_image(mount_point):
+            mounted_points.remove(mount_point)
+
+        monkeypatch.setattr(utils, 'mount_disk_image', mount_disk_image)
+        monkeypatch.setattr(utils, 'unmount_disk_image', unmount_disk_image)
+        monkeypatch.setattr(
+            os.path, 'ismount', lambda path: str(path) in mounted_points)
+        return mounted_points
+
+    @pytest.fixture
+    def image_path(self, tmpdir):
+        image_path = tmpdir.join('bluray.iso')
+        image_path.write_binary(b'disc')
+        return image_path
+
+    def test_reuse_mount_of_same_image(
+            self, tmpdir, image_path, mounted_points):
+        # The same disk image, reached through another path.
+        linked_image_path = tmpdir.join('link.iso')
+        os.link(str(image_path), str(linked_image_path))
+
+        mount_pool = utils.MountPool(str(tmpdir.join('pool')), idle_timeout=0)
+        mount_point = mount_pool.acquire(str(image_path))
+        assert mount_pool.acquire(str(linked_image_path)) == mount_point
+        assert mounted_points == [mount_point]
+
+        mount_pool.release(str(image_path))
+        assert mounted_points == [mount_point]
+
+        mount_pool.release(str(linked_image_path))
+        assert mounted_points == []
+
+    def test_unmount_after_idle_timeout(
+            self, tmpdir, image_path, mounted_points):
+        mount_pool = utils.MountPool(
+            str(tmpdir.join('pool')), idle_timeout=300)
+        with mount_pool.mount(str(image_path)) as mount_point:
+            assert mounted_points == [mount_point]
+
+        # The disk image is kept mounted until idle for long enough.
+        mount_pool.close()
+        assert mount_pool.cleanup() == []
+        assert mounted_points == [mount_point]
+
+        users_file = Path(mount_point).with_name('users')
+        idle_time = time.time() - 301
+        os.utime(str(users_file), (idle_time, idle_time))
+
+        assert mount_pool.cleanup() == [mount_point]
+        assert mounted_points == []
+
+    def test_cleanup_mount_of_dead_process(
+            self, tmpdir, image_path, mounted_points):
+        dead_process = subprocess.Popen(['true'])
+        dead_process.wait()
+
+        mount_pool = utils.MountPool(str(tmpdir.join('pool')), idle_timeout=0)
+        mount_point = mount_pool.acquire(str(image_path))
+
+        # The process is registered as user of the disk image, while dead.
+        users_file = Path(mount_point).with_name('users')
+        users_file.write_text('{}\n'.format(dead_process.pid))
+
+        assert mount_pool.cleanup() == [mount_point]
+        assert mounted_points == []
+
+    def test_unmount_once_idle_after_release(
+            self, tmpdir, image_path, mounted_points):
+        mount_pool = utils.MountPool(str(tmpdir.join('pool')), idle_timeout=1)
+        with mount_pool.mount(str(image_path)) as mount_point:
+            assert mounted_points == [mount_point]
+
+        # No other job needs to start for the disk image to be unmounted.
+        deadline = time.monotonic() + 5
+        while mounted_points and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert mounted_points == []
+
+    def test_remount_when_backed_by_another_image(
+            self, tmpdir, image_path, mounted_points, monkeypatch):
+        sysfs_dir = tmpdir.mkdir('sys')
+        mount_pool = utils.MountPool(
+            str(tmpdir.join('pool')), idle_timeout=0,
+            sysfs_path=str(sysfs_dir))
+        mount_point = mount_pool.get_mount_point(str(image_path))
+        Path(mount_point).mkdir(parents=True)
+        mounted_points.append(mount_point)
+
+        # The mount point is backed by another disk image, left by a job
+        # which died.
+        other_image_path = tmpdir.join('other.iso')
+        other_image_path.write_binary(b'other disc')
+        device_id = os.stat(mount_point).st_dev
+        sysfs_dir.ensure(
+            'dev', 'block',
+            '{}:{}'.format(os.major(device_id), os.minor(device_id)),
+            'loop', 'backing_file').write(str(other_image_path) + '\n')
+
+        unmounted_points = list()
+        unmount_disk_image = utils.unmount_disk_image
+        monkeypatch.setattr(
+            utils, 'unmount_disk_image',
+            lambda mount_point: (
+                unmounted_points.append(mount_point),
+                unmount_disk_image(mount_point)))
+
+        assert mount_pool.acquire(str(image_path)) == mount_point
+        assert unmounted_points == [mount_point]
+        assert mounted_points == [mount_point]
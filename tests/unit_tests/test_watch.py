@@ -0,0 +1,135 @@
+import signal
+import subprocess
+import threading
+import time
+
+import pytest
+
+from blu_mkv import jobqueue
+from blu_mkv.jobqueue import JobQueue
+from blu_mkv.watch import InboxDaemon, InboxWatcher
+
+
+def poll_until(watcher, timeout=5):
+    """Poll a watcher until it returns discs."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        disc_paths = watcher.poll(0.05)
+        if disc_paths:
+            return disc_paths
+    return []
+
+
+@pytest.fixture
+def inbox_dir(tmpdir):
+    return tmpdir.mkdir('inbox')
+
+
+class TestInboxWatcher:
+    @pytest.mark.parametrize('use_inotify', [True, False])
+    def test_find_discs_once_fully_written(self, inbox_dir, use_inotify):
+        inbox_dir.join('present.iso').write_binary(b'disc')
+        watcher = InboxWatcher(
+            [str(inbox_dir)], settle_time=0.2, poll_interval=0,
+            use_inotify=use_inotify)
+
+        # Discs present before watching are found too.
+        assert poll_until(watcher) == [str(inbox_dir.join('present.iso'))]
+
+        new_disc = inbox_dir.join('new.iso')
+        inbox_dir.join('notes.txt').write('not a disc')
+        with open(str(new_disc), 'wb') as disc_file:
+            disc_file.write(b'first part')
+            disc_file.flush()
+            # Still being written.
+            assert watcher.poll(0.05) == []
+            time.sleep(0.1)
+            disc_file.write(b'second part')
+
+        assert poll_until(watcher) == [str(new_disc)]
+
+        # Discs are only found once.
+        assert watcher.poll(0.3) == []
+        watcher.close()
+
+
+class TestInboxDaemon:
+    def test_convert_queued_discs(self, inbox_dir, tmpdir):
+        job_queue = JobQueue(str(tmpdir.join('queue.db')))
+        watcher = InboxWatcher([str(inbox_dir)], settle_time=0)
+        converted_discs = list()
+
+        def convert(disc_path):
+            converted_discs.append(disc_path)
+            if disc_path.endswith('broken.iso'):
+                raise RuntimeError("Unable to mount disk image")
+            if len(converted_discs) == 2:
+                daemon.stop()
+
+        daemon = InboxDaemon(watcher, job_queue, convert, max_workers=2)
+
+        inbox_dir.join('broken.iso').write_binary(b'disc')
+        inbox_dir.join('movie.iso').write_binary(b'disc')
+        # Stopped after both conversions, or on timeout.
+        timeout = threading.Timer(5, daemon.stop)
+        timeout.start()
+        daemon.run(poll_timeout=0.05)
+        timeout.cancel()
+        watcher.close()
+
+        assert sorted(converted_discs) == [
+            str(inbox_dir.join('broken.iso')),
+            str(inbox_dir.join('movie.iso'))]
+        assert [
+            (job['path'], job['state'], job['error'])
+            for job in job_queue.get_jobs()] == [
+                (
+                    str(inbox_dir.join('broken.iso')), jobqueue.FAILED,
+                    "Unable to mount disk image"),
+                (str(inbox_dir.join('movie.iso')), jobqueue.DONE, None)]
+
+    def test_requeue_conversions_interrupted_by_stop(self, inbox_dir, tmpdir):
+        job_queue = JobQueue(str(tmpdir.join('queue.db')))
+        watcher = InboxWatcher([str(inbox_dir)], settle_time=0)
+
+        def convert(disc_path):
+            # Interrupted by the signal stopping the daemon.
+            daemon.stop()
+            raise RuntimeError("Conversion cancelled")
+
+        daemon = InboxDaemon(watcher, job_queue, convert)
+
+        inbox_dir.join('movie.iso').write_binary(b'disc')
+        timeout = threading.Timer(5, daemon.stop)
+        timeout.start()
+        daemon.run(poll_timeout=0.05)
+        timeout.cancel()
+        watcher.close()
+
+        [job] = job_queue.get_jobs()
+        assert (job['state'], job['attempts']) == (jobqueue.PENDING, 1)
+
+    def test_requeue_conversions_killed_by_signal(self, inbox_dir, tmpdir):
+        job_queue = JobQueue(str(tmpdir.join('queue.db')))
+        watcher = InboxWatcher([str(inbox_dir)], settle_time=0)
+        converted_discs = list()
+
+        def convert(disc_path):
+            converted_discs.append(disc_path)
+            if len(converted_discs) == 1:
+                # The conversion script is killed, but not the daemon.
+                raise subprocess.CalledProcessError(
+                    -signal.SIGTERM, ['convert_bluray_to_mkv.py'])
+            daemon.stop()
+
+        daemon = InboxDaemon(watcher, job_queue, convert)
+
+        inbox_dir.join('movie.iso').write_binary(b'disc')
+        timeout = threading.Timer(5, daemon.stop)
+        timeout.start()
+        daemon.run(poll_timeout=0.05)
+        timeout.cancel()
+        watcher.close()
+
+        [job] = job_queue.get_jobs()
+        assert (job['state'], job['attempts']) == (jobqueue.DONE, 2)